@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+服务端空闲通道内存基准 - 测量每个打开但空闲的通道占用的服务端内存
+
+bench_relay.py 的 idle 场景经过 SOCKS5 和客户端，受客户端通道 ID 上限约束，且 RSS 同时包含两端和目标。
+这里只测服务端: 多个 TunnelSession 的隧道一侧写入到空写入器，直接处理 CONNECT，
+目标在子进程中接受连接并保持不动，因此本进程的 RSS 增量只来自服务端通道
+（通道对象、目标连接的传输层和协议对象等，不含内核套接字缓冲）。
+
+输出:
+- 每个通道数下的 RSS 增量和每通道字节数
+- 事件循环中的任务数（通道不应各自占用一个任务）
+
+打开的目标连接受 RLIMIT_NOFILE 限制，启动时把软限制提高到硬限制；
+通道数超过可用文件描述符时报错退出。
+
+用法:
+    python bench_channels.py --channels 1000,10000
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import CAP_HALF_CLOSE, ServerConfig, PerformanceConfig
+from server import TunnelSession
+
+MAX_CHANNELS_PER_SESSION = PerformanceConfig().max_channels_per_session  # 默认的每会话通道数上限
+
+CONNECT_CONCURRENCY = 256  # 同时进行的 CONNECT 数（目标 listen 队列为 4096）
+
+
+def raise_fd_limit() -> int:
+    """把打开文件数的软限制提高到硬限制，返回新的软限制"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def rss_bytes() -> int:
+    """当前 RSS（/proc/self/statm）"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def run_target():
+    """子进程: 接受连接并保持打开，不读不写"""
+    raise_fd_limit()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(4096)
+    print(listener.getsockname()[1], flush=True)
+    held = []
+    while True:
+        conn, _ = listener.accept()
+        held.append(conn)
+
+
+class NullWriter:
+    """隧道一侧的写入器: 丢弃发往客户端的帧"""
+
+    def __init__(self):
+        self.written = 0
+        self.transport = self
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_write_buffer_limits(self):
+        return 0, 65536
+
+    def write(self, data):
+        self.written += len(data)
+
+    async def drain(self):
+        pass
+
+    def is_closing(self) -> bool:
+        return False
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 40000) if name == 'peername' else None
+
+
+def make_session() -> TunnelSession:
+    session = TunnelSession(None, NullWriter(), ServerConfig(), None, {})
+    session.capabilities = {CAP_HALF_CLOSE: []}
+    return session
+
+
+async def open_channels(sessions: List[TunnelSession], count: int, payload: bytes):
+    """把通道总数补足到 count，按 MAX_CHANNELS_PER_SESSION 分配到多个会话"""
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(session: TunnelSession, channel_id: int):
+        async with semaphore:
+            await session._handle_connect(channel_id, payload)
+
+    jobs = []
+    session = sessions[-1] if sessions else None
+    next_id = len(session.channels) + 1 if session else MAX_CHANNELS_PER_SESSION + 1
+    for _ in range(count - sum(len(s.channels) for s in sessions)):
+        if next_id > MAX_CHANNELS_PER_SESSION:
+            session = make_session()
+            sessions.append(session)
+            next_id = 1
+        jobs.append(connect(session, next_id))
+        next_id += 1
+    await asyncio.gather(*jobs)
+
+    total = sum(len(session.channels) for session in sessions)
+    if total != count:
+        raise RuntimeError(f"只打开了 {total} / {count} 个通道（连接失败，可能是文件描述符不足）")
+
+
+async def run(args) -> Dict:
+    limit = raise_fd_limit()
+    if max(args.channels) + 100 > limit:
+        raise SystemExit(f"通道数 {max(args.channels)} 超过可用文件描述符 {limit}（RLIMIT_NOFILE 硬限制）")
+
+    target = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--target'],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(target.stdout.readline())
+        host = b'127.0.0.1'
+        payload = bytes([len(host)]) + host + struct.pack('>H', port)
+
+        sessions: List[TunnelSession] = []
+        gc.collect()
+        baseline = rss_bytes()
+        tasks_baseline = len(asyncio.all_tasks())
+        results = []
+        for count in sorted(args.channels):
+            started = time.perf_counter()
+            await open_channels(sessions, count, payload)
+            elapsed = time.perf_counter() - started
+            await asyncio.sleep(0.2)  # 等待连接建立后的回调全部完成
+            gc.collect()
+            delta = rss_bytes() - baseline
+            result = {
+                'channels': count,
+                'sessions': len(sessions),
+                'rss_delta_bytes': delta,
+                'rss_per_channel_bytes': delta // count,
+                'tasks': len(asyncio.all_tasks()) - tasks_baseline,
+                'open_seconds': round(elapsed, 2),
+            }
+            results.append(result)
+            print(f"  {count:7d} 个通道: RSS +{delta / 1048576:.1f} MiB, "
+                  f"每通道 {result['rss_per_channel_bytes'] / 1024:.2f} KiB, 任务 {result['tasks']} 个")
+
+        for session in sessions:
+            for channel in list(session.channels.values()):
+                session._close_channel(channel)
+    finally:
+        target.kill()
+        target.wait()
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'fd_limit': limit,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务端空闲通道内存基准')
+    parser.add_argument('--channels', default='1000,10000', help='逗号分隔的通道数 (默认: 1000,10000)')
+    parser.add_argument('--output', '-o', default=None, help='JSON 结果文件')
+    parser.add_argument('--target', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.target:
+        run_target()
+        return 0
+
+    args.channels = [int(n) for n in args.channels.split(',') if n]
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.disable(logging.INFO)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
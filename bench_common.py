@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+common.py 热路径微基准测试
+
+覆盖每条消息都会调用的辅助函数:
+- TunnelCrypto.encrypt / decrypt
+- 内层加密: BatchSealer.flush / BatchOpener.feed（每批一条记录，与逐条 encrypt 对比）
+- TrafficShaper.pad_data / unpad_data
+- TunnelCrypto.verify_auth_token_multi_user（不同用户数）
+- IPWhitelist.is_allowed（不同条目数）
+- SMTPMessageGenerator.wrap_tunnel_data / extract_tunnel_data
+- DATA 传输模式的流式编解码: Base64LineEncoder / Base64LineDecoder / MIMEStreamDecoder
+- 帧编解码: encode_frame / encode_frame_iov / BufferPool.write_frame / FrameDecoder
+
+每项报告:
+- ops/s 和 µs/op（自适应循环次数，取多轮中最好的一轮）
+- MB/s（有输入大小的项）
+- 单次调用的峰值临时分配（tracemalloc）和多次调用后残留的内存
+
+用法:
+    python bench_common.py                    # 全部
+    python bench_common.py --list             # 列出名称
+    python bench_common.py 'crypto.*' frame.decode   # 按名称匹配（支持通配符）
+    python bench_common.py --output before.json  # 保存结果，便于优化前后比较
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    TunnelCrypto, BatchSealer, BatchOpener, TrafficShaper, SMTPMessageGenerator, IPWhitelist, UserConfig,
+    FRAME_DATA, FrameDecoder, BufferPool, encode_frame, encode_frame_iov,
+    Base64LineEncoder, Base64LineDecoder, MIMEStreamDecoder
+)
+
+PAYLOAD_SIZES = (64, 1400, 16384, 65535)  # 小控制消息、一个 MTU、一个 TLS 记录、最大帧
+SMTP_SIZES = (1400, 16384, 65535)
+USER_COUNTS = (1, 100, 1000)
+WHITELIST_SIZES = (1, 10, 100)
+MIME_SIZES = (65536, 1 << 20)  # 一次读取、一封满载的 DATA 邮件
+MIME_READ_SIZE = 65536  # 解码时每次喂入的块大小（与接收循环的读取大小一致）
+
+
+@dataclass
+class Benchmark:
+    """一个基准项: func 无参数，每次调用执行一次操作"""
+    name: str
+    func: Callable[[], object]
+    size: int = 0  # 每次操作处理的字节数（用于 MB/s），0 表示不适用
+
+
+# ============================================================================
+# 基准项
+# ============================================================================
+
+def crypto_benchmarks() -> List[Benchmark]:
+    client = TunnelCrypto('benchmark-secret', is_server=False)
+    server = TunnelCrypto('benchmark-secret', is_server=True)
+    benchmarks = []
+    for size in PAYLOAD_SIZES:
+        plaintext = os.urandom(size)
+        sealed = client.encrypt(plaintext)
+        benchmarks.append(Benchmark(f'crypto.encrypt[{size}]', lambda p=plaintext: client.encrypt(p), size))
+        benchmarks.append(Benchmark(f'crypto.decrypt[{size}]', lambda s=sealed: server.decrypt(s), size))
+    return benchmarks
+
+
+class NullWriter:
+    """丢弃写入的数据，只保留最后一次写入"""
+
+    last = b''
+
+    def write(self, data):
+        self.last = data
+
+    def is_closing(self):
+        return False
+
+
+def seal_benchmarks() -> List[Benchmark]:
+    salt = os.urandom(32)
+    client_send, _ = TunnelCrypto('benchmark-secret', is_server=False).session_ciphers(salt)
+    _, server_recv = TunnelCrypto('benchmark-secret', is_server=True).session_ciphers(salt)
+    benchmarks = []
+    for size in PAYLOAD_SIZES:
+        data = os.urandom(size)
+        writer = NullWriter()
+        sealer = BatchSealer(writer, client_send)
+
+        def seal(data=data, sealer=sealer):
+            sealer.pending = bytearray(data)  # 相当于一轮事件循环中写入的批次
+            sealer.flush()
+
+        seal()
+        opener = BatchOpener(server_recv)
+
+        def open_record(record=writer.last, opener=opener):
+            opener.counter = 0
+            return opener.feed(record)
+
+        benchmarks.append(Benchmark(f'seal.seal[{size}]', seal, size))
+        benchmarks.append(Benchmark(f'seal.open[{size}]', open_record, size))
+    return benchmarks
+
+
+def shaper_benchmarks() -> List[Benchmark]:
+    shaper = TrafficShaper()
+    benchmarks = []
+    for size in PAYLOAD_SIZES[:3]:  # pad_data 的长度前缀只有 2 字节
+        data = os.urandom(size)
+        padded = shaper.pad_data(data)
+        benchmarks.append(Benchmark(f'shaper.pad[{size}]', lambda d=data: shaper.pad_data(d), size))
+        benchmarks.append(Benchmark(f'shaper.unpad[{size}]', lambda p=padded: TrafficShaper.unpad_data(p), size))
+    return benchmarks
+
+
+def auth_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for count in USER_COUNTS:
+        users = {f'user{i}': UserConfig(f'user{i}', f'secret-{i}') for i in range(count)}
+        username = f'user{count - 1}'
+        token = TunnelCrypto(users[username].secret).generate_auth_token(int(time.time()), username)
+        verify = TunnelCrypto.verify_auth_token_multi_user
+        benchmarks.append(Benchmark(f'auth.verify[{count}]', lambda t=token, u=users: verify(t, u)))
+    bad_token = TunnelCrypto('wrong').generate_auth_token(int(time.time()), 'user0')
+    users = {'user0': UserConfig('user0', 'secret-0')}
+    benchmarks.append(Benchmark('auth.verify_reject', lambda: TunnelCrypto.verify_auth_token_multi_user(bad_token, users)))
+    return benchmarks
+
+
+def whitelist_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for count in WHITELIST_SIZES:
+        # 一半单个地址、一半网段，被检查的地址只匹配最后一个条目（最坏情况）
+        entries = [f'10.{i // 256}.{i % 256}.1' if i % 2 else f'10.{100 + i // 256}.{i % 256}.0/24'
+                   for i in range(count - 1)]
+        entries.append('192.168.0.0/16')
+        whitelist = IPWhitelist(entries)
+        benchmarks.append(Benchmark(f'whitelist.hit[{count}]', lambda w=whitelist: w.is_allowed('192.168.5.6')))
+        benchmarks.append(Benchmark(f'whitelist.miss[{count}]', lambda w=whitelist: w.is_allowed('203.0.113.9')))
+    return benchmarks
+
+
+def smtp_benchmarks() -> List[Benchmark]:
+    generator = SMTPMessageGenerator()
+    benchmarks = []
+    for size in SMTP_SIZES:
+        data = os.urandom(size)
+        message = generator.wrap_tunnel_data(data)[3]
+        benchmarks.append(Benchmark(f'smtp.wrap[{size}]', lambda d=data: generator.wrap_tunnel_data(d), size))
+        benchmarks.append(Benchmark(f'smtp.extract[{size}]', lambda m=message: generator.extract_tunnel_data(m), size))
+    return benchmarks
+
+
+def mime_benchmarks() -> List[Benchmark]:
+    generator = SMTPMessageGenerator()
+    benchmarks = []
+    for size in MIME_SIZES:
+        data = os.urandom(size)
+
+        def encode(data=data):
+            encoder = Base64LineEncoder()
+            return encoder.encode(data) + encoder.flush()
+
+        encoded = encode()
+        reply = Base64LineEncoder(b'250-').encode(data)
+
+        def decode(encoded=encoded, prefix=b''):
+            decoder = Base64LineDecoder(prefix)
+            for offset in range(0, len(encoded), MIME_READ_SIZE):
+                decoder.decode(encoded[offset:offset + MIME_READ_SIZE])
+            return decoder.finish()
+
+        _, _, _, head, tail = generator.begin_message()
+        message = head + encoded + tail
+
+        def decode_message(message=message):
+            decoder = MIMEStreamDecoder()
+            for offset in range(0, len(message), MIME_READ_SIZE):
+                decoder.feed(message[offset:offset + MIME_READ_SIZE])
+            decoder.finish()
+
+        benchmarks.append(Benchmark(f'mime.encode[{size}]', encode, size))
+        benchmarks.append(Benchmark(f'mime.decode[{size}]', decode, size))
+        benchmarks.append(Benchmark(f'mime.decode_reply[{size}]', lambda r=reply: decode(r, b'250-'), size))
+        benchmarks.append(Benchmark(f'mime.decode_message[{size}]', decode_message, size))
+    return benchmarks
+
+
+class CopyingSink:
+    """与 BatchSealer / TLS 传输一样在 write() 中复制数据的写入器，每次写入后清空"""
+
+    def __init__(self):
+        self.pending = bytearray()
+
+    def write(self, data):
+        self.pending += data
+        del self.pending[:]
+
+
+def frame_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    pool = BufferPool()
+    sink = CopyingSink()
+    for size in PAYLOAD_SIZES:
+        payload = os.urandom(size)
+        benchmarks.append(Benchmark(f'frame.encode[{size}]', lambda p=payload: encode_frame(FRAME_DATA, 1, p), size))
+        benchmarks.append(Benchmark(f'frame.encode_iov[{size}]',
+                                    lambda p=payload: encode_frame_iov(FRAME_DATA, 1, p), size))
+        # 编码并交给写入器: 每帧新分配 vs 缓冲区池
+        benchmarks.append(Benchmark(f'frame.encode_write[{size}]',
+                                    lambda p=payload: sink.write(encode_frame(FRAME_DATA, 1, p)), size))
+        benchmarks.append(Benchmark(f'frame.encode_pooled[{size}]',
+                                    lambda p=payload: pool.write_frame(sink.write, FRAME_DATA, 1, p), size))
+
+        # 解码: 一次 64 KiB 读取中包含若干完整帧（与接收循环的读取大小一致）
+        frame = bytes(encode_frame(FRAME_DATA, 1, payload))
+        chunk = frame * max(1, 65536 // len(frame))
+
+        def decode(chunk=chunk):
+            decoder = FrameDecoder()
+            decoder.feed(chunk)
+            for _ in decoder:
+                pass
+
+        benchmarks.append(Benchmark(f'frame.decode[{size}]', decode, len(chunk)))
+    return benchmarks
+
+
+GROUPS = (crypto_benchmarks, seal_benchmarks, shaper_benchmarks, auth_benchmarks, whitelist_benchmarks,
+          smtp_benchmarks, mime_benchmarks, frame_benchmarks)
+
+
+def all_benchmarks() -> List[Benchmark]:
+    benchmarks = []
+    for group in GROUPS:
+        benchmarks.extend(group())
+    return benchmarks
+
+
+# ============================================================================
+# 测量
+# ============================================================================
+
+def measure_speed(func: Callable[[], object], min_time: float, repeat: int) -> float:
+    """
+    测量单次调用耗时（秒）
+
+    先把循环次数加倍到单轮不少于 min_time，再重复 repeat 轮取最快的一轮，
+    减少调度和 GC 造成的噪声
+    """
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best
+
+
+def measure_memory(func: Callable[[], object], calls: int = 100) -> Dict[str, int]:
+    """
+    测量内存分配
+
+    返回:
+        peak_bytes: 单次调用期间的峰值临时分配（含返回值）
+        retained_bytes: calls 次调用后仍未释放的平均字节数（应接近 0）
+    """
+    func()  # 预热: 排除首次调用的缓存和延迟导入
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        del result
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            func()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': peak - baseline, 'retained_bytes': max(0, after - before) // calls}
+
+
+def run_benchmark(benchmark: Benchmark, min_time: float, repeat: int) -> Dict:
+    seconds = measure_speed(benchmark.func, min_time, repeat)
+    result = {
+        'ops_per_second': round(1 / seconds, 1),
+        'us_per_op': round(seconds * 1e6, 3),
+        'mb_per_second': round(benchmark.size / seconds / 1e6, 1) if benchmark.size else None,
+    }
+    result.update(measure_memory(benchmark.func))
+    return result
+
+
+def git_revision() -> Optional[str]:
+    """当前提交（工作区有改动时加 -dirty 后缀）"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=base_dir,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=base_dir,
+                               capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if not commit:
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def select(benchmarks: List[Benchmark], patterns: List[str]) -> List[Benchmark]:
+    """按名称选择基准项，模式可以是通配符或名称前缀"""
+    if not patterns:
+        return benchmarks
+    return [b for b in benchmarks
+            if any(fnmatch.fnmatchcase(b.name, p) or b.name.startswith(p) for p in patterns)]
+
+
+def format_row(name: str, result: Dict) -> str:
+    mb = f"{result['mb_per_second']:>9.1f}" if result['mb_per_second'] is not None else f"{'-':>9}"
+    return (f"{name:28s} {result['ops_per_second']:>12,.0f} {result['us_per_op']:>10.2f} {mb} "
+            f"{result['peak_bytes']:>10,} {result['retained_bytes']:>8,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='common.py 热路径微基准测试')
+    parser.add_argument('patterns', nargs='*', help='基准项名称或通配符 (例如 crypto.* 或 frame.decode)')
+    parser.add_argument('--list', action='store_true', help='只列出基准项名称')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每轮最短时间 (秒，默认: 0.2)')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测量轮数，取最快 (默认: 3)')
+    parser.add_argument('--output', '-o', default=None, help='JSON 结果文件')
+    args = parser.parse_args()
+
+    benchmarks = select(all_benchmarks(), args.patterns)
+    if args.list:
+        for benchmark in benchmarks:
+            print(benchmark.name)
+        return 0
+    if not benchmarks:
+        print(f"没有匹配的基准项: {' '.join(args.patterns)}")
+        return 1
+
+    print(f"{'名称':26s} {'ops/s':>12} {'µs/op':>10} {'MB/s':>9} {'峰值分配B':>9} {'残留B':>6}")
+    results: Dict[str, Dict] = {}
+    for benchmark in benchmarks:
+        results[benchmark.name] = run_benchmark(benchmark, args.min_time, args.repeat)
+        print(format_row(benchmark.name, results[benchmark.name]), flush=True)
+
+    if args.output:
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'min_time': args.min_time,
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
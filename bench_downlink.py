@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+服务端下行转发基准 - 目标 → 服务端通道 → TLS 隧道连接，经本机回环批量传输
+
+bench_relay.py 的 download 场景经过 SOCKS5 和客户端，单核机器上两端和目标共用一个 CPU，
+吞吐量主要反映整条链路。这里只测服务端的下行路径:
+- 目标在子进程中，接受连接后尽快发送指定字节数再关闭
+- 本进程的 TunnelSession 直接处理 CONNECT，隧道一侧是到子进程的真实 TLS 连接，子进程读取并丢弃
+- 本进程的 CPU 时间（getrusage）只包含读取目标、编码帧和 TLS 加密
+
+输出:
+- 吞吐量 (MB/s) 和本进程每 GB 的 CPU 秒数
+- 帧缓冲区池的命中率和同时取出数的最大值
+
+用法:
+    python bench_downlink.py --channels 8 --size 256
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_certs
+from common import ServerConfig
+from server import TunnelSession
+
+CHUNK_SIZE = 1 << 20  # 目标每次写入的字节数
+
+
+def run_source(size: int):
+    """子进程: 每个连接发送 size 字节后关闭"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    print(listener.getsockname()[1], flush=True)
+    chunk = memoryview(os.urandom(CHUNK_SIZE))
+
+    async def serve(reader, writer):
+        remaining = size
+        while remaining > 0:
+            writer.write(chunk[:min(remaining, CHUNK_SIZE)])
+            remaining -= min(remaining, CHUNK_SIZE)
+            await writer.drain()
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(serve, sock=listener)
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def run_sink(cert_file: str, key_file: str):
+    """子进程: TLS 服务端，读取并丢弃隧道数据"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+
+    async def serve(reader, writer):
+        while await reader.read(1 << 20):
+            pass
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(serve, '127.0.0.1', 0, ssl=context)
+        print(server.sockets[0].getsockname()[1], flush=True)
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_child(*args) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *args], stdout=subprocess.PIPE, text=True)
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def run(args) -> Dict:
+    size = args.size * 1024 * 1024
+    with tempfile.TemporaryDirectory(prefix='smtp-tunnel-bench-') as directory:
+        cert_file, key_file = os.path.join(directory, 'server.crt'), os.path.join(directory, 'server.key')
+        ca_key = generate_certs.generate_private_key(2048)
+        ca_cert = generate_certs.generate_ca_certificate(ca_key)
+        server_key = generate_certs.generate_private_key(2048)
+        generate_certs.save_certificate(
+            generate_certs.generate_server_certificate(ca_key, ca_cert, server_key, hostname='localhost'), cert_file)
+        generate_certs.save_private_key(server_key, key_file)
+        sink = start_child('--sink', cert_file, key_file)
+        source = start_child('--source', str(size))
+        sink_port = int(sink.stdout.readline() or 0)  # 子进程加载证书后才输出端口
+        source_port = int(source.stdout.readline() or 0)
+
+    try:
+        if not sink_port or not source_port:
+            raise RuntimeError("子进程启动失败")
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        _, writer = await asyncio.open_connection('127.0.0.1', sink_port, ssl=context)
+
+        session = TunnelSession(None, writer, ServerConfig(), None, {})
+        host = b'127.0.0.1'
+        payload = bytes([len(host)]) + host + struct.pack('>H', source_port)
+
+        cpu = cpu_seconds()
+        started = time.perf_counter()
+        await asyncio.gather(*(session._handle_connect(channel_id, payload)
+                               for channel_id in range(1, args.channels + 1)))
+        while session.channels:
+            await asyncio.sleep(0.01)
+        await writer.drain()
+        wall = time.perf_counter() - started
+        cpu = cpu_seconds() - cpu
+
+        sent = session.user_metrics.bytes_sent.value
+        await session._cleanup()
+    finally:
+        sink.kill()
+        source.kill()
+        sink.wait()
+        source.wait()
+
+    total = size * args.channels
+    pool = session.buffer_pool
+    result = {
+        'channels': args.channels,
+        'bytes': total,
+        'tunnel_bytes': sent,
+        'mb_s': round(total / wall / 1e6, 1),
+        'cpu_seconds_per_gb': round(cpu / (total / 1e9), 3),
+        'buffer_pool': {'hit_rate': round(pool.hit_rate, 4), 'high_water': pool.high_water,
+                        'retained': pool.retained},
+    }
+    print(f"  {args.channels} 个通道 x {args.size} MiB: {result['mb_s']} MB/s, "
+          f"CPU {result['cpu_seconds_per_gb']} s/GB, 缓冲区池命中率 {pool.hit_rate:.1%}, "
+          f"最多同时取出 {pool.high_water}, 未归还 {pool.retained}")
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'result': result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务端下行转发基准')
+    parser.add_argument('--channels', type=int, default=8, help='并发通道数 (默认: 8)')
+    parser.add_argument('--size', type=int, default=256, help='每个通道传输的 MiB 数 (默认: 256)')
+    parser.add_argument('--output', '-o', default=None, help='JSON 结果文件')
+    parser.add_argument('--source', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--sink', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.source is not None:
+        run_source(args.source)
+        return 0
+    if args.sink:
+        run_sink(*args.sink)
+        return 0
+
+    logging.disable(logging.INFO)
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+"""
+隧道中继基准测试 - 在同一进程中启动服务端、客户端和本地目标
+
+与 load_test.py 不同，这里不依赖外部目标和已运行的客户端:
+使用 generate_certs.py 生成一次性证书，启动 TunnelServer、TunnelClient 和 SOCKS5Server，
+再启动本地 echo / sink / source 目标，全部流量只经过回环接口。
+
+场景:
+1. upload: 每个通道向 sink 目标发送固定字节数，等待目标确认全部收到
+2. download: 每个通道从 source 目标接收固定字节数
+3. echo: 每个通道经 echo 目标往返固定字节数
+4. open: 串行打开通道，统计从 TCP 连接到 SOCKS 成功回复的延迟
+5. idle: 同时保持多个空闲通道，统计每个通道占用的 RSS
+
+输出:
+- 每通道和总体吞吐量（MB/s，1 MB = 10^6 字节）
+- 打开通道延迟 p50/p99
+- 每 GB 流量消耗的 CPU 秒数（整个进程: 客户端、服务端、目标和压测端之和）
+- 每个空闲通道的 RSS 增量（同样包含两端和目标的套接字）
+- --stealth 时两个方向的填充字节比例（与不带 --stealth 的结果对比即为隐蔽模式的吞吐量开销）
+- --seal 时客户端要求内层加密，报告上行记录数和平均每条记录的明文大小（与不带 --seal 对比即为加密开销）
+- --crypto-threads N 时两端的内层加密大批次交给 N 个线程的线程池；吞吐量场景同时报告事件循环延迟
+  （10 ms 定时器的超时 p50/p99/max），比较 0 / 1 / N 个线程的结果
+- --transport data / bdat 测量邮件传输模式（每批帧一封邮件，DATA 或 BDAT 发送）的吞吐量
+
+--output 写出 JSON（含 git 提交和参数），便于比较不同版本:
+    python bench_relay.py --output before.json
+    git checkout feature && python bench_relay.py --output after.json
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_certs
+from common import ServerConfig, ClientConfig, UserConfig, CryptoOffload
+from server import TunnelServer
+from client import TunnelClient, SOCKS5Server
+
+SIZE_HEADER = struct.Struct('>Q')  # sink / source 目标的请求头: 字节数
+CHUNK_SIZE = 65536  # 压测端每次写入的大小
+LAG_INTERVAL = 0.01  # 事件循环延迟采样间隔（秒）
+SCENARIOS = ('upload', 'download', 'echo', 'open', 'idle')
+SOCKS_CONNECTION_LIMIT = 100  # SOCKS5Server 的并发连接上限
+
+
+# ============================================================================
+# 测量工具
+# ============================================================================
+
+def cpu_seconds() -> float:
+    """进程累计 CPU 时间（用户态 + 内核态）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rss_bytes() -> int:
+    """当前常驻内存（字节），没有 /proc 时退回到峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def git_revision() -> Optional[str]:
+    """当前提交（工作区有改动时加 -dirty 后缀）"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=base_dir,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=base_dir,
+                               capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if not commit:
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def throughput_summary(results: List[Tuple[int, float]], wall: float, cpu: float) -> Dict:
+    """
+    汇总吞吐量
+
+    参数:
+        results: 每个通道的 (字节数, 耗时秒)
+        wall: 所有通道并发运行的总耗时
+        cpu: 期间消耗的 CPU 秒数
+    """
+    total = sum(size for size, _ in results)
+    per_channel = [size / elapsed / 1e6 for size, elapsed in results if elapsed > 0]
+    return {
+        'channels': len(results),
+        'bytes': total,
+        'wall_seconds': round(wall, 4),
+        'aggregate_mb_s': round(total / wall / 1e6, 2) if wall > 0 else None,
+        'per_channel_mb_s': {
+            'mean': round(sum(per_channel) / len(per_channel), 2) if per_channel else None,
+            'min': round(min(per_channel), 2) if per_channel else None,
+            'max': round(max(per_channel), 2) if per_channel else None,
+        },
+        'cpu_seconds': round(cpu, 4),
+        'cpu_seconds_per_gb': round(cpu / (total / 1e9), 3) if total else None,
+    }
+
+
+class LoopLagMonitor:
+    """事件循环延迟: 每 LAG_INTERVAL 秒睡眠一次，记录实际唤醒比预期晚了多久"""
+
+    def __init__(self):
+        self.samples: List[float] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.samples.append(time.perf_counter() - started - LAG_INTERVAL)
+
+    def stop(self) -> Dict:
+        """停止采样，返回延迟统计（毫秒）"""
+        self.task.cancel()
+        return {
+            'samples': len(self.samples),
+            'p50_ms': round(percentile(self.samples, 50) * 1000, 3) if self.samples else None,
+            'p99_ms': round(percentile(self.samples, 99) * 1000, 3) if self.samples else None,
+            'max_ms': round(max(self.samples) * 1000, 3) if self.samples else None,
+        }
+
+
+# ============================================================================
+# 本地目标
+# ============================================================================
+
+class Targets:
+    """echo / sink / source 目标服务"""
+
+    def __init__(self, chunk: bytes):
+        self.chunk = chunk
+        self.servers = []
+        self.ports: Dict[str, int] = {}
+
+    async def start(self):
+        """在回环接口的随机端口上启动所有目标"""
+        for name, handler in (('echo', self._echo), ('sink', self._sink), ('source', self._source)):
+            server = await asyncio.start_server(handler, '127.0.0.1', 0)
+            self.servers.append(server)
+            self.ports[name] = server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    @staticmethod
+    async def _echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """原样返回收到的数据"""
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """读取请求头指定的字节数后回复一个字节"""
+        try:
+            size, = SIZE_HEADER.unpack(await reader.readexactly(SIZE_HEADER.size))
+            while size > 0:
+                data = await reader.read(min(size, 1 << 20))
+                if not data:
+                    return
+                size -= len(data)
+            writer.write(b'\x01')
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _source(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """发送请求头指定的字节数后关闭"""
+        try:
+            size, = SIZE_HEADER.unpack(await reader.readexactly(SIZE_HEADER.size))
+            view = memoryview(self.chunk)
+            while size > 0:
+                part = view[:min(size, len(view))]
+                writer.write(part)
+                await writer.drain()
+                size -= len(part)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+
+# ============================================================================
+# 隧道
+# ============================================================================
+
+class Bench:
+    """进程内隧道及各个场景"""
+
+    def __init__(self, args):
+        self.args = args
+        self.chunk = self._make_chunk(args.payload)
+        self.targets = Targets(self.chunk)
+        self.tmpdir = tempfile.TemporaryDirectory(prefix='smtp-tunnel-bench-')
+        self.tunnel_server = None
+        self.tunnel: Optional[TunnelClient] = None
+        self.crypto_offload: Optional[CryptoOffload] = None  # 客户端的加密线程池（服务端自己创建）
+        self.listeners = []
+        self.socks_port = 0
+
+    @staticmethod
+    def _make_chunk(kind: str) -> bytes:
+        """压测数据: random 不可压缩，text 可压缩"""
+        if kind == 'text':
+            line = b'GET /static/app.js HTTP/1.1\r\nHost: example.com\r\nAccept: */*\r\n\r\n'
+            return (line * (CHUNK_SIZE // len(line) + 1))[:CHUNK_SIZE]
+        return os.urandom(CHUNK_SIZE)
+
+    def _make_certs(self) -> Tuple[str, str, str]:
+        """生成一次性的 CA 和服务器证书"""
+        directory = self.tmpdir.name
+        ca_key = generate_certs.generate_private_key(2048)
+        ca_cert = generate_certs.generate_ca_certificate(ca_key)
+        server_key = generate_certs.generate_private_key(2048)
+        server_cert = generate_certs.generate_server_certificate(ca_key, ca_cert, server_key, hostname='localhost')
+        paths = tuple(os.path.join(directory, name) for name in ('server.crt', 'server.key', 'ca.crt'))
+        generate_certs.save_certificate(server_cert, paths[0])
+        generate_certs.save_private_key(server_key, paths[1])
+        generate_certs.save_certificate(ca_cert, paths[2])
+        return paths
+
+    async def start(self):
+        """启动目标、服务端、客户端和 SOCKS5 代理"""
+        await self.targets.start()
+        cert_file, key_file, ca_file = self._make_certs()
+
+        users = {'bench': UserConfig('bench', 'bench-secret')}
+        server_config = ServerConfig(host='127.0.0.1', port=0, hostname='localhost',
+                                     cert_file=cert_file, key_file=key_file, stealth_enabled=self.args.stealth,
+                                     crypto_threads=self.args.crypto_threads)
+        self.tunnel_server = TunnelServer(server_config, users)
+        listener = await asyncio.start_server(self.tunnel_server.handle_client, '127.0.0.1', 0)
+        self.listeners.append(listener)
+
+        client_config = ClientConfig(server_host='localhost', server_port=listener.sockets[0].getsockname()[1],
+                                     username='bench', secret='bench-secret',
+                                     compression=self.args.compression, stealth_enabled=self.args.stealth,
+                                     transport=self.args.transport, inner_encryption=self.args.seal)
+        if self.args.crypto_threads:
+            self.crypto_offload = CryptoOffload(self.args.crypto_threads)
+        self.tunnel = TunnelClient(client_config, ca_file, crypto_offload=self.crypto_offload)
+        if not await self.tunnel.connect():
+            raise RuntimeError("无法连接到进程内隧道服务端")
+        await self.tunnel.start_receiver()
+
+        socks = SOCKS5Server(self.tunnel, '127.0.0.1', 0)
+        listener = await asyncio.start_server(socks.handle_client, '127.0.0.1', 0)
+        self.listeners.append(listener)
+        self.socks_port = listener.sockets[0].getsockname()[1]
+
+    def stealth_summary(self) -> Dict:
+        """两个方向的填充字节和比例（上行取客户端输出级，下行取服务端指标）"""
+        upload = self.tunnel.stealth
+        user_metrics = self.tunnel_server.metrics.for_user('bench')
+        sent = user_metrics.bytes_sent.value
+        return {
+            'upload_padding_bytes': upload.padding_bytes if upload else None,
+            'upload_overhead': round(upload.overhead, 4) if upload else None,
+            'download_padding_bytes': user_metrics.padding_sent.value,
+            'download_overhead': round(user_metrics.padding_sent.value / sent, 4) if sent else None,
+        }
+
+    def seal_summary(self) -> Dict:
+        """上行内层加密的记录数和平均记录大小（体现合并效果）"""
+        sealer = self.tunnel.sealer
+        return {
+            'upload_records': sealer.counter,
+            'upload_bytes': sealer.sealed_bytes,
+            'upload_bytes_per_record': round(sealer.sealed_bytes / sealer.counter) if sealer.counter else None,
+            'client_offloaded_records': self.crypto_offload.offloaded if self.crypto_offload else 0,
+            'server_offloaded_records': (self.tunnel_server.crypto_offload.offloaded
+                                         if self.tunnel_server.crypto_offload else 0),
+        }
+
+    def pool_summary(self) -> Dict:
+        """两端帧缓冲区池的命中率、同时取出数的最大值和未归还数"""
+        summary = {}
+        for side, pool in (('client', self.tunnel.buffer_pool), ('server', self.tunnel_server.buffer_pool)):
+            summary[side] = {
+                'hits': pool.hits,
+                'misses': pool.misses,
+                'hit_rate': round(pool.hit_rate, 4),
+                'high_water': pool.high_water,
+                'retained': pool.retained,
+            }
+        return summary
+
+    async def stop(self):
+        if self.tunnel:
+            await self.tunnel.disconnect()
+        for listener in self.listeners:
+            listener.close()
+        for offload in (self.crypto_offload, self.tunnel_server and self.tunnel_server.crypto_offload):
+            if offload:
+                offload.shutdown()
+        await self.targets.stop()
+        self.tmpdir.cleanup()
+
+    async def open(self, target: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """经 SOCKS5 打开到目标的通道"""
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.socks_port)
+        writer.write(b'\x05\x01\x00')
+        await writer.drain()
+        if await reader.readexactly(2) != b'\x05\x00':
+            raise RuntimeError("SOCKS5 协商失败")
+        writer.write(b'\x05\x01\x00\x01' + bytes([127, 0, 0, 1]) + struct.pack('>H', self.targets.ports[target]))
+        await writer.drain()
+        reply = await reader.readexactly(10)
+        if reply[1] != 0:
+            writer.close()
+            raise RuntimeError(f"SOCKS5 连接失败: {reply[1]}")
+        return reader, writer
+
+    async def _write_bytes(self, writer: asyncio.StreamWriter, size: int):
+        view = memoryview(self.chunk)
+        while size > 0:
+            part = view[:min(size, len(view))]
+            writer.write(part)
+            await writer.drain()
+            size -= len(part)
+
+    # ------------------------------------------------------------------
+    # 场景
+    # ------------------------------------------------------------------
+
+    async def _upload_one(self, size: int) -> Tuple[int, float]:
+        reader, writer = await self.open('sink')
+        started = time.perf_counter()
+        writer.write(SIZE_HEADER.pack(size))
+        await self._write_bytes(writer, size)
+        if await reader.readexactly(1) != b'\x01':
+            raise RuntimeError("sink 确认无效")
+        elapsed = time.perf_counter() - started
+        writer.close()
+        return size, elapsed
+
+    async def _download_one(self, size: int) -> Tuple[int, float]:
+        reader, writer = await self.open('source')
+        started = time.perf_counter()
+        writer.write(SIZE_HEADER.pack(size))
+        await writer.drain()
+        remaining = size
+        while remaining > 0:
+            data = await reader.read(1 << 20)
+            if not data:
+                raise RuntimeError(f"下载提前结束，缺少 {remaining} 字节")
+            remaining -= len(data)
+        elapsed = time.perf_counter() - started
+        writer.close()
+        return size, elapsed
+
+    async def _echo_one(self, size: int) -> Tuple[int, float]:
+        reader, writer = await self.open('echo')
+        started = time.perf_counter()
+        sender = asyncio.create_task(self._write_bytes(writer, size))
+        remaining = size
+        while remaining > 0:
+            data = await reader.read(1 << 20)
+            if not data:
+                raise RuntimeError(f"回显提前结束，缺少 {remaining} 字节")
+            remaining -= len(data)
+        await sender
+        elapsed = time.perf_counter() - started
+        writer.close()
+        return size * 2, elapsed  # 两个方向都经过隧道
+
+    async def run_throughput(self, name: str) -> Dict:
+        """并发运行 --channels 个通道的吞吐量场景"""
+        worker = {'upload': self._upload_one, 'download': self._download_one, 'echo': self._echo_one}[name]
+        size = int(self.args.size * 1024 * 1024)
+        gc.collect()
+        lag = LoopLagMonitor()
+        lag.start()
+        cpu_started = cpu_seconds()
+        started = time.perf_counter()
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(worker(size) for _ in range(self.args.channels))),
+                timeout=self.args.timeout
+            )
+        finally:
+            loop_lag = lag.stop()
+        wall = time.perf_counter() - started
+        summary = throughput_summary(results, wall, cpu_seconds() - cpu_started)
+        summary['loop_lag'] = loop_lag
+        return summary
+
+    async def run_open(self) -> Dict:
+        """串行打开 --opens 个通道，统计打开延迟"""
+        latencies = []
+        cpu_started = cpu_seconds()
+        started = time.perf_counter()
+        for _ in range(self.args.opens):
+            opened = time.perf_counter()
+            reader, writer = await self.open('echo')
+            latencies.append(time.perf_counter() - opened)
+            writer.close()
+            await writer.wait_closed()
+        wall = time.perf_counter() - started
+        return {
+            'count': len(latencies),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3),
+            'opens_per_second': round(len(latencies) / wall, 1),
+            'cpu_seconds': round(cpu_seconds() - cpu_started, 4),
+        }
+
+    async def run_idle(self) -> Dict:
+        """同时保持 --idle 个空闲通道，统计 RSS 增量"""
+        await asyncio.sleep(0.5)  # 等待前面场景关闭的通道清理完成
+        gc.collect()
+        baseline = rss_bytes()
+        channels = []
+        for _ in range(self.args.idle):
+            reader, writer = await self.open('echo')
+            writer.write(b'x')
+            await reader.readexactly(1)  # 确保通道已经完整打开并经过一次往返
+            channels.append(writer)
+        gc.collect()
+        loaded = rss_bytes()
+        for writer in channels:
+            writer.close()
+        return {
+            'channels': len(channels),
+            'rss_baseline_bytes': baseline,
+            'rss_loaded_bytes': loaded,
+            'rss_per_channel_bytes': (loaded - baseline) // len(channels) if channels else None,
+        }
+
+
+# ============================================================================
+# 主程序
+# ============================================================================
+
+async def run(args) -> Dict:
+    """启动隧道，依次运行选中的场景"""
+    bench = Bench(args)
+    results = {}
+    await bench.start()
+    try:
+        print(f"隧道已启动: 压缩={bench.tunnel.compression or '关闭'}, "
+              f"能力={','.join(sorted(bench.tunnel.capabilities)) or '-'}")
+        for name in args.scenarios:
+            if name in ('upload', 'download', 'echo'):
+                result = await bench.run_throughput(name)
+                print(f"  {name:8s} 总体 {result['aggregate_mb_s']} MB/s, "
+                      f"每通道 {result['per_channel_mb_s']['mean']} MB/s, "
+                      f"CPU {result['cpu_seconds_per_gb']} s/GB, "
+                      f"事件循环延迟 p99 {result['loop_lag']['p99_ms']} ms")
+            elif name == 'open':
+                result = await bench.run_open()
+                print(f"  {name:8s} p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                      f"{result['opens_per_second']} 次/秒")
+            else:
+                result = await bench.run_idle()
+                print(f"  {name:8s} {result['channels']} 个通道, "
+                      f"每通道 RSS {result['rss_per_channel_bytes'] / 1024:.1f} KiB")
+            results[name] = result
+        if args.stealth:
+            results['stealth'] = bench.stealth_summary()
+            print(f"  stealth  上行填充 {results['stealth']['upload_overhead']}, "
+                  f"下行填充 {results['stealth']['download_overhead']}")
+        if args.seal:
+            results['seal'] = bench.seal_summary()
+            print(f"  seal     上行 {results['seal']['upload_records']} 条记录, "
+                  f"平均 {results['seal']['upload_bytes_per_record']} 字节/记录, "
+                  f"线程池加密 {results['seal']['client_offloaded_records']} / "
+                  f"{results['seal']['server_offloaded_records']} 条 (客户端 / 服务端)")
+        results['buffer_pool'] = pool = bench.pool_summary()
+        print(f"  pool     命中率 {pool['client']['hit_rate']:.1%} / {pool['server']['hit_rate']:.1%}, "
+              f"最多同时取出 {pool['client']['high_water']} / {pool['server']['high_water']}, "
+              f"未归还 {pool['client']['retained']} / {pool['server']['retained']} (客户端 / 服务端)")
+    finally:
+        await bench.stop()
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {
+            'channels': args.channels,
+            'size_mib': args.size,
+            'opens': args.opens,
+            'idle': args.idle,
+            'payload': args.payload,
+            'compression': args.compression,
+            'stealth': args.stealth,
+            'transport': args.transport,
+            'seal': args.seal,
+            'crypto_threads': args.crypto_threads,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SMTP 隧道进程内中继基准测试')
+    parser.add_argument('--channels', type=int, default=8, help='吞吐量场景的并发通道数 (默认: 8)')
+    parser.add_argument('--size', type=float, default=32, help='每个通道传输的 MiB 数 (默认: 32)')
+    parser.add_argument('--opens', type=int, default=200, help='open 场景打开的通道数 (默认: 200)')
+    parser.add_argument('--idle', type=int, default=90,
+                        help=f'idle 场景保持的通道数 (默认: 90，上限 {SOCKS_CONNECTION_LIMIT})')
+    parser.add_argument('--payload', choices=('random', 'text'), default='random',
+                        help='数据内容: random 不可压缩, text 可压缩 (默认: random)')
+    parser.add_argument('--compression', action='store_true', help='请求通道压缩')
+    parser.add_argument('--stealth', action='store_true', help='两端启用隐蔽模式（默认 stealth 配置）')
+    parser.add_argument('--seal', action='store_true', help='客户端要求内层加密 (SEAL)')
+    parser.add_argument('--crypto-threads', type=int, default=0,
+                        help='两端内层加密的线程池大小 (默认: 0, 在事件循环中加密)')
+    parser.add_argument('--transport', choices=('binary', 'data', 'bdat'), default='binary',
+                        help='隧道传输方式 (默认: binary)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'逗号分隔的场景 (默认: {",".join(SCENARIOS)})')
+    parser.add_argument('--timeout', type=float, default=300.0, help='单个场景的超时秒数 (默认: 300)')
+    parser.add_argument('--output', '-o', default=None, help='JSON 结果文件')
+    parser.add_argument('--debug', action='store_true', help='显示隧道日志')
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    if not 0 < args.idle <= SOCKS_CONNECTION_LIMIT:
+        parser.error(f"--idle 必须在 1 到 {SOCKS_CONNECTION_LIMIT} 之间")
+    if args.channels > SOCKS_CONNECTION_LIMIT:
+        parser.error(f"--channels 不能超过 {SOCKS_CONNECTION_LIMIT}")
+
+    logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.WARNING)
+    for name in ('smtp-tunnel-server', 'smtp-tunnel-client'):
+        logging.getLogger(name).setLevel(logging.DEBUG if args.debug else logging.ERROR)
+    if not args.debug:
+        # 退出时被取消的连接处理任务会由 asyncio 记录为错误，与结果无关
+        logging.getLogger('asyncio').setLevel(logging.CRITICAL)
+
+    try:
+        report = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("\n测试已中断")
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入 {args.output}")
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
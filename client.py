@@ -25,10 +25,26 @@ import struct
 import time
 import os
 import socket
-from typing import Dict, Optional, Tuple
-from dataclasses import dataclass
-
-from common import TunnelCrypto, load_config, ClientConfig
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+
+from common import (
+    TunnelCrypto, load_config, ClientConfig,
+    parse_capabilities, format_capabilities, TUNNEL_EHLO_KEYWORD, BINARY_OK_LINE, CAP_DNS,
+    CAP_COMPRESS, COMPRESSION_ALGORITHMS, choose_compression,
+    ChannelCompressor, ChannelDecompressor, format_compression_stats,
+    MetricsRegistry, start_metrics_server, register_process_metrics,
+    CAP_PING, KeepaliveMonitor, CAP_HALF_CLOSE, CAP_PADDING, StealthScheduler, parse_stealth_config,
+    CAP_SEAL, SEAL_SALT_SIZE, BatchSealer, BatchOpener, CryptoOffload,
+    CAP_MAIL_DATA, CAP_MAIL_BDAT, MAIL_CAPABILITIES_HEADER, MAIL_MESSAGE_MAX, FrameSpool, SMTPMessageGenerator,
+    Base64LineEncoder, Base64LineDecoder, padded_size, pad_frames, FRAME_HEADER_SIZE,
+    FRAME_DATA, FRAME_CONNECT, FRAME_CONNECT_OK, FRAME_CONNECT_FAIL, FRAME_CLOSE, FRAME_PING, FRAME_PONG,
+    FRAME_DNS_QUERY, FRAME_DNS_RESPONSE, FRAME_DATA_Z, FRAME_HALF_CLOSE, FRAME_PADDING,
+    FrameDecoder, BufferPool, ReadSizeTuner, CHANNEL_READ_SIZE, TUNNEL_READ_SIZE_MIN, parse_performance_config,
+    MOVED_PERFORMANCE_KEYS
+)
 
 # 配置日志格式,输出时间、日志级别和消息内容
 logging.basicConfig(
@@ -43,27 +59,17 @@ logger = logging.getLogger('smtp-tunnel-client')
 # 二进制协议定义
 # ============================================================================
 
-# 帧类型常量定义
-FRAME_DATA = 0x01        # 数据帧 - 用于传输实际数据
-FRAME_CONNECT = 0x02     # 连接帧 - 用于建立新连接
-FRAME_CONNECT_OK = 0x03  # 连接成功帧 - 服务器确认连接成功
-FRAME_CONNECT_FAIL = 0x04 # 连接失败帧 - 服务器拒绝连接
-FRAME_CLOSE = 0x05       # 关闭帧 - 用于关闭连接
-FRAME_HEADER_SIZE = 5     # 帧头大小 - 1字节帧类型 + 2字节通道ID + 2字节载荷长度
+# 客户端支持的隧道扩展能力
+CLIENT_CAPABILITIES = {CAP_DNS: [], CAP_COMPRESS: COMPRESSION_ALGORITHMS, CAP_PING: [], CAP_HALF_CLOSE: [],
+                       CAP_PADDING: [], CAP_SEAL: []}
 
-def make_frame(frame_type: int, channel_id: int, payload: bytes = b'') -> bytes:
-    """
-    创建二进制协议帧
-    
-    参数:
-        frame_type: 帧类型 (数据/连接/关闭等)
-        channel_id: 通道ID,用于标识不同的连接
-        payload: 载荷数据 (可选)
-        
-    返回:
-        完整的二进制帧,格式为: 帧类型(1B) + 通道ID(2B) + 载荷长度(2B) + 载荷数据
-    """
-    return struct.pack('>BHH', frame_type, channel_id, len(payload)) + payload
+# 隧道传输方式: 二进制流（默认）或真实的邮件事务（DATA 或 BDAT 发送）
+TRANSPORT_BINARY = 'binary'
+TRANSPORT_DATA = 'data'
+TRANSPORT_BDAT = 'bdat'
+MAIL_TRANSPORT_CAPABILITIES = {TRANSPORT_DATA: CAP_MAIL_DATA, TRANSPORT_BDAT: CAP_MAIL_BDAT}
+MAIL_WRITE_CHUNK = Base64LineEncoder.LINE_BYTES * 1024  # 邮件正文每次编码写入的原始字节数（整行）
+LOCAL_READ_POLL = 0.1  # 转发循环每次等待本地数据的最长时间（秒），之后检查通道和隧道是否仍然连接
 
 def make_connect_payload(host: str, port: int) -> bytes:
     """
@@ -109,6 +115,79 @@ class Channel:
     host: str                          # 目标主机名
     port: int                          # 目标端口号
     connected: bool = False           # 连接状态标志
+    compressor: Optional[ChannelCompressor] = None      # 发送方向压缩器 (协商压缩时创建)
+    decompressor: Optional[ChannelDecompressor] = None  # 接收方向解压器
+    bytes_sent: int = 0                # 发往服务器的数据字节数
+    bytes_received: int = 0            # 从服务器收到的数据字节数
+    eof_sent: bool = False             # 本地客户端已发送 FIN,已向服务器发送 HALF_CLOSE
+    eof_received: bool = False         # 服务器已发送 HALF_CLOSE,已向本地客户端写入 FIN
+    uplink_paused: bool = False        # 隧道上行超过高水位,已暂停读取本地连接
+    read_tuner: Optional[ReadSizeTuner] = None  # 每次读取本地连接的字节数,转发循环按流量调整
+    remote_done: asyncio.Event = field(default_factory=asyncio.Event)  # 服务器方向已结束或通道已关闭,唤醒半关闭等待
+
+
+# ============================================================================
+# 运行指标
+# ============================================================================
+
+# 单通道流量直方图的桶 (字节)
+CHANNEL_BYTES_BUCKETS = tuple(float(1 << n) for n in range(10, 31, 2))  # 1KB - 1GB
+
+
+class ClientMetrics:
+    """
+    客户端指标定义
+
+    在 run_client 中创建一次,跨重连保留; 每个新的 TunnelClient 实例
+    把活跃通道数等采集函数重新绑定到自己身上
+    """
+
+    def __init__(self):
+        self.registry = MetricsRegistry('smtp_tunnel_client_')
+        r = self.registry
+        self.connected = r.gauge('connected', '与服务器的隧道是否已连接 (1/0)')
+        self.channels_active = r.gauge('channels_active', '当前打开的通道数')
+        self.channels_opened = r.counter('channels_opened_total', '成功打开的通道数')
+        self.channel_open_failures = r.counter('channel_open_failures_total', '通道打开失败次数')
+        self.channel_open_seconds = r.histogram('channel_open_seconds', '从发送 CONNECT 到服务器确认的耗时')
+        self.channel_bytes = r.histogram('channel_bytes', '每个通道关闭时的双向流量 (字节)',
+                                         buckets=CHANNEL_BYTES_BUCKETS)
+        self.bytes_sent = r.counter('bytes_sent_total', '发往服务器的通道数据字节数')
+        self.bytes_received = r.counter('bytes_received_total', '从服务器收到的通道数据字节数')
+        self.reconnects = r.counter('reconnects_total', '重连成功次数')
+        self.reconnect_seconds = r.histogram('reconnect_seconds', '从连接丢失到重新连接的耗时',
+                                             buckets=(1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+        self.dns_cache_hits = r.counter('dns_cache_hits_total', 'DNS 缓存命中次数')
+        self.dns_cache_misses = r.counter('dns_cache_misses_total', 'DNS 缓存未命中次数')
+        self.dns_cache_entries = r.gauge('dns_cache_entries', 'DNS 缓存条目数')
+        self.rtt_seconds = r.gauge('rtt_seconds', '平滑后的隧道往返时间')
+        self.keepalive_timeouts = r.counter('keepalive_timeouts_total', '因保活无响应断开隧道的次数')
+        self.buffer_pool_hit_ratio = r.gauge('buffer_pool_hit_ratio', '帧缓冲区池命中率')
+        self.buffer_pool_in_use = r.gauge('buffer_pool_in_use', '已取出的帧缓冲区数')
+        self.buffer_pool_high_water = r.gauge('buffer_pool_high_water', '同时取出的帧缓冲区数的最大值')
+        self.channel_read_size = r.gauge('channels_by_read_size', '按当前每次读取本地连接的字节数统计的通道数',
+                                         ('read_size',))
+        self.tunnel_read_size = r.gauge('tunnel_read_size_bytes', '当前每次读取隧道连接的字节数')
+        register_process_metrics(r)
+
+    def bind_tunnel(self, tunnel: 'TunnelClient'):
+        """采集时从当前隧道实例读取连接状态和活跃通道数"""
+        self.connected.set_function(lambda: 1 if tunnel.connected else 0)
+        self.channels_active.set_function(lambda: len(tunnel.channels))
+        self.rtt_seconds.set_function(lambda: tunnel.keepalive.srtt if tunnel.keepalive else None)
+        self.tunnel_read_size.set_function(lambda: tunnel.read_tuner.size if tunnel.read_tuner else None)
+
+    def bind_dns_cache(self, cache: 'DNSCache'):
+        """采集时从 DNS 缓存读取统计"""
+        self.dns_cache_hits.set_function(lambda: cache.hits)
+        self.dns_cache_misses.set_function(lambda: cache.misses)
+        self.dns_cache_entries.set_function(lambda: len(cache.entries))
+
+    def bind_buffer_pool(self, pool: BufferPool):
+        """采集时从帧缓冲区池读取统计"""
+        self.buffer_pool_hit_ratio.set_function(lambda: pool.hit_rate)
+        self.buffer_pool_in_use.set_function(lambda: pool.in_use)
+        self.buffer_pool_high_water.set_function(lambda: pool.high_water)
 
 
 # ============================================================================
@@ -135,13 +214,19 @@ class TunnelClient:
     DEFAULT_MAX_RECONNECT_DELAY = 60.0          # 最大重连延迟（秒）
     DEFAULT_FAILURE_WINDOW_SECONDS = 60.0       # 失败计数窗口（秒）
     
-    def __init__(self, config: ClientConfig, ca_cert: str = None):
+    def __init__(self, config: ClientConfig, ca_cert: str = None,
+                 metrics: Optional[ClientMetrics] = None,
+                 crypto_offload: Optional[CryptoOffload] = None,
+                 buffer_pool: Optional[BufferPool] = None):
         """
         初始化隧道客户端
         
         参数:
             config: 客户端配置对象,包含服务器地址、端口、用户名等信息
             ca_cert: CA 证书路径,用于 TLS 验证 (可选)
+            metrics: 运行指标 (可选,跨重连共享时由调用方传入)
+            crypto_offload: 内层加密线程池 (可选,跨重连共享,由调用方创建和关闭)
+            buffer_pool: 帧缓冲区池 (可选,跨重连共享)
         """
         self.config = config
         self.ca_cert = ca_cert
@@ -157,7 +242,7 @@ class TunnelClient:
         self.channel_lock = asyncio.Lock()          # 通道ID分配锁
         # 添加通道ID回收机制
         self.available_channel_ids = []             # 可用的通道ID列表
-        self.max_channel_id = 1000                 # 最大通道ID
+        self.max_channel_id = config.performance.max_channels_per_session  # 最大通道ID
 
         # 连接事件管理 - 用于等待服务器响应
         self.connect_events: Dict[int, asyncio.Event] = {}    # 通道连接事件
@@ -166,9 +251,34 @@ class TunnelClient:
         # 写入锁 - 防止并发写入导致数据混乱
         self.write_lock = asyncio.Lock()
 
+        # 上行背压 - 隧道写缓冲超过高水位时暂停读取全部本地连接,降到低水位后轮流恢复
+        self.uplink_paused: List[Channel] = []
+        self.uplink_task: Optional[asyncio.Task] = None
+        self.uplink_rounds = 0
+
+        # 隧道扩展能力 - 服务器通告的和 BINARY 时协商启用的
+        self.server_capabilities: Dict[str, List[str]] = {}
+        self.capabilities: Dict[str, List[str]] = {}
+        self.compression: Optional[str] = None  # 协商的压缩算法, None 表示不压缩
+        self.keepalive: Optional[KeepaliveMonitor] = None  # 协商了 PING 时由接收循环创建
+        self.mail_spool: Optional[FrameSpool] = None  # DATA 传输模式的上行帧缓冲
+        self.seal_salt = b''  # 本次握手请求 SEAL 时发送的会话随机数
+        self.sealer: Optional[BatchSealer] = None  # 协商了 SEAL 时的上行内层加密
+        self.opener: Optional[BatchOpener] = None  # 协商了 SEAL 时的下行内层解密
+        self.crypto_offload = crypto_offload
+        self.buffer_pool = buffer_pool or BufferPool()
+        self.mail_generator = SMTPMessageGenerator()
+        self.stealth: Optional[StealthScheduler] = None  # 启用隐蔽模式且服务器支持 PADDING 时由接收循环创建
+        self.read_tuner: Optional[ReadSizeTuner] = None  # 隧道连接的读取大小,由接收循环创建
+
+        # 通过隧道的 DNS 查询 - 按标签等待服务器响应
+        self.dns_waiters: Dict[int, asyncio.Future] = {}
+        self.next_dns_tag = 1
+        self.dns_cache: Optional['DNSCache'] = None  # 由 DNS 转发器设置,用于统计
+
         # 添加资源监控
-        self.max_channels = 1000  # 最大通道数
-        self.max_buffer_size = 10 * 1024 * 1024  # 最大缓冲区大小: 10MB
+        self.max_channels = config.performance.max_channels_per_session  # 最大通道数
+        self.max_buffer_size = config.performance.max_receive_buffer  # 接收缓冲区上限(默认 10MB)
 
         # 添加连接统计
         self.total_connections = 0
@@ -197,6 +307,10 @@ class TunnelClient:
         self._max_reconnect_delay = self.DEFAULT_MAX_RECONNECT_DELAY
         self._failure_window_seconds = self.DEFAULT_FAILURE_WINDOW_SECONDS
 
+        # 运行指标
+        self.metrics = metrics or ClientMetrics()
+        self.metrics.bind_tunnel(self)
+
     async def connect(self) -> bool:
         """
         连接到服务器并完成 SMTP 握手,然后切换到二进制模式
@@ -207,10 +321,10 @@ class TunnelClient:
         try:
             logger.info(f"正在连接到 {self.config.server_host}:{self.config.server_port}")
 
-            # 建立与服务器的 TCP 连接,超时时间 30 秒
+            # 建立与服务器的 TCP 连接
             self.reader, self.writer = await asyncio.wait_for(
                 asyncio.open_connection(self.config.server_host, self.config.server_port),
-                timeout=30.0
+                timeout=self.config.performance.connect_timeout
             )
 
             # 执行 SMTP 握手流程
@@ -250,6 +364,7 @@ class TunnelClient:
         
         # 更新连续失败计数
         self._consecutive_failures += 1
+        self.metrics.channel_open_failures.inc()
         
         logger.warning(
             f"通道打开失败记录: 原因='{reason}', "
@@ -315,6 +430,7 @@ class TunnelClient:
         self._reconnecting = True
         self._total_reconnects += 1
         self._last_reconnect_time = time.time()
+        reconnect_started = time.monotonic()
         
         logger.warning(
             f"开始执行自动重连 (第 {self._total_reconnects} 次), "
@@ -350,6 +466,8 @@ class TunnelClient:
                     self._current_reconnect_delay = self._initial_reconnect_delay
                     self._consecutive_failures = 0
                     self._failure_timestamps.clear()
+                    self.metrics.reconnects.inc()
+                    self.metrics.reconnect_seconds.observe(time.monotonic() - reconnect_started)
                     
                     logger.info(
                         f"自动重连成功! (成功 {self._successful_reconnects}/{self._total_reconnects})"
@@ -499,11 +617,19 @@ class TunnelClient:
             # TLS 升级后再次发送 EHLO
             logger.debug("TLS 升级后再次发送 EHLO 命令")
             await self._send_line("EHLO tunnel-client.local")
-            if not await self._expect_250():
+            ehlo_lines = []
+            if not await self._expect_250(ehlo_lines):
                 logger.error("TLS 升级后 EHLO 命令响应错误")
                 return False
             logger.info("TLS 升级后 EHLO 命令成功")
 
+            # 记录服务器通告的隧道扩展能力
+            self.server_capabilities = {}
+            for ehlo_line in ehlo_lines:
+                keyword, _, rest = ehlo_line.partition(' ')
+                if keyword.upper() == TUNNEL_EHLO_KEYWORD:
+                    self.server_capabilities = parse_capabilities(rest)
+
             # 进行身份认证
             logger.info(f"开始身份认证,用户名: {self.config.username}")
             timestamp = int(time.time())
@@ -518,13 +644,37 @@ class TunnelClient:
                 return False
             logger.info(f"身份认证成功: {line}")
 
-            # 切换到二进制模式
+            # DATA / BDAT 传输模式: 不发送 BINARY,由第一封邮件协商扩展能力
+            self.mail_spool = None
+            self.sealer = self.opener = None
+            if self.config.transport in MAIL_TRANSPORT_CAPABILITIES:
+                return await self._start_mail_transport()
+
+            # 切换到二进制模式,同时请求双方都支持的扩展能力
+            requested = format_capabilities(self._select_capabilities())
             logger.debug("发送 BINARY 命令切换到二进制模式")
-            await self._send_line("BINARY")
+            await self._send_line(f"BINARY {requested}" if requested else "BINARY")
             line = await self._read_line()
             if not line or not line.startswith('299'):
                 logger.error(f"切换二进制模式失败: {line}")
                 return False
+            self.capabilities = parse_capabilities(
+                line[len(BINARY_OK_LINE):] if line.startswith(BINARY_OK_LINE) else ''
+            )
+            self.compression = choose_compression(self.capabilities.get(CAP_COMPRESS, []))
+            if self.config.inner_encryption:
+                server_salt = self.capabilities.get(CAP_SEAL, [''])[0]
+                if len(server_salt) != SEAL_SALT_SIZE * 2:
+                    logger.error("服务器不支持内层加密 (SEAL),拒绝在没有端到端加密的情况下继续")
+                    return False
+                # 299 之后双方的字节流都是内层加密记录
+                crypto = TunnelCrypto(self.config.secret, is_server=False)
+                send_cipher, recv_cipher = crypto.session_ciphers(self.seal_salt + bytes.fromhex(server_salt))
+                self.sealer = BatchSealer(self.writer, send_cipher, self.crypto_offload)
+                self.opener = BatchOpener(recv_cipher, self.crypto_offload)
+            # 隧道连接写缓冲的水位: 超过高水位时暂停读取全部本地连接,降到低水位后恢复
+            self.writer.transport.set_write_buffer_limits(self.config.performance.write_buffer_high,
+                                                          self.config.performance.write_buffer_low)
             logger.info(f"成功切换到二进制模式: {line}")
 
             logger.info("SMTP 握手流程完成")
@@ -534,6 +684,190 @@ class TunnelClient:
             logger.error(f"握手错误: {e}")
             return False
 
+    async def _start_mail_transport(self) -> bool:
+        """
+        开始 DATA / BDAT 传输模式: 发送一封不带帧的邮件,邮件头携带请求的扩展能力
+
+        返回:
+            bool: 服务器接受返回 True
+        """
+        mode = self.config.transport.upper()
+        if MAIL_TRANSPORT_CAPABILITIES[self.config.transport] not in self.server_capabilities:
+            logger.error(f"服务器不支持 {mode} 传输模式")
+            return False
+        requested = format_capabilities(self._select_capabilities())
+        await self._send_mail(b'', {MAIL_CAPABILITIES_HEADER: requested} if requested else None)
+        lines = []
+        if not await self._expect_250(lines):
+            logger.error(f"{mode} 传输模式协商失败")
+            return False
+        self.capabilities = {}
+        for reply_line in lines:
+            keyword, _, rest = reply_line.partition(' ')
+            if keyword.upper() == TUNNEL_EHLO_KEYWORD:
+                self.capabilities = parse_capabilities(rest)
+        self.compression = choose_compression(self.capabilities.get(CAP_COMPRESS, []))
+        self.mail_spool = FrameSpool(MAIL_MESSAGE_MAX)
+        logger.info(f"成功切换到 {mode} 传输模式: {format_capabilities(self.capabilities) or '-'}")
+        logger.info("SMTP 握手流程完成")
+        return True
+
+    async def _send_mail(self, data: bytes, extra_headers: Optional[Dict[str, str]] = None):
+        """
+        把一段上行帧流作为一封邮件发送（按配置的传输方式使用 DATA 或 BDAT）
+
+        参数:
+            data: 帧流（DATA 方式可以在帧中间截断,BDAT 方式必须由完整的帧组成）
+            extra_headers: 追加的邮件头 (可选)
+        """
+        if self.config.transport == TRANSPORT_BDAT:
+            await self._send_mail_bdat(data, extra_headers)
+        else:
+            await self._send_mail_data(data, extra_headers)
+
+    async def _send_mail_data(self, data: bytes, extra_headers: Optional[Dict[str, str]] = None):
+        """
+        以 DATA 发送一封邮件
+
+        MAIL / RCPT / DATA 三条命令流水线发送,收到 354 后边编码边写入 base64 附件正文
+        """
+        from_addr, to_addr, _, head, tail = self.mail_generator.begin_message(extra_headers=extra_headers)
+        self.writer.write(f"MAIL FROM:<{from_addr}>\r\nRCPT TO:<{to_addr}>\r\nDATA\r\n".encode())
+        await self.writer.drain()
+        for expected in ('250', '250', '354'):
+            line = await self._read_line()
+            if not line or not line.startswith(expected):
+                raise ConnectionError(f"邮件事务被拒绝: {line}")
+
+        self.writer.write(head)
+        encoder = Base64LineEncoder()
+        view = memoryview(data)
+        for offset in range(0, len(view), MAIL_WRITE_CHUNK):
+            self.writer.write(encoder.encode(view[offset:offset + MAIL_WRITE_CHUNK]))
+            await self.writer.drain()
+        self.writer.write(encoder.flush() + tail + b'\r\n.\r\n')
+        await self.writer.drain()
+
+    async def _send_mail_bdat(self, data: bytes, extra_headers: Optional[Dict[str, str]] = None):
+        """
+        以 BDAT 块发送一封邮件（RFC 3030,BODY=BINARYMIME）
+
+        邮件头、附件正文和结束边界分块发送。附件正文是原始帧流,没有 base64 开销,
+        按 stealth.pad_to_sizes 分块: 协商了 PADDING 时用 PADDING 帧补齐到填充大小,
+        否则按最大填充大小切分。MAIL / RCPT 和全部 BDAT 块流水线发送后再读取应答
+        """
+        from_addr, to_addr, _, head, tail = self.mail_generator.begin_message(
+            extra_headers=extra_headers, transfer_encoding='binary')
+        pad_sizes = sorted(size for size in self.config.stealth.pad_to_sizes if size > FRAME_HEADER_SIZE) or [16384]
+        if data and CAP_PADDING in self.capabilities:
+            data = pad_frames(data, padded_size(len(data), pad_sizes))
+        largest = pad_sizes[-1]
+        view = memoryview(data)
+        chunks = [head] + [view[offset:offset + largest] for offset in range(0, len(view), largest)] + [tail]
+
+        self.writer.write(f"MAIL FROM:<{from_addr}> BODY=BINARYMIME\r\nRCPT TO:<{to_addr}>\r\n".encode())
+        for index, chunk in enumerate(chunks):
+            last = ' LAST' if index == len(chunks) - 1 else ''
+            self.writer.write(f"BDAT {len(chunk)}{last}\r\n".encode())
+            self.writer.write(chunk)
+            await self.writer.drain()
+
+        # MAIL、RCPT 和每个非 LAST 块各有一个应答,LAST 块的应答由 _receive_mail_reply 读取
+        for _ in range(len(chunks) + 1):
+            line = await self._read_line()
+            if not line or not line.startswith('250'):
+                raise ConnectionError(f"邮件事务被拒绝: {line}")
+
+    async def _receive_mail_reply(self, decoder: FrameDecoder) -> int:
+        """
+        读取邮件结束后的 250 响应,处理其中 "250-" base64 行携带的下行帧
+
+        响应按块读取,不逐行解析
+
+        返回:
+            int: 下行帧流的字节数
+        """
+        timeout = self.config.performance.tunnel_read_timeout
+        status = await asyncio.wait_for(self.reader.readexactly(4), timeout=timeout)
+        if status == b'250 ':
+            await self.reader.readline()
+            return 0
+        if status != b'250-':
+            line = await self.reader.readline()
+            raise ConnectionError(f"邮件被服务器拒绝: {(status + line).decode('utf-8', errors='replace').strip()}")
+
+        body = Base64LineDecoder(b'250-')
+        received = 0
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.reader.readuntil(b'\r\n250 '), timeout=timeout)
+                data = body.decode(chunk[:-4]) + body.finish()  # 最后一行 "250 ..." 不是数据
+                last = True
+            except asyncio.LimitOverrunError as e:
+                data = body.decode(await self.reader.readexactly(e.consumed))
+                last = False
+            received += len(data)
+            decoder.feed(data)
+            for frame_type, channel_id, payload in decoder:
+                await self._handle_frame(frame_type, channel_id, payload)
+            if last:
+                await self.reader.readline()
+                return received
+
+    async def _mail_loop(self, keepalive: Optional[KeepaliveMonitor]):
+        """
+        DATA / BDAT 传输模式的事务循环
+
+        每次取走缓冲区中的上行帧发送一封邮件,再处理响应中的下行帧;
+        双方都没有数据时按 data_poll_interval 发送空邮件轮询
+        """
+        spool = self.mail_spool
+        spool.flusher = asyncio.current_task()
+        decoder = FrameDecoder()
+        whole_frames = self.config.transport == TRANSPORT_BDAT  # 补齐填充需要在帧边界结束
+        idle = False
+        try:
+            while self.connected:
+                if idle:
+                    await spool.wait(self.config.data_poll_interval)
+                data = spool.take(MAIL_MESSAGE_MAX, whole_frames)
+                await self._send_mail(data)
+                received = await self._receive_mail_reply(decoder)
+                if keepalive:
+                    keepalive.activity = True
+                idle = not data and not received
+        except Exception as e:
+            if self.connected:  # 主动断开时读到 EOF 是正常的
+                logger.error(f"{self.config.transport.upper()} 传输错误: {e}")
+
+    def _select_capabilities(self) -> Dict[str, List[str]]:
+        """
+        选择要请求的扩展能力: 客户端支持且服务器已通告的能力
+
+        返回:
+            {能力名: 参数列表} 字典
+        """
+        selected = {}
+        for name, values in CLIENT_CAPABILITIES.items():
+            if name not in self.server_capabilities:
+                continue
+            if name == CAP_PING and self.config.keepalive_interval <= 0:
+                continue
+            if name == CAP_SEAL:
+                if not self.config.inner_encryption or self.config.transport != TRANSPORT_BINARY:
+                    continue
+                self.seal_salt = os.urandom(SEAL_SALT_SIZE)
+                values = [self.seal_salt.hex()]
+            if name == CAP_COMPRESS:
+                if not self.config.compression:
+                    continue
+                # 按客户端优先级保留服务器也支持的算法
+                values = [v for v in values if v in self.server_capabilities[name]]
+                if not values:
+                    continue
+            selected[name] = values
+        return selected
+
     async def _upgrade_tls(self):
         """
         将连接升级为 TLS 加密
@@ -590,8 +924,9 @@ class TunnelClient:
             None: 超时或连接断开
         """
         try:
-            # 读取一行,超时时间 60 秒
-            data = await asyncio.wait_for(self.reader.readline(), timeout=60.0)
+            # 读取一行
+            data = await asyncio.wait_for(self.reader.readline(),
+                                          timeout=self.config.performance.tunnel_read_timeout)
             if not data:
                 logger.debug("读取行失败: 连接断开")
                 return None
@@ -602,12 +937,15 @@ class TunnelClient:
             logger.debug(f"读取行超时或错误: {e}")
             return None
 
-    async def _expect_250(self) -> bool:
+    async def _expect_250(self, lines: Optional[list] = None) -> bool:
         """
         期望并跳过 SMTP 多行响应,直到收到 250 成功响应
         
         SMTP 命令可能返回多行响应,每行以 250- 开头,最后一行以 250 开头
         
+        参数:
+            lines: 可选列表,用于收集每行去掉 "250-" 前缀后的内容
+        
         返回:
             bool: 收到 250 响应返回 True,否则返回 False
         """
@@ -615,9 +953,11 @@ class TunnelClient:
             line = await self._read_line()
             if not line:
                 return False
-            if line.startswith('250 '):
-                return True
-            if line.startswith('250-'):
+            if line.startswith('250 ') or line.startswith('250-'):
+                if lines is not None:
+                    lines.append(line[4:])
+                if line.startswith('250 '):
+                    return True
                 continue
             return False
 
@@ -672,67 +1012,89 @@ class TunnelClient:
 
         持续读取二进制数据,解析帧,并根据帧类型进行相应处理
         """
-        buffer = b''  # 接收缓冲区
+        decoder = FrameDecoder()  # 接收缓冲区
         timeout_count = 0  # 超时计数器
         max_timeout_count = 3  # 最大允许超时次数
-        receive_timeout = 60.0  # 接收超时时间 (秒)
+        receive_timeout = self.config.performance.tunnel_read_timeout  # 接收超时时间 (秒)
         logger.debug("帧接收器循环开始")
 
-        while self.connected:
-            try:
-                # 读取数据,超时时间 60 秒
-                chunk = await asyncio.wait_for(self.reader.read(65536), timeout=receive_timeout)
-                if not chunk:
-                    logger.info("服务器连接已断开")
-                    break
-                buffer += chunk
-                timeout_count = 0  # 成功接收数据，重置超时计数器
-                logger.debug(f"接收到数据块: {len(chunk)} 字节")
-
-                # 检查缓冲区大小
-                if len(buffer) > self.max_buffer_size:
-                    logger.error(f"缓冲区大小超过限制: {len(buffer)} > {self.max_buffer_size}")
-                    logger.error("可能收到恶意数据或协议错误，清空缓冲区")
-                    buffer = b''  # 修复：清空缓冲区而不是断开连接
-                    continue
-
-                # 处理缓冲区中的完整帧
-                while len(buffer) >= FRAME_HEADER_SIZE:
-                    # 解析帧头: 帧类型(1B) + 通道ID(2B) + 载荷长度(2B)
-                    frame_type, channel_id, payload_len = struct.unpack('>BHH', buffer[:5])
-                    total_len = FRAME_HEADER_SIZE + payload_len
-
-                    # 检查载荷长度是否合理
-                    if payload_len > self.max_buffer_size:
-                        logger.error(f"载荷长度过大: {payload_len} > {self.max_buffer_size}")
-                        break
-
-                    # 如果数据不足一个完整帧,等待更多数据
-                    if len(buffer) < total_len:
-                        logger.debug(f"数据不足一个完整帧,需要 {total_len} 字节,当前 {len(buffer)} 字节")
-                        break
-
-                    # 提取载荷并从缓冲区移除
-                    payload = buffer[FRAME_HEADER_SIZE:total_len]
-                    buffer = buffer[total_len:]
-
-                    # 处理该帧
-                    logger.debug(f"处理帧: 类型={frame_type}, 通道ID={channel_id}, 载荷长度={payload_len}")
-                    await self._handle_frame(frame_type, channel_id, payload)
+        # PING/PONG 保活: 隧道失联时几秒内断开并触发重连,
+        # 不必等待多次 60 秒的接收超时
+        keepalive_task = None
+        if CAP_PING in self.capabilities and self.config.keepalive_interval > 0:
+            self.keepalive = KeepaliveMonitor(self.config.keepalive_interval, self.config.keepalive_misses)
+            keepalive_task = asyncio.create_task(self._keepalive_loop(self.keepalive))
+        keepalive = self.keepalive
+
+        # 隐蔽模式: 上行帧经时隙调度、合并和填充后发送（DATA 传输模式本身已是邮件形态，不再整形）
+        # 启用内层加密时整批再加密
+        self.stealth = None
+        if self.config.stealth_enabled and not self.mail_spool:
+            if CAP_PADDING in self.capabilities:
+                self.stealth = StealthScheduler(self.sealer or self.writer, self.config.stealth)
+                self.stealth.start()
+            else:
+                logger.warning("服务器不支持 PADDING,隐蔽模式未启用")
 
-            except asyncio.TimeoutError:
-                # 超时计数器递增
-                timeout_count += 1
-                logger.debug(f"接收数据超时 ({timeout_count}/{max_timeout_count}), 继续等待")
+        try:
+            if self.mail_spool:
+                # DATA 传输模式: 下行帧在邮件事务的响应中到达
+                await self._mail_loop(keepalive)
+            else:
+                # 批量下载时加大读取大小,减少读取和解密的次数
+                read_tuner = self.read_tuner = ReadSizeTuner(
+                    TUNNEL_READ_SIZE_MIN, self.config.performance.tunnel_read_size_max, TUNNEL_READ_SIZE_MIN)
+                while self.connected:
+                    try:
+                        # 读取数据,超时时间 60 秒
+                        chunk = await asyncio.wait_for(self.reader.read(read_tuner.size), timeout=receive_timeout)
+                        if not chunk:
+                            logger.info("服务器连接已断开")
+                            break
+                        decoder.feed(await self.opener.feed_async(chunk) if self.opener else chunk)
+                        timeout_count = 0  # 成功接收数据，重置超时计数器
+                        if keepalive:
+                            keepalive.activity = True
+                        if read_tuner.record(len(chunk)):
+                            logger.debug(f"隧道连接读取大小调整为 {read_tuner.size} 字节")
+                        logger.debug(f"接收到数据块: {len(chunk)} 字节")
+
+                        # 检查缓冲区大小
+                        if decoder.pending > self.max_buffer_size:
+                            logger.error(f"缓冲区大小超过限制: {decoder.pending} > {self.max_buffer_size}")
+                            logger.error("可能收到恶意数据或协议错误，清空缓冲区")
+                            decoder = FrameDecoder()  # 修复：清空缓冲区而不是断开连接
+                            continue
+
+                        # 处理缓冲区中的完整帧,不足一个完整帧的数据留在解码器中
+                        for frame_type, channel_id, payload in decoder:
+                            logger.debug(f"处理帧: 类型={frame_type}, 通道ID={channel_id}, 载荷长度={len(payload)}")
+                            await self._handle_frame(frame_type, channel_id, payload)
+
+                    except asyncio.TimeoutError:
+                        # 超时计数器递增
+                        timeout_count += 1
+                        logger.debug(f"接收数据超时 ({timeout_count}/{max_timeout_count}), 继续等待")
                 
-                # 连续超时达到阈值，说明网络可能中断，断开连接触发重连
-                if timeout_count >= max_timeout_count:
-                    logger.warning(f"连续超时 {max_timeout_count} 次，网络可能中断，断开连接")
-                    break
-                continue
-            except Exception as e:
-                logger.error(f"接收器错误: {e}")
-                break
+                        # 连续超时达到阈值，说明网络可能中断，断开连接触发重连
+                        if timeout_count >= max_timeout_count:
+                            logger.warning(f"连续超时 {max_timeout_count} 次，网络可能中断，断开连接")
+                            break
+                        continue
+                    except Exception as e:
+                        logger.error(f"接收器错误: {e}")
+                        break
+        finally:
+            if keepalive_task:
+                keepalive_task.cancel()
+            if self.stealth:
+                self.stealth.stop()
+                logger.info(f"隐蔽模式统计: {self.stealth.stats()}")
+                self.stealth = None
+            if self.sealer:
+                await self.sealer.join()
+            if self.mail_spool:
+                self.mail_spool.close()
 
         # 连接断开
         logger.info("帧接收器循环结束")
@@ -755,8 +1117,9 @@ class TunnelClient:
                 self.connect_events[channel_id].set()
 
         elif frame_type == FRAME_CONNECT_FAIL:
-            # 连接失败 - 唤醒等待该通道连接的事件
-            logger.warning(f"通道 {channel_id} 连接失败")
+            # 连接失败 - 唤醒等待该通道连接的事件（载荷为服务器给出的原因）
+            reason = payload.decode('utf-8', errors='replace')
+            logger.warning(f"通道 {channel_id} 连接失败" + (f": {reason}" if reason else ""))
             if channel_id in self.connect_events:
                 self.connect_results[channel_id] = False
                 self.connect_events[channel_id].set()
@@ -765,6 +1128,8 @@ class TunnelClient:
             # 数据帧 - 将数据转发到对应的通道
             channel = self.channels.get(channel_id)
             if channel and channel.connected:
+                channel.bytes_received += len(payload)
+                self.metrics.bytes_received.inc(len(payload))
                 try:
                     channel.writer.write(payload)
                     await channel.writer.drain()
@@ -774,6 +1139,28 @@ class TunnelClient:
                     logger.error(f"通道 {channel_id} 写入数据失败: {e}")
                     await self._close_channel(channel)
 
+        elif frame_type == FRAME_DATA_Z:
+            # 压缩数据帧 - 用通道的解压上下文还原后转发
+            channel = self.channels.get(channel_id)
+            if channel and channel.connected and self.compression:
+                if channel.decompressor is None:
+                    channel.decompressor = ChannelDecompressor(self.compression)
+                try:
+                    data = channel.decompressor.decompress(payload)
+                except ValueError as e:
+                    logger.error(f"通道 {channel_id} {e}")
+                    await self.close_channel_remote(channel_id)
+                    await self._close_channel(channel)
+                    return
+                channel.bytes_received += len(data)
+                self.metrics.bytes_received.inc(len(data))
+                try:
+                    channel.writer.write(data)
+                    await channel.writer.drain()
+                except Exception as e:
+                    logger.error(f"通道 {channel_id} 写入数据失败: {e}")
+                    await self._close_channel(channel)
+
         elif frame_type == FRAME_CLOSE:
             # 关闭帧 - 关闭对应的通道
             logger.info(f"收到通道 {channel_id} 关闭帧")
@@ -781,6 +1168,67 @@ class TunnelClient:
             if channel:
                 await self._close_channel(channel)
 
+        elif frame_type == FRAME_HALF_CLOSE:
+            # 半关闭帧 - 目标不再发送数据,向本地客户端写入 FIN
+            channel = self.channels.get(channel_id)
+            if channel and channel.connected and not channel.eof_received:
+                channel.eof_received = True
+                channel.remote_done.set()
+                logger.debug(f"通道 {channel_id} 服务器方向已结束")
+                if channel.eof_sent:
+                    return  # 两个方向都已结束,转发循环随即退出并关闭通道
+                if not channel.writer.can_write_eof():
+                    await self._close_channel(channel)
+                    return
+                try:
+                    channel.writer.write_eof()
+                except Exception as e:
+                    logger.error(f"通道 {channel_id} 写入 FIN 失败: {e}")
+                    await self.close_channel_remote(channel_id)
+                    await self._close_channel(channel)
+
+        elif frame_type == FRAME_DNS_RESPONSE:
+            # DNS 响应 - 唤醒等待该标签的查询
+            future = self.dns_waiters.get(channel_id)
+            if future and not future.done():
+                future.set_result(payload)
+
+        elif frame_type == FRAME_PING:
+            # 服务器探测 - 原样回显
+            await self.send_frame(FRAME_PONG, channel_id, payload)
+
+        elif frame_type == FRAME_PONG:
+            # 保活响应 - 更新 RTT 估计
+            if self.keepalive:
+                self.keepalive.on_pong(payload)
+
+        elif frame_type == FRAME_PADDING:
+            pass  # 服务器隐蔽模式的填充,直接丢弃
+
+    async def _keepalive_loop(self, keepalive: KeepaliveMonitor):
+        """
+        定期发送 PING,连续无响应时中断隧道连接
+
+        中断后接收循环读到 EOF 并结束,由 run_client 或重连监控重新连接
+        """
+        while self.connected:
+            await asyncio.sleep(keepalive.interval)
+            if keepalive.tick():
+                logger.warning(
+                    f"连续 {keepalive.missed} 个保活间隔 ({keepalive.interval:g}s) 未收到服务器响应,断开隧道"
+                )
+                self.metrics.keepalive_timeouts.inc()
+                if self.writer:
+                    self.writer.transport.abort()
+                return
+            try:
+                # 网络中断时 drain 可能一直阻塞,不能让它卡住保活计时
+                await asyncio.wait_for(
+                    self.send_frame(FRAME_PING, 0, keepalive.make_ping()), timeout=keepalive.interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
     async def send_frame(self, frame_type: int, channel_id: int, payload: bytes = b''):
         """
         向服务器发送帧
@@ -793,17 +1241,84 @@ class TunnelClient:
         if not self.connected or not self.writer:
             logger.warning("未连接到服务器,无法发送帧")
             return
+        if self.mail_spool:
+            # DATA 传输模式: 帧进入缓冲区由事务循环发送,
+            # 事务循环处理下行帧时也会发送帧,这里不能持有写入锁等待
+            self.buffer_pool.write_frame(self.mail_spool.write, frame_type, channel_id, payload)
+            if self._uplink_backlogged():
+                self._pause_uplink()
+            try:
+                await self.mail_spool.drain()
+            except ConnectionResetError as e:
+                logger.error(f"发送帧失败: {e}")
+                self.connected = False
+            return
         async with self.write_lock:
             try:
-                frame = make_frame(frame_type, channel_id, payload)
-                self.writer.write(frame)
-                await self.writer.drain()
+                # TLS 传输对每段写入单独加密成记录,帧头和负载必须一次写入; 帧在池中的缓冲区编码,写入后归还
+                if self.stealth or self.sealer:
+                    write, transport = self.stealth.send if self.stealth else self.sealer.write, None
+                else:
+                    write, transport = self.writer.write, self.writer.transport
+                self.buffer_pool.write_frame(write, frame_type, channel_id, payload, transport)
+                if self._uplink_backlogged():
+                    self._pause_uplink()
+                await (self.sealer or self.writer).drain()
                 logger.debug(f"发送帧: 类型={frame_type}, 通道ID={channel_id}, 载荷长度={len(payload)}")
             except Exception as e:
                 # 发送失败,标记连接断开
                 logger.error(f"发送帧失败: {e}")
                 self.connected = False
 
+    def _uplink_backlogged(self) -> bool:
+        """上行帧是否积压,即此时 drain() 会等待"""
+        if self.mail_spool:
+            return self.mail_spool.backlogged
+        if self.sealer and self.sealer.backlogged:
+            return True
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+
+    def _pause_uplink(self):
+        """
+        隧道上行积压: 暂停读取全部本地连接,启动一个任务等待积压写出
+
+        每个通道的转发循环只等待自己的 drain(),其他本地连接仍会把数据读入各自的 StreamReader;
+        这里直接暂停它们的传输层,数据留在内核缓冲区中由 TCP 流量控制反压到本地应用。
+        StreamReader 因自身缓冲已满而暂停的传输层不在此处理,仍由 StreamReader 恢复
+        """
+        for channel in self.channels.values():
+            transport = channel.writer.transport
+            if not channel.uplink_paused and transport.is_reading():
+                transport.pause_reading()
+                channel.uplink_paused = True
+                self.uplink_paused.append(channel)
+        if self.uplink_task is None:
+            self.uplink_task = asyncio.create_task(self._resume_uplink())
+
+    async def _resume_uplink(self):
+        """等待上行积压写出（降到低水位）,轮流恢复因此暂停读取的本地连接"""
+        try:
+            if self.mail_spool:
+                await self.mail_spool.drain()
+            else:
+                async with self.write_lock:
+                    await (self.sealer or self.writer).drain()
+        except (ConnectionResetError, OSError) as e:
+            logger.debug(f"等待上行积压写出时连接断开: {e}")
+        finally:
+            self.uplink_task = None
+            paused, self.uplink_paused = self.uplink_paused, []
+            if paused:
+                # 每轮从不同的通道开始恢复,避免总是同一批连接先占满上行
+                start = self.uplink_rounds % len(paused)
+                self.uplink_rounds += 1
+                for channel in paused[start:] + paused[:start]:
+                    channel.uplink_paused = False
+                    transport = channel.writer.transport
+                    if not transport.is_closing():
+                        transport.resume_reading()
+
     async def open_channel(self, host: str, port: int) -> Tuple[int, bool]:
         """
         打开一个隧道通道
@@ -855,6 +1370,7 @@ class TunnelClient:
         self.connect_results[channel_id] = False
 
         # 发送连接请求
+        open_started = time.monotonic()
         try:
             payload = make_connect_payload(host, port)
             await self.send_frame(FRAME_CONNECT, channel_id, payload)
@@ -868,12 +1384,13 @@ class TunnelClient:
             self._record_channel_failure(f"发送连接请求失败: {e}")
             return channel_id, False
 
-        # 减少超时时间: 30 秒 -> 10 秒
         try:
-            await asyncio.wait_for(event.wait(), timeout=10.0)
+            await asyncio.wait_for(event.wait(), timeout=self.config.performance.channel_open_timeout)
             success = self.connect_results.get(channel_id, False)
             if success:
                 logger.info(f"通道 {channel_id} 打开成功")
+                self.metrics.channels_opened.inc()
+                self.metrics.channel_open_seconds.observe(time.monotonic() - open_started)
                 self._record_channel_success()  # 记录成功，重置失败计数
             else:
                 logger.warning(f"通道 {channel_id} 打开失败")
@@ -919,8 +1436,55 @@ class TunnelClient:
             data: 要发送的数据
         """
         logger.debug(f"通道 {channel_id} 发送数据: {len(data)} 字节")
+        self.metrics.bytes_sent.inc(len(data))
+        channel = self.channels.get(channel_id)
+        if channel:
+            channel.bytes_sent += len(data)
+            if self.compression:
+                if channel.compressor is None:
+                    channel.compressor = ChannelCompressor(self.compression)
+                compressed = channel.compressor.compress(data)
+                if compressed is not None:
+                    await self.send_frame(FRAME_DATA_Z, channel_id, compressed)
+                    return
         await self.send_frame(FRAME_DATA, channel_id, data)
 
+    async def dns_query(self, query: bytes, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        通过隧道把原始 DNS 查询报文发送到服务器端的解析器
+
+        参数:
+            query: DNS 查询报文
+            timeout: 等待响应的超时时间 (秒),默认为 performance.dns_timeout
+
+        返回:
+            Optional[bytes]: DNS 响应报文; 未协商 DNS 能力、超时或服务器查询失败时返回 None
+        """
+        if not self.connected or CAP_DNS not in self.capabilities:
+            return None
+        if len(self.dns_waiters) >= self.config.performance.max_dns_inflight:
+            # 标签有空闲时下面的循环才会结束; 服务器对超出上限的查询也只回复空响应
+            logger.debug("进行中的 DNS 查询过多,拒绝新查询")
+            return None
+
+        # 分配 16 位查询标签,跳过仍在等待中的标签
+        tag = self.next_dns_tag
+        while tag in self.dns_waiters:
+            tag = tag % 0xFFFF + 1
+        self.next_dns_tag = tag % 0xFFFF + 1
+
+        future = asyncio.get_running_loop().create_future()
+        self.dns_waiters[tag] = future
+        try:
+            await self.send_frame(FRAME_DNS_QUERY, tag, query)
+            response = await asyncio.wait_for(future, timeout=timeout or self.config.performance.dns_timeout)
+            return response or None
+        except asyncio.TimeoutError:
+            logger.debug(f"DNS 查询超时: 标签 {tag}")
+            return None
+        finally:
+            self.dns_waiters.pop(tag, None)
+
     async def close_channel_remote(self, channel_id: int):
         """
         通知服务器关闭通道
@@ -928,9 +1492,29 @@ class TunnelClient:
         参数:
             channel_id: 要关闭的通道ID
         """
+        channel = self.channels.get(channel_id)
+        if channel and channel.eof_sent and channel.eof_received:
+            # 两个方向都已通过 HALF_CLOSE 结束,服务器已自行关闭通道
+            return
         logger.info(f"通知服务器关闭通道 {channel_id}")
         await self.send_frame(FRAME_CLOSE, channel_id)
 
+    async def half_close_channel(self, channel: Channel) -> bool:
+        """
+        本地客户端不再发送数据时通知服务器 (只结束上传方向)
+
+        参数:
+            channel: 通道对象
+
+        返回:
+            False 表示服务器不支持半关闭,调用方应直接关闭通道
+        """
+        if CAP_HALF_CLOSE not in self.capabilities:
+            return False
+        channel.eof_sent = True
+        await self.send_frame(FRAME_HALF_CLOSE, channel.channel_id)
+        return True
+
     async def _close_channel(self, channel: Channel):
         """
         关闭本地通道
@@ -948,13 +1532,18 @@ class TunnelClient:
         
         logger.info(f"关闭本地通道 {channel.channel_id}")
         channel.connected = False
+        channel.remote_done.set()
         self.closed_connections += 1
+        self.metrics.channel_bytes.observe(channel.bytes_sent + channel.bytes_received)
+        compression_stats = format_compression_stats(channel.compressor, channel.decompressor)
+        if compression_stats:
+            logger.info(f"通道 {channel.channel_id} 压缩统计: {compression_stats}")
 
         # 关闭写入流
         try:
             if hasattr(channel, 'writer') and channel.writer:
                 channel.writer.close()
-                await asyncio.wait_for(channel.writer.wait_closed(), timeout=5.0)
+                await asyncio.wait_for(channel.writer.wait_closed(), timeout=self.config.performance.close_timeout)
         except asyncio.TimeoutError:
             logger.warning(f"关闭通道 {channel.channel_id} writer 超时,强制关闭")
             try:
@@ -1001,50 +1590,26 @@ class TunnelClient:
             self.available_channel_ids.append(channel.channel_id)
             logger.debug(f"回收通道ID: {channel.channel_id}")
 
+    def rtt_text(self) -> str:
+        """当前平滑 RTT 的可读形式,尚无测量时为 '-'"""
+        if not self.keepalive or self.keepalive.srtt is None:
+            return '-'
+        return f"{self.keepalive.srtt * 1000:.1f}ms"
+
     async def _report_stats(self):
-        """定期报告连接统计"""
+        """定期在日志中输出一行连接摘要 (完整数据见指标端点)"""
         while self.connected:
             try:
-                await asyncio.sleep(60)  # 每分钟报告一次
-                task_count = len(asyncio.all_tasks())
-                
-                # 添加文件描述符监控
-                try:
-                    import psutil
-                    import os
-                    proc = psutil.Process(os.getpid())
-                    num_fds = proc.num_fds() if hasattr(proc, 'num_fds') else 0
-                    memory_mb = proc.memory_info().rss / 1024 / 1024
-                    cpu_percent = proc.cpu_percent(interval=0.1)
-                except ImportError:
-                    num_fds = 0
-                    memory_mb = 0
-                    cpu_percent = 0
-                
+                await asyncio.sleep(self.config.performance.stats_interval)
+                m = self.metrics
                 logger.info(f"连接统计: 总计={self.total_connections}, "
                            f"失败={self.failed_connections}, "
                            f"关闭={self.closed_connections}, "
                            f"活跃={len(self.channels)}, "
-                           f"事件={len(self.connect_events)}, "
-                           f"结果={len(self.connect_results)}, "
-                           f"任务={task_count}, "
-                           f"可用ID={len(self.available_channel_ids)}, "
-                           f"下一个ID={self.next_channel_id}, "
-                           f"文件描述符={num_fds}, "
-                           f"内存={memory_mb:.1f}MB, "
-                           f"CPU={cpu_percent:.1f}%")
-                
-                # 添加重连统计
-                reconnect_stats = self.get_reconnect_stats()
-                if reconnect_stats['total_reconnects'] > 0:
-                    logger.info(
-                        f"重连统计: 总计={reconnect_stats['total_reconnects']}, "
-                        f"成功={reconnect_stats['successful_reconnects']}, "
-                        f"连续失败={reconnect_stats['consecutive_failures']}, "
-                        f"最后原因='{reconnect_stats['last_failure_reason']}', "
-                        f"当前延迟={reconnect_stats['current_reconnect_delay']:.1f}s, "
-                        f"重连中={reconnect_stats['is_reconnecting']}"
-                    )
+                           f"发送={m.bytes_sent.value}B, "
+                           f"接收={m.bytes_received.value}B, "
+                           f"重连={m.reconnects.value}, "
+                           f"RTT={self.rtt_text()}")
             except asyncio.CancelledError:
                 break
             except Exception as e:
@@ -1054,7 +1619,7 @@ class TunnelClient:
         """清理僵尸连接"""
         while self.connected:
             try:
-                await asyncio.sleep(120)  # 每 120 秒检查一次
+                await asyncio.sleep(self.config.performance.zombie_check_interval)
                 
                 zombie_channels = []
                 for channel_id, channel in self.channels.items():
@@ -1082,7 +1647,7 @@ class TunnelClient:
         """清理过期的连接事件和结果，防止资源泄漏"""
         while self.connected:
             try:
-                await asyncio.sleep(60)  # 每分钟检查一次
+                await asyncio.sleep(self.config.performance.stale_check_interval)
                 
                 # 清理已设置的连接事件（超时或完成的连接）
                 stale_events = []
@@ -1115,11 +1680,16 @@ class TunnelClient:
         for channel in list(self.channels.values()):
             await self._close_channel(channel)
         
-        # 关闭与服务器的连接
+        if self.uplink_task:
+            self.uplink_task.cancel()
+
+        # 关闭与服务器的连接（先写出内层加密尚未发送的 CLOSE 帧）
+        if self.sealer:
+            await self.sealer.join()
         if self.writer:
             try:
                 self.writer.close()
-                await asyncio.wait_for(self.writer.wait_closed(), timeout=2.0)
+                await asyncio.wait_for(self.writer.wait_closed(), timeout=self.config.performance.close_timeout)
                 logger.info("与服务器的连接已关闭")
             except Exception as e:
                 logger.error(f"关闭与服务器的连接失败: {e}")
@@ -1131,6 +1701,12 @@ class TunnelClient:
             logger.warning(f"清理 {event_count} 个连接事件和 {result_count} 个连接结果")
         self.connect_events.clear()
         self.connect_results.clear()
+
+        # 唤醒所有等待中的 DNS 查询
+        for future in self.dns_waiters.values():
+            if not future.done():
+                future.set_result(b'')
+        self.dns_waiters.clear()
         
         # 清理所有资源
         self.reader = None
@@ -1140,86 +1716,203 @@ class TunnelClient:
 
 
 # ============================================================================
-# SOCKS5 代理服务器
+# 本地代理服务器基类
 # ============================================================================
 
-class SOCKS5Server:
+class LocalProxyServer(ABC):
     """
-    SOCKS5 代理服务器
-    
-    在本地监听 SOCKS5 连接,将连接请求通过隧道转发到远程服务器
-    充当本地 SOCKS5 代理和隧道客户端之间的桥梁
+    本地代理服务器基类
+
+    SOCKS5、HTTP 等本地监听器共用的部分: 并发限制、通道数据转发循环、
+    客户端连接关闭。子类只需实现各自协议的握手并调用 open_channel
     """
-    
+
+    PROXY_NAME = 'LOCAL'  # 日志中显示的代理类型
+
     def __init__(self, tunnel: TunnelClient, host: str = '127.0.0.1', port: int = 1080):
         """
-        初始化 SOCKS5 服务器
-        
+        初始化本地代理服务器
+
         参数:
             tunnel: 隧道客户端实例,用于转发连接
             host: 监听地址 (默认: 127.0.0.1)
-            port: 监听端口 (默认: 1080)
+            port: 监听端口
         """
         self.tunnel = tunnel
         self.host = host
         self.port = port
         # 添加连接速率限制
-        self.max_connections = 100  # 最大并发连接数
+        self.max_connections = tunnel.config.performance.max_local_connections  # 最大并发连接数
         self.current_connections = 0
         self.connection_semaphore = asyncio.Semaphore(self.max_connections)
 
+    @abstractmethod
     async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理本地客户端连接: 完成各自协议的握手,打开通道后调用 _forward_loop"""
+
+    async def _forward_loop(self, channel: Channel):
         """
-        处理 SOCKS5 客户端连接
+        数据转发循环
         
-        流程:
-        1. 握手阶段 - 确认 SOCKS5 版本,选择认证方式
-        2. 请求阶段 - 解析连接请求,获取目标地址和端口
-        3. 连接阶段 - 通过隧道建立连接
-        4. 转发阶段 - 在客户端和隧道之间转发数据
+        从本地客户端读取数据,通过隧道发送到服务器
         
         参数:
-            reader: 客户端读取流
-            writer: 客户端写入流
+            channel: 通道对象
         """
-        # 使用信号量限制并发连接
-        async with self.connection_semaphore:
-            channel = None
-            try:
-                self.current_connections += 1
-                logger.info(f"当前连接数: {self.current_connections}/{self.max_connections}")
+        performance = self.tunnel.config.performance
+        idle_count = 0
+        max_idle_count = int(performance.local_idle_timeout / LOCAL_READ_POLL)  # 无数据超过 local_idle_timeout 则关闭
+        # 每次读取的字节数: 批量上传时加大,交互式流量时减小,上行积压时不加大
+        tuner = channel.read_tuner = ReadSizeTuner(performance.read_size_min, performance.read_size_max,
+                                                   CHANNEL_READ_SIZE, self.tunnel.metrics.channel_read_size)
+        
+        try:
+            while channel.connected and self.tunnel.connected:
+                try:
+                    data = await asyncio.wait_for(channel.reader.read(tuner.size), timeout=LOCAL_READ_POLL)
+                    if data:
+                        await self.tunnel.send_data(channel.channel_id, data)
+                        logger.debug(f"通道 {channel.channel_id} 转发数据到隧道: {len(data)} 字节")
+                        idle_count = 0  # 重置空闲计数
+                        if tuner.record(len(data), self.tunnel.uplink_task is not None):
+                            logger.debug(f"通道 {channel.channel_id} 读取大小调整为 {tuner.size} 字节")
+                    elif data == b'':
+                        if channel.eof_received or not await self.tunnel.half_close_channel(channel):
+                            logger.info(f"通道 {channel.channel_id} 客户端断开连接")
+                            break
+                        # 客户端半关闭 (shutdown SHUT_WR): 继续接收响应,直到服务器方向也结束
+                        # (HALF_CLOSE 或 CLOSE),服务器一直不结束时按空闲超时关闭
+                        logger.debug(f"通道 {channel.channel_id} 客户端半关闭,等待服务器方向结束")
+                        try:
+                            await asyncio.wait_for(channel.remote_done.wait(), timeout=performance.local_idle_timeout)
+                        except asyncio.TimeoutError:
+                            logger.warning(f"通道 {channel.channel_id} 等待服务器方向结束超时，关闭连接")
+                        break
+                except asyncio.TimeoutError:
+                    idle_count += 1
+                    # 修复：添加空闲超时退出条件，防止无限循环消耗CPU
+                    if idle_count >= max_idle_count:
+                        logger.warning(f"通道 {channel.channel_id} 空闲超时，关闭连接")
+                        break
+                    continue
+        except Exception as e:
+            logger.error(f"通道 {channel.channel_id} 转发循环异常: {e}")
+            if channel.connected:
+                channel.connected = False
+        finally:
+            tuner.close()
 
-                # 检查隧道是否已连接
-                if not self.tunnel.connected:
-                    logger.warning("隧道未连接,拒绝客户端请求")
-                    writer.close()
-                    await writer.wait_closed()
-                    return
+    async def start(self):
+        """
+        启动代理服务器
+        
+        在指定地址和端口上监听并接受客户端连接
+        """
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        addr = server.sockets[0].getsockname()
+        logger.info(f"{self.PROXY_NAME} 代理服务已启动: {addr[0]}:{addr[1]}")
 
-                # SOCKS5 握手 - 读取客户端版本和认证方法
-                logger.debug("开始 SOCKS5 握手")
-                # 添加超时: 10 秒
-                data = await asyncio.wait_for(reader.read(2), timeout=10.0)
-                if len(data) < 2 or data[0] != SOCKS5.VERSION:
-                    logger.warning(f"无效的 SOCKS5 版本: {data[0] if data else 'None'}")
-                    writer.close()
-                    await writer.wait_closed()
-                    return
+        async with server:
+            await server.serve_forever()
 
-                nmethods = data[1]
-                logger.debug(f"客户端支持的认证方法数量: {nmethods}")
-                # 添加超时: 10 秒
-                await asyncio.wait_for(reader.read(nmethods), timeout=10.0)
+    async def _close_client_writer(self, writer: asyncio.StreamWriter):
+        """
+        关闭本地客户端连接,必要时强制中止传输层
 
-                # 响应握手 - 选择无需认证
+        参数:
+            writer: 客户端写入流
+        """
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), timeout=self.tunnel.config.performance.close_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("关闭 writer 超时,强制关闭")
+            try:
+                writer.transport.abort()
+            except Exception as e:
+                logger.error(f"强制关闭 transport 失败: {e}")
+        except Exception as e:
+            logger.debug(f"关闭客户端连接失败: {e}")
+            try:
+                writer.transport.abort()
+            except Exception as e2:
+                logger.error(f"强制关闭 transport 失败: {e2}")
+        finally:
+            # 最后的手段：强制关闭Socket
+            try:
+                if (hasattr(writer, 'transport') and 
+                    writer.transport and 
+                    hasattr(writer.transport, '_sock') and 
+                    writer.transport._sock is not None):
+                    writer.transport._sock.close()
+            except Exception as e:
+                logger.error(f"强制关闭 Socket 失败: {e}")
+
+
+# ============================================================================
+# SOCKS5 代理服务器
+# ============================================================================
+
+class SOCKS5Server(LocalProxyServer):
+    """
+    SOCKS5 代理服务器
+    
+    在本地监听 SOCKS5 连接,将连接请求通过隧道转发到远程服务器
+    充当本地 SOCKS5 代理和隧道客户端之间的桥梁
+    """
+
+    PROXY_NAME = 'SOCKS5'
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        处理 SOCKS5 客户端连接
+        
+        流程:
+        1. 握手阶段 - 确认 SOCKS5 版本,选择认证方式
+        2. 请求阶段 - 解析连接请求,获取目标地址和端口
+        3. 连接阶段 - 通过隧道建立连接
+        4. 转发阶段 - 在客户端和隧道之间转发数据
+        
+        参数:
+            reader: 客户端读取流
+            writer: 客户端写入流
+        """
+        # 使用信号量限制并发连接
+        async with self.connection_semaphore:
+            channel = None
+            try:
+                self.current_connections += 1
+                logger.info(f"当前连接数: {self.current_connections}/{self.max_connections}")
+
+                # 检查隧道是否已连接
+                if not self.tunnel.connected:
+                    logger.warning("隧道未连接,拒绝客户端请求")
+                    writer.close()
+                    await writer.wait_closed()
+                    return
+
+                # SOCKS5 握手 - 读取客户端版本和认证方法
+                logger.debug("开始 SOCKS5 握手")
+                timeout = self.tunnel.config.performance.local_handshake_timeout
+                data = await asyncio.wait_for(reader.read(2), timeout=timeout)
+                if len(data) < 2 or data[0] != SOCKS5.VERSION:
+                    logger.warning(f"无效的 SOCKS5 版本: {data[0] if data else 'None'}")
+                    writer.close()
+                    await writer.wait_closed()
+                    return
+
+                nmethods = data[1]
+                logger.debug(f"客户端支持的认证方法数量: {nmethods}")
+                await asyncio.wait_for(reader.read(nmethods), timeout=timeout)
+
+                # 响应握手 - 选择无需认证
                 logger.debug("发送握手响应: 选择无需认证")
                 writer.write(bytes([SOCKS5.VERSION, SOCKS5.AUTH_NONE]))
                 await writer.drain()
 
                 # 读取连接请求
                 logger.debug("等待连接请求")
-                # 添加超时: 10 秒
-                data = await asyncio.wait_for(reader.read(4), timeout=10.0)
+                data = await asyncio.wait_for(reader.read(4), timeout=timeout)
                 if len(data) < 4:
                     logger.warning("未收到完整的连接请求")
                     writer.close()
@@ -1246,10 +1939,8 @@ class SOCKS5Server:
                     logger.debug(f"解析 IPv4 地址: {host}")
                 elif atyp == SOCKS5.ATYP_DOMAIN:
                     # 域名 (1字节长度 + 域名)
-                    # 添加超时: 10 秒
-                    length = (await asyncio.wait_for(reader.read(1), timeout=10.0))[0]
-                    # 添加超时: 10 秒
-                    host = (await asyncio.wait_for(reader.read(length), timeout=10.0)).decode()
+                    length = (await asyncio.wait_for(reader.read(1), timeout=timeout))[0]
+                    host = (await asyncio.wait_for(reader.read(length), timeout=timeout)).decode()
                     logger.debug(f"解析域名: {host}")
                 elif atyp == SOCKS5.ATYP_IPV6:
                     # IPv6 地址 (16字节)
@@ -1313,83 +2004,711 @@ class SOCKS5Server:
                     await self.tunnel._close_channel(channel)
 
                 # 确保在所有情况下都关闭 writer
-                try:
-                    writer.close()
-                    await asyncio.wait_for(writer.wait_closed(), timeout=5.0)
-                except asyncio.TimeoutError:
-                    logger.warning("关闭 writer 超时,强制关闭")
-                    try:
-                        writer.transport.abort()
-                    except Exception as e:
-                        logger.error(f"强制关闭 transport 失败: {e}")
-                except Exception as e:
-                    logger.debug(f"关闭客户端连接失败: {e}")
-                    try:
-                        writer.transport.abort()
-                    except Exception as e2:
-                        logger.error(f"强制关闭 transport 失败: {e2}")
-                finally:
-                    # 最后的手段：强制关闭Socket
-                    try:
-                        if (hasattr(writer, 'transport') and 
-                            writer.transport and 
-                            hasattr(writer.transport, '_sock') and 
-                            writer.transport._sock is not None):
-                            writer.transport._sock.close()
-                    except Exception as e:
-                        logger.error(f"强制关闭 Socket 失败: {e}")
+                await self._close_client_writer(writer)
 
                 # 确保计数器被减少
                 self.current_connections -= 1
                 logger.debug(f"连接已关闭,当前连接数: {self.current_connections}/{self.max_connections}")
 
-    async def _forward_loop(self, channel: Channel):
+
+# ============================================================================
+# HTTP 代理服务器
+# ============================================================================
+
+class HTTPProxyServer(LocalProxyServer):
+    """
+    HTTP/1.1 代理服务器
+
+    与 SOCKS5Server 共用隧道通道: 每个请求通过 open_channel 打开一个通道,
+    之后的数据经 send_data 转发,不再需要额外的 SOCKS 到 HTTP 转换进程
+
+    支持:
+    - CONNECT 隧道,请求头之后已到达的 (流水线) 字节直接作为通道数据转发
+    - 绝对 URI 形式的普通 HTTP 请求 (GET http://host/path),请求行改写为
+      源服务器形式并强制 Connection: close,每个客户端连接只转发一个请求
+    """
+
+    PROXY_NAME = 'HTTP'
+    MAX_HEADER_SIZE = 16384  # 请求头最大长度
+    # 转发普通 HTTP 请求时需要去掉的逐跳头部 (RFC 9110 §7.6.1) 和只发给代理的头部,
+    # Connection 中列出的头部同样去掉。请求体原样转发,所以保留 Transfer-Encoding
+    # 和 Content-Length,否则源服务器无法确定请求体的边界
+    HOP_BY_HOP_HEADERS = frozenset((
+        b'connection', b'proxy-connection', b'keep-alive', b'te', b'trailer', b'upgrade',
+        b'proxy-authorization', b'proxy-authenticate',
+    ))
+    BODY_FRAMING_HEADERS = frozenset((b'transfer-encoding', b'content-length'))
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """
-        数据转发循环
-        
-        从 SOCKS5 客户端读取数据,通过隧道发送到服务器
-        
+        处理 HTTP 代理客户端连接
+
+        流程:
+        1. 读取请求头 (直到空行)
+        2. 解析 CONNECT 目标或绝对 URI
+        3. 通过隧道打开通道
+        4. 转发请求头之后的数据 (或改写后的请求),进入转发循环
+
         参数:
-            channel: 通道对象
+            reader: 客户端读取流
+            writer: 客户端写入流
         """
-        idle_count = 0
-        max_idle_count = 1000  # 100秒无数据则关闭 (0.1秒 * 1000)
-        
-        try:
-            while channel.connected and self.tunnel.connected:
+        async with self.connection_semaphore:
+            channel = None
+            try:
+                self.current_connections += 1
+                logger.info(f"当前 HTTP 连接数: {self.current_connections}/{self.max_connections}")
+
+                if not self.tunnel.connected:
+                    logger.warning("隧道未连接,拒绝 HTTP 客户端请求")
+                    await self._send_error(writer, 503, 'Service Unavailable')
+                    return
+
+                # 读取请求头
                 try:
-                    data = await asyncio.wait_for(channel.reader.read(32768), timeout=0.1)
-                    if data:
-                        await self.tunnel.send_data(channel.channel_id, data)
-                        logger.debug(f"通道 {channel.channel_id} 转发数据到隧道: {len(data)} 字节")
-                        idle_count = 0  # 重置空闲计数
-                    elif data == b'':
-                        logger.info(f"通道 {channel.channel_id} 客户端断开连接")
-                        break
-                except asyncio.TimeoutError:
-                    idle_count += 1
-                    # 修复：添加空闲超时退出条件，防止无限循环消耗CPU
-                    if idle_count >= max_idle_count:
-                        logger.warning(f"通道 {channel.channel_id} 空闲超时，关闭连接")
-                        break
-                    continue
+                    head = await asyncio.wait_for(self._read_head(reader),
+                                                  timeout=self.tunnel.config.performance.local_handshake_timeout)
+                except asyncio.IncompleteReadError:
+                    logger.debug("HTTP 客户端在发送完整请求头前断开")
+                    return
+                if head is None:
+                    await self._send_error(writer, 431, 'Request Header Fields Too Large')
+                    return
+
+                request = self.parse_request(head)
+                if request is None:
+                    logger.warning("无效的 HTTP 代理请求")
+                    await self._send_error(writer, 400, 'Bad Request')
+                    return
+                method, host, port, first_data = request
+                if not host:
+                    await self._send_error(writer, 501, 'Not Implemented')
+                    return
+
+                logger.info(f"HTTP {method} 请求: {host}:{port}")
+
+                # 通过隧道打开连接
+                channel_id, success = await self.tunnel.open_channel(host, port)
+                if not success:
+                    logger.warning(f"HTTP 代理连接失败: {host}:{port}")
+                    await self._send_error(writer, 502, 'Bad Gateway')
+                    return
+
+                if method == 'CONNECT':
+                    writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+                    await writer.drain()
+
+                channel = Channel(
+                    channel_id=channel_id,
+                    reader=reader,
+                    writer=writer,
+                    host=host,
+                    port=port,
+                    connected=True
+                )
+                self.tunnel.channels[channel_id] = channel
+
+                # 普通 HTTP 请求: 先发送改写后的请求头
+                # CONNECT: 请求头之后的流水线字节仍在 reader 缓冲区中,由转发循环立即读出
+                if first_data:
+                    await self.tunnel.send_data(channel_id, first_data)
+
+                logger.debug(f"启动通道 {channel_id} 数据转发循环")
+                await self._forward_loop(channel)
+
+            except asyncio.TimeoutError:
+                logger.warning("HTTP 客户端操作超时")
+            except Exception as e:
+                logger.debug(f"HTTP 代理错误: {e}")
+            finally:
+                if channel:
+                    logger.debug(f"清理通道 {channel.channel_id}")
+                    await self.tunnel.close_channel_remote(channel.channel_id)
+                    await self.tunnel._close_channel(channel)
+
+                await self._close_client_writer(writer)
+
+                self.current_connections -= 1
+                logger.debug(f"HTTP 连接已关闭,当前连接数: {self.current_connections}/{self.max_connections}")
+
+    @classmethod
+    async def _read_head(cls, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """
+        逐行读取请求头直到空行,行尾可以是 CRLF 或裸 LF
+
+        返回:
+            完整的请求头; 超过 MAX_HEADER_SIZE 时返回 None
+
+        异常:
+            asyncio.IncompleteReadError: 客户端在空行之前断开
+        """
+        head = bytearray()
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:  # 单行超过 StreamReader 的缓冲上限
+                return None
+            if not line.endswith(b'\n'):
+                raise asyncio.IncompleteReadError(bytes(head + line), None)
+            if line in (b'\r\n', b'\n'):
+                if head:
+                    return bytes(head + line)
+                continue  # 请求行之前的空行忽略 (RFC 9112 §2.2)
+            head += line
+            if len(head) > cls.MAX_HEADER_SIZE:
+                return None
+
+    @classmethod
+    def parse_request(cls, head: bytes) -> Optional[Tuple[str, Optional[str], int, bytes]]:
+        """
+        解析代理请求头
+
+        参数:
+            head: 以空行结尾的完整请求头
+
+        返回:
+            (方法, 主机, 端口, 需要先发送的数据) 元组; 请求格式无效时返回 None;
+            不支持的 URI 协议返回主机为 None
+        """
+        lines = [line[:-1] if line.endswith(b'\r') else line for line in head.split(b'\n')]
+        try:
+            method, target, version = lines[0].decode('ascii').split(' ')
+        except (UnicodeDecodeError, ValueError):
+            return None
+        if not version.startswith('HTTP/1.'):
+            return None
+
+        if method == 'CONNECT':
+            host, port = cls._split_host_port(target, 443)
+            if not host or port is None:
+                return None
+            return method, host, port, b''
+
+        # 普通请求必须是绝对 URI 形式
+        if not target.lower().startswith('http://'):
+            return method, None, 0, b''
+        # 授权部分在第一个 '/'、'?' 或 '#' 处结束; 片段不发送给源服务器
+        rest = target[7:]
+        end = min((index for index in map(rest.find, '/?#') if index >= 0), default=len(rest))
+        authority, path = rest[:end], rest[end:].partition('#')[0]
+        if not path.startswith('/'):
+            path = '/' + path
+        # 去掉 user:pass@ (不能转发给源服务器)
+        authority = authority.rpartition('@')[2]
+        host, port = cls._split_host_port(authority, 80)
+        if not host or port is None:
+            return None
+
+        # Connection 头部中列出的头部也是逐跳的
+        headers = []
+        dropped = set(cls.HOP_BY_HOP_HEADERS)
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(b':')
+            name = name.strip().lower()
+            headers.append((name, line))
+            if name == b'connection':
+                dropped.update(token.strip().lower() for token in value.split(b','))
+        dropped -= cls.BODY_FRAMING_HEADERS
+
+        # 改写为源服务器形式并去掉逐跳头部
+        out = [f"{method} {path} {version}".encode('ascii')]
+        out.extend(line for name, line in headers if name not in dropped)
+        out.append(b'Connection: close')
+        return method, host, port, b'\r\n'.join(out) + b'\r\n\r\n'
+
+    @staticmethod
+    def _split_host_port(authority: str, default_port: int) -> Tuple[str, Optional[int]]:
+        """
+        拆分 host[:port],支持 [IPv6]:port 形式
+
+        返回:
+            (主机, 端口) 元组,端口无效时为 None
+        """
+        if authority.startswith('['):
+            host, _, rest = authority[1:].partition(']')
+            port_str = rest[1:] if rest.startswith(':') else ''
+        elif authority.count(':') == 1:
+            host, _, port_str = authority.partition(':')
+        else:
+            host, port_str = authority, ''
+        if not port_str:
+            return host, default_port
+        try:
+            port = int(port_str)
+        except ValueError:
+            return host, None
+        if not 0 < port <= 65535:
+            return host, None
+        return host, port
+
+    @staticmethod
+    async def _send_error(writer: asyncio.StreamWriter, status: int, reason: str):
+        """向客户端发送 HTTP 错误响应"""
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode('ascii')
+            )
+            await writer.drain()
         except Exception as e:
-            logger.error(f"通道 {channel.channel_id} 转发循环异常: {e}")
-            if channel.connected:
-                channel.connected = False
+            logger.debug(f"发送 HTTP 错误响应失败: {e}")
 
-    async def start(self):
+
+# ============================================================================
+# 透明代理
+# ============================================================================
+
+# netfilter 常量 (linux/netfilter_ipv4.h, linux/netfilter_ipv6/ip6_tables.h)
+SO_ORIGINAL_DST = 80        # IPv4 原始目标地址选项
+IP6T_SO_ORIGINAL_DST = 80   # IPv6 原始目标地址选项
+SOL_IP = getattr(socket, 'SOL_IP', 0)
+SOL_IPV6 = getattr(socket, 'IPPROTO_IPV6', 41)
+
+
+def get_original_dst(sock: socket.socket) -> Tuple[str, int]:
+    """
+    读取被 iptables REDIRECT 重定向之前的原始目标地址
+
+    参数:
+        sock: 已接受的客户端套接字
+
+    返回:
+        Tuple[str, int]: (原始目标地址, 原始目标端口)
+
+    异常:
+        OSError: 连接没有经过 REDIRECT (没有 conntrack 记录) 或系统不支持
+    """
+    peer = sock.getpeername()
+    # 双栈监听器上的 IPv4 连接 (::ffff:a.b.c.d) 仍然走 IPv4 conntrack
+    if sock.family == socket.AF_INET6 and not str(peer[0]).startswith('::ffff:'):
+        # struct sockaddr_in6: 地址族(2) + 端口(2) + 流标签(4) + 地址(16) + 范围ID(4)
+        raw = sock.getsockopt(SOL_IPV6, IP6T_SO_ORIGINAL_DST, 28)
+        port = struct.unpack_from('>H', raw, 2)[0]
+        host = socket.inet_ntop(socket.AF_INET6, raw[8:24])
+    else:
+        # struct sockaddr_in: 地址族(2) + 端口(2) + 地址(4) + 填充(8)
+        raw = sock.getsockopt(SOL_IP, SO_ORIGINAL_DST, 16)
+        port = struct.unpack_from('>H', raw, 2)[0]
+        host = socket.inet_ntoa(raw[4:8])
+    return host, port
+
+
+class TransparentProxyServer(LocalProxyServer):
+    """
+    透明代理服务器
+
+    配合 iptables REDIRECT 使用: 从 SO_ORIGINAL_DST 读取原始目标地址,
+    直接通过 open_channel 打开隧道通道,没有 SOCKS 问候/请求往返,
+    应用程序也不需要任何代理配置
+
+    示例规则 (将本机发出的 TCP 流量重定向到 12345 端口):
+        iptables -t nat -A OUTPUT -p tcp -d 203.0.113.0/24 -j REDIRECT --to-ports 12345
+        ip6tables -t nat -A OUTPUT -p tcp -d 2001:db8::/32 -j REDIRECT --to-ports 12345
+    注意排除到隧道服务器本身的流量,否则会形成回环
+    """
+
+    PROXY_NAME = '透明'
+
+    def __init__(self, tunnel: TunnelClient, host='127.0.0.1', port: int = 12345,
+                 original_dst_resolver=get_original_dst):
         """
-        启动 SOCKS5 服务器
-        
-        在指定地址和端口上监听并接受客户端连接
+        初始化透明代理服务器
+
+        参数:
+            tunnel: 隧道客户端实例
+            host: 监听地址,可以是地址列表 (同时监听 IPv4 和 IPv6)
+            port: 监听端口
+            original_dst_resolver: 从套接字读取原始目标地址的函数 (测试时可替换)
         """
-        server = await asyncio.start_server(self.handle_client, self.host, self.port)
-        addr = server.sockets[0].getsockname()
-        logger.info(f"SOCKS5 代理服务已启动: {addr[0]}:{addr[1]}")
+        super().__init__(tunnel, host, port)
+        self.original_dst_resolver = original_dst_resolver
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        处理被重定向的客户端连接
+
+        参数:
+            reader: 客户端读取流
+            writer: 客户端写入流
+        """
+        async with self.connection_semaphore:
+            channel = None
+            try:
+                self.current_connections += 1
+
+                if not self.tunnel.connected:
+                    logger.warning("隧道未连接,拒绝透明代理连接")
+                    return
+
+                sock = writer.get_extra_info('socket')
+                try:
+                    host, port = self.original_dst_resolver(sock)
+                except OSError as e:
+                    logger.warning(f"无法获取原始目标地址 (连接未经过 REDIRECT?): {e}")
+                    return
+
+                # 直接连接到监听端口 (没有重定向) 会让通道指回自己
+                sockname = writer.get_extra_info('sockname')
+                if sockname and (host, port) == tuple(sockname[:2]):
+                    logger.warning(f"原始目标地址就是透明代理本身,拒绝: {host}:{port}")
+                    return
+
+                logger.info(f"透明代理连接请求: {host}:{port}")
+
+                channel_id, success = await self.tunnel.open_channel(host, port)
+                if not success:
+                    logger.warning(f"透明代理连接失败: {host}:{port}")
+                    return
+
+                channel = Channel(
+                    channel_id=channel_id,
+                    reader=reader,
+                    writer=writer,
+                    host=host,
+                    port=port,
+                    connected=True
+                )
+                self.tunnel.channels[channel_id] = channel
+
+                logger.debug(f"启动通道 {channel_id} 数据转发循环")
+                await self._forward_loop(channel)
+
+            except Exception as e:
+                logger.debug(f"透明代理错误: {e}")
+            finally:
+                if channel:
+                    logger.debug(f"清理通道 {channel.channel_id}")
+                    await self.tunnel.close_channel_remote(channel.channel_id)
+                    await self.tunnel._close_channel(channel)
+
+                await self._close_client_writer(writer)
+
+                self.current_connections -= 1
+
+
+# ============================================================================
+# DNS 转发
+# ============================================================================
+
+DNS_TYPE_OPT = 41  # EDNS0 伪记录,TTL 字段含义不同,不参与缓存时间计算
+DNS_RCODE_NOERROR = 0
+DNS_RCODE_NXDOMAIN = 3
+MAX_DNS_FORWARDER_TASKS = 1024  # 本地 DNS 转发器同时处理的查询数 (含等待合并查询的重复问题和预取),超出时回复 SERVFAIL
+
+
+def _dns_skip_name(msg: bytes, offset: int) -> int:
+    """跳过报文中的域名 (支持压缩指针),返回域名之后的偏移"""
+    while True:
+        if offset >= len(msg):
+            raise ValueError("域名越界")
+        length = msg[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+
+
+def dns_question_key(msg: bytes) -> Optional[Tuple[bytes, int, int]]:
+    """
+    提取 DNS 报文的问题作为缓存键
+
+    参数:
+        msg: DNS 报文
+
+    返回:
+        (小写域名线格式, 查询类型, 查询类) 元组; 不是单问题报文时返回 None
+    """
+    try:
+        if len(msg) < 12 or struct.unpack_from('>H', msg, 4)[0] != 1:
+            return None
+        end = _dns_skip_name(msg, 12)
+        qtype, qclass = struct.unpack_from('>HH', msg, end)
+        # 标签长度字节都小于 64,lower() 只会改变 A-Z
+        return msg[12:end].lower(), qtype, qclass
+    except (ValueError, struct.error):
+        return None
 
-        async with server:
-            await server.serve_forever()
+
+def dns_record_ttls(msg: bytes) -> List[Tuple[int, int]]:
+    """
+    找出响应中所有资源记录的 TTL 字段
+
+    参数:
+        msg: DNS 响应报文
+
+    返回:
+        [(TTL 字段偏移, TTL)] 列表 (不含 OPT 伪记录)
+
+    异常:
+        ValueError / struct.error: 报文格式错误
+    """
+    qdcount, ancount, nscount, arcount = struct.unpack_from('>HHHH', msg, 4)
+    offset = 12
+    for _ in range(qdcount):
+        offset = _dns_skip_name(msg, offset) + 4
+    ttls = []
+    for _ in range(ancount + nscount + arcount):
+        offset = _dns_skip_name(msg, offset)
+        rtype, _, ttl, rdlength = struct.unpack_from('>HHIH', msg, offset)
+        if rtype != DNS_TYPE_OPT:
+            ttls.append((offset + 4, ttl))
+        offset += 10 + rdlength
+    if offset > len(msg):
+        raise ValueError("记录越界")
+    return ttls
+
+
+def dns_servfail(query: bytes) -> Optional[bytes]:
+    """
+    根据查询构造 SERVFAIL 响应
+
+    参数:
+        query: DNS 查询报文
+
+    返回:
+        Optional[bytes]: SERVFAIL 响应,查询无法解析时返回 None
+    """
+    try:
+        end = _dns_skip_name(query, 12) + 4
+    except ValueError:
+        return None
+    if end > len(query):
+        return None
+    flags = struct.unpack_from('>H', query, 2)[0]
+    # QR=1, 保留 OPCODE 和 RD, RA=1, RCODE=2
+    flags = 0x8000 | (flags & 0x7900) | 0x0080 | 0x0002
+    return query[:2] + struct.pack('>HHHHH', flags, 1, 0, 0, 0) + query[12:end]
+
+
+@dataclass
+class DNSCacheEntry:
+    """DNS 缓存条目"""
+    response: bytes                     # 原始响应报文
+    ttl_fields: List[Tuple[int, int]]   # [(TTL 字段偏移, 原始 TTL)]
+    stored_at: float                    # 存入时间 (monotonic)
+    ttl: int                            # 条目有效期 (秒)
+    hits: int = 0                       # 命中次数
+    prefetching: bool = False           # 是否正在预取
+
+
+class DNSCache:
+    """
+    遵循 TTL 的 DNS 响应缓存
+
+    - 条目有效期取响应中最小的记录 TTL,命中时按已过去的时间递减各记录 TTL
+    - 只缓存 NOERROR / NXDOMAIN 且未截断的响应
+    - 热点条目 (命中次数达到阈值) 在剩余有效期低于一定比例时提前预取
+    - 超过容量时淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_entries: int = 4096, max_ttl: int = 86400,
+                 prefetch_ratio: float = 0.1, prefetch_min_hits: int = 2):
+        """
+        初始化 DNS 缓存
+
+        参数:
+            max_entries: 最大条目数
+            max_ttl: TTL 上限 (秒)
+            prefetch_ratio: 剩余有效期低于该比例时预取
+            prefetch_min_hits: 触发预取所需的最少命中次数
+        """
+        self.entries: 'OrderedDict[tuple, DNSCacheEntry]' = OrderedDict()
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.prefetch_ratio = prefetch_ratio
+        self.prefetch_min_hits = prefetch_min_hits
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """缓存命中率 (0-1)"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: tuple, query_id: bytes) -> Tuple[Optional[bytes], bool]:
+        """
+        查找缓存
+
+        参数:
+            key: dns_question_key 返回的缓存键
+            query_id: 查询报文的 2 字节 ID,写入返回的响应
+
+        返回:
+            (响应报文或 None, 是否需要预取) 元组
+        """
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is None or now - entry.stored_at >= entry.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None, False
+
+        self.hits += 1
+        entry.hits += 1
+        self.entries.move_to_end(key)
+
+        elapsed = int(now - entry.stored_at)
+        response = bytearray(entry.response)
+        response[0:2] = query_id
+        for offset, ttl in entry.ttl_fields:
+            struct.pack_into('>I', response, offset, max(0, ttl - elapsed))
+
+        prefetch = (
+            not entry.prefetching
+            and entry.hits >= self.prefetch_min_hits
+            and entry.ttl - (now - entry.stored_at) <= entry.ttl * self.prefetch_ratio
+        )
+        if prefetch:
+            entry.prefetching = True
+            self.prefetches += 1
+        return bytes(response), prefetch
+
+    def put(self, key: tuple, response: bytes) -> bool:
+        """
+        存入响应
+
+        参数:
+            key: 缓存键
+            response: DNS 响应报文
+
+        返回:
+            bool: 响应可缓存并已存入返回 True
+        """
+        try:
+            flags = struct.unpack_from('>H', response, 2)[0]
+            ttl_fields = dns_record_ttls(response)
+        except (ValueError, struct.error):
+            return False
+        rcode = flags & 0x000F
+        truncated = flags & 0x0200
+        if truncated or rcode not in (DNS_RCODE_NOERROR, DNS_RCODE_NXDOMAIN) or not ttl_fields:
+            return False
+        ttl = min(min(t for _, t in ttl_fields), self.max_ttl)
+        if ttl <= 0:
+            return False
+
+        # 预取得到的新响应会继承旧条目的命中次数,保持热点状态
+        old = self.entries.pop(key, None)
+        self.entries[key] = DNSCacheEntry(
+            response=bytes(response),
+            ttl_fields=ttl_fields,
+            stored_at=time.monotonic(),
+            ttl=ttl,
+            hits=old.hits if old else 0,
+        )
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return True
+
+    def prefetch_done(self, key: tuple):
+        """预取结束 (失败时允许下次命中再次预取)"""
+        entry = self.entries.get(key)
+        if entry:
+            entry.prefetching = False
+
+
+class DNSForwarder(asyncio.DatagramProtocol):
+    """
+    本地 DNS 转发器
+
+    在本地 UDP 端口接收查询,命中缓存直接回复,
+    否则通过 TunnelClient.dns_query 转发到服务器端的解析器。
+    相同问题的并发查询只发送一次
+    """
+
+    def __init__(self, tunnel: TunnelClient, cache: DNSCache):
+        """
+        初始化 DNS 转发器
+
+        参数:
+            tunnel: 隧道客户端实例
+            cache: DNS 缓存 (跨重连保留)
+        """
+        self.tunnel = tunnel
+        self.cache = cache
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.inflight: Dict[tuple, asyncio.Future] = {}  # 进行中的查询
+        self.tasks: Set[asyncio.Task] = set()  # 处理查询和预取的任务 (最多 MAX_DNS_FORWARDER_TASKS 个)
+        tunnel.dns_cache = cache
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        """处理本地 DNS 查询"""
+        key = dns_question_key(data)
+        if key is not None:
+            response, prefetch = self.cache.get(key, data[:2])
+            if response is not None:
+                self.transport.sendto(response, addr)
+                if prefetch:
+                    if len(self.tasks) >= MAX_DNS_FORWARDER_TASKS:
+                        self.cache.prefetch_done(key)
+                    else:
+                        logger.debug(f"DNS 预取: {key[0]!r}")
+                        self._start(self._prefetch(key, data))
+                return
+        if len(self.tasks) >= MAX_DNS_FORWARDER_TASKS:
+            # 本地查询过多: 直接回复 SERVFAIL,不再创建任务
+            response = dns_servfail(data)
+            if response is not None:
+                self.transport.sendto(response, addr)
+            return
+        self._start(self._resolve(data, key, addr))
+
+    def _start(self, coro):
+        """创建任务并保存引用,结束后移除"""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _resolve(self, query: bytes, key: Optional[tuple], addr):
+        """通过隧道解析并回复本地客户端"""
+        response = await self._lookup(query, key)
+        if response is None:
+            response = dns_servfail(query)
+            if response is None:
+                return
+        else:
+            response = query[:2] + response[2:]
+        if self.transport and not self.transport.is_closing():
+            self.transport.sendto(response, addr)
+
+    async def _prefetch(self, key: tuple, query: bytes):
+        """在条目过期前刷新热点名称"""
+        try:
+            await self._lookup(query, key)
+        finally:
+            self.cache.prefetch_done(key)
+
+    async def _lookup(self, query: bytes, key: Optional[tuple]) -> Optional[bytes]:
+        """发送查询 (合并相同问题的并发查询) 并写入缓存"""
+        if key is None:
+            return await self.tunnel.dns_query(query)
+        if key in self.inflight:
+            return await asyncio.shield(self.inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        response = None
+        try:
+            response = await self.tunnel.dns_query(query)
+            if response is not None:
+                self.cache.put(key, response)
+        except Exception as e:
+            logger.debug(f"DNS 查询失败: {e}")
+        finally:
+            future.set_result(response)
+            self.inflight.pop(key, None)
+        return response
 
 
 # ============================================================================
@@ -1408,15 +2727,39 @@ async def run_client(config: ClientConfig, ca_cert: str):
     max_reconnect_delay = 30  # 最大重连延迟 (秒)
     current_delay = reconnect_delay
     socks_server = None       # 跟踪 SOCKS5 服务器实例
+    local_servers = []        # 跟踪其他本地监听器 (HTTP 代理等)
+    dns_cache = DNSCache()    # DNS 缓存跨重连保留
     receiver_task = None       # 跟踪接收器任务
+    metrics = ClientMetrics()  # 运行指标跨重连保留
+    crypto_offload = None      # 内层加密线程池跨重连保留
+    if config.crypto_threads > 0:
+        crypto_offload = CryptoOffload(config.crypto_threads, config.performance.crypto_offload_threshold)
+    buffer_pool = BufferPool()  # 帧缓冲区池跨重连保留
+    metrics.bind_dns_cache(dns_cache)
+    metrics.bind_buffer_pool(buffer_pool)
+    lost_at: Optional[float] = None  # 连接丢失的时间,用于统计重连耗时
+    metrics_server = None      # 指标端点 (不随重连重建)
+
+    # 启动可选的指标端点 (HTTP 端口或 Unix 套接字)
+    if config.metrics_port or config.metrics_socket:
+        try:
+            metrics_server = await start_metrics_server(
+                metrics.registry, config.metrics_host, config.metrics_port, path=config.metrics_socket
+            )
+            local = config.metrics_socket or f"{config.metrics_host}:{config.metrics_port}"
+            logger.info(f"指标端点已启动: {local} (GET /metrics)")
+        except OSError as e:
+            logger.error(f"指标端点启动失败: {e}")
 
     while True:
         logger.info("创建新的隧道客户端实例")
-        tunnel = TunnelClient(config, ca_cert)
+        tunnel = TunnelClient(config, ca_cert, metrics, crypto_offload, buffer_pool)
 
         # 尝试连接
         logger.info("尝试连接到服务器")
         if not await tunnel.connect():
+            if lost_at is None:
+                lost_at = time.monotonic()
             logger.warning(f"连接失败,{current_delay}秒后重试...")
             await asyncio.sleep(current_delay)
             current_delay = min(current_delay * 2, max_reconnect_delay)
@@ -1424,13 +2767,17 @@ async def run_client(config: ClientConfig, ca_cert: str):
 
         # 连接成功 - 重置延迟
         current_delay = reconnect_delay
+        if lost_at is not None:
+            metrics.reconnects.inc()
+            metrics.reconnect_seconds.observe(time.monotonic() - lost_at)
+            lost_at = None
 
         # 取消旧的接收器任务（如果存在）
         if receiver_task and not receiver_task.done():
             logger.info("取消旧的接收器任务")
             receiver_task.cancel()
             try:
-                await asyncio.wait_for(receiver_task, timeout=5.0)
+                await asyncio.wait_for(receiver_task, timeout=config.performance.close_timeout)
             except (asyncio.CancelledError, asyncio.TimeoutError):
                 logger.debug("旧接收器任务取消超时")
 
@@ -1448,6 +2795,7 @@ async def run_client(config: ClientConfig, ca_cert: str):
                 logger.info("关闭旧的 SOCKS5 服务器")
                 socks_server.close()
                 await socks_server.wait_closed()
+            await _close_local_servers(local_servers)
 
             # 创建 SOCKS 服务器但不阻塞
             socks_server = await asyncio.start_server(
@@ -1459,6 +2807,47 @@ async def run_client(config: ClientConfig, ca_cert: str):
             addr = socks_server.sockets[0].getsockname()
             logger.info(f"SOCKS5 代理服务已启动: {addr[0]}:{addr[1]}")
 
+            # 启动可选的 HTTP 代理
+            if config.http_proxy_port:
+                http_proxy = HTTPProxyServer(tunnel, config.http_proxy_host, config.http_proxy_port)
+                http_server = await asyncio.start_server(
+                    http_proxy.handle_client,
+                    http_proxy.host,
+                    http_proxy.port,
+                    reuse_address=True
+                )
+                local_servers.append(http_server)
+                addr = http_server.sockets[0].getsockname()
+                logger.info(f"HTTP 代理服务已启动: {addr[0]}:{addr[1]}")
+
+            # 启动可选的透明代理 (需要 iptables REDIRECT)
+            if config.transparent_port:
+                transparent = TransparentProxyServer(
+                    tunnel, config.transparent_host, config.transparent_port
+                )
+                transparent_server = await asyncio.start_server(
+                    transparent.handle_client,
+                    transparent.host,
+                    transparent.port,
+                    reuse_address=True
+                )
+                local_servers.append(transparent_server)
+                for sock in transparent_server.sockets:
+                    addr = sock.getsockname()
+                    logger.info(f"透明代理服务已启动: {addr[0]}:{addr[1]}")
+
+            # 启动可选的本地 DNS 转发器
+            if config.dns_port:
+                if CAP_DNS in tunnel.capabilities:
+                    dns_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                        lambda: DNSForwarder(tunnel, dns_cache),
+                        local_addr=(config.dns_host, config.dns_port)
+                    )
+                    local_servers.append(dns_transport)
+                    logger.info(f"DNS 转发服务已启动: {config.dns_host}:{config.dns_port}")
+                else:
+                    logger.warning("服务器不支持 DNS 转发,本地 DNS 转发器未启动")
+
             # 等待以下任一事件: 接收器结束 (连接丢失) 或键盘中断
             async with socks_server:
                 try:
@@ -1474,6 +2863,7 @@ async def run_client(config: ClientConfig, ca_cert: str):
                 tunnel.connected = False
 
             logger.warning("连接丢失,正在重新连接...")
+            lost_at = time.monotonic()
             current_delay = reconnect_delay  # 为下次失败重置延迟
 
         except KeyboardInterrupt:
@@ -1484,6 +2874,11 @@ async def run_client(config: ClientConfig, ca_cert: str):
                 logger.info("关闭 SOCKS5 服务器")
                 socks_server.close()
                 await socks_server.wait_closed()
+            await _close_local_servers(local_servers)
+            if metrics_server:
+                metrics_server.close()
+            if crypto_offload:
+                crypto_offload.shutdown()
             return 0
         except OSError as e:
             if "Address already in use" in str(e):
@@ -1499,13 +2894,34 @@ async def run_client(config: ClientConfig, ca_cert: str):
             if not receiver_task.done():
                 receiver_task.cancel()
                 try:
-                    await asyncio.wait_for(receiver_task, timeout=5.0)
+                    await asyncio.wait_for(receiver_task, timeout=config.performance.close_timeout)
                 except (asyncio.CancelledError, asyncio.TimeoutError):
                     logger.debug("接收器任务取消超时")
 
         # 连接丢失后不延迟 - 仅在连接失败时延迟 (在循环顶部处理)
 
 
+async def _close_local_servers(servers: list):
+    """
+    关闭并清空本地监听器列表
+
+    参数:
+        servers: asyncio.Server 或 DatagramTransport 列表
+    """
+    for server in servers:
+        try:
+            server.close()
+            # DNS 转发器是 DatagramTransport,没有 wait_closed,
+            # 让出一次事件循环使套接字真正关闭,以便重连后重新绑定端口
+            if hasattr(server, 'wait_closed'):
+                await server.wait_closed()
+            else:
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.debug(f"关闭本地监听器失败: {e}")
+    servers.clear()
+
+
 def main():
     """
     主函数 - 解析命令行参数并启动客户端
@@ -1515,6 +2931,9 @@ def main():
         --server: 服务器域名 (TLS 需要 FQDN)
         --server-port: 服务器端口
         --socks-port, -p: SOCKS5 代理端口
+        --http-port: HTTP 代理端口 (0 表示禁用)
+        --transparent-port: 透明代理端口 (0 表示禁用)
+        --dns-port: 本地 DNS 转发端口 (0 表示禁用)
         --username, -u: 认证用户名
         --secret, -s: 认证密钥
         --ca-cert: CA 证书路径
@@ -1526,6 +2945,13 @@ def main():
     parser.add_argument('--server', default=None, help='服务器域名 (TLS 需要完全限定域名)')
     parser.add_argument('--server-port', type=int, default=None, help='服务器端口')
     parser.add_argument('--socks-port', '-p', type=int, default=None, help='SOCKS5 代理端口')
+    parser.add_argument('--http-port', type=int, default=None, help='HTTP 代理端口 (0 表示禁用)')
+    parser.add_argument('--transparent-port', type=int, default=None,
+                        help='透明代理端口,配合 iptables REDIRECT 使用 (0 表示禁用)')
+    parser.add_argument('--dns-port', type=int, default=None,
+                        help='本地 DNS 转发端口,查询经隧道在服务器端解析 (0 表示禁用)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='指标 HTTP 端口 (0 表示禁用)')
     parser.add_argument('--username', '-u', default=None, help='认证用户名')
     parser.add_argument('--secret', '-s', default=None, help='认证密钥')
     parser.add_argument('--ca-cert', default=None, help='CA 证书路径')
@@ -1547,6 +2973,14 @@ def main():
         config_data = {}
 
     client_conf = config_data.get('client', {})
+    try:
+        performance = parse_performance_config(config_data.get('performance'))
+    except ValueError as e:
+        logger.error(f"performance 配置无效: {e}")
+        return 1
+    moved = [name for name in MOVED_PERFORMANCE_KEYS if name in client_conf]
+    if moved:
+        logger.warning(f"client 段中的 {', '.join(moved)} 已移到 performance 段，此处的设置被忽略")
 
     # 创建客户端配置 - 命令行参数优先于配置文件
     config = ClientConfig(
@@ -1554,8 +2988,31 @@ def main():
         server_port=args.server_port or client_conf.get('server_port', 587),
         socks_port=args.socks_port or client_conf.get('socks_port', 1080),
         socks_host=client_conf.get('socks_host', '127.0.0.1'),
+        http_proxy_port=(args.http_port if args.http_port is not None
+                         else client_conf.get('http_proxy_port', 0)),
+        http_proxy_host=client_conf.get('http_proxy_host', '127.0.0.1'),
+        transparent_port=(args.transparent_port if args.transparent_port is not None
+                          else client_conf.get('transparent_port', 0)),
+        transparent_host=client_conf.get('transparent_host', '127.0.0.1'),
+        dns_port=(args.dns_port if args.dns_port is not None
+                  else client_conf.get('dns_port', 0)),
+        dns_host=client_conf.get('dns_host', '127.0.0.1'),
+        compression=client_conf.get('compression', False),
+        inner_encryption=client_conf.get('inner_encryption', False),
+        crypto_threads=client_conf.get('crypto_threads', 0),
+        keepalive_interval=client_conf.get('keepalive_interval', 5.0),
+        keepalive_misses=client_conf.get('keepalive_misses', 3),
+        metrics_port=(args.metrics_port if args.metrics_port is not None
+                      else client_conf.get('metrics_port', 0)),
+        metrics_host=client_conf.get('metrics_host', '127.0.0.1'),
+        metrics_socket=client_conf.get('metrics_socket', ''),
         username=args.username or client_conf.get('username', ''),
         secret=args.secret or client_conf.get('secret', ''),
+        stealth_enabled=(config_data.get('stealth') or {}).get('enabled', False),
+        stealth=parse_stealth_config(config_data.get('stealth')),
+        transport=client_conf.get('transport', TRANSPORT_BINARY),
+        data_poll_interval=client_conf.get('data_poll_interval', 0.2),
+        performance=performance,
     )
 
     # 获取 CA 证书路径
@@ -1570,6 +3027,10 @@ def main():
         logger.error("未配置密钥!")
         return 1
 
+    if config.transport not in (TRANSPORT_BINARY, TRANSPORT_DATA, TRANSPORT_BDAT):
+        logger.error(f"未知的传输方式: {config.transport}")
+        return 1
+
     logger.info(f"客户端配置: 服务器={config.server_host}:{config.server_port}, "
                 f"SOCKS5={config.socks_host}:{config.socks_port}, 用户名={config.username}")
 
@@ -12,21 +12,35 @@ import hashlib
 import hmac
 import os
 import base64
+import binascii
 import time
 import re
 import ipaddress
 import logging
-from enum import IntEnum
+import math
+import stat
+import zlib
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, List, Tuple, Dict
+from typing import Optional, List, Tuple, Dict, Union
 from datetime import datetime, timezone
 
 import yaml
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
 
+# 可选依赖: 安装 zstandard 后优先使用 zstd 压缩
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 # ============================================================================
 # 协议常量
@@ -36,126 +50,1079 @@ PROTOCOL_VERSION = 1  # 协议版本号
 MAX_PAYLOAD_SIZE = 65535  # 最大负载大小
 NONCE_SIZE = 12  # 随机数（nonce）大小
 TAG_SIZE = 16  # 认证标签大小
+SEAL_RECORD_HEADER = struct.Struct('>I')  # 内层加密记录头: 密文长度（含认证标签）
+SEAL_RECORD_MAX = 65536  # 内层加密每条记录的最大明文字节数
+SEAL_SALT_SIZE = 16  # 内层加密每方提供的会话随机数字节数
+SEAL_INFLIGHT_MAX = 16  # 每个会话在加密线程池中排队的记录上限（超过时 drain() 等待）
+
+# 帧类型（二进制模式，帧头见下方 FRAME_HEADER）
+FRAME_DATA = 0x01  # 数据帧
+FRAME_CONNECT = 0x02  # 连接帧: 主机长度(1) + 主机名 + 端口(2)
+FRAME_CONNECT_OK = 0x03  # 连接成功帧
+FRAME_CONNECT_FAIL = 0x04  # 连接失败帧，载荷为拒绝原因
+FRAME_CLOSE = 0x05  # 关闭帧
+FRAME_PING = 0x06  # 保活请求帧（载荷由发送方定义，对端原样回显）
+FRAME_PONG = 0x07  # 保活响应帧
+FRAME_DNS_QUERY = 0x08  # DNS 查询帧（通道ID字段为查询标签）
+FRAME_DNS_RESPONSE = 0x09  # DNS 响应帧，空载荷表示服务器查询失败
+FRAME_DATA_Z = 0x0A  # 压缩数据帧，载荷为通道压缩流的一段
+FRAME_HALF_CLOSE = 0x0B  # 半关闭帧: 发送方向已结束（TCP FIN），另一方向继续
+FRAME_PADDING = 0x0C  # 填充帧（隐蔽模式），接收方直接丢弃
+
+
+# ============================================================================
+# 隧道扩展能力协商
+# ============================================================================
+
+# 服务端在 TLS 之后的 EHLO 响应中以 "250-X-TUNNEL 能力..." 通告支持的扩展,
+# 客户端在 BINARY 命令中请求其中的一部分 ("BINARY 能力..."),
+# 服务端在 299 响应末尾回显最终启用的扩展。旧版本客户端只发送 "BINARY",
+# 旧版本服务端不通告 X-TUNNEL,双方都退回到基础二进制协议
+TUNNEL_EHLO_KEYWORD = 'X-TUNNEL'
+BINARY_OK_LINE = '299 Binary mode activated'
+
+CAP_DNS = 'DNS'  # 通过隧道转发 DNS 查询
+CAP_COMPRESS = 'COMPRESS'  # 按通道压缩 DATA 帧，参数为算法列表
+CAP_PING = 'PING'  # PING/PONG 保活帧，用于测量 RTT 和检测失效连接
+CAP_HALF_CLOSE = 'HALFCLOSE'  # HALF_CLOSE 帧，单方向传递 TCP FIN
+CAP_PADDING = 'PADDING'  # 能识别并丢弃 PADDING 帧，对端可以启用隐蔽整形
+CAP_SEAL = 'SEAL'  # 二进制模式的内层加密，参数为本方的会话随机数（十六进制），见 BatchSealer
+CAP_MAIL_DATA = 'MAILDATA'  # DATA 传输模式: 帧放在真实的 MAIL/RCPT/DATA 事务中传输（见下）
+CAP_MAIL_BDAT = 'MAILBDAT'  # BDAT 传输模式: 同上，但上行用 BDAT 分块（RFC 3030）发送原始字节
+
+# DATA 传输模式
+# 客户端认证后不发送 BINARY，而是直接开始邮件事务（MAIL FROM / RCPT TO / DATA 流水线发送）。
+# 上行帧流以 base64 附件的形式放在邮件正文中；服务端在 DATA 结束后的 250 多行响应中
+# 以 "250-" + base64 行的形式返回下行帧流。第一封邮件不带帧，邮件头 X-Tunnel-Capabilities
+# 携带客户端请求的能力，服务端在响应的 "250-X-TUNNEL ..." 行中回显启用的能力。
+# 客户端空闲时按间隔发送空邮件轮询下行数据
+#
+# BDAT 传输模式与 DATA 传输模式相同，只是邮件以 BODY=BINARYMIME 声明、用 BDAT 块发送:
+# 邮件头一块，附件正文（Content-Transfer-Encoding: binary，即原始帧流）按 pad_to_sizes 分块，
+# 结束边界作为 LAST 块。上行没有 base64 开销；下行仍在 LAST 块的 250 响应中以 base64 返回
+MAIL_CAPABILITIES_HEADER = 'X-Tunnel-Capabilities'
+MAIL_MESSAGE_MAX = 1024 * 1024  # 每封邮件 / 每个响应携带的最大帧字节数
+
+
+def parse_capabilities(text: str) -> Dict[str, List[str]]:
+    """
+    解析能力列表
+
+    参数:
+        text: 空格分隔的能力,形如 "DNS COMPRESS=zstd,zlib"
 
-# 消息类型枚举
-class MsgType(IntEnum):
-    DATA = 0x01           # 隧道数据
-    CONNECT = 0x02        # 打开新通道（SOCKS CONNECT）
-    CONNECT_OK = 0x03     # 连接已建立
-    CONNECT_FAIL = 0x04   # 连接失败
-    CLOSE = 0x05          # 关闭通道
-    KEEPALIVE = 0x06      # 保持连接活跃
-    KEEPALIVE_ACK = 0x07  # 保活响应
+    返回:
+        {能力名: 参数列表} 字典,能力名统一为大写
+    """
+    caps = {}
+    for token in text.split():
+        name, _, values = token.partition('=')
+        caps[name.upper()] = [v for v in values.split(',') if v]
+    return caps
+
+
+def format_capabilities(caps: Dict[str, List[str]]) -> str:
+    """
+    将能力字典格式化为空格分隔的文本 (parse_capabilities 的逆操作)
+
+    参数:
+        caps: {能力名: 参数列表} 字典
+
+    返回:
+        能力文本
+    """
+    parts = []
+    for name, values in caps.items():
+        parts.append(f"{name}={','.join(values)}" if values else name)
+    return ' '.join(parts)
 
 
 # ============================================================================
-# 隧道协议消息
+# 通道压缩
 # ============================================================================
 
-@dataclass
-class TunnelMessage:
-    """
-    用于多路复用隧道流量的二进制协议
-
-    线路格式（加密前）:
-    ┌─────────┬────────────┬────────────┬──────────────┬─────────────┐
-    │ 版本号  │ 消息类型   │ 通道ID     │ 负载长度     │    负载     │
-    │ 1 字节  │  1 字节    │  2 字节    │  2 字节      │   可变长度   │
-    └─────────┴────────────┴────────────┴──────────────┴─────────────┘
-    """
-    msg_type: MsgType  # 消息类型
-    channel_id: int  # 通道ID
-    payload: bytes  # 负载数据
-
-    HEADER_SIZE = 6  # 头部大小：1(版本) + 1(类型) + 2(通道ID) + 2(负载长度)
-
-    def serialize(self) -> bytes:
-        """将消息序列化为字节"""
-        # 使用大端序打包头部：版本、类型、通道ID、负载长度
-        header = struct.pack(
-            '>BBHH',
-            PROTOCOL_VERSION,
-            self.msg_type,
-            self.channel_id,
-            len(self.payload)
+# 本机可用的压缩算法（按优先级排列）
+COMPRESSION_ALGORITHMS = (['zstd'] if zstandard else []) + ['zlib']
+
+
+def choose_compression(requested: List[str], available: List[str] = None) -> Optional[str]:
+    """
+    从对方请求的算法列表中选择第一个本机支持的算法
+
+    参数:
+        requested: 对方按优先级排列的算法列表
+        available: 本机支持的算法，默认为 COMPRESSION_ALGORITHMS
+
+    返回:
+        选中的算法名，没有共同算法时返回 None
+    """
+    available = COMPRESSION_ALGORITHMS if available is None else available
+    for algorithm in requested:
+        if algorithm in available:
+            return algorithm
+    return None
+
+
+def shannon_entropy(sample: bytes) -> float:
+    """
+    计算字节序列的香农熵
+
+    返回:
+        每字节的比特数 (0-8)，加密和已压缩数据接近 8
+    """
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(n / total * math.log2(n / total) for n in Counter(sample).values())
+
+
+class ChannelCompressor:
+    """
+    单通道流式压缩器
+
+    每个通道一个压缩上下文，每块数据以同步刷新结束，对端可以立即解压。
+    通道开头的数据先以原样发送并采样，采样足够后根据熵决定是否压缩:
+    TLS、图片、视频等高熵数据直接旁路，不浪费 CPU。
+    压缩后的比率如果一直很差也会切换到旁路，之后的数据原样发送
+    （每块都已同步刷新，切换不影响对端的解压上下文）。
+    """
+
+    SAMPLE_SIZE = 4096         # 熵采样字节数
+    MIN_SAMPLE_SIZE = 1024     # 做出决定所需的最少采样字节数
+    ENTROPY_THRESHOLD = 7.2    # 超过该熵（比特/字节）视为不可压缩
+    RATIO_CHECK_BYTES = 65536  # 每压缩这么多字节检查一次该窗口的压缩比率
+    MIN_USEFUL_RATIO = 0.9     # 压缩后/压缩前超过该值则旁路
+
+    def __init__(self, algorithm: str):
+        """
+        初始化压缩器
+
+        参数:
+            algorithm: 'zstd' 或 'zlib'
+        """
+        self.algorithm = algorithm
+        self.state = 'sampling'  # sampling / compress / bypass
+        self._sample = bytearray()
+        self._ctx = None
+        self.entropy: Optional[float] = None
+        # 统计
+        self.bytes_in = 0   # 进入压缩器的字节数
+        self.bytes_out = 0  # 压缩后的字节数
+        self.cpu_time = 0.0  # 压缩耗费的 CPU 时间（秒）
+        self._window_in = 0
+        self._window_out = 0
+
+    def _create_context(self):
+        """创建流式压缩上下文（窗口较小以控制每通道内存）"""
+        if self.algorithm == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compressobj()
+        return zlib.compressobj(1, zlib.DEFLATED, -13, 6)
+
+    def compress(self, data: bytes) -> Optional[bytes]:
+        """
+        压缩一块通道数据
+
+        参数:
+            data: 原始数据
+
+        返回:
+            压缩后的数据（以压缩数据帧发送），返回 None 表示原样发送
+        """
+        if self.state == 'bypass':
+            return None
+        if self.state == 'sampling':
+            self._sample += data[:self.SAMPLE_SIZE - len(self._sample)]
+            if len(self._sample) < self.MIN_SAMPLE_SIZE:
+                return None
+            self.entropy = shannon_entropy(bytes(self._sample))
+            self._sample = None
+            if self.entropy > self.ENTROPY_THRESHOLD:
+                self.state = 'bypass'
+                return None
+            self.state = 'compress'
+            self._ctx = self._create_context()
+
+        start = time.thread_time()
+        if self.algorithm == 'zstd':
+            out = self._ctx.compress(data) + self._ctx.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        else:
+            out = self._ctx.compress(data) + self._ctx.flush(zlib.Z_SYNC_FLUSH)
+        self.cpu_time += time.thread_time() - start
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+
+        # 流量中途变为不可压缩（例如开始传输已压缩的文件）时切换到旁路
+        self._window_in += len(data)
+        self._window_out += len(out)
+        if self._window_in >= self.RATIO_CHECK_BYTES:
+            if self._window_out > self._window_in * self.MIN_USEFUL_RATIO:
+                self.state = 'bypass'
+                self._ctx = None
+            self._window_in = self._window_out = 0
+        return out
+
+    @property
+    def ratio(self) -> float:
+        """压缩比率（压缩后/压缩前，越小越好）"""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    def stats(self) -> dict:
+        """返回压缩统计"""
+        return {
+            'algorithm': self.algorithm,
+            'state': self.state,
+            'entropy': self.entropy,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.ratio,
+            'cpu_time': self.cpu_time,
+        }
+
+
+class _ZstdInputExhausted(Exception):
+    """zstd 输入端已没有数据（本帧已全部交给读取器）"""
+
+
+class _ZstdInput:
+    """zstd stream_reader 的输入端: 每帧放入压缩数据，读取器从这里取走"""
+
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = b''
+
+    def read(self, size: int = -1) -> bytes:
+        # 不能返回空数据: 读取器收到空数据会认为输入结束，之后的帧无法解压
+        if not self.data:
+            raise _ZstdInputExhausted()
+        if size < 0 or size >= len(self.data):
+            data, self.data = self.data, b''
+        else:
+            data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+class ChannelDecompressor:
+    """
+    单通道流式解压器，与 ChannelCompressor 对应
+
+    每帧的解压输出在解压过程中就限制在 MAX_OUTPUT_SIZE 以内，超过时停止解压并报错，
+    不会先分配完整的输出再检查: zlib 用 max_length；zstd 的 decompressobj 没有输出上限，
+    改用 stream_reader 把输出写入一个 MAX_OUTPUT_SIZE + 1 字节的缓冲区。
+    这个缓冲区所有通道共用（解压只在事件循环线程中进行），第一次解压 zstd 数据时分配。
+    """
+
+    MAX_OUTPUT_SIZE = 4 * 1024 * 1024  # 单帧最大解压输出，防止解压炸弹
+    ZSTD_MAX_WINDOW_SIZE = 8 * 1024 * 1024  # zstd 窗口上限（本端压缩级别 3 的窗口为 2 MiB）
+    _zstd_output: Optional[memoryview] = None  # zstd 解压输出缓冲区（所有通道共用）
+
+    def __init__(self, algorithm: str):
+        """
+        初始化解压器
+
+        参数:
+            algorithm: 'zstd' 或 'zlib'
+        """
+        self.algorithm = algorithm
+        if algorithm == 'zstd':
+            # 读取器每次从输入端取一帧（负载不超过 MAX_PAYLOAD_SIZE），解压上下文跨帧保留
+            self._input = _ZstdInput()
+            self._ctx = zstandard.ZstdDecompressor(max_window_size=self.ZSTD_MAX_WINDOW_SIZE).stream_reader(
+                self._input, read_size=MAX_PAYLOAD_SIZE + 1)
+        else:
+            self._ctx = zlib.decompressobj(-13)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        解压一帧数据
+
+        异常:
+            ValueError: 数据损坏或解压输出超过限制
+        """
+        start = time.thread_time()
+        try:
+            if self.algorithm == 'zstd':
+                out = self._decompress_zstd(data)
+            else:
+                out = self._ctx.decompress(data, self.MAX_OUTPUT_SIZE)
+                if self._ctx.unconsumed_tail:
+                    raise ValueError("解压输出超过限制")
+        except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as e:
+            raise ValueError(f"解压失败: {e}")
+        finally:
+            self.cpu_time += time.thread_time() - start
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        return out
+
+    def _decompress_zstd(self, data: bytes) -> bytes:
+        """
+        解压一帧 zstd 数据，输出达到 MAX_OUTPUT_SIZE + 1 字节时停止
+
+        readinto1() 先输出已解压的数据，没有可输出的数据时才向输入端取数据；
+        输入端为空时抛出 _ZstdInputExhausted，说明这一帧已全部解压（包括只含半个块的帧）。
+        """
+        output = ChannelDecompressor._zstd_output
+        if output is None:
+            output = ChannelDecompressor._zstd_output = memoryview(bytearray(self.MAX_OUTPUT_SIZE + 1))
+        self._input.data = data
+        length = 0
+        try:
+            while True:
+                length += self._ctx.readinto1(output[length:])
+                if length > self.MAX_OUTPUT_SIZE:
+                    self._input.data = b''
+                    raise ValueError("解压输出超过限制")
+        except _ZstdInputExhausted:
+            pass
+        return bytes(output[:length])
+
+
+def format_compression_stats(compressor: Optional[ChannelCompressor],
+                             decompressor: Optional[ChannelDecompressor]) -> str:
+    """
+    格式化单通道的压缩统计，用于通道关闭时的日志
+
+    返回:
+        统计文本，通道未启用压缩时返回空字符串
+    """
+    if not compressor and not decompressor:
+        return ''
+    parts = []
+    if compressor:
+        entropy = f"{compressor.entropy:.2f}" if compressor.entropy is not None else '-'
+        parts.append(
+            f"发送 {compressor.algorithm}/{compressor.state} 熵={entropy} "
+            f"{compressor.bytes_in}->{compressor.bytes_out} 字节 "
+            f"比率={compressor.ratio:.2f} CPU={compressor.cpu_time * 1000:.1f}ms"
+        )
+    if decompressor and decompressor.bytes_in:
+        parts.append(
+            f"接收 {decompressor.bytes_in}->{decompressor.bytes_out} 字节 "
+            f"CPU={decompressor.cpu_time * 1000:.1f}ms"
         )
-        return header + self.payload
+    return ', '.join(parts)
+
+
+# ============================================================================
+# 运行指标（Prometheus 文本格式）
+# ============================================================================
+
+# 默认的延迟直方图桶（秒）
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_metric_value(value) -> str:
+    """格式化指标值"""
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
 
-    @classmethod
-    def deserialize(cls, data: bytes) -> Tuple['TunnelMessage', bytes]:
+def _escape_label_value(value: str) -> str:
+    """转义标签值中的反斜杠、双引号和换行"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    """格式化标签集合，例如 {user="alice",le="0.5"}"""
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class CounterValue:
+    """单个计数器序列，热路径上只做一次整数加法"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """增加计数"""
+        self.value += amount
+
+
+class GaugeValue:
+    """单个仪表序列"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """增加"""
+        self.value += amount
+
+    def dec(self, amount=1):
+        """减少"""
+        self.value -= amount
+
+    def set(self, value):
+        """设置为指定值"""
+        self.value = value
+
+
+class HistogramValue:
+    """单个直方图序列，每次观测只更新预分配的桶计数"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """记录一次观测值"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(ABC):
+    """
+    指标族: 名称、说明和标签名相同的一组序列
+
+    带标签的序列应在会话或通道建立时用 labels() 取出并保存，
+    之后直接更新序列对象，热路径上没有字典查找和对象分配。
+    不带标签的指标族可以直接调用 inc()/set()/observe()，
+    也可以用 set_function() 在采集时读取现有状态（如字典长度），完全不占用热路径。
+    """
+
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._function = None
+        if not self.labelnames:
+            self._default = self.labels()
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一个新的序列对象（CounterValue、GaugeValue 或 HistogramValue）"""
+
+    def labels(self, *values) -> object:
+        """
+        取得（必要时创建）指定标签值的序列
+
+        参数:
+            values: 与 labelnames 一一对应的标签值
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def set_function(self, function):
+        """
+        采集时调用 function() 取值（仅用于不带标签的计数器和仪表）
+
+        参数:
+            function: 无参数函数，返回当前值；传入 None 取消
+        """
+        if self.labelnames:
+            raise ValueError(f"带标签的指标 {self.name} 不支持函数取值")
+        self._function = function
+
+    def __getattr__(self, attr):
+        # 不带标签的指标族把 inc/set/observe 等调用转给默认序列
+        if attr.startswith('_') or '_default' not in self.__dict__:
+            raise AttributeError(attr)
+        return getattr(self._default, attr)
+
+    def collect(self) -> List[str]:
+        """生成该指标族的文本格式行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        if self._function is not None:
+            try:
+                value = self._function()
+                if value is not None:  # None 表示暂无数据，省略该样本
+                    lines.append(f"{self.name} {_format_metric_value(value)}")
+            except Exception:
+                pass  # 取值失败时省略该样本
+            return lines
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} "
+                         f"{_format_metric_value(child.value)}")
+        return lines
+
+
+class CounterMetric(Metric):
+    """单调递增的计数器"""
+
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return CounterValue()
+
+
+class GaugeMetric(Metric):
+    """可增可减的仪表"""
+
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return GaugeValue()
+
+
+class HistogramMetric(Metric):
+    """分桶直方图"""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = f'le="{_format_metric_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_metric_value(float(child.sum))}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，负责创建指标并输出 Prometheus 文本格式"""
+
+    def __init__(self, prefix: str = ''):
         """
-        从字节反序列化消息
-        返回: (消息对象, 剩余字节)
+        初始化注册表
+
+        参数:
+            prefix: 所有指标名的前缀，例如 'smtp_tunnel_'
         """
-        if len(data) < cls.HEADER_SIZE:
-            raise ValueError("数据不足，无法解析头部")
+        self.prefix = prefix
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"指标已注册: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> CounterMetric:
+        """注册计数器"""
+        return self._register(CounterMetric(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> GaugeMetric:
+        """注册仪表"""
+        return self._register(GaugeMetric(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> HistogramMetric:
+        """注册直方图"""
+        return self._register(HistogramMetric(self.prefix + name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """输出所有指标的 Prometheus 文本格式"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
 
-        # 解包头部信息
-        version, msg_type, channel_id, payload_len = struct.unpack(
-            '>BBHH', data[:cls.HEADER_SIZE]
+
+def register_process_metrics(registry: MetricsRegistry):
+    """
+    注册进程级指标（CPU 时间、常驻内存、打开的文件描述符）
+
+    使用 Prometheus 的标准名称，不带前缀；只读取标准库和 /proc 能提供的数据，
+    当前平台不支持的指标在采集时省略。
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        resource = None
+
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def resident_memory():
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def open_fds():
+        return len(os.listdir('/proc/self/fd'))
+
+    prefix, registry.prefix = registry.prefix, ''
+    try:
+        if resource:
+            registry.counter('process_cpu_seconds_total', '进程用户态和内核态 CPU 时间').set_function(cpu_seconds)
+        if os.path.exists('/proc/self/statm'):
+            registry.gauge('process_resident_memory_bytes', '进程常驻内存').set_function(resident_memory)
+            registry.gauge('process_open_fds', '进程打开的文件描述符数').set_function(open_fds)
+    finally:
+        registry.prefix = prefix
+
+
+async def _serve_metrics_request(registry: MetricsRegistry, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+    """处理一次指标 HTTP 请求（GET /metrics）"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=5.0)
+        parts = head.split(b'\r\n', 1)[0].split()
+        method = parts[0] if parts else b''
+        path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else b''
+        if method not in (b'GET', b'HEAD'):
+            status, body = '405 Method Not Allowed', b''
+        elif path != b'/metrics':
+            status, body = '404 Not Found', b''
+        else:
+            status, body = '200 OK', registry.render().encode('utf-8')
+        writer.write(
+            f"HTTP/1.0 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('ascii')
+            + (body if method == b'GET' else b'')
         )
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 0,
+                               path: str = '') -> asyncio.AbstractServer:
+    """
+    启动指标 HTTP 监听器
+
+    参数:
+        registry: 指标注册表
+        host: 监听地址（建议只监听本地或内网地址）
+        port: 监听端口
+        path: Unix 套接字路径；设置后忽略 host/port，在该套接字上提供同样的 HTTP 接口
+
+    返回:
+        asyncio 服务器对象
+    """
+    handler = lambda r, w: _serve_metrics_request(registry, r, w)
+    if path:
+        # 清理上次运行遗留的套接字文件
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        return await asyncio.start_unix_server(handler, path)
+    return await asyncio.start_server(handler, host, port)
+
+
+# ============================================================================
+# 保活与 RTT 估计
+# ============================================================================
+
+class KeepaliveMonitor:
+    """
+    PING/PONG 保活状态
+
+    每个间隔调用一次 tick() 并发送 make_ping() 生成的 PING，对端原样回显为 PONG。
+    一个间隔内收到任何数据都说明连接仍然活着（繁忙时 PONG 可能排在数据后面），
+    连续 max_missed 个间隔既没有数据也没有 PONG 时判定对端失效。
+    RTT 按 RFC 6298 做指数平滑。
+    """
+
+    PING_PAYLOAD = struct.Struct('>Q')  # 发送方的单调时钟（纳秒），对端原样回显
+
+    def __init__(self, interval: float = 5.0, max_missed: int = 3):
+        """
+        初始化保活状态
 
-        # 验证协议版本
-        if version != PROTOCOL_VERSION:
-            raise ValueError(f"未知的协议版本: {version}")
-
-        # 检查数据是否完整
-        total_len = cls.HEADER_SIZE + payload_len
-        if len(data) < total_len:
-            raise ValueError("数据不足，无法解析负载")
-
-        # 提取负载数据和剩余字节
-        payload = data[cls.HEADER_SIZE:total_len]
-        remaining = data[total_len:]
-
-        return cls(MsgType(msg_type), channel_id, payload), remaining
-
-    @classmethod
-    def data(cls, channel_id: int, data: bytes) -> 'TunnelMessage':
-        """创建数据消息"""
-        return cls(MsgType.DATA, channel_id, data)
-
-    @classmethod
-    def connect(cls, channel_id: int, host: str, port: int) -> 'TunnelMessage':
-        """创建连接消息"""
-        # 负载格式: 主机长度(1字节) + 主机名 + 端口(2字节)
-        host_bytes = host.encode('utf-8')
-        payload = struct.pack('>B', len(host_bytes)) + host_bytes + struct.pack('>H', port)
-        return cls(MsgType.CONNECT, channel_id, payload)
-
-    @classmethod
-    def connect_ok(cls, channel_id: int) -> 'TunnelMessage':
-        """创建连接成功消息"""
-        return cls(MsgType.CONNECT_OK, channel_id, b'')
-
-    @classmethod
-    def connect_fail(cls, channel_id: int, reason: str = '') -> 'TunnelMessage':
-        """创建连接失败消息"""
-        return cls(MsgType.CONNECT_FAIL, channel_id, reason.encode('utf-8'))
-
-    @classmethod
-    def close(cls, channel_id: int) -> 'TunnelMessage':
-        """创建关闭通道消息"""
-        return cls(MsgType.CLOSE, channel_id, b'')
-
-    @classmethod
-    def keepalive(cls) -> 'TunnelMessage':
-        """创建保活消息"""
-        return cls(MsgType.KEEPALIVE, 0, b'')
-
-    @classmethod
-    def keepalive_ack(cls) -> 'TunnelMessage':
-        """创建保活响应消息"""
-        return cls(MsgType.KEEPALIVE_ACK, 0, b'')
-
-    def parse_connect(self) -> Tuple[str, int]:
-        """解析连接消息负载，获取主机和端口"""
-        if self.msg_type != MsgType.CONNECT:
-            raise ValueError("不是连接消息")
-        host_len = self.payload[0]
-        host = self.payload[1:1+host_len].decode('utf-8')
-        port = struct.unpack('>H', self.payload[1+host_len:3+host_len])[0]
-        return host, port
+        参数:
+            interval: PING 间隔（秒）
+            max_missed: 判定失效的连续无响应间隔数
+        """
+        self.interval = interval
+        self.max_missed = max_missed
+        self.activity = False     # 本间隔内是否收到过数据（由读取循环设置）
+        self.outstanding = False  # 是否有未回应的 PING
+        self.missed = 0
+        self.srtt: Optional[float] = None    # 平滑 RTT（秒）
+        self.rttvar: Optional[float] = None  # RTT 偏差（秒）
+        self.last_rtt: Optional[float] = None
+
+    def make_ping(self) -> bytes:
+        """生成 PING 载荷并标记等待回应"""
+        self.outstanding = True
+        return self.PING_PAYLOAD.pack(time.monotonic_ns())
+
+    def tick(self) -> bool:
+        """
+        每个间隔调用一次
+
+        返回:
+            True 表示对端已失效
+        """
+        if self.activity:
+            self.missed = 0
+        elif self.outstanding:
+            self.missed += 1
+        self.activity = False
+        return self.missed >= self.max_missed
+
+    def on_pong(self, payload: bytes) -> Optional[float]:
+        """
+        处理 PONG，更新 RTT
+
+        返回:
+            本次 RTT（秒），载荷无效时返回 None
+        """
+        if len(payload) != self.PING_PAYLOAD.size:
+            return None
+        sent_ns, = self.PING_PAYLOAD.unpack(payload)
+        rtt = (time.monotonic_ns() - sent_ns) / 1e9
+        if rtt < 0:
+            return None
+        self.outstanding = False
+        self.missed = 0
+        self.last_rtt = rtt
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        return rtt
+
+    @property
+    def dead_after(self) -> float:
+        """最长的失效检测时间（秒）"""
+        return self.interval * (self.max_missed + 1)
+
+
+# ============================================================================
+# 隧道帧编解码
+# ============================================================================
+
+# 帧格式:
+# ┌──────────┬────────────┬────────────┬─────────────┐
+# │ 帧类型   │ 通道ID     │ 负载长度   │    负载     │
+# │ 1 字节   │  2 字节    │  2 字节    │   可变长度  │
+# └──────────┴────────────┴────────────┴─────────────┘
+FRAME_HEADER = struct.Struct('>BHH')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_FRAME_PAYLOAD = 0xFFFF
+
+
+def encode_frame(frame_type: int, channel_id: int, payload: bytes = b'') -> bytearray:
+    """
+    编码一个完整的帧（单次分配，适合控制帧和小负载）
+
+    参数:
+        frame_type: 帧类型
+        channel_id: 通道ID
+        payload: 负载
+
+    返回:
+        帧头 + 负载
+    """
+    frame = bytearray(FRAME_HEADER_SIZE + len(payload))
+    pack_frame_into(frame, 0, frame_type, channel_id, payload)
+    return frame
+
+
+def encode_frame_iov(frame_type: int, channel_id: int, payload: bytes = b'') -> Tuple[bytes, memoryview]:
+    """
+    分散/聚集编码: 返回 (帧头, 负载视图)，不拼接也不复制负载
+
+    配合 StreamWriter.writelines() 使用，TLS 传输会把两段依次交给 SSL 对象加密，
+    大的数据帧省去一次完整的负载复制。
+    """
+    return FRAME_HEADER.pack(frame_type, channel_id, len(payload)), memoryview(payload)
+
+
+def pack_frame_into(buffer, offset: int, frame_type: int, channel_id: int, payload: bytes = b'') -> int:
+    """
+    把帧写入预分配的缓冲区
+
+    参数:
+        buffer: 可写缓冲区（bytearray 或 memoryview），剩余空间需容纳整个帧
+        offset: 写入位置
+        frame_type: 帧类型
+        channel_id: 通道ID
+        payload: 负载
+
+    返回:
+        帧之后的位置
+    """
+    FRAME_HEADER.pack_into(buffer, offset, frame_type, channel_id, len(payload))
+    start = offset + FRAME_HEADER_SIZE
+    end = start + len(payload)
+    buffer[start:end] = payload
+    return end
+
+
+BUFFER_POOL_SIZES = (16384, 32768, 65536)  # 缓冲区池的负载大小分级（每个缓冲区另加帧头空间；32 KiB 是转发的初始读取大小）
+BUFFER_POOL_MAX_FREE = 32  # 每个大小分级最多保留的空闲缓冲区数
+BUFFER_POOL_MIN_PAYLOAD = 8192  # 更小的负载（控制帧、小数据帧）直接分配: 池的簿记比分配本身更贵
+
+
+class BufferPool:
+    """
+    帧缓冲区池
+
+    按大小分级保存固定大小的 bytearray，每个缓冲区在负载前预留帧头空间，
+    编码帧时复用而不是每帧重新分配。一个进程共享一个池（只在事件循环线程中使用）。
+
+    写入后缓冲区是否归还，只由写入方的类型和传输层的写缓冲决定:
+    - transport 为 None: 写入方在 write() 中复制数据（BatchSealer、FrameSpool、StealthScheduler），
+      写入返回后立即归还
+    - 直接写入传输层时传入 transport。传输层只在无法立即写出时保留数据（TCP 传输保留剩余部分的视图，
+      TLS 传输保留在写入积压中），这时 get_write_buffer_size() 大于 0。写入前已有积压时交出 bytes 副本，
+      缓冲区立即归还；写入前没有积压时交出视图，写入后仍没有积压才归还，否则不再归还，
+      由垃圾回收释放（计入 retained）
+    """
+
+    def __init__(self, sizes: Tuple[int, ...] = BUFFER_POOL_SIZES, max_free: int = BUFFER_POOL_MAX_FREE):
+        """
+        初始化缓冲区池
+
+        参数:
+            sizes: 负载大小分级（升序）
+            max_free: 每个分级最多保留的空闲缓冲区数
+        """
+        self.sizes = tuple(sorted(sizes))
+        self.max_free = max_free
+        self.free: Dict[int, List[bytearray]] = {size: [] for size in self.sizes}
+        self.hits = 0  # 从空闲列表取得缓冲区的次数
+        self.misses = 0  # 新分配缓冲区的次数（含超过最大分级的负载）
+        self.retained = 0  # 写入方仍持有、没有归还的缓冲区数
+        self.in_use = 0  # 已取出尚未归还的分级缓冲区数
+        self.high_water = 0  # in_use 的最大值
+
+    @property
+    def hit_rate(self) -> float:
+        """命中率 (0-1)"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def acquire(self, payload_size: int) -> bytearray:
+        """
+        取得能容纳 帧头 + payload_size 字节的缓冲区（长度是分级大小加帧头，不是请求的大小）
+
+        超过最大分级的负载分配独立的缓冲区，release() 时直接丢弃
+        """
+        for size in self.sizes:
+            if payload_size <= size:
+                break
+        else:
+            self.misses += 1
+            return bytearray(FRAME_HEADER_SIZE + payload_size)
+        self.in_use += 1
+        if self.in_use > self.high_water:
+            self.high_water = self.in_use
+        free = self.free[size]
+        if free:
+            self.hits += 1
+            return free.pop()
+        self.misses += 1
+        return bytearray(FRAME_HEADER_SIZE + size)
+
+    def release(self, buffer: bytearray):
+        """归还 acquire() 取得的缓冲区（调用方不能再持有它或它的视图）"""
+        free = self.free.get(len(buffer) - FRAME_HEADER_SIZE)
+        if free is None:
+            return
+        self.in_use -= 1
+        if len(free) < self.max_free:
+            free.append(buffer)
+
+    def write_frame(self, write, frame_type: int, channel_id: int, payload: bytes = b'',
+                    transport: Optional[asyncio.WriteTransport] = None) -> int:
+        """
+        把帧编码到池中的缓冲区，以一次 write() 交出，返回帧长度
+
+        参数:
+            write: 写入函数（writer.write、BatchSealer.write 或 StealthScheduler.send）
+            frame_type: 帧类型
+            channel_id: 通道ID
+            payload: 负载
+            transport: write 直接写入传输层时为该传输层，写入方复制数据时为 None
+        """
+        if len(payload) < BUFFER_POOL_MIN_PAYLOAD:
+            frame = encode_frame(frame_type, channel_id, payload)
+            write(frame)
+            return len(frame)
+        buffer = self.acquire(len(payload))
+        # 经视图写入负载是一次 memcpy，比 bytearray 的切片赋值快
+        with memoryview(buffer) as view:
+            end = pack_frame_into(view, 0, frame_type, channel_id, payload)
+        self.write_buffer(write, buffer, end, transport)
+        return end
+
+    def write_buffer(self, write, buffer: bytearray, end: int, transport: Optional[asyncio.WriteTransport] = None):
+        """
+        以一次 write() 交出 buffer[:end]（acquire() 取得、已经编码好的帧），按类说明中的规则归还
+
+        调用后不能再使用 buffer
+        """
+        view = memoryview(buffer)[:end]
+        if transport is not None and transport.get_write_buffer_size():
+            # 传输层已有积压，这次写入整段进入积压: 交出副本
+            write(bytes(view))
+        else:
+            write(view)
+            if transport is not None and transport.get_write_buffer_size():
+                # 传输层没有全部写出，可能保留了视图
+                self.retained += 1
+                if len(buffer) - FRAME_HEADER_SIZE in self.free:
+                    self.in_use -= 1
+                return
+        self.release(buffer)
+
+CHANNEL_READ_SIZE = 32768  # 每次读取通道数据的初始字节数，之后由 ReadSizeTuner 在配置的范围内调整
+READ_SIZE_MIN = 16384  # 通道读取大小的默认下限（缓冲区池的最小分级，更小的读取不省内存）
+READ_SIZE_MAX = 61440  # 通道读取大小的上限: DATA 帧负载最大 65535，留出压缩输出膨胀的余量
+TUNNEL_READ_SIZE_MIN = 65536  # 隧道连接每次读取的字节数下限
+TUNNEL_READ_SIZE_MAX = 262144  # 隧道连接每次读取的字节数上限（asyncio 传输层每次 recv 最多 256 KiB）
+READ_SIZE_GROW_AFTER = 4  # 连续多少次读满（且隧道没有积压）后加倍
+READ_SIZE_SHRINK_AFTER = 16  # 连续多少次读取不到四分之一后减半
+
+
+class ReadSizeTuner:
+    """
+    按最近的读取量调整每次读取的大小
+
+    连续 READ_SIZE_GROW_AFTER 次读满说明对端发送得比读取快（批量传输），加倍以减少读取和帧的次数；
+    隧道写缓冲积压时不加倍，更大的读取只会让积压更多。连续 READ_SIZE_SHRINK_AFTER 次读取不到
+    四分之一说明是交互式流量，减半以使用更小的缓冲区。大小始终在 [minimum, maximum] 内。
+
+    每个通道一个实例，另外每条隧道连接一个。gauge 是按读取大小统计通道数的带标签仪表（可选），
+    只在大小变化和 close() 时更新
+    """
+
+    __slots__ = ('size', 'minimum', 'maximum', 'full_reads', 'small_reads', 'gauge')
+
+    def __init__(self, minimum: int, maximum: int, initial: int, gauge: Optional[GaugeMetric] = None):
+        """
+        初始化
+
+        参数:
+            minimum: 读取大小下限
+            maximum: 读取大小上限
+            initial: 初始读取大小（限制在上下限之间）
+            gauge: 按读取大小统计的仪表，标签为 read_size
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = min(max(initial, minimum), maximum)
+        self.full_reads = 0
+        self.small_reads = 0
+        self.gauge = gauge
+        if gauge:
+            gauge.labels(self.size).inc()
+
+    def record(self, nbytes: int, congested: bool = False) -> bool:
+        """
+        记录一次读取
+
+        参数:
+            nbytes: 读到的字节数
+            congested: 隧道写缓冲是否积压
+
+        返回:
+            读取大小是否改变（调用方据此记录调试日志）
+        """
+        if nbytes >= self.size:
+            self.small_reads = 0
+            if congested:
+                self.full_reads = 0
+                return False
+            self.full_reads += 1
+            if self.full_reads >= READ_SIZE_GROW_AFTER and self.size < self.maximum:
+                return self._resize(min(self.size * 2, self.maximum))
+        elif nbytes * 4 < self.size:
+            self.full_reads = 0
+            self.small_reads += 1
+            if self.small_reads >= READ_SIZE_SHRINK_AFTER and self.size > self.minimum:
+                return self._resize(max(self.size // 2, self.minimum))
+        else:
+            self.full_reads = self.small_reads = 0
+        return False
+
+    def _resize(self, size: int) -> bool:
+        if self.gauge:
+            self.gauge.labels(self.size).dec()
+            self.gauge.labels(size).inc()
+        self.size = size
+        self.full_reads = self.small_reads = 0
+        return True
+
+    def close(self):
+        """通道关闭: 从仪表中移除（只调用一次）"""
+        if self.gauge:
+            self.gauge.labels(self.size).dec()
+            self.gauge = None
+
+
+class FrameDecoder:
+    """
+    从字节流中切分帧
+
+    接收缓冲区是带读取偏移的 bytearray: 解析帧只移动偏移，
+    已消费的前缀在累积过半时才整体移除，避免每帧重新复制剩余数据。
+    产出的负载是独立的 bytes，调用方可以长期持有（例如交给传输层缓冲）。
+    """
+
+    __slots__ = ('buffer', 'offset')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, data: bytes):
+        """追加接收到的数据"""
+        if self.offset and self.offset >= len(self.buffer) // 2:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def __iter__(self):
+        """依次产出 (帧类型, 通道ID, 负载)，数据不足一个完整帧时停止"""
+        buffer = self.buffer
+        unpack_from = FRAME_HEADER.unpack_from
+        while len(buffer) - self.offset >= FRAME_HEADER_SIZE:
+            frame_type, channel_id, length = unpack_from(buffer, self.offset)
+            start = self.offset + FRAME_HEADER_SIZE
+            end = start + length
+            if end > len(buffer):
+                break
+            self.offset = end
+            # 经 memoryview 只复制一次负载；视图必须在让出前释放，否则 feed() 无法调整缓冲区大小
+            with memoryview(buffer) as view:
+                payload = bytes(view[start:end])
+            yield frame_type, channel_id, payload
+
+    @property
+    def pending(self) -> int:
+        """尚未解析的字节数"""
+        return len(self.buffer) - self.offset
 
 
 # ============================================================================
@@ -348,25 +1315,295 @@ class TunnelCrypto:
                 logger.debug(f"认证: 用户 '{username}' 未找到")
                 return False, None
 
-            # 获取用户密钥
-            user_data = users[username]
-            if isinstance(user_data, UserConfig):
-                secret = user_data.secret
-            elif isinstance(user_data, dict):
-                secret = user_data.get('secret', '')
-            else:
-                secret = str(user_data)
+            # 获取用户密钥
+            user_data = users[username]
+            if isinstance(user_data, UserConfig):
+                secret = user_data.secret
+            elif isinstance(user_data, dict):
+                secret = user_data.get('secret', '')
+            else:
+                secret = str(user_data)
+
+            # 使用用户的密钥验证 HMAC
+            crypto = TunnelCrypto(secret)
+            expected_token = crypto.generate_auth_token(timestamp, username)
+            if hmac.compare_digest(token, expected_token):
+                return True, username
+            logger.debug(f"认证: 用户 '{username}' 的 HMAC 不匹配")
+            return False, None
+        except Exception as e:
+            logger.warning(f"认证: 异常 - {e}")
+            return False, None
+
+    def session_ciphers(self, salt: bytes) -> Tuple[ChaCha20Poly1305, ChaCha20Poly1305]:
+        """
+        为一个会话派生内层加密的密钥
+
+        参数:
+            salt: 客户端随机数 + 服务端随机数，每个会话的密钥都不同，
+                  因此计数器 nonce 每个会话从 0 开始也不会在同一密钥下重复
+
+        返回:
+            (发送密钥, 接收密钥) 元组
+        """
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=64,
+            salt=salt,
+            info=b'tunnel-seal-v1',
+            backend=default_backend(),
+        )
+        key_material = hkdf.derive(self.secret)
+        c2s_key, s2c_key = key_material[:32], key_material[32:]
+        if self.is_server:
+            return ChaCha20Poly1305(s2c_key), ChaCha20Poly1305(c2s_key)
+        return ChaCha20Poly1305(c2s_key), ChaCha20Poly1305(s2c_key)
+
+
+def seal_nonce(counter: int) -> bytes:
+    """内层加密的 nonce: 4 字节零 + 8 字节记录序号（不在线路上传输）"""
+    return counter.to_bytes(NONCE_SIZE, 'big')
+
+
+class CryptoOffload:
+    """
+    内层加密的线程池卸载
+
+    大批次的 AEAD 调用交给有界线程池执行，事件循环在加密期间继续处理其他会话的 I/O。
+    小于阈值的批次在事件循环中直接加密: 线程切换的开销比加密本身还大。
+    一个进程共享一个线程池，各会话的顺序由 BatchSealer / BatchOpener 按记录序号保证
+    """
+
+    def __init__(self, threads: int, threshold: int = 16384):
+        """
+        初始化线程池
+
+        参数:
+            threads: 加密线程数（至少 1）
+            threshold: 批次达到多少字节才交给线程池
+        """
+        self.threads = threads
+        self.threshold = threshold
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='seal')
+        self.offloaded = 0  # 交给线程池的记录数
+
+    def should_offload(self, size: int) -> bool:
+        """批次是否值得交给线程池"""
+        return size >= self.threshold
+
+    def run(self, func, *args) -> asyncio.Future:
+        """在线程池中执行 func(*args)"""
+        self.offloaded += 1
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def shutdown(self):
+        """关闭线程池（已提交的任务继续完成）"""
+        self.executor.shutdown(wait=False)
+
+
+class BatchSealer:
+    """
+    二进制模式的内层加密发送端（能力 SEAL）
+
+    TLS 在中间设备终结时仍保持端到端加密。包装连接的写入器:
+    同一轮事件循环中写入的帧合并成一条记录，只调用一次 AEAD，而不是每帧一次。
+    记录格式: 长度(4 字节，作为附加数据认证) + 密文 + 认证标签(16 字节)；
+    nonce 是纯计数器，不调用 os.urandom，也不占线路字节
+
+    配置了 CryptoOffload 时大批次在线程池中加密: 序号在提交时同步分配，
+    完成的记录按序号从队首依次写出，后面的批次即使先完成也要等待。
+    与 StealthScheduler 一样提供 write() / is_closing()，调用方用 drain() 代替原写入器的 drain()
+    """
+
+    def __init__(self, writer, cipher: ChaCha20Poly1305, offload: Optional[CryptoOffload] = None):
+        """
+        初始化发送端
+
+        参数:
+            writer: 隧道连接的写入器
+            cipher: 发送方向的密钥（TunnelCrypto.session_ciphers）
+            offload: 加密线程池（可选）
+        """
+        self.writer = writer
+        self.cipher = cipher
+        self.offload = offload
+        self.counter = 0  # 下一条记录的序号，也是已发送的记录数
+        self.sealed_bytes = 0  # 已加密的明文字节数
+        self.pending = bytearray()
+        self.scheduled = False
+        self.inflight: deque = deque()  # 按序号排队等待写出的记录: 线程池 Future 或已加密的 [记录头, 密文]
+
+    def write(self, data: bytes):
+        """追加数据，本轮事件循环结束时统一加密写出"""
+        self.pending += data
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def is_closing(self) -> bool:
+        return self.writer.is_closing()
+
+    def _seal(self, data: bytearray, start: int, end: int, counter: int) -> List[bytes]:
+        """把 data[start:end] 加密成序号为 counter 的记录，返回 [记录头, 密文]（可在线程池中执行）"""
+        header = SEAL_RECORD_HEADER.pack(end - start + TAG_SIZE)
+        with memoryview(data) as view:
+            return [header, self.cipher.encrypt(seal_nonce(counter), view[start:end], header)]
+
+    def flush(self):
+        """把待发数据加密成记录（超过 SEAL_RECORD_MAX 时拆分）并写出"""
+        self.scheduled = False
+        pending, self.pending = self.pending, bytearray()
+        if not pending or self.writer.is_closing():
+            return
+        offload = self.offload if self.offload and self.offload.should_offload(len(pending)) else None
+        records = []
+        for start in range(0, len(pending), SEAL_RECORD_MAX):
+            end = min(start + SEAL_RECORD_MAX, len(pending))
+            if offload:
+                # pending 已与 self.pending 分离，线程中读取期间不会被修改
+                future = offload.run(self._seal, pending, start, end, self.counter)
+                future.add_done_callback(self._write_completed)
+                records.append(future)
+            else:
+                records.append(self._seal(pending, start, end, self.counter))
+            self.counter += 1
+        self.sealed_bytes += len(pending)
+        if offload or self.inflight:
+            # 前面还有记录在线程池中: 排在它们之后写出
+            self.inflight.extend(records)
+            self._write_completed()
+            return
+        # 一次写入: TLS 传输对每段写入单独加密成记录
+        self.writer.write(b''.join(piece for record in records for piece in record))
+
+    def _write_completed(self, _future=None):
+        """从队首依次写出已加密的记录，遇到仍在加密的记录为止"""
+        inflight = self.inflight
+        pieces = []
+        while inflight and (isinstance(inflight[0], list) or inflight[0].done()):
+            record = inflight.popleft()
+            pieces.extend(record if isinstance(record, list) else record.result())
+        if pieces and not self.writer.is_closing():
+            self.writer.write(b''.join(pieces))
+
+    @property
+    def backlogged(self) -> bool:
+        """线程池中的记录是否超过 SEAL_INFLIGHT_MAX 条（此时 drain() 会等待）"""
+        return len(self.inflight) > SEAL_INFLIGHT_MAX
+
+    async def drain(self):
+        """等待线程池中的记录不超过 SEAL_INFLIGHT_MAX 条，再等待连接的写缓冲"""
+        while self.backlogged:
+            await asyncio.wait([self.inflight[0]])
+        await self.writer.drain()
+
+    async def join(self):
+        """写出待发数据并等待线程池中的记录全部写出（会话结束时调用）"""
+        self.flush()
+        while self.inflight:
+            await asyncio.wait([self.inflight[0]])
+
+
+class BatchOpener:
+    """
+    二进制模式的内层加密接收端
+
+    从字节流中切出记录，用期望的下一个序号作为 nonce 解密:
+    重放、乱序、丢弃或篡改的记录都无法通过认证，错误时抛出 ValueError，会话随之断开
+    """
+
+    def __init__(self, cipher: ChaCha20Poly1305, offload: Optional[CryptoOffload] = None):
+        """
+        初始化接收端
+
+        参数:
+            cipher: 接收方向的密钥（TunnelCrypto.session_ciphers）
+            offload: 加密线程池（可选，只用于 feed_async）
+        """
+        self.cipher = cipher
+        self.offload = offload
+        self.counter = 0
+        self.buffer = bytearray()
+
+    @property
+    def pending(self) -> int:
+        """缓存中尚未组成完整记录的字节数"""
+        return len(self.buffer)
+
+    def _take_records(self, data: bytes) -> Tuple[bytearray, list]:
+        """
+        追加密文并取走其中的完整记录
+
+        返回:
+            (记录所在的缓冲, [(序号, 记录头偏移, 密文起点, 密文终点), ...])；
+            返回的缓冲不再被修改，可以交给线程池读取
+        """
+        buffer = self.buffer
+        buffer += data
+        records = []
+        offset = 0
+        while len(buffer) - offset >= SEAL_RECORD_HEADER.size:
+            (length,) = SEAL_RECORD_HEADER.unpack_from(buffer, offset)
+            if not TAG_SIZE < length <= SEAL_RECORD_MAX + TAG_SIZE:
+                raise ValueError(f"内层加密记录长度无效: {length}")
+            start = offset + SEAL_RECORD_HEADER.size
+            if len(buffer) < start + length:
+                break
+            records.append((self.counter, offset, start, start + length))
+            self.counter += 1
+            offset = start + length
+        if offset == len(buffer):
+            self.buffer = bytearray()
+            return buffer, records
+        block = buffer[:offset]
+        del buffer[:offset]
+        return block, records
+
+    def _open(self, block: bytearray, counter: int, header: int, start: int, end: int) -> bytes:
+        """解密一条记录（可在线程池中执行）"""
+        with memoryview(block) as view:
+            try:
+                return self.cipher.decrypt(seal_nonce(counter), view[start:end], view[header:start])
+            except InvalidTag:
+                raise ValueError(f"内层加密记录 {counter} 认证失败（篡改、重放或乱序）")
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        输入一块密文
+
+        返回:
+            本块中完整记录解密出的明文（可能为空）
+
+        异常:
+            ValueError: 记录长度无效或认证失败
+        """
+        block, records = self._take_records(data)
+        return b''.join([self._open(block, *record) for record in records])
+
+    async def feed_async(self, data: bytes) -> bytes:
+        """
+        与 feed() 相同，但达到阈值的记录在线程池中解密（各记录并行，按序号拼接明文）
 
-            # 使用用户的密钥验证 HMAC
-            crypto = TunnelCrypto(secret)
-            expected_token = crypto.generate_auth_token(timestamp, username)
-            if hmac.compare_digest(token, expected_token):
-                return True, username
-            logger.debug(f"认证: 用户 '{username}' 的 HMAC 不匹配")
-            return False, None
-        except Exception as e:
-            logger.warning(f"认证: 异常 - {e}")
-            return False, None
+        异常:
+            ValueError: 记录长度无效或认证失败
+        """
+        offload = self.offload
+        if offload is None:
+            return self.feed(data)
+        block, records = self._take_records(data)
+        parts = []
+        try:
+            for record in records:
+                if offload.should_offload(record[3] - record[2]):
+                    parts.append(offload.run(self._open, block, *record))
+                else:
+                    parts.append(self._open(block, *record))
+            return b''.join([await part if isinstance(part, asyncio.Future) else part for part in parts])
+        except ValueError:
+            # 会话随之断开: 等待其余记录结束，取回它们的异常
+            await asyncio.gather(*[part for part in parts if isinstance(part, asyncio.Future)],
+                                 return_exceptions=True)
+            raise
 
 
 # ============================================================================
@@ -451,6 +1688,248 @@ class TrafficShaper:
         return os.urandom(size)
 
 
+def padded_size(length: int, pad_sizes: List[int]) -> int:
+    """
+    长度 length 的帧流补齐后的大小
+
+    取 pad_sizes（升序）中第一个至少能再容纳一个 PADDING 帧头的大小，超过最大值时取其整数倍；
+    恰好等于某个大小或最大值整数倍时不需要填充
+    """
+    largest = pad_sizes[-1]
+    if length in pad_sizes or length % largest == 0:
+        return length
+    for size in pad_sizes:
+        if length + FRAME_HEADER_SIZE <= size:
+            return size
+    return -(-(length + FRAME_HEADER_SIZE) // largest) * largest
+
+
+def pad_frames(data: bytes, target: int) -> bytearray:
+    """
+    在帧流 data 之后追加 PADDING 帧补齐到 target 字节
+
+    data 必须在帧边界结束，target - len(data) 为 0 或不小于一个帧头；
+    填充内容在 TLS 内，保持为零即可
+    """
+    length = len(data)
+    batch = bytearray(target)  # 一次分配，填充内容保持为零
+    batch[:length] = data
+    offset, gap = length, target - length
+    while gap:
+        payload_len = min(gap - FRAME_HEADER_SIZE, MAX_FRAME_PAYLOAD)
+        if 0 < gap - FRAME_HEADER_SIZE - payload_len < FRAME_HEADER_SIZE:
+            payload_len -= FRAME_HEADER_SIZE  # 剩余部分必须放得下下一个帧头
+        FRAME_HEADER.pack_into(batch, offset, FRAME_PADDING, 0, payload_len)
+        offset += FRAME_HEADER_SIZE + payload_len
+        gap -= FRAME_HEADER_SIZE + payload_len
+    return batch
+
+
+class StealthScheduler:
+    """
+    二进制模式的隐蔽输出级
+
+    TrafficShaper 对每条消息单独延迟并用 os.urandom 填充，启用后吞吐量无法接受。
+    这里改为按发送时隙批量输出:
+    - 帧先进入待发缓冲区，每个时隙（min_delay_ms 到 max_delay_ms 之间随机）合并发送一次
+    - 积累满最大填充大小的整块立即发送，大流量不等待时隙，只有尾部等待
+    - 每批用 PADDING 帧补齐到 pad_to_sizes 中的下一个大小（超过最大值时补齐到其整数倍），
+      填充内容在 TLS 内，用全零即可
+    - 虚假消息按预算调度: 每个时隙累积 dummy_message_probability 个额度，
+      只在空闲时隙花费，预算上限为 1，不会在繁忙之后集中发送
+
+    写入对象只需提供 write()，背压仍由调用方的 drain() 负责
+    """
+
+    def __init__(self, writer, config: 'StealthConfig', padding_counter: Optional[CounterValue] = None):
+        """
+        初始化隐蔽输出级
+
+        参数:
+            writer: 隧道连接的写入器
+            config: 隐蔽配置
+            padding_counter: 填充字节数指标（可选）
+        """
+        self.writer = writer
+        self.padding_counter = padding_counter
+        self.pad_sizes = sorted(size for size in config.pad_to_sizes if size > FRAME_HEADER_SIZE) or [16384]
+        self.min_delay = config.min_delay_ms / 1000.0
+        self.max_delay = max(config.max_delay_ms, config.min_delay_ms) / 1000.0
+        self.dummy_rate = config.dummy_message_probability
+        self.pending = bytearray()  # 等待下一个时隙的帧
+        self.dummy_budget = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.payload_bytes = 0   # 实际帧字节数
+        self.padding_bytes = 0   # PADDING 帧字节数（含虚假消息）
+        self.batches = 0         # 写入次数
+        self.dummy_messages = 0  # 虚假消息数
+
+    @property
+    def overhead(self) -> float:
+        """填充字节相对实际帧字节的比例"""
+        return self.padding_bytes / self.payload_bytes if self.payload_bytes else 0.0
+
+    def send(self, frame: bytes):
+        """
+        提交一个已编码的帧
+
+        缓冲区满一个最大填充大小时立即写出整块，剩余部分等待时隙
+        """
+        pending = self.pending
+        pending += frame
+        self.payload_bytes += len(frame)
+        largest = self.pad_sizes[-1]
+        if len(pending) >= largest:
+            size = len(pending) - len(pending) % largest
+            self.writer.write(pending[:size])
+            del pending[:size]
+            self.batches += 1
+
+    def flush(self):
+        """把待发缓冲区补齐到填充大小后写出"""
+        if not self.pending:
+            return
+        batch = self._padded(self.pending)
+        self.pending.clear()
+        self.writer.write(batch)
+        self.batches += 1
+
+    def _padded(self, data: bytes, target: int = 0) -> bytearray:
+        """在 data 后追加 PADDING 帧补齐到 target（默认为下一个填充大小）"""
+        length = len(data)
+        target = target or padded_size(length, self.pad_sizes)
+        batch = pad_frames(data, target)
+        self.padding_bytes += target - length
+        if self.padding_counter:
+            self.padding_counter.inc(target - length)
+        return batch
+
+    def _tick(self):
+        """一个时隙: 有数据时合并发送，空闲时按预算发送虚假消息"""
+        self.dummy_budget = min(self.dummy_budget + self.dummy_rate, 1.0)
+        if self.pending:
+            self.flush()
+        elif self.dummy_budget >= 1.0:
+            self.dummy_budget -= 1.0
+            self.writer.write(self._padded(b'', random.choice(self.pad_sizes)))
+            self.dummy_messages += 1
+            self.batches += 1
+
+    async def run(self):
+        """时隙循环，直到被取消或连接关闭"""
+        while not self.writer.is_closing():
+            await asyncio.sleep(random.uniform(self.min_delay, self.max_delay))
+            self._tick()
+
+    def start(self):
+        """启动时隙任务"""
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """停止时隙任务并写出剩余数据"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if not self.writer.is_closing():
+            self.flush()
+
+    def stats(self) -> str:
+        """统计摘要（用于日志）"""
+        return (f"帧 {self.payload_bytes} 字节, 填充 {self.padding_bytes} 字节 "
+                f"({self.overhead:.1%}), 写入 {self.batches} 次, 虚假消息 {self.dummy_messages} 条")
+
+
+class FrameSpool:
+    """
+    DATA 传输模式的帧缓冲
+
+    提供与 StreamWriter 相同的 write() / drain() / is_closing() 接口，发送帧的代码无需区分传输模式；
+    帧先进入缓冲区，由邮件事务循环（flusher 任务）每次取走一批放进一封邮件或一个响应。
+    缓冲超过 limit 时 drain() 等待事务循环取走数据; 事务循环自己处理帧时也会发送帧，
+    它调用 drain() 时直接返回，否则会等待它自己而死锁
+    """
+
+    def __init__(self, limit: int = 1024 * 1024):
+        """
+        初始化帧缓冲
+
+        参数:
+            limit: drain() 开始等待的缓冲字节数
+        """
+        self.limit = limit
+        self.buffer = bytearray()
+        self.flusher: Optional[asyncio.Task] = None  # 取走数据的事务循环任务
+        self.closed = False
+        self._drained = asyncio.Event()
+        self._ready = asyncio.Event()
+
+    def write(self, data: bytes):
+        """追加一个已编码的帧"""
+        self.buffer += data
+        self._ready.set()
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    @property
+    def backlogged(self) -> bool:
+        """缓冲是否超过上限（此时 drain() 会等待）"""
+        return len(self.buffer) > self.limit and not self.closed
+
+    async def drain(self):
+        """缓冲区过大时等待事务循环取走数据"""
+        if asyncio.current_task() is self.flusher:
+            return
+        while self.backlogged:
+            self._drained.clear()
+            await self._drained.wait()
+        if self.closed:
+            raise ConnectionResetError("邮件传输已关闭")
+
+    def take(self, max_bytes: int, whole_frames: bool = False) -> bytes:
+        """
+        取走最多 max_bytes 字节
+
+        默认可能在帧中间截断（接收方按字节流重组）；whole_frames 为 True 时只取完整的帧，
+        之后可以追加 PADDING 帧（缓冲区过小时至少取一个帧）
+        """
+        if whole_frames and len(self.buffer) > max_bytes:
+            end = 0
+            while True:
+                size = FRAME_HEADER_SIZE + FRAME_HEADER.unpack_from(self.buffer, end)[2]
+                if end + size > max_bytes:
+                    break
+                end += size
+            max_bytes = end or size
+        if len(self.buffer) <= max_bytes:
+            data, self.buffer = self.buffer, bytearray()
+        else:
+            data = bytes(self.buffer[:max_bytes])
+            del self.buffer[:max_bytes]
+        if len(self.buffer) <= self.limit:
+            self._drained.set()
+        if not self.buffer:
+            self._ready.clear()
+        return data
+
+    async def wait(self, timeout: float):
+        """等待有数据写入，最多 timeout 秒"""
+        if self.buffer or self.closed:
+            return
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self):
+        """关闭缓冲区，唤醒所有等待者"""
+        self.closed = True
+        self._drained.set()
+        self._ready.set()
+
+
 # ============================================================================
 # SMTP 消息生成
 # ============================================================================
@@ -604,12 +2083,20 @@ class SMTPMessageGenerator:
         """生成 MIME 边界"""
         return f"----=_Part_{os.urandom(6).hex()}"
 
-    def wrap_tunnel_data(self, tunnel_data: bytes, filename: str = "document.dat") -> Tuple[str, str, str, str]:
+    def begin_message(self, filename: str = "document.dat",
+                      extra_headers: Optional[Dict[str, str]] = None,
+                      transfer_encoding: str = 'base64') -> Tuple[str, str, str, bytes, bytes]:
         """
-        将隧道数据包装在逼真的 MIME 邮件消息中
+        生成一封带附件邮件的头部和结尾，附件正文由调用方流式写入
+
+        参数:
+            filename: 附件文件名
+            extra_headers: 追加在 Message-ID 之后的邮件头（可选）
+            transfer_encoding: 附件编码，base64 或 binary（BINARYMIME，只能用 BDAT 发送）
 
         返回:
-            (发件人地址, 收件人地址, 主题, 消息正文) 元组
+            (发件人地址, 收件人地址, 主题, 附件正文之前的部分, 附件正文之后的结束边界) 元组，
+            base64 附件正文为 Base64LineEncoder 的输出（每行以 CRLF 结尾），binary 附件正文为原始字节
         """
         from_name, from_addr = self.generate_sender()
         to_name, to_addr = self.generate_recipient()
@@ -620,21 +2107,17 @@ class SMTPMessageGenerator:
         # 当前日期（RFC 2822 格式）
         now = datetime.now(timezone.utc)
         date_str = now.strftime("%a, %d %b %Y %H:%M:%S %z")
-
-        # Base64 编码隧道数据（根据 RFC 2045 使用 76 字符行宽）
-        b64_data = base64.b64encode(tunnel_data).decode('ascii')
-        b64_lines = [b64_data[i:i+76] for i in range(0, len(b64_data), 76)]
-        b64_formatted = '\r\n'.join(b64_lines)
+        extra = ''.join(f"{name}: {value}\n" for name, value in (extra_headers or {}).items())
 
         # 构建 MIME 消息
         body_text = random.choice(self.BODY_TEMPLATES)
 
-        message = f"""From: {from_name} <{from_addr}>
+        head = f"""From: {from_name} <{from_addr}>
 To: {to_name} <{to_addr}>
 Subject: {subject}
 Date: {date_str}
 Message-ID: {message_id}
-MIME-Version: 1.0
+{extra}MIME-Version: 1.0
 Content-Type: multipart/mixed; boundary="{boundary}"
 
 --{boundary}
@@ -645,16 +2128,32 @@ Content-Transfer-Encoding: 7bit
 
 --{boundary}
 Content-Type: application/octet-stream
-Content-Transfer-Encoding: base64
+Content-Transfer-Encoding: {transfer_encoding}
 Content-Disposition: attachment; filename="{filename}"
 
-{b64_formatted}
---{boundary}--"""
+"""
 
         # 转换为 CRLF 行结束符
-        message = message.replace('\n', '\r\n')
+        head = head.replace('\n', '\r\n').encode('utf-8')
+        tail = f"--{boundary}--".encode('ascii')
+        if transfer_encoding == 'binary':
+            tail = b'\r\n' + tail  # 原始正文不以 CRLF 结尾，分隔符前的 CRLF 属于边界
+        return from_addr, to_addr, subject, head, tail
+
+    def wrap_tunnel_data(self, tunnel_data: bytes, filename: str = "document.dat") -> Tuple[str, str, str, str]:
+        """
+        将隧道数据包装在逼真的 MIME 邮件消息中
+
+        返回:
+            (发件人地址, 收件人地址, 主题, 消息正文) 元组
+        """
+        from_addr, to_addr, subject, head, tail = self.begin_message(filename)
+
+        # Base64 编码隧道数据（根据 RFC 2045 使用 76 字符行宽）
+        encoder = Base64LineEncoder()
+        message = head + encoder.encode(tunnel_data) + encoder.flush() + tail
 
-        return from_addr, to_addr, subject, message
+        return from_addr, to_addr, subject, message.decode('utf-8')
 
     def extract_tunnel_data(self, message: str) -> Optional[bytes]:
         """
@@ -666,25 +2165,254 @@ Content-Disposition: attachment; filename="{filename}"
         返回:
             隧道数据，如果提取失败则返回 None
         """
+        decoder = MIMEStreamDecoder()
         try:
-            from email import message_from_string
-            from email.policy import default
+            data = decoder.feed(message.encode('utf-8'))
+            data += decoder.finish()
+        except ValueError:
+            return None
+        return data or None
+
 
-            # 解析邮件消息
-            email_msg = message_from_string(message, policy=default)
+# ============================================================================
+# 邮件正文流式编解码（DATA 传输模式）
+# ============================================================================
 
-            # 查找附件
-            for part in email_msg.walk():
-                # 检查是否为附件
-                if part.get_content_disposition() == 'attachment':
-                    # 获取附件内容
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        return payload
+class Base64LineEncoder:
+    """
+    增量 base64 编码器，按 RFC 2045 折行（每行 76 个字符，以 CRLF 结尾）
 
-            return None
-        except Exception:
-            return None
+    输入可以任意分块: 每次只编码 57 字节（一整行）的整数倍，余下部分留到下一块，
+    因此除 flush() 输出的最后一行外每一行都是完整的。line_prefix 加在每行前面，
+    用于把数据放进 SMTP 多行响应（"250-"）
+    """
+
+    LINE_BYTES = 57  # 一行 76 个 base64 字符对应的原始字节数
+
+    def __init__(self, line_prefix: bytes = b''):
+        """
+        初始化编码器
+
+        参数:
+            line_prefix: 每行的前缀
+        """
+        self.prefix = line_prefix
+        self.separator = b'\r\n' + line_prefix
+        self.line_chars = self.LINE_BYTES // 3 * 4
+        self.pending = b''  # 不足一行的输入
+
+    def encode(self, data: bytes) -> bytes:
+        """编码一块数据，返回完整的行"""
+        if self.pending:
+            data = self.pending + data
+        usable = len(data) - len(data) % self.LINE_BYTES
+        self.pending = bytes(data[usable:])
+        if not usable:
+            return b''
+        return self._lines(memoryview(data)[:usable])
+
+    def flush(self) -> bytes:
+        """编码剩余数据（最后一行可能不足 76 个字符）"""
+        data, self.pending = self.pending, b''
+        return self._lines(data) if data else b''
+
+    def _lines(self, data) -> bytes:
+        text = binascii.b2a_base64(data, newline=False)
+        n = self.line_chars
+        return self.prefix + self.separator.join([text[i:i + n] for i in range(0, len(text), n)]) + b'\r\n'
+
+
+class Base64LineDecoder:
+    """
+    增量 base64 解码器（Base64LineEncoder 的逆操作）
+
+    忽略行尾和行前缀，输入可以在任意位置分块；
+    不足 4 个字符的 base64 尾部留到下一块一起解码
+    """
+
+    def __init__(self, line_prefix: bytes = b''):
+        """
+        初始化解码器
+
+        参数:
+            line_prefix: 每行的前缀（行首出现时去掉）
+        """
+        self.prefix = line_prefix
+        self.marker = b'\n' + line_prefix
+        self.pending = b''  # 有行前缀时: 尚未到行尾的部分
+        self.carry = b''    # 不足 4 个字符的 base64 尾部
+
+    def decode(self, data: bytes) -> bytes:
+        """解码一块数据"""
+        if self.prefix:
+            # 前缀只能在完整的行中可靠识别，行尾之后的部分留到下一块
+            data = self.pending + data
+            end = data.rfind(b'\n') + 1
+            self.pending = data[end:]
+            if not end:
+                return b''
+            text = data[:end].replace(self.marker, b'\n')
+            if text.startswith(self.prefix):
+                text = text[len(self.prefix):]
+        else:
+            text = data
+        return self._decode(text.translate(None, b'\r\n'))
+
+    def finish(self) -> bytes:
+        """
+        解码剩余数据
+
+        异常:
+            ValueError: base64 数据不完整
+        """
+        text = self.pending
+        if self.prefix and text.startswith(self.prefix):
+            text = text[len(self.prefix):]
+        self.pending = b''
+        data = self._decode(text.translate(None, b'\r\n'))
+        if self.carry:
+            raise ValueError("base64 数据不完整")
+        return data
+
+    def _decode(self, text: bytes) -> bytes:
+        if self.carry:
+            text = self.carry + text
+        usable = len(text) - len(text) % 4
+        self.carry = text[usable:]
+        if not usable:
+            return b''
+        try:
+            return binascii.a2b_base64(memoryview(text)[:usable])
+        except binascii.Error as e:
+            raise ValueError(f"base64 解码失败: {e}")
+
+
+class MIMEStreamDecoder:
+    """
+    增量解析 SMTPMessageGenerator 格式的邮件，输出附件的内容
+
+    - 缓存并解析邮件头，取出 multipart 边界（headers 中保存全部邮件头，名称为小写）
+    - 跳过附件之前的各部分，找到第一个 Content-Transfer-Encoding 为 base64 或 binary 的部分
+    - 附件正文边收边解码（binary 原样输出），扫描结束边界时只保留可能跨块的边界前缀
+
+    与 email.message_from_string 不同，整封邮件不需要同时留在内存中
+    """
+
+    MAX_HEADER_SIZE = 65536  # 邮件头和附件之前各部分的最大缓存
+
+    _HEADERS, _PARTS, _BODY, _DONE = range(4)
+    _BOUNDARY_RE = re.compile(rb'boundary="?([^";\s]+)"?', re.IGNORECASE)
+    _ATTACHMENT_RE = re.compile(rb'^content-transfer-encoding:\s*(base64|binary)\s*$',
+                                re.IGNORECASE | re.MULTILINE)
+
+    def __init__(self):
+        self.headers: Dict[str, str] = {}
+        self.state = self._HEADERS
+        self.buffer = b''
+        self.part_marker = b''
+        self.end_marker = b''
+        self.body: Optional[Base64LineDecoder] = None  # binary 附件为 None
+
+    @property
+    def done(self) -> bool:
+        """附件是否已经结束"""
+        return self.state == self._DONE
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        输入一块邮件内容
+
+        返回:
+            本块中解码出的附件数据
+
+        异常:
+            ValueError: 邮件格式错误
+        """
+        if self.state == self._DONE:
+            return b''
+        buffer = self.buffer + data if self.buffer else bytes(data)
+        self.buffer = b''
+
+        if self.state == self._HEADERS:
+            end = buffer.find(b'\r\n\r\n')
+            if end < 0:
+                return self._keep(buffer)
+            self.headers = self._parse_headers(buffer[:end])
+            match = self._BOUNDARY_RE.search(self.headers.get('content-type', '').encode('ascii', 'replace'))
+            if not match:
+                raise ValueError("邮件不是 multipart 格式")
+            boundary = match.group(1)
+            self.part_marker = b'--' + boundary
+            self.end_marker = b'\r\n--' + boundary
+            buffer = buffer[end + 2:]
+            self.state = self._PARTS
+
+        if self.state == self._PARTS:
+            while True:
+                start = buffer.find(self.part_marker)
+                if start < 0 or len(buffer) < start + len(self.part_marker) + 2:
+                    return self._keep(buffer)
+                after = start + len(self.part_marker)
+                if buffer[after:after + 2] == b'--':
+                    self.state = self._DONE  # 没有附件
+                    return b''
+                end = buffer.find(b'\r\n\r\n', after)
+                if end < 0:
+                    return self._keep(buffer)
+                part_headers = buffer[after:end]
+                # 保留部分头的结尾 CRLF: 空附件时结束边界紧跟在后面
+                buffer = buffer[end + 2:]
+                match = self._ATTACHMENT_RE.search(part_headers)
+                if match:
+                    if match.group(1).lower() == b'base64':
+                        self.body = Base64LineDecoder()
+                    else:
+                        buffer = buffer[2:]  # binary 正文从空行之后开始，保留的 CRLF 不属于正文
+                    self.state = self._BODY
+                    break
+
+        # 附件正文: 结束边界之前的内容都可以解码
+        end = buffer.find(self.end_marker)
+        body = self.body
+        if end >= 0:
+            self.state = self._DONE
+            return body.decode(buffer[:end]) + body.finish() if body else buffer[:end]
+        safe = max(0, len(buffer) - len(self.end_marker) + 1)
+        self.buffer = buffer[safe:]
+        return body.decode(buffer[:safe]) if body else buffer[:safe]
+
+    def finish(self) -> bytes:
+        """
+        邮件结束
+
+        异常:
+            ValueError: 没有找到附件或附件不完整
+        """
+        if self.state != self._DONE:
+            raise ValueError("邮件在附件结束之前中断")
+        return b''
+
+    def _keep(self, buffer: bytes) -> bytes:
+        """缓存尚未能解析的部分"""
+        if len(buffer) > self.MAX_HEADER_SIZE:
+            raise ValueError("邮件头过长")
+        self.buffer = buffer
+        return b''
+
+    @staticmethod
+    def _parse_headers(block: bytes) -> Dict[str, str]:
+        """解析邮件头（支持折叠行），名称转为小写"""
+        headers: Dict[str, str] = {}
+        name = None
+        for line in block.decode('utf-8', errors='replace').split('\r\n'):
+            if line[:1] in (' ', '\t') and name:
+                headers[name] += ' ' + line.strip()
+                continue
+            key, sep, value = line.partition(':')
+            if sep:
+                name = key.strip().lower()
+                headers[name] = value.strip()
+        return headers
 
 
 # ============================================================================
@@ -722,6 +2450,12 @@ class UserConfig:
     secret: str  # 密钥
     whitelist: List[str] = None  # IP 白名单
     logging: bool = True  # 是否记录日志
+    upload_rate: int = 0  # 上传限速（字节/秒，该用户所有会话共享，0 表示不限）
+    download_rate: int = 0  # 下载限速（字节/秒，该用户所有会话共享，0 表示不限）
+    channel_download_rate: int = 0  # 单通道下载限速（字节/秒，0 表示不限）
+    max_sessions: int = 0  # 同时在线的会话数上限（0 表示不限）
+    max_channels: int = 0  # 所有会话合计的通道数上限（0 表示不限）
+    connect_rate: float = 0  # 每秒 CONNECT 请求数上限（所有会话合计，0 表示不限）
 
     def __post_init__(self):
         if self.whitelist is None:
@@ -741,6 +2475,165 @@ class StealthConfig:
             self.pad_to_sizes = [4096, 8192, 16384]
 
 
+def parse_stealth_config(section: Optional[dict]) -> StealthConfig:
+    """
+    从配置文件的 stealth 段创建隐蔽配置
+
+    参数:
+        section: stealth 段（可以为空）
+
+    返回:
+        StealthConfig 对象
+    """
+    section = section or {}
+    defaults = StealthConfig()
+    return StealthConfig(
+        min_delay_ms=section.get('min_delay_ms', defaults.min_delay_ms),
+        max_delay_ms=section.get('max_delay_ms', defaults.max_delay_ms),
+        pad_to_sizes=section.get('pad_to_sizes') or defaults.pad_to_sizes,
+        dummy_message_probability=section.get('dummy_message_probability', defaults.dummy_message_probability),
+    )
+
+
+@dataclass
+class PerformanceConfig:
+    """
+    性能和资源上限（配置文件的 performance 段，服务端和客户端共用）
+
+    只对其中一端有意义的项在另一端忽略
+    """
+    max_channels_per_session: int = 1000  # 单个会话（客户端: 单条隧道）的通道数上限，也是客户端通道 ID 的上限
+    max_local_connections: int = 100  # 客户端每个本地代理监听器的并发连接数上限
+    max_receive_buffer: int = 10 * 1024 * 1024  # 客户端接收缓冲中尚未组成完整帧的最大字节数
+    read_size_min: int = READ_SIZE_MIN  # 每次读取目标 / 本地连接的字节数下限（按流量自动调整）
+    read_size_max: int = READ_SIZE_MAX  # 每次读取目标 / 本地连接的字节数上限（不超过 READ_SIZE_MAX）
+    tunnel_read_size_max: int = TUNNEL_READ_SIZE_MAX  # 每次读取隧道连接的字节数上限（自动调整，下限 64 KiB）
+    connect_timeout: float = 30.0  # 连接目标主机（服务端）或服务器（客户端）的超时（秒）
+    channel_open_timeout: float = 10.0  # 客户端等待服务器确认 CONNECT 的超时（秒）
+    local_handshake_timeout: float = 10.0  # 客户端 SOCKS5 / HTTP 代理握手每一步的超时（秒）
+    tunnel_read_timeout: float = 60.0  # 隧道连接上等待 SMTP 命令、响应或数据的超时（秒）
+    dns_timeout: float = 5.0  # DNS 查询超时（服务端: 上游解析器；客户端: 经隧道的查询）（秒）
+    max_dns_inflight: int = 64  # 单个会话（客户端: 单条隧道）同时进行的 DNS 查询数上限，超出时立即失败
+    channel_idle_timeout: float = 300.0  # 服务端: 目标连接多久没有数据时关闭通道（秒）
+    local_idle_timeout: float = 100.0  # 客户端: 本地连接多久没有数据时关闭通道（秒）
+    close_timeout: float = 5.0  # 关闭连接或停止接收器任务时等待完成的超时，超时后强制中止（秒）
+    stats_interval: float = 60.0  # 客户端: 在日志中输出连接摘要的间隔（秒）
+    stale_check_interval: float = 60.0  # 客户端: 清理已完成的连接事件的间隔（秒）
+    zombie_check_interval: float = 120.0  # 客户端: 检查本地连接已关闭但未清理的通道的间隔（秒）
+    write_buffer_high: int = 65536  # 隧道连接写缓冲的高水位（字节），超过时暂停读取全部目标 / 本地连接
+    write_buffer_low: int = 16384  # 隧道连接写缓冲的低水位（字节），降到此值后轮流恢复读取（可以为 0）
+    crypto_offload_threshold: int = 16384  # 启用加密线程池时，批次达到多少字节才交给线程池
+
+
+# 早期版本写在 server / client 段中、现在属于 performance 段的配置项
+MOVED_PERFORMANCE_KEYS = ('write_buffer_high', 'write_buffer_low', 'crypto_offload_threshold')
+
+
+def parse_performance_config(section: Optional[dict]) -> PerformanceConfig:
+    """
+    从配置文件的 performance 段创建性能配置
+
+    参数:
+        section: performance 段（可以为空）
+
+    返回:
+        PerformanceConfig 对象
+
+    异常:
+        ValueError: 未知的配置项、类型错误或取值超出范围
+    """
+    section = section or {}
+    defaults = PerformanceConfig()
+    unknown = set(section) - set(defaults.__dict__)
+    if unknown:
+        raise ValueError(f"未知的 performance 配置项: {', '.join(sorted(unknown))}")
+    values = {}
+    for name, default in defaults.__dict__.items():
+        value = section.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"performance.{name} 应为数值: {value!r}")
+        if isinstance(default, int) and value != int(value):
+            raise ValueError(f"performance.{name} 应为整数: {value!r}")
+        if name == 'write_buffer_low':
+            if value < 0:
+                raise ValueError(f"performance.{name} 不能小于 0: {value!r}")
+        elif value <= 0:
+            raise ValueError(f"performance.{name} 应大于 0: {value!r}")
+        values[name] = type(default)(value)
+    config = PerformanceConfig(**values)
+    if config.max_channels_per_session > 65535:
+        raise ValueError("performance.max_channels_per_session 不能超过 65535（通道 ID 为 16 位）")
+    if config.max_dns_inflight > 65535:
+        raise ValueError("performance.max_dns_inflight 不能超过 65535（查询标签为 16 位）")
+    if not config.read_size_min <= config.read_size_max <= READ_SIZE_MAX:
+        raise ValueError(f"需要 read_size_min ({config.read_size_min}) <= read_size_max "
+                         f"({config.read_size_max}) <= {READ_SIZE_MAX}")
+    if config.tunnel_read_size_max < TUNNEL_READ_SIZE_MIN:
+        raise ValueError(f"performance.tunnel_read_size_max 不能小于 {TUNNEL_READ_SIZE_MIN}")
+    if config.write_buffer_low > config.write_buffer_high:
+        raise ValueError(f"需要 write_buffer_low ({config.write_buffer_low}) <= write_buffer_high "
+                         f"({config.write_buffer_high})")
+    return config
+
+
+@dataclass
+class AcceptFilterConfig:
+    """
+    服务端接受连接时的来源过滤（server.accept_filter 段）
+
+    在发送 220 问候和 TLS 握手之前检查，被拒绝的连接直接关闭
+    """
+    allow: List[str] = None  # 允许的来源 IP / CIDR（空表示允许所有）
+    deny: List[str] = None  # 拒绝的来源 IP / CIDR（优先于 allow）
+    max_connections_per_ip: int = 0  # 每个来源 IP 同时打开的连接数上限（0 表示不限）
+    connection_rate_per_ip: float = 0  # 每个来源 IP 每秒新建连接数上限（0 表示不限）
+    connection_burst_per_ip: int = 0  # 每个来源 IP 的突发连接数（0 表示一秒的配额，至少 1 个）
+
+    def __post_init__(self):
+        if self.allow is None:
+            self.allow = []
+        if self.deny is None:
+            self.deny = []
+
+
+def parse_accept_filter_config(section: Optional[dict]) -> AcceptFilterConfig:
+    """
+    从配置文件的 server.accept_filter 段创建来源过滤配置
+
+    参数:
+        section: accept_filter 段（可以为空）
+
+    返回:
+        AcceptFilterConfig 对象
+
+    异常:
+        ValueError: 未知的配置项、无效的地址或限制值
+    """
+    section = section or {}
+    unknown = set(section) - set(AcceptFilterConfig().__dict__)
+    if unknown:
+        raise ValueError(f"未知的 accept_filter 配置项: {', '.join(sorted(unknown))}")
+    tables = {}
+    for name in ('allow', 'deny'):
+        entries = section.get(name) or []
+        if not isinstance(entries, list):
+            raise ValueError(f"accept_filter.{name} 应为列表: {entries!r}")
+        for entry in entries:
+            try:
+                ipaddress.ip_network(str(entry), strict=False)
+            except ValueError:
+                raise ValueError(f"accept_filter.{name} 中的地址无效: {entry!r}")
+        tables[name] = [str(entry) for entry in entries]
+    limits = {}
+    for name, cast in (('max_connections_per_ip', int), ('connection_rate_per_ip', float),
+                       ('connection_burst_per_ip', int)):
+        try:
+            limits[name] = parse_limit(section.get(name), cast)
+        except ValueError as e:
+            raise ValueError(f"accept_filter.{name}: {e}")
+    return AcceptFilterConfig(allow=tables['allow'], deny=tables['deny'], **limits)
+
+
 @dataclass
 class ServerConfig:
     """服务端配置"""
@@ -753,14 +2646,28 @@ class ServerConfig:
     log_users: bool = True  # 是否记录用户日志
     secret: str = ''  # 密钥
     users: Dict[str, UserConfig] = None  # 用户字典
+    dns_resolver: str = ''  # 隧道 DNS 查询的上游解析器 "主机:端口"（空表示使用系统解析器）
+    compression: bool = True  # 是否允许客户端协商通道压缩
+    inner_encryption: bool = True  # 是否允许客户端协商内层加密（SEAL）
+    crypto_threads: int = 0  # 内层加密线程池大小（0 表示在事件循环中加密）
+    keepalive_interval: float = 5.0  # PING 间隔（秒，0 表示不主动探测）
+    keepalive_misses: int = 3  # 连续多少个间隔无响应判定会话失效
+    metrics_port: int = 0  # Prometheus 指标端口（0 表示禁用）
+    metrics_host: str = '127.0.0.1'  # 指标监听地址
     stealth_enabled: bool = False  # 是否启用隐蔽模式
     stealth: StealthConfig = None  # 隐蔽配置
+    performance: PerformanceConfig = None  # 性能和资源上限
+    accept_filter: AcceptFilterConfig = None  # 接受连接时的来源过滤
 
     def __post_init__(self):
         if self.users is None:
             self.users = {}
         if self.stealth is None:
             self.stealth = StealthConfig()
+        if self.performance is None:
+            self.performance = PerformanceConfig()
+        if self.accept_filter is None:
+            self.accept_filter = AcceptFilterConfig()
 
 
 class IPWhitelist:
@@ -833,6 +2740,132 @@ class IPWhitelist:
         return bool(self.entries)
 
 
+# ============================================================================
+# 限速
+# ============================================================================
+
+_RATE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?(?:/S)?\s*$', re.IGNORECASE)
+_RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(value) -> int:
+    """
+    解析限速值
+
+    参数:
+        value: 整数（字节/秒）或带单位的字符串，例如 '512K'、'10M'、'1.5MB/s'
+
+    返回:
+        字节/秒，0 表示不限速
+
+    异常:
+        ValueError: 格式无效
+    """
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        raise ValueError(f"无效的速率: {value!r}")
+    if isinstance(value, (int, float)):
+        if value < 0:
+            raise ValueError(f"无效的速率: {value!r}")
+        return int(value)
+    match = _RATE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"无效的速率: {value!r}")
+    return int(float(match.group(1)) * _RATE_UNITS[match.group(2).upper()])
+
+
+def format_rate(rate: int) -> str:
+    """把字节/秒格式化为 parse_rate 可读回的最短形式，例如 10485760 -> '10M'"""
+    for unit in ('G', 'M', 'K'):
+        if rate >= _RATE_UNITS[unit] and rate % _RATE_UNITS[unit] == 0:
+            return f"{rate // _RATE_UNITS[unit]}{unit}"
+    return str(rate)
+
+
+def parse_limit(value, cast=int):
+    """
+    解析准入限制值（会话数、通道数、每秒连接数）
+
+    参数:
+        value: 非负数字，None 或空字符串表示不限
+        cast: 结果类型（int 或 float）
+
+    返回:
+        限制值，0 表示不限
+
+    异常:
+        ValueError: 格式无效或为负数
+    """
+    if value is None or value == '':
+        return cast(0)
+    if isinstance(value, bool):
+        raise ValueError(f"无效的限制值: {value!r}")
+    try:
+        limit = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"无效的限制值: {value!r}")
+    if limit < 0:
+        raise ValueError(f"无效的限制值: {value!r}")
+    return limit
+
+
+class TokenBucket:
+    """
+    令牌桶
+
+    consume() 允许透支: 立即扣除令牌并返回需要暂停的秒数，
+    调用方在发出本次数据后暂停读取，而不是缓存数据。
+    多个会话共享同一个桶时，各自的透支都会推迟后续读取，总速率仍受限。
+    """
+
+    MIN_BURST = 65536  # 最小突发量，至少容纳一次完整读取
+
+    def __init__(self, rate: int, burst: int = 0):
+        """
+        初始化令牌桶
+
+        参数:
+            rate: 速率（字节/秒）
+            burst: 桶容量（字节），默认一秒的流量且不小于 MIN_BURST
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, self.MIN_BURST))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def consume(self, amount: int) -> float:
+        """
+        扣除令牌
+
+        参数:
+            amount: 本次传输的字节数
+
+        返回:
+            需要暂停的秒数，令牌充足时为 0
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def try_consume(self, amount: float = 1) -> bool:
+        """
+        不透支地扣除令牌，用于直接拒绝超额请求的场合
+
+        返回:
+            True 表示令牌充足且已扣除
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
 @dataclass
 class ClientConfig:
     """客户端配置"""
@@ -840,8 +2873,33 @@ class ClientConfig:
     server_port: int = 587  # 服务器端口
     socks_port: int = 1080  # SOCKS 代理端口
     socks_host: str = '127.0.0.1'  # SOCKS 代理地址
+    http_proxy_port: int = 0  # HTTP 代理端口（0 表示禁用）
+    http_proxy_host: str = '127.0.0.1'  # HTTP 代理地址
+    transparent_port: int = 0  # 透明代理端口（0 表示禁用）
+    transparent_host: Union[str, List[str]] = '127.0.0.1'  # 透明代理地址，可以是列表
+    dns_port: int = 0  # 本地 DNS 转发端口（0 表示禁用）
+    dns_host: str = '127.0.0.1'  # 本地 DNS 转发地址
+    compression: bool = False  # 是否请求通道压缩（需服务器支持）
+    inner_encryption: bool = False  # 二进制模式是否要求内层加密（服务器不支持时握手失败）
+    crypto_threads: int = 0  # 内层加密线程池大小（0 表示在事件循环中加密）
+    keepalive_interval: float = 5.0  # PING 间隔（秒，0 表示禁用）
+    keepalive_misses: int = 3  # 连续多少个间隔无响应判定隧道失效
+    metrics_port: int = 0  # 指标 HTTP 端口（0 表示禁用）
+    metrics_host: str = '127.0.0.1'  # 指标监听地址
+    metrics_socket: str = ''  # 指标 Unix 套接字路径（设置后代替 HTTP 端口）
     username: str = ''  # 多用户认证的用户名
     secret: str = ''  # 密钥
+    stealth_enabled: bool = False  # 是否启用隐蔽模式（需服务器支持 PADDING）
+    stealth: StealthConfig = None  # 隐蔽配置
+    performance: PerformanceConfig = None  # 性能和资源上限
+    transport: str = 'binary'  # 隧道传输方式: binary（二进制流）、data 或 bdat（真实的邮件事务）
+    data_poll_interval: float = 0.2  # DATA / BDAT 传输模式空闲时轮询下行数据的间隔（秒）
+
+    def __post_init__(self):
+        if self.stealth is None:
+            self.stealth = StealthConfig()
+        if self.performance is None:
+            self.performance = PerformanceConfig()
 
 
 def load_config(path: str) -> dict:
@@ -881,12 +2939,21 @@ def load_users(path: str) -> Dict[str, UserConfig]:
     for username, user_data in users_data.items():
         if isinstance(user_data, dict):
             # 完整格式
-            users[username] = UserConfig(
-                username=username,
-                secret=user_data.get('secret', ''),
-                whitelist=user_data.get('whitelist', []),
-                logging=user_data.get('logging', True)
-            )
+            try:
+                users[username] = UserConfig(
+                    username=username,
+                    secret=user_data.get('secret', ''),
+                    whitelist=user_data.get('whitelist', []),
+                    logging=user_data.get('logging', True),
+                    upload_rate=parse_rate(user_data.get('upload_rate')),
+                    download_rate=parse_rate(user_data.get('download_rate')),
+                    channel_download_rate=parse_rate(user_data.get('channel_download_rate')),
+                    max_sessions=parse_limit(user_data.get('max_sessions')),
+                    max_channels=parse_limit(user_data.get('max_channels')),
+                    connect_rate=parse_limit(user_data.get('connect_rate'), float)
+                )
+            except ValueError as e:
+                raise ValueError(f"用户 {username} 配置错误: {e}")
         elif isinstance(user_data, str):
             # 简单格式: 用户名: 密钥
             users[username] = UserConfig(
@@ -913,6 +2980,12 @@ def save_users(path: str, users: Dict[str, UserConfig]):
         lines.append(f"  {username}:")
         lines.append(f"    secret: {user.secret}")
         lines.append(f"    logging: {str(user.logging).lower()}")
+        for key in ('upload_rate', 'download_rate', 'channel_download_rate'):
+            if getattr(user, key):
+                lines.append(f"    {key}: {format_rate(getattr(user, key))}")
+        for key in ('max_sessions', 'max_channels', 'connect_rate'):
+            if getattr(user, key):
+                lines.append(f"    {key}: {getattr(user, key):g}")
 
         if user.whitelist:
             lines.append("    whitelist:")
@@ -933,55 +3006,6 @@ def save_users(path: str, users: Dict[str, UserConfig]):
 # 工具类
 # ============================================================================
 
-class FrameBuffer:
-    """
-    用于累积和解析隧道消息的缓冲区
-    处理部分读取和消息边界
-    """
-
-    def __init__(self):
-        """初始化缓冲区"""
-        self.buffer = b''  # 内部字节缓冲区
-
-    def append(self, data: bytes):
-        """将数据添加到缓冲区"""
-        self.buffer += data
-
-    def get_messages(self) -> List[TunnelMessage]:
-        """
-        从缓冲区提取完整的消息
-        返回消息列表，更新缓冲区以包含剩余数据
-        """
-        messages = []
-
-        # 只要缓冲区中有足够的数据来解析头部
-        while len(self.buffer) >= TunnelMessage.HEADER_SIZE:
-            try:
-                # 预览负载长度
-                _, _, _, payload_len = struct.unpack(
-                    '>BBHH', self.buffer[:TunnelMessage.HEADER_SIZE]
-                )
-                total_len = TunnelMessage.HEADER_SIZE + payload_len
-
-                # 如果数据不足，等待更多数据
-                if len(self.buffer) < total_len:
-                    break
-
-                # 反序列化消息
-                msg, remaining = TunnelMessage.deserialize(self.buffer)
-                messages.append(msg)
-                self.buffer = remaining
-
-            except ValueError:
-                break
-
-        return messages
-
-    def clear(self):
-        """清空缓冲区"""
-        self.buffer = b''
-
-
 class AsyncQueue:
     """用于消息传递的简单异步队列包装器"""
 
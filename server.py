@@ -13,6 +13,9 @@ SMTP 隧道服务端 - 快速二进制模式
 - 支持多用户，每个用户有独立密钥
 - 每用户 IP 白名单
 - 每用户日志记录（可选）
+- Prometheus 指标端点（可选）
+- 每用户令牌桶限速（可选）
+- 每用户准入控制: 会话数、通道数、CONNECT 速率（可选）
 """
 
 import asyncio
@@ -22,12 +25,25 @@ import argparse
 import struct
 import os
 import re
+import time
 import ipaddress
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set
 from dataclasses import dataclass
 
 from common import (
-    TunnelCrypto, load_config, load_users, ServerConfig, UserConfig, IPWhitelist
+    TunnelCrypto, load_config, load_users, ServerConfig, UserConfig, IPWhitelist,
+    parse_capabilities, format_capabilities, TUNNEL_EHLO_KEYWORD, BINARY_OK_LINE, CAP_DNS,
+    CAP_COMPRESS, COMPRESSION_ALGORITHMS, choose_compression,
+    ChannelCompressor, ChannelDecompressor, format_compression_stats,
+    MetricsRegistry, start_metrics_server, register_process_metrics, TokenBucket,
+    CAP_PING, KeepaliveMonitor, CAP_HALF_CLOSE, CAP_PADDING, StealthScheduler, parse_stealth_config,
+    CAP_SEAL, SEAL_SALT_SIZE, BatchSealer, BatchOpener, CryptoOffload,
+    CAP_MAIL_DATA, CAP_MAIL_BDAT, MAIL_CAPABILITIES_HEADER, MAIL_MESSAGE_MAX, FrameSpool, Base64LineEncoder, MIMEStreamDecoder,
+    FRAME_DATA, FRAME_CONNECT, FRAME_CONNECT_OK, FRAME_CONNECT_FAIL, FRAME_CLOSE, FRAME_PING, FRAME_PONG,
+    FRAME_DNS_QUERY, FRAME_DNS_RESPONSE, FRAME_DATA_Z, FRAME_HALF_CLOSE, FRAME_PADDING,
+    FrameDecoder, BufferPool, FRAME_HEADER, FRAME_HEADER_SIZE,
+    ReadSizeTuner, CHANNEL_READ_SIZE, TUNNEL_READ_SIZE_MIN, parse_performance_config, MOVED_PERFORMANCE_KEYS,
+    AcceptFilterConfig, parse_accept_filter_config, CounterMetric
 )
 
 logging.basicConfig(
@@ -41,25 +57,440 @@ logger = logging.getLogger('smtp-tunnel-server')
 # 二进制协议（在 SMTP 握手后使用）
 # ============================================================================
 
-# 帧类型
-FRAME_DATA = 0x01  # 数据帧
-FRAME_CONNECT = 0x02  # 连接帧
-FRAME_CONNECT_OK = 0x03  # 连接成功帧
-FRAME_CONNECT_FAIL = 0x04  # 连接失败帧
-FRAME_CLOSE = 0x05  # 关闭帧
+# 服务端支持的隧道扩展能力
+SERVER_CAPABILITIES = {CAP_DNS: [], CAP_COMPRESS: COMPRESSION_ALGORITHMS, CAP_PING: [], CAP_HALF_CLOSE: [],
+                       CAP_PADDING: [], CAP_MAIL_DATA: [], CAP_MAIL_BDAT: [], CAP_SEAL: []}
 
-def make_frame(frame_type: int, channel_id: int, payload: bytes = b'') -> bytes:
-    """创建二进制帧: 类型(1) + 通道(2) + 长度(2) + 负载"""
-    return struct.pack('>BHH', frame_type, channel_id, len(payload)) + payload
+SMTP_DATA_END = b'\r\n.\r\n'  # DATA 正文结束标记（第一个 CRLF 属于最后一行）
+BDAT_READ_SIZE = 65536  # BDAT 块每次读取的最大字节数
 
-def parse_frame_header(data: bytes):
-    """解析帧头部，返回 (类型, 通道ID, 负载长度) 或 None"""
-    if len(data) < 5:
+
+# ============================================================================
+# 运行指标
+# ============================================================================
+
+class UserMetrics:
+    """单个用户的指标序列，会话认证后取出一次，之后直接更新"""
+
+    def __init__(self, metrics: 'ServerMetrics', user: str):
+        self.sessions = metrics.sessions.labels(user)
+        self.channels = metrics.channels.labels(user)
+        self.channels_active = metrics.channels_active.labels(user)
+        self.connect_failures = metrics.connect_failures.labels(user)
+        self.bytes_received = metrics.bytes_received.labels(user)
+        self.bytes_sent = metrics.bytes_sent.labels(user)
+        self.frames_received = metrics.frames_received.labels(user)
+        self.frames_sent = metrics.frames_sent.labels(user)
+        self.padding_sent = metrics.padding_bytes_sent.labels(user)
+        self.throttled_upload = metrics.throttled_seconds.labels(user, 'upload')
+        self.throttled_download = metrics.throttled_seconds.labels(user, 'download')
+        self.rejected_sessions = metrics.admission_rejections.labels(user, 'sessions')
+        self.rejected_channels = metrics.admission_rejections.labels(user, 'channels')
+        self.rejected_connect_rate = metrics.admission_rejections.labels(user, 'connect_rate')
+
+
+class ServerMetrics:
+    """服务端指标定义，所有会话共享同一个实例"""
+
+    ANONYMOUS_USER = '-'  # 关闭了日志记录的用户不单独出现在指标中
+
+    def __init__(self):
+        self.registry = MetricsRegistry('smtp_tunnel_')
+        r = self.registry
+        self.connections = r.counter('connections_total', '接受的 TCP 连接数')
+        self.sessions_active = r.gauge('sessions_active', '当前会话数（含握手中）')
+        self.auth_failures = r.counter('auth_failures_total', '认证失败次数')
+        self.handshake_seconds = r.histogram('handshake_seconds', '从连接到进入二进制模式的耗时')
+        self.sessions = r.counter('sessions_total', '认证成功的会话数', ('user',))
+        self.channels = r.counter('channels_total', '成功打开的通道数', ('user',))
+        self.channels_active = r.gauge('channels_active', '当前打开的通道数', ('user',))
+        self.connect_failures = r.counter('connect_failures_total', '连接目标失败次数', ('user',))
+        self.connect_seconds = r.histogram('connect_seconds', '连接目标主机的耗时（含域名解析）')
+        self.bytes_received = r.counter('bytes_received_total', '从客户端接收的隧道字节数', ('user',))
+        self.bytes_sent = r.counter('bytes_sent_total', '发送给客户端的隧道字节数', ('user',))
+        self.frames_received = r.counter('frames_received_total', '从客户端接收的帧数', ('user',))
+        self.frames_sent = r.counter('frames_sent_total', '发送给客户端的帧数', ('user',))
+        self.padding_bytes_sent = r.counter('padding_bytes_sent_total', '隐蔽模式发送的填充字节数', ('user',))
+        self.dns_seconds = r.histogram('dns_query_seconds', '上游 DNS 查询耗时')
+        self.dns_failures = r.counter('dns_failures_total', '上游 DNS 查询失败次数')
+        self.throttled_seconds = r.counter('throttled_seconds_total', '因限速暂停读取的时间',
+                                           ('user', 'direction'))
+        self.rtt_seconds = r.histogram('rtt_seconds', 'PING/PONG 往返时间',
+                                       buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0))
+        self.dead_sessions = r.counter('dead_sessions_total', '因保活无响应被关闭的会话数')
+        self.admission_rejections = r.counter('admission_rejections_total', '准入控制拒绝的会话和通道数',
+                                              ('user', 'reason'))
+        self.buffer_pool_hit_ratio = r.gauge('buffer_pool_hit_ratio', '帧缓冲区池命中率')
+        self.buffer_pool_in_use = r.gauge('buffer_pool_in_use', '已取出的帧缓冲区数')
+        self.buffer_pool_high_water = r.gauge('buffer_pool_high_water', '同时取出的帧缓冲区数的最大值')
+        self.channel_read_size = r.gauge('channels_by_read_size', '按当前每次读取目标的字节数统计的通道数',
+                                         ('read_size',))
+        self.accept_rejections = r.counter('accept_rejections_total', '接受连接时被来源过滤拒绝的连接数',
+                                           ('prefix', 'reason'))
+        self.accept_sources = r.gauge('accept_filter_sources', '来源过滤正在跟踪的来源 IP 数')
+        register_process_metrics(r)
+        self._users: Dict[str, UserMetrics] = {}
+
+    def bind_buffer_pool(self, pool: BufferPool):
+        """采集时从帧缓冲区池读取统计"""
+        self.buffer_pool_hit_ratio.set_function(lambda: pool.hit_rate)
+        self.buffer_pool_in_use.set_function(lambda: pool.in_use)
+        self.buffer_pool_high_water.set_function(lambda: pool.high_water)
+
+    def bind_accept_filter(self, accept_filter: 'AcceptFilter'):
+        """采集时从来源过滤读取跟踪的来源数"""
+        self.accept_sources.set_function(lambda: len(accept_filter.sources))
+
+    def for_user(self, user: str) -> UserMetrics:
+        """取得用户的指标序列（按用户缓存）"""
+        user_metrics = self._users.get(user)
+        if user_metrics is None:
+            user_metrics = self._users[user] = UserMetrics(self, user)
+        return user_metrics
+
+
+# ============================================================================
+# 限速
+# ============================================================================
+
+class UserRateLimiter:
+    """
+    单个用户的令牌桶
+
+    上传限速在 _binary_mode 中暂停读取隧道连接，下载限速在 _channel_data 中
+    暂停读取目标连接；用户级的桶由该用户的所有会话共享。
+    单通道限速只作用于下载方向: 上传方向所有通道复用同一条隧道连接，
+    为一个通道暂停读取会连带阻塞其他通道。
+    """
+
+    def __init__(self, user_config: UserConfig):
+        self.upload = TokenBucket(user_config.upload_rate) if user_config.upload_rate else None
+        self.download = TokenBucket(user_config.download_rate) if user_config.download_rate else None
+        self.channel_download_rate = user_config.channel_download_rate
+
+    def channel_bucket(self) -> Optional[TokenBucket]:
+        """为新通道创建下载令牌桶（未配置单通道限速时返回 None）"""
+        if self.channel_download_rate:
+            return TokenBucket(self.channel_download_rate)
+        return None
+
+
+class RateLimiters:
+    """按用户名保存限速器，TunnelServer 持有一个实例供所有会话共享"""
+
+    def __init__(self):
+        self._limiters: Dict[str, UserRateLimiter] = {}
+
+    def for_user(self, user_config: Optional[UserConfig]) -> Optional[UserRateLimiter]:
+        """
+        取得用户的限速器
+
+        返回:
+            未配置任何限速的用户返回 None，热路径只需判断一次
+        """
+        if not user_config or not (user_config.upload_rate or user_config.download_rate
+                                   or user_config.channel_download_rate):
+            return None
+        limiter = self._limiters.get(user_config.username)
+        if limiter is None:
+            limiter = self._limiters[user_config.username] = UserRateLimiter(user_config)
+        return limiter
+
+
+# ============================================================================
+# 准入控制
+# ============================================================================
+
+class UserAdmission:
+    """
+    单个用户的准入计数，该用户的所有会话共享
+
+    所有检查都只做计数比较，在解析目标地址和建立连接之前完成；
+    事件循环是单线程的，检查与计数之间不会被其他会话插入。
+    """
+
+    # CONNECT_FAIL 载荷中的拒绝原因
+    REASON_CHANNELS = b'User channel limit reached'
+    REASON_CONNECT_RATE = b'Connect rate limit exceeded'
+
+    def __init__(self, user_config: UserConfig):
+        self.max_sessions = user_config.max_sessions
+        self.max_channels = user_config.max_channels
+        # 突发量为一秒的配额（至少 1 个），允许浏览器式的并发打开
+        self.connect_bucket = (TokenBucket(user_config.connect_rate, max(1.0, user_config.connect_rate))
+                               if user_config.connect_rate else None)
+        self.sessions = 0
+        self.channels = 0
+
+    def acquire_session(self) -> bool:
+        """占用一个会话名额，已满时返回 False"""
+        if self.max_sessions and self.sessions >= self.max_sessions:
+            return False
+        self.sessions += 1
+        return True
+
+    def release_session(self):
+        """释放会话名额"""
+        self.sessions -= 1
+
+    def acquire_channel(self) -> Optional[bytes]:
+        """
+        占用一个通道名额
+
+        返回:
+            None 表示允许，否则为拒绝原因
+        """
+        if self.max_channels and self.channels >= self.max_channels:
+            return self.REASON_CHANNELS
+        if self.connect_bucket and not self.connect_bucket.try_consume():
+            return self.REASON_CONNECT_RATE
+        self.channels += 1
+        return None
+
+    def release_channel(self):
+        """释放通道名额"""
+        self.channels -= 1
+
+
+class AdmissionControl:
+    """按用户名保存准入计数，TunnelServer 持有一个实例供所有会话共享"""
+
+    def __init__(self):
+        self._users: Dict[str, UserAdmission] = {}
+
+    def for_user(self, user_config: Optional[UserConfig]) -> Optional[UserAdmission]:
+        """
+        取得用户的准入计数
+
+        返回:
+            未配置任何准入限制的用户返回 None
+        """
+        if not user_config or not (user_config.max_sessions or user_config.max_channels
+                                   or user_config.connect_rate):
+            return None
+        admission = self._users.get(user_config.username)
+        if admission is None:
+            admission = self._users[user_config.username] = UserAdmission(user_config)
+        return admission
+
+
+# ============================================================================
+# 来源过滤
+# ============================================================================
+
+REJECTION_PREFIX_V4 = 24  # 拒绝次数按来源前缀汇总: IPv4 /24
+REJECTION_PREFIX_V6 = 64  # IPv6 /64
+MAX_REJECTION_PREFIXES = 1024  # 指标中单独列出的前缀数，超出后归入 "other"
+ACCEPT_SOURCES_SWEEP_MIN = 1024  # 来源状态表达到这个大小后才开始清理
+
+
+class SourceState:
+    """单个来源 IP 的连接计数和新建速率令牌桶"""
+
+    __slots__ = ('connections', 'bucket')
+
+    def __init__(self):
+        self.connections = 0
+        self.bucket: Optional[TokenBucket] = None
+
+
+class AcceptFilter:
+    """
+    接受连接时的来源过滤，TunnelServer 持有一个实例
+
+    在 handle_client 中、发送 220 问候和 TLS 握手之前检查拒绝表、允许表、
+    每个来源 IP 的并发连接数和新建速率；和准入控制一样只做查表和计数。
+    没有连接且令牌桶已经补满的来源在状态表增长到一倍时清理，扫描器的大量来源不会一直占用内存。
+    """
+
+    # 拒绝原因（指标的 reason 标签）
+    REASON_DENIED = 'denied'
+    REASON_NOT_ALLOWED = 'not_allowed'
+    REASON_CONNECTIONS = 'connections'
+    REASON_RATE = 'rate'
+
+    def __init__(self, config: AcceptFilterConfig, rejections: Optional[CounterMetric] = None):
+        """
+        初始化来源过滤
+
+        参数:
+            config: accept_filter 配置
+            rejections: 按 (前缀, 原因) 统计拒绝次数的计数器（可选）
+        """
+        self.allow = [ipaddress.ip_network(entry, strict=False) for entry in config.allow]
+        self.deny = [ipaddress.ip_network(entry, strict=False) for entry in config.deny]
+        self.max_connections = config.max_connections_per_ip
+        self.rate = config.connection_rate_per_ip
+        self.burst = config.connection_burst_per_ip or max(1.0, self.rate)
+        self.active = bool(self.allow or self.deny or self.max_connections or self.rate)  # 未配置时跳过检查
+        self.sources: Dict[object, SourceState] = {}
+        self.sweep_at = ACCEPT_SOURCES_SWEEP_MIN
+        self.rejections = rejections
+        self.rejection_prefixes = set()
+
+    @staticmethod
+    def _address(ip: str):
+        """解析来源地址，IPv4 映射的 IPv6 地址按 IPv4 处理；无法解析时返回 None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        return getattr(address, 'ipv4_mapped', None) or address
+
+    def admit(self, ip: str) -> Optional[str]:
+        """
+        检查来源并占用一个连接名额
+
+        参数:
+            ip: 来源 IP（无法解析的地址，例如 Unix 套接字，不做检查）
+
+        返回:
+            None 表示允许（连接结束时调用 release），否则为拒绝原因
+        """
+        address = self._address(ip)
+        if address is None:
+            return None
+        if any(address in network for network in self.deny):
+            return self._reject(address, self.REASON_DENIED)
+        if self.allow and not any(address in network for network in self.allow):
+            return self._reject(address, self.REASON_NOT_ALLOWED)
+        if not (self.max_connections or self.rate):
+            return None
+
+        state = self.sources.get(address)
+        if state is None:
+            if len(self.sources) >= self.sweep_at:
+                self._sweep()
+            state = self.sources[address] = SourceState()
+        if self.max_connections and state.connections >= self.max_connections:
+            return self._reject(address, self.REASON_CONNECTIONS)
+        if self.rate:
+            if state.bucket is None:
+                state.bucket = TokenBucket(self.rate, self.burst)
+            if not state.bucket.try_consume():
+                return self._reject(address, self.REASON_RATE)
+        state.connections += 1
         return None
-    frame_type, channel_id, payload_len = struct.unpack('>BHH', data[:5])
-    return frame_type, channel_id, payload_len
 
-FRAME_HEADER_SIZE = 5  # 帧头部大小
+    def release(self, ip: str):
+        """连接结束时释放 admit 占用的名额"""
+        address = self._address(ip)
+        state = self.sources.get(address)
+        if state is None:
+            return
+        state.connections -= 1
+        if not state.connections and state.bucket is None:
+            del self.sources[address]
+
+    def _reject(self, address, reason: str) -> str:
+        """按来源前缀记录一次拒绝"""
+        if self.rejections is not None:
+            length = REJECTION_PREFIX_V4 if address.version == 4 else REJECTION_PREFIX_V6
+            prefix = str(ipaddress.ip_network((address, length), strict=False))
+            if prefix not in self.rejection_prefixes:
+                if len(self.rejection_prefixes) >= MAX_REJECTION_PREFIXES:
+                    prefix = 'other'
+                else:
+                    self.rejection_prefixes.add(prefix)
+            self.rejections.labels(prefix, reason).inc()
+        return reason
+
+    def _sweep(self):
+        """清理没有连接且令牌桶已补满的来源"""
+        now = time.monotonic()
+        for address, state in list(self.sources.items()):
+            bucket = state.bucket
+            if not state.connections and (bucket is None
+                                          or bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity):
+                del self.sources[address]
+        self.sweep_at = max(ACCEPT_SOURCES_SWEEP_MIN, 2 * len(self.sources))
+
+
+# ============================================================================
+# DNS 解析器端点
+# ============================================================================
+
+
+
+def get_dns_upstream(resolver: str = '') -> tuple:
+    """
+    获取上游 DNS 解析器地址
+
+    参数:
+        resolver: "主机:端口" 或 "主机"，为空时读取 /etc/resolv.conf 的第一个 nameserver
+
+    返回:
+        (主机, 端口) 元组
+
+    异常:
+        ValueError: 主机为空或端口无效（main 在加载配置时调用一次，启动时即报错）
+    """
+    if not resolver:
+        try:
+            with open('/etc/resolv.conf', 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 2 and parts[0] == 'nameserver':
+                        return parts[1], 53
+        except OSError:
+            pass
+        return '8.8.8.8', 53
+
+    if resolver.startswith('['):
+        host, _, rest = resolver[1:].partition(']')
+        if rest and not rest.startswith(':'):
+            raise ValueError(f"无效的 DNS 解析器地址: {resolver!r}")
+        port = rest[1:] if rest else '53'
+    elif resolver.count(':') == 1:
+        host, _, port = resolver.partition(':')
+    else:
+        host, port = resolver, '53'
+    if not host or not port.isdigit() or not 0 < int(port) <= 65535:
+        raise ValueError(f"无效的 DNS 解析器地址: {resolver!r}")
+    return host, int(port)
+
+
+class _DNSQueryProtocol(asyncio.DatagramProtocol):
+    """单次 UDP DNS 查询: 收到第一个 ID 匹配的响应后完成 future"""
+
+    def __init__(self, query: bytes, future: asyncio.Future):
+        self.query = query
+        self.future = future
+
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+
+    def datagram_received(self, data, addr):
+        if len(data) >= 2 and data[:2] == self.query[:2] and not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+async def query_dns_upstream(query: bytes, upstream: tuple, timeout: float = 5.0) -> bytes:
+    """
+    向上游解析器发送原始 DNS 查询报文并返回原始响应
+
+    参数:
+        query: DNS 查询报文
+        upstream: (主机, 端口) 元组
+        timeout: 超时时间（秒）
+
+    返回:
+        DNS 响应报文
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _DNSQueryProtocol(query, future),
+        remote_addr=upstream
+    )
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    finally:
+        transport.close()
 
 
 # ============================================================================
@@ -72,9 +503,99 @@ class Channel:
     channel_id: int  # 通道 ID
     host: str  # 目标主机
     port: int  # 目标端口
-    reader: Optional[asyncio.StreamReader] = None  # 读取器
-    writer: Optional[asyncio.StreamWriter] = None  # 写入器
+    transport: Optional[asyncio.Transport] = None  # 目标连接的传输层
+    protocol: Optional['ChannelProtocol'] = None  # 目标连接的协议（数据回调和反压）
     connected: bool = False  # 连接状态
+    compressor: Optional[ChannelCompressor] = None  # 发送方向压缩器
+    decompressor: Optional[ChannelDecompressor] = None  # 接收方向解压器
+    download_bucket: Optional[TokenBucket] = None  # 单通道下载限速
+    eof_sent: bool = False  # 目标已发送 FIN，已向客户端发送 HALF_CLOSE
+    eof_received: bool = False  # 客户端已发送 HALF_CLOSE，已向目标写入 FIN
+    last_activity: float = 0.0  # 最近一次收到目标数据的时间（事件循环时钟）
+    read_tuner: Optional[ReadSizeTuner] = None  # 每次读取目标的字节数（即 DATA 帧的最大负载），按流量调整
+
+
+class ChannelProtocol(asyncio.BufferedProtocol):
+    """
+    目标连接的协议: 数据到达时在回调中直接编码成帧写入隧道，每个通道不占用任务和协程
+
+    目标数据直接读入帧缓冲区池中的缓冲区，前面留出帧头空间: 回调里原地填写帧头，
+    整帧以一个视图交给隧道写入器，转发的每个字节在加密前只复制一次（TLS 或内层加密读取它时）；
+    隧道连接已有积压时交出副本（见 BufferPool）。缓冲区只在读取期间占用，写入后归还，
+    空闲的通道不持有缓冲区
+
+    暂停读取的原因按位记录（等待 CONNECT_OK、下载限速、隧道下行积压），全部解除后才恢复读取；
+    目标不读取时传输层调用 pause_writing()，_handle_data 通过 drain() 等待
+    """
+
+    __slots__ = ('session', 'channel', 'transport', 'blocked', 'write_paused', 'drain_waiter', 'buffer')
+
+    BLOCK_CONNECTING = 1  # 已连接，CONNECT_OK 尚未发送
+    BLOCK_THROTTLED = 2  # 下载限速透支
+    BLOCK_BACKLOG = 4  # 隧道下行积压
+
+    def __init__(self, session: 'TunnelSession', channel: Channel):
+        self.session = session
+        self.channel = channel
+        self.transport: Optional[asyncio.Transport] = None
+        self.blocked = self.BLOCK_CONNECTING
+        self.write_paused = False
+        self.drain_waiter: Optional[asyncio.Future] = None
+        self.buffer: Optional[bytearray] = None  # get_buffer() 取出、尚未收到数据的缓冲区
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        transport.pause_reading()  # CONNECT_OK 之前到达的数据不能先于它发给客户端
+
+    def block(self, reason: int):
+        """因 reason 暂停读取目标连接"""
+        if not self.blocked:
+            self.transport.pause_reading()
+        self.blocked |= reason
+
+    def unblock(self, reason: int):
+        """解除 reason，没有其他原因时恢复读取"""
+        if not self.blocked & reason:
+            return
+        self.blocked &= ~reason
+        if not self.blocked:
+            self.transport.resume_reading()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        # 没有读到数据（EAGAIN）时缓冲区留到下一次读取
+        size = self.channel.read_tuner.size
+        if self.buffer is None:
+            self.buffer = self.session.buffer_pool.acquire(size)
+        return memoryview(self.buffer)[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + size]
+
+    def buffer_updated(self, nbytes: int):
+        buffer, self.buffer = self.buffer, None
+        self.session._channel_data(self.channel, buffer, nbytes)
+
+    def eof_received(self) -> bool:
+        return self.session._channel_eof(self.channel)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if self.drain_waiter and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+        if self.buffer is not None:
+            self.session.buffer_pool.release(self.buffer)
+            self.buffer = None
+        self.session._channel_lost(self.channel)
+
+    def pause_writing(self):
+        self.write_paused = True
+
+    def resume_writing(self):
+        self.write_paused = False
+        if self.drain_waiter and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+
+    async def drain(self):
+        """等待目标连接的写缓冲降到低水位（连接断开时立即返回）"""
+        if self.write_paused and not self.transport.is_closing():
+            self.drain_waiter = asyncio.get_running_loop().create_future()
+            await self.drain_waiter
 
 
 # ============================================================================
@@ -90,7 +611,12 @@ class TunnelSession:
         writer: asyncio.StreamWriter,
         config: ServerConfig,
         ssl_context: ssl.SSLContext,
-        users: Dict[str, UserConfig]
+        users: Dict[str, UserConfig],
+        metrics: Optional[ServerMetrics] = None,
+        rate_limiters: Optional[RateLimiters] = None,
+        admission_control: Optional[AdmissionControl] = None,
+        crypto_offload: Optional[CryptoOffload] = None,
+        buffer_pool: Optional[BufferPool] = None
     ):
         """初始化隧道会话"""
         self.reader = reader
@@ -100,13 +626,42 @@ class TunnelSession:
         self.users = users
         self.authenticated = False  # 认证状态
         self.binary_mode = False  # 二进制模式标志
+        self.mail_mode = False  # DATA 传输模式标志（客户端认证后直接开始邮件事务）
+        self.pending_command: Optional[str] = None  # 握手阶段已读取的第一条 MAIL 命令
+        self.frame_writer = writer  # 帧的输出: 连接本身、BatchSealer（内层加密）或 FrameSpool（邮件传输模式）
         self.channels: Dict[int, Channel] = {}  # 通道字典
+        self.backlogged: List[ChannelProtocol] = []  # 因隧道下行超过高水位暂停读取的通道
+        self.backlog_task: Optional[asyncio.Task] = None  # 等待积压写出后恢复这些通道
+        self.backlog_rounds = 0  # 积压恢复的轮数（决定下一轮从哪个通道开始恢复）
+        self.idle_task: Optional[asyncio.Task] = None  # 关闭空闲通道（第一个通道打开时启动）
         self.write_lock = asyncio.Lock()  # 写入锁
+        self.capabilities: Dict[str, list] = {}  # BINARY 时协商启用的扩展能力
+        self.compression: Optional[str] = None  # 协商的压缩算法
+        self.keepalive: Optional[KeepaliveMonitor] = None  # 协商了 PING 且启用探测时创建
+        self.stealth: Optional[StealthScheduler] = None  # 启用隐蔽模式且客户端支持 PADDING 时创建
+        self.sealer: Optional[BatchSealer] = None  # 协商了 SEAL 时的下行内层加密
+        self.opener: Optional[BatchOpener] = None  # 协商了 SEAL 时的上行内层解密
+        self.crypto_offload = crypto_offload  # 内层加密线程池（跨会话共享）
+        self.buffer_pool = buffer_pool or BufferPool()  # 帧缓冲区池（跨会话共享）
+        self.dns_tasks: Set[asyncio.Task] = set()  # 进行中的 DNS 查询（最多 performance.max_dns_inflight 个）
+        self.dns_upstream: Optional[tuple] = None  # 上游 DNS 解析器（首次查询时确定）
 
         # 用户信息（认证后设置）
         self.username: Optional[str] = None
         self.user_config: Optional[UserConfig] = None
 
+        # 运行指标（用户序列在认证后确定）
+        self.metrics = metrics or ServerMetrics()
+        self.user_metrics = self.metrics.for_user(ServerMetrics.ANONYMOUS_USER)
+
+        # 限速（认证后按用户确定，None 表示不限速）
+        self.rate_limiters = rate_limiters or RateLimiters()
+        self.rate_limiter: Optional[UserRateLimiter] = None
+
+        # 准入控制（认证后按用户确定，None 表示不限制）
+        self.admission_control = admission_control or AdmissionControl()
+        self.admission: Optional[UserAdmission] = None
+
         # 获取客户端信息
         peer = writer.get_extra_info('peername')
         self.client_ip = peer[0] if peer else "unknown"
@@ -127,16 +682,25 @@ class TunnelSession:
     async def run(self):
         """主会话处理器"""
         logger.info(f"来自 {self.peer_str} 的连接")
+        self.metrics.connections.inc()
+        self.metrics.sessions_active.inc()
+        started = time.monotonic()
 
         try:
             # 阶段 1: SMTP 握手
             if not await self._smtp_handshake():
                 return
 
-            self._log(logging.INFO, f"已认证，进入二进制模式: {self.peer_str}")
+            self.metrics.handshake_seconds.observe(time.monotonic() - started)
+            self.user_metrics.sessions.inc()
 
-            # 阶段 2: 二进制流模式
-            await self._binary_mode()
+            # 阶段 2: 二进制流模式或邮件传输模式（DATA / BDAT）
+            if self.mail_mode:
+                self._log(logging.INFO, f"已认证，进入邮件传输模式: {self.peer_str}")
+                await self._mail_mode()
+            else:
+                self._log(logging.INFO, f"已认证，进入二进制模式: {self.peer_str}")
+                await self._binary_mode()
 
         except asyncio.CancelledError:
             pass
@@ -144,6 +708,9 @@ class TunnelSession:
             self._log(logging.ERROR, f"会话错误: {e}")
         finally:
             await self._cleanup()
+            if self.admission:
+                self.admission.release_session()
+            self.metrics.sessions_active.dec()
             self._log(logging.INFO, f"会话结束: {self.peer_str}")
 
     async def _smtp_handshake(self) -> bool:
@@ -183,6 +750,10 @@ class TunnelSession:
 
             await self._send_line(f"250-{self.config.hostname}")
             await self._send_line("250-AUTH PLAIN LOGIN")
+            await self._send_line(f"250-{TUNNEL_EHLO_KEYWORD} {format_capabilities(self._offered_capabilities())}")
+            await self._send_line("250-PIPELINING")
+            await self._send_line("250-CHUNKING")
+            await self._send_line("250-BINARYMIME")
             await self._send_line("250 8BITMIME")
 
             # 等待 AUTH
@@ -193,6 +764,7 @@ class TunnelSession:
             # 解析认证令牌
             parts = line.split(' ', 2)
             if len(parts) < 3:
+                self.metrics.auth_failures.inc()
                 await self._send_line("535 5.7.8 Authentication failed")
                 return False
 
@@ -203,6 +775,7 @@ class TunnelSession:
 
             if not valid or not username:
                 logger.warning(f"来自 {self.peer_str} 的认证失败")
+                self.metrics.auth_failures.inc()
                 await self._send_line("535 5.7.8 Authentication failed")
                 return False
 
@@ -215,25 +788,99 @@ class TunnelSession:
                 user_whitelist = IPWhitelist(self.user_config.whitelist)
                 if not user_whitelist.is_allowed(self.client_ip):
                     logger.warning(f"用户 {username} 不允许从 IP {self.client_ip} 访问")
+                    self.metrics.auth_failures.inc()
                     await self._send_line("535 5.7.8 Authentication failed")
                     return False
 
+            if not self.user_config or self.user_config.logging:
+                self.user_metrics = self.metrics.for_user(username)
+
+            # 检查该用户的同时在线会话数
+            admission = self.admission_control.for_user(self.user_config)
+            if admission:
+                if not admission.acquire_session():
+                    self._log(logging.WARNING, f"会话数已达上限 {admission.max_sessions}，拒绝 {self.peer_str}")
+                    self.user_metrics.rejected_sessions.inc()
+                    await self._send_line("421 4.7.0 Too many concurrent sessions")
+                    return False
+                self.admission = admission
+
             await self._send_line("235 2.7.0 Authentication successful")
             self.authenticated = True
+            self.rate_limiter = self.rate_limiters.for_user(self.user_config)
 
             # 信号二进制模式 - 客户端发送特殊标记
+            # 新版本客户端在 BINARY 之后附带请求的扩展能力
             line = await self._read_line()
-            if line == "BINARY":
-                await self._send_line("299 Binary mode activated")
+            if line and (line == "BINARY" or line.startswith("BINARY ")):
+                requested = parse_capabilities(line[len("BINARY"):])
+                self.capabilities = self._negotiate_capabilities(requested)
+                if CAP_COMPRESS in self.capabilities:
+                    self.compression = self.capabilities[CAP_COMPRESS][0]
+                accepted = format_capabilities(self.capabilities)
+                await self._send_line(f"{BINARY_OK_LINE} {accepted}" if accepted else BINARY_OK_LINE)
+                if CAP_SEAL in self.capabilities:
+                    # 299 之后双方的字节流都是内层加密记录
+                    self._start_seal(requested[CAP_SEAL][0], self.capabilities[CAP_SEAL][0])
                 self.binary_mode = True
                 return True
 
+            # DATA 传输模式: 客户端直接开始第一封邮件，能力在该邮件的头部中协商
+            if line and line.upper().startswith('MAIL FROM:'):
+                self.pending_command = line
+                self.mail_mode = True
+                return True
+
             return False
 
         except Exception as e:
             logger.error(f"握手错误: {e}")
             return False
 
+    def _offered_capabilities(self) -> Dict[str, list]:
+        """EHLO 中通告的扩展能力（按服务器配置过滤）"""
+        return {
+            name: values for name, values in SERVER_CAPABILITIES.items()
+            if (name != CAP_COMPRESS or self.config.compression)
+            and (name != CAP_SEAL or self.config.inner_encryption)
+        }
+
+    def _negotiate_capabilities(self, requested: Dict[str, list]) -> Dict[str, list]:
+        """
+        从客户端请求的能力中选出启用的能力
+
+        压缩能力只保留一个算法: 客户端列表中第一个服务器支持的算法;
+        内层加密只用于二进制模式，回复服务端的会话随机数
+        """
+        offered = self._offered_capabilities()
+        accepted = {}
+        for name, values in requested.items():
+            if name not in offered:
+                continue
+            if name == CAP_COMPRESS:
+                algorithm = choose_compression(values)
+                if not algorithm:
+                    continue
+                values = [algorithm]
+            if name == CAP_SEAL:
+                if self.mail_mode or len(values) != 1 or len(values[0]) != SEAL_SALT_SIZE * 2:
+                    continue
+                try:
+                    bytes.fromhex(values[0])
+                except ValueError:
+                    continue
+                values = [os.urandom(SEAL_SALT_SIZE).hex()]
+            accepted[name] = values
+        return accepted
+
+    def _start_seal(self, client_salt: str, server_salt: str):
+        """用双方的会话随机数派生密钥，启用内层加密"""
+        salt = bytes.fromhex(client_salt) + bytes.fromhex(server_salt)
+        send_cipher, recv_cipher = TunnelCrypto(self.user_config.secret, is_server=True).session_ciphers(salt)
+        self.sealer = BatchSealer(self.writer, send_cipher, self.crypto_offload)
+        self.opener = BatchOpener(recv_cipher, self.crypto_offload)
+        self.frame_writer = self.sealer
+
     async def _upgrade_tls(self):
         """升级连接到 TLS"""
         transport = self.writer.transport
@@ -258,7 +905,8 @@ class TunnelSession:
     async def _read_line(self) -> Optional[str]:
         """读取 SMTP 行"""
         try:
-            data = await asyncio.wait_for(self.reader.readline(), timeout=60.0)
+            data = await asyncio.wait_for(self.reader.readline(),
+                                          timeout=self.config.performance.tunnel_read_timeout)
             if not data:
                 return None
             return data.decode('utf-8', errors='replace').strip()
@@ -274,44 +922,252 @@ class TunnelSession:
 
     async def _binary_mode(self):
         """处理二进制流模式 - 这是快速模式"""
-        buffer = b''  # 数据缓冲区
+        decoder = FrameDecoder()
+        user_metrics = self.user_metrics
+        upload_bucket = self.rate_limiter.upload if self.rate_limiter else None
+
+        # 主动保活探测: 客户端失联时几秒内回收会话
+        keepalive_task = self._start_keepalive()
+        keepalive = self.keepalive
+
+        opener = self.opener
+        # 隧道连接的读取大小: 批量上传时加大，减少读取和解密的次数；上传限速时不加大
+        performance = self.config.performance
+        read_tuner = ReadSizeTuner(TUNNEL_READ_SIZE_MIN, performance.tunnel_read_size_max, TUNNEL_READ_SIZE_MIN)
+        read_timeout = performance.tunnel_read_timeout
+
+        # 隧道连接写缓冲的水位: 超过高水位时暂停读取全部目标连接，降到低水位后恢复
+        self.writer.transport.set_write_buffer_limits(performance.write_buffer_high, performance.write_buffer_low)
+
+        # 隐蔽模式: 下行帧经时隙调度、合并和填充后发送（启用内层加密时整批再加密）
+        if self.config.stealth_enabled:
+            if CAP_PADDING in self.capabilities:
+                self.stealth = StealthScheduler(self.frame_writer, self.config.stealth,
+                                                self.user_metrics.padding_sent)
+                self.stealth.start()
+            else:
+                self._log(logging.DEBUG, "客户端不支持 PADDING，本会话不启用隐蔽模式")
 
-        while True:
-            # 读取数据
-            try:
-                chunk = await asyncio.wait_for(self.reader.read(65536), timeout=60.0)
-                if not chunk:
-                    self._log(logging.DEBUG, "客户端关闭连接")
+        try:
+            while True:
+                # 读取数据
+                try:
+                    chunk = await asyncio.wait_for(self.reader.read(read_tuner.size), timeout=read_timeout)
+                    if not chunk:
+                        self._log(logging.DEBUG, "客户端关闭连接")
+                        break
+                    decoder.feed(await opener.feed_async(chunk) if opener else chunk)
+                    user_metrics.bytes_received.inc(len(chunk))
+                    if keepalive:
+                        keepalive.activity = True
+                    if read_tuner.record(len(chunk), upload_bucket is not None):
+                        self._log(logging.DEBUG, f"隧道连接读取大小调整为 {read_tuner.size} 字节")
+                except asyncio.TimeoutError:
+                    # 检查连接是否仍然活跃
+                    if self.writer.is_closing():
+                        break
+                    continue
+                except (ConnectionResetError, BrokenPipeError, OSError) as e:
+                    self._log(logging.DEBUG, f"连接错误: {e}")
                     break
-                buffer += chunk
-            except asyncio.TimeoutError:
-                # 检查连接是否仍然活跃
-                if self.writer.is_closing():
+                except ValueError as e:
+                    self._log(logging.WARNING, f"内层加密错误，断开会话: {e}")
                     break
-                continue
-            except (ConnectionResetError, BrokenPipeError, OSError) as e:
-                self._log(logging.DEBUG, f"连接错误: {e}")
-                break
 
-            # 处理完整的帧
-            while len(buffer) >= FRAME_HEADER_SIZE:
-                header = parse_frame_header(buffer)
-                if not header:
-                    break
+                # 处理完整的帧（不完整的帧留在解码器中等待更多数据）
+                for frame_type, channel_id, payload in decoder:
+                    user_metrics.frames_received.inc()
+                    await self._handle_frame(frame_type, channel_id, payload)
+
+                # 上传限速: 已收到的数据照常转发，透支时暂停读取隧道连接
+                if upload_bucket:
+                    delay = upload_bucket.consume(len(chunk))
+                    if delay > 0:
+                        user_metrics.throttled_upload.inc(delay)
+                        await asyncio.sleep(delay)
+                        if keepalive:
+                            keepalive.activity = True  # 主动暂停读取期间不计为无响应
+        finally:
+            if keepalive_task:
+                keepalive_task.cancel()
+            if self.stealth:
+                self.stealth.stop()
+                self._log(logging.DEBUG, f"隐蔽模式统计: {self.stealth.stats()}")
+            if self.sealer:
+                await self.sealer.join()
+
+    def _start_keepalive(self) -> Optional[asyncio.Task]:
+        """协商了 PING 且启用探测时启动保活任务"""
+        if CAP_PING not in self.capabilities or self.config.keepalive_interval <= 0:
+            return None
+        self.keepalive = KeepaliveMonitor(self.config.keepalive_interval, self.config.keepalive_misses)
+        return asyncio.create_task(self._keepalive_loop(self.keepalive))
+
+    async def _mail_mode(self):
+        """
+        DATA / BDAT 传输模式: 每封邮件的附件是一段上行帧流，邮件结束后的 250 响应携带下行帧流
 
-                frame_type, channel_id, payload_len = header
-                total_len = FRAME_HEADER_SIZE + payload_len
+        比二进制模式慢（base64 开销、每封邮件一次往返），用于只放行真实邮件事务的网络；
+        客户端每封邮件可以用 DATA 或 BDAT 发送，服务端都接受
+        """
+        decoder = FrameDecoder()
+        spool = FrameSpool(MAIL_MESSAGE_MAX)
+        spool.flusher = asyncio.current_task()
+        self.frame_writer = spool
+        keepalive_task = None
+        negotiated = False
 
-                # 如果数据不足，等待更多数据
-                if len(buffer) < total_len:
+        try:
+            while True:
+                message = await self._receive_mail(decoder)
+                if message is None:
                     break
 
-                # 提取负载并更新缓冲区
-                payload = buffer[FRAME_HEADER_SIZE:total_len]
-                buffer = buffer[total_len:]
+                extra_lines = []
+                if not negotiated:
+                    # 第一封邮件: 按邮件头协商能力
+                    requested = parse_capabilities(message.headers.get(MAIL_CAPABILITIES_HEADER.lower(), ''))
+                    self.capabilities = self._negotiate_capabilities(requested)
+                    if CAP_COMPRESS in self.capabilities:
+                        self.compression = self.capabilities[CAP_COMPRESS][0]
+                    extra_lines.append(f"{TUNNEL_EHLO_KEYWORD} {format_capabilities(self.capabilities)}")
+                    negotiated = True
+                    keepalive_task = self._start_keepalive()
+
+                await self._send_mail_reply(spool, extra_lines)
+        except ValueError as e:
+            self._log(logging.WARNING, f"邮件格式错误: {e}")
+            await self._send_line("554 5.6.0 Message content rejected")
+        except (ConnectionResetError, BrokenPipeError, OSError, asyncio.IncompleteReadError) as e:
+            self._log(logging.DEBUG, f"连接错误: {e}")
+        finally:
+            if keepalive_task:
+                keepalive_task.cancel()
+            spool.close()
 
-                # 处理帧
-                await self._handle_frame(frame_type, channel_id, payload)
+    async def _receive_mail(self, decoder: FrameDecoder) -> Optional[MIMEStreamDecoder]:
+        """
+        处理一封邮件的 SMTP 命令并流式处理正文中的帧
+
+        返回:
+            邮件的解码器（含邮件头），客户端 QUIT 或连接断开时返回 None
+        """
+        # 流水线发送的 MAIL / RCPT / DATA（或第一个 BDAT）逐条应答
+        while True:
+            line, self.pending_command = self.pending_command, None
+            if line is None:
+                line = await self._read_line()
+            if line is None:
+                return None
+            if self.keepalive:
+                self.keepalive.activity = True
+            verb = line[:4].upper()
+            if verb == 'MAIL':
+                await self._send_line("250 2.1.0 Ok")
+            elif verb == 'RCPT':
+                await self._send_line("250 2.1.5 Ok")
+            elif verb == 'DATA':
+                await self._send_line("354 End data with <CR><LF>.<CR><LF>")
+                body = self._iter_data_body()
+                break
+            elif verb == 'BDAT':
+                body = self._iter_bdat_body(line)
+                break
+            elif verb in ('NOOP', 'RSET'):
+                await self._send_line("250 2.0.0 Ok")
+            elif verb == 'QUIT':
+                await self._send_line("221 2.0.0 Bye")
+                return None
+            else:
+                await self._send_line("502 5.5.2 Error: command not recognized")
+
+        message = MIMEStreamDecoder()
+        user_metrics = self.user_metrics
+        upload_bucket = self.rate_limiter.upload if self.rate_limiter else None
+        async for chunk in body:
+            user_metrics.bytes_received.inc(len(chunk))
+            if self.keepalive:
+                self.keepalive.activity = True
+            data = message.feed(chunk)
+            if data:
+                decoder.feed(data)
+                for frame_type, channel_id, payload in decoder:
+                    user_metrics.frames_received.inc()
+                    await self._handle_frame(frame_type, channel_id, payload)
+
+            if upload_bucket:
+                delay = upload_bucket.consume(len(chunk))
+                if delay > 0:
+                    user_metrics.throttled_upload.inc(delay)
+                    await asyncio.sleep(delay)
+        message.finish()
+        return message
+
+    async def _iter_data_body(self):
+        """
+        逐块读取 DATA 正文直到结束标记
+
+        每块不超过读取器的缓冲上限，结束标记之后的数据留在读取器中。
+        正文中不会出现以 "." 开头的行（base64、MIME 头和边界行都不以 "." 开头），
+        附件解码也会忽略非 base64 字符，因此不做点号反转义
+        """
+        timeout = self.config.performance.tunnel_read_timeout
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.reader.readuntil(SMTP_DATA_END), timeout=timeout)
+            except asyncio.LimitOverrunError as e:
+                # 还没有结束标记: 先取走不可能属于结束标记的部分
+                yield await self.reader.readexactly(e.consumed)
+                continue
+            except asyncio.TimeoutError:
+                raise ConnectionResetError("等待邮件正文超时")
+            yield chunk[:-3]  # 保留最后一行的 CRLF
+            return
+
+    async def _iter_bdat_body(self, line: str):
+        """
+        逐块读取 BDAT 块（RFC 3030）直到 LAST 块
+
+        块内是原始字节，不需要扫描结束标记；非 LAST 块读完后立即应答，
+        LAST 块的应答（携带下行帧流）由 _send_mail_reply 发送
+
+        参数:
+            line: 第一个 BDAT 命令行
+        """
+        while True:
+            parts = line.split()
+            if (len(parts) not in (2, 3) or parts[0].upper() != 'BDAT' or not parts[1].isdigit()
+                    or (len(parts) == 3 and parts[2].upper() != 'LAST')):
+                raise ValueError(f"无效的 BDAT 命令: {line[:64]}")
+            size = int(parts[1])
+            remaining = size
+            while remaining:
+                try:
+                    chunk = await asyncio.wait_for(self.reader.read(min(remaining, BDAT_READ_SIZE)),
+                                                   timeout=self.config.performance.tunnel_read_timeout)
+                except asyncio.TimeoutError:
+                    raise ConnectionResetError("等待 BDAT 块超时")
+                if not chunk:
+                    raise ConnectionResetError("BDAT 块未完成时连接关闭")
+                remaining -= len(chunk)
+                yield chunk
+            if len(parts) == 3:
+                return
+            await self._send_line(f"250 2.0.0 Ok: {size} octets received")
+            line = await self._read_line()
+            if line is None:
+                raise ConnectionResetError("BDAT 块之间连接关闭")
+
+    async def _send_mail_reply(self, spool: FrameSpool, extra_lines: list):
+        """邮件结束后的 250 响应，以 "250-" base64 行携带下行帧流"""
+        encoder = Base64LineEncoder(b'250-')
+        data = spool.take(MAIL_MESSAGE_MAX)
+        reply = [f"250-{line}\r\n".encode() for line in extra_lines]
+        reply.append(encoder.encode(data))
+        reply.append(encoder.flush())
+        reply.append(f"250 2.0.0 Ok: queued as {os.urandom(5).hex().upper()}\r\n".encode())
+        self.writer.write(b''.join(reply))
+        await self.writer.drain()
 
     async def _handle_frame(self, frame_type: int, channel_id: int, payload: bytes):
         """处理二进制帧"""
@@ -319,8 +1175,47 @@ class TunnelSession:
             await self._handle_connect(channel_id, payload)
         elif frame_type == FRAME_DATA:
             await self._handle_data(channel_id, payload)
+        elif frame_type == FRAME_DATA_Z and self.compression:
+            await self._handle_compressed_data(channel_id, payload)
         elif frame_type == FRAME_CLOSE:
             await self._handle_close(channel_id)
+        elif frame_type == FRAME_HALF_CLOSE and CAP_HALF_CLOSE in self.capabilities:
+            await self._handle_half_close(channel_id)
+        elif frame_type == FRAME_DNS_QUERY and CAP_DNS in self.capabilities:
+            # 不阻塞帧处理循环；进行中的查询已满时立即返回空负载（客户端回复 SERVFAIL）
+            if len(self.dns_tasks) >= self.config.performance.max_dns_inflight:
+                self.metrics.dns_failures.inc()
+                await self._send_frame(FRAME_DNS_RESPONSE, channel_id)
+            else:
+                task = asyncio.create_task(self._handle_dns_query(channel_id, payload))
+                self.dns_tasks.add(task)
+                task.add_done_callback(self.dns_tasks.discard)
+        elif frame_type == FRAME_PING:
+            await self._send_frame(FRAME_PONG, channel_id, payload)
+        elif frame_type == FRAME_PONG and self.keepalive:
+            rtt = self.keepalive.on_pong(payload)
+            if rtt is not None:
+                self.metrics.rtt_seconds.observe(rtt)
+        elif frame_type == FRAME_PADDING:
+            pass  # 客户端隐蔽模式的填充，直接丢弃
+
+    async def _keepalive_loop(self, keepalive: KeepaliveMonitor):
+        """定期发送 PING，连续无响应时中断连接使会话结束"""
+        while not self.writer.is_closing():
+            await asyncio.sleep(keepalive.interval)
+            if keepalive.tick():
+                self._log(logging.WARNING,
+                          f"{self.peer_str} 连续 {keepalive.missed} 个保活间隔无响应，关闭会话")
+                self.metrics.dead_sessions.inc()
+                self.writer.transport.abort()
+                return
+            try:
+                # 对端不再读取时 drain 会一直阻塞，不能让它卡住保活计时
+                await asyncio.wait_for(
+                    self._send_frame(FRAME_PING, 0, keepalive.make_ping()), timeout=keepalive.interval
+                )
+            except asyncio.TimeoutError:
+                pass
 
     async def _handle_connect(self, channel_id: int, payload: bytes):
         """处理 CONNECT 请求"""
@@ -332,12 +1227,25 @@ class TunnelSession:
             return
         
         # 检查通道数量限制
-        MAX_CHANNELS = 1000
-        if len(self.channels) >= MAX_CHANNELS:
-            logger.warning(f"通道数量超过限制: {len(self.channels)} >= {MAX_CHANNELS}")
+        max_channels = self.config.performance.max_channels_per_session
+        if len(self.channels) >= max_channels:
+            logger.warning(f"通道数量超过限制: {len(self.channels)} >= {max_channels}")
             await self._send_frame(FRAME_CONNECT_FAIL, channel_id, b'Too many channels')
             return
-        
+
+        # 用户级准入控制: 在解析和连接目标之前拒绝
+        if self.admission:
+            reason = self.admission.acquire_channel()
+            if reason:
+                self._log(logging.DEBUG, f"拒绝 ch={channel_id}: {reason.decode()}")
+                if reason is UserAdmission.REASON_CHANNELS:
+                    self.user_metrics.rejected_channels.inc()
+                else:
+                    self.user_metrics.rejected_connect_rate.inc()
+                await self._send_frame(FRAME_CONNECT_FAIL, channel_id, reason)
+                return
+
+        opened = False
         try:
             # 解析: 主机长度(1) + 主机名 + 端口(2)
             host_len = payload[0]
@@ -377,32 +1285,46 @@ class TunnelSession:
             logger.info(f"连接 ch={channel_id} -> {host}:{port}")
 
             try:
-                # 连接到目标主机
-                reader, writer = await asyncio.wait_for(
-                    asyncio.open_connection(host, port),
-                    timeout=30.0
-                )
-
                 # 创建通道对象
                 channel = Channel(
                     channel_id=channel_id,
                     host=host,
                     port=port,
-                    reader=reader,
-                    writer=writer,
-                    connected=True
+                    download_bucket=self.rate_limiter.channel_bucket() if self.rate_limiter else None
                 )
-                self.channels[channel_id] = channel
 
-                # 启动从目标读取数据的任务
-                asyncio.create_task(self._channel_reader(channel))
-
-                # 发送成功响应
-                await self._send_frame(FRAME_CONNECT_OK, channel_id)
+                # 连接到目标主机: 目标数据由 ChannelProtocol 的回调直接转发，不为通道创建任务
+                loop = asyncio.get_running_loop()
+                connect_started = time.monotonic()
+                transport, protocol = await asyncio.wait_for(
+                    loop.create_connection(lambda: ChannelProtocol(self, channel), host, port),
+                    timeout=self.config.performance.connect_timeout
+                )
+                self.metrics.connect_seconds.observe(time.monotonic() - connect_started)
+
+                channel.transport = transport
+                channel.protocol = protocol
+                channel.connected = True
+                channel.last_activity = loop.time()
+                performance = self.config.performance
+                channel.read_tuner = ReadSizeTuner(performance.read_size_min, performance.read_size_max,
+                                                   CHANNEL_READ_SIZE, self.metrics.channel_read_size)
+                self.channels[channel_id] = channel
+                opened = True  # 通道名额由 _close_channel 释放
+                self.user_metrics.channels.inc()
+                self.user_metrics.channels_active.inc()
+                if self.idle_task is None:
+                    self.idle_task = asyncio.create_task(self._idle_channel_loop())
+
+                # 发送成功响应，之后才开始读取目标
+                self._write_frame(FRAME_CONNECT_OK, channel_id)
+                protocol.unblock(ChannelProtocol.BLOCK_CONNECTING)
                 logger.info(f"已连接 ch={channel_id}")
+                await self._send_frame_drain()
 
             except Exception as e:
                 logger.error(f"连接失败: {e}")
+                self.user_metrics.connect_failures.inc()
                 # 发送失败响应（限制错误消息长度）
                 await self._send_frame(FRAME_CONNECT_FAIL, channel_id, str(e).encode()[:100])
 
@@ -415,51 +1337,251 @@ class TunnelSession:
         except Exception as e:
             logger.error(f"处理连接错误: {e}")
             await self._send_frame(FRAME_CONNECT_FAIL, channel_id)
+        finally:
+            if self.admission and not opened:
+                self.admission.release_channel()
+
+    async def _handle_dns_query(self, tag: int, payload: bytes):
+        """
+        转发 DNS 查询到上游解析器，并以相同标签返回响应
+        查询失败时返回空负载，客户端据此立即回复 SERVFAIL
+        """
+        if len(payload) < 12:
+            await self._send_frame(FRAME_DNS_RESPONSE, tag)
+            return
+        if self.dns_upstream is None:
+            self.dns_upstream = get_dns_upstream(self.config.dns_resolver)
+        response = b''
+        started = time.monotonic()
+        try:
+            response = await query_dns_upstream(payload, self.dns_upstream,
+                                                 self.config.performance.dns_timeout)
+            self.metrics.dns_seconds.observe(time.monotonic() - started)
+        except Exception as e:
+            self.metrics.dns_failures.inc()
+            self._log(logging.DEBUG, f"DNS 查询失败 tag={tag}: {e}")
+        await self._send_frame(FRAME_DNS_RESPONSE, tag, response)
 
     async def _handle_data(self, channel_id: int, payload: bytes):
         """将数据转发到目标"""
         channel = self.channels.get(channel_id)
-        if channel and channel.connected and channel.writer:
+        if channel and channel.connected:
             try:
-                channel.writer.write(payload)
-                await channel.writer.drain()
+                channel.transport.write(payload)
+                await channel.protocol.drain()
             except (ConnectionResetError, BrokenPipeError, OSError) as e:
                 self._log(logging.DEBUG, f"通道 {channel_id} 写入失败: {e}")
-                await self._close_channel(channel)
+                self._close_channel(channel)
             except Exception as e:
                 self._log(logging.ERROR, f"通道 {channel_id} 意外错误: {e}")
-                await self._close_channel(channel)
+                self._close_channel(channel)
+
+    async def _handle_compressed_data(self, channel_id: int, payload: bytes):
+        """解压数据帧后转发到目标"""
+        channel = self.channels.get(channel_id)
+        if not (channel and channel.connected):
+            return
+        if channel.decompressor is None:
+            channel.decompressor = ChannelDecompressor(self.compression)
+        try:
+            data = channel.decompressor.decompress(payload)
+        except ValueError as e:
+            self._log(logging.WARNING, f"通道 {channel_id} {e}")
+            await self._send_frame(FRAME_CLOSE, channel_id)
+            self._close_channel(channel)
+            return
+        await self._handle_data(channel_id, data)
 
     async def _handle_close(self, channel_id: int):
         """关闭通道"""
         channel = self.channels.get(channel_id)
         if channel:
-            await self._close_channel(channel)
+            self._close_channel(channel)
 
-    async def _channel_reader(self, channel: Channel):
-        """从目标读取数据并发送到客户端"""
+    async def _handle_half_close(self, channel_id: int):
+        """客户端不再发送数据: 向目标写入 FIN，两个方向都结束后关闭通道"""
+        channel = self.channels.get(channel_id)
+        if not (channel and channel.connected) or channel.eof_received:
+            return
+        channel.eof_received = True
+        if channel.eof_sent or not channel.transport.can_write_eof():
+            self._close_channel(channel)
+            return
         try:
-            while channel.connected:
-                # 从目标读取数据
-                data = await asyncio.wait_for(
-                    channel.reader.read(32768),
-                    timeout=300.0
-                )
-                if not data:
-                    break
+            channel.transport.write_eof()
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            self._log(logging.DEBUG, f"通道 {channel_id} 写入 FIN 失败: {e}")
+            await self._send_frame(FRAME_CLOSE, channel_id)
+            self._close_channel(channel)
 
-                # 将数据发送到客户端
-                await self._send_frame(FRAME_DATA, channel.channel_id, data)
+    def _channel_data(self, channel: Channel, buffer: bytearray, nbytes: int):
+        """
+        ChannelProtocol 回调: 把目标数据作为帧发送到客户端
 
-        except asyncio.TimeoutError:
-            pass
-        except Exception as e:
-            logger.debug(f"通道读取器错误: {e}")
+        参数:
+            channel: 通道
+            buffer: 帧缓冲区池中的缓冲区，目标数据在帧头之后（本方法负责归还）
+            nbytes: 目标数据的字节数
+        """
+        if not channel.connected:
+            self.buffer_pool.release(buffer)
+            return
+        protocol = channel.protocol
+        channel.last_activity = asyncio.get_running_loop().time()
+        end = FRAME_HEADER_SIZE + nbytes
+        # 协商了压缩时按通道压缩，高熵数据原样发送
+        compressed = None
+        if self.compression:
+            if channel.compressor is None:
+                channel.compressor = ChannelCompressor(self.compression)
+            with memoryview(buffer) as view:
+                compressed = channel.compressor.compress(view[FRAME_HEADER_SIZE:end])
+        if compressed is not None:
+            self.buffer_pool.release(buffer)
+            self._write_frame(FRAME_DATA_Z, channel.channel_id, compressed)
+        else:
+            # 帧头原地写在数据前面，整帧一次写入
+            FRAME_HEADER.pack_into(buffer, 0, FRAME_DATA, channel.channel_id, nbytes)
+            self._write_buffer(buffer, end)
+
+        # 下载限速: 透支时暂停读取目标连接，到期由定时器恢复
+        if self.rate_limiter:
+            user_bucket = self.rate_limiter.download
+            channel_bucket = channel.download_bucket
+            delay = max(user_bucket.consume(nbytes) if user_bucket else 0.0,
+                        channel_bucket.consume(nbytes) if channel_bucket else 0.0)
+            if delay > 0:
+                self.user_metrics.throttled_download.inc(delay)
+                protocol.block(ChannelProtocol.BLOCK_THROTTLED)
+                asyncio.get_running_loop().call_later(delay, protocol.unblock, ChannelProtocol.BLOCK_THROTTLED)
+
+        # 隧道下行超过高水位: 暂停读取全部目标连接，由一个会话级任务等待降到低水位后轮流恢复
+        backlogged = self._frames_backlogged()
+        if backlogged:
+            self._pause_channels()
+
+        # 按读取量调整下一次读取的大小（下行积压时不加大）
+        if channel.read_tuner.record(nbytes, backlogged):
+            self._log(logging.DEBUG, f"通道 {channel.channel_id} 读取大小调整为 {channel.read_tuner.size} 字节")
+
+    def _channel_eof(self, channel: Channel) -> bool:
+        """
+        ChannelProtocol 回调: 目标发送了 FIN
+
+        返回:
+            True 表示只结束下载方向（协商了 HALF_CLOSE），上传方向保持到客户端也发送 HALF_CLOSE；
+            False 时传输层随即关闭，由 _channel_lost 发送 CLOSE
+        """
+        if channel.connected and CAP_HALF_CLOSE in self.capabilities and not channel.eof_received:
+            channel.eof_sent = True
+            self._write_frame(FRAME_HALF_CLOSE, channel.channel_id)
+            return True
+        return False
+
+    def _channel_lost(self, channel: Channel):
+        """ChannelProtocol 回调: 目标连接已断开（不是由 _close_channel 关闭时通知客户端）"""
+        if channel.connected:
+            self._write_frame(FRAME_CLOSE, channel.channel_id)
+            self._close_channel(channel)
+
+    def _frames_backlogged(self) -> bool:
+        """下行帧是否积压，即此时 drain() 会等待"""
+        if self.writer.is_closing():
+            return False
+        if self.mail_mode:
+            return self.frame_writer.backlogged
+        if self.sealer and self.sealer.backlogged:
+            return True
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+
+    def _pause_channels(self):
+        """
+        隧道下行积压: 暂停读取全部目标连接（不只是刚读到数据的那个），启动会话级任务等待积压写出
+
+        积压期间新读到数据的通道（例如刚收到 CONNECT_OK）在下一次调用时加入
+        """
+        for channel in self.channels.values():
+            protocol = channel.protocol
+            if protocol and not protocol.blocked & ChannelProtocol.BLOCK_BACKLOG:
+                protocol.block(ChannelProtocol.BLOCK_BACKLOG)
+                self.backlogged.append(protocol)
+        if self.backlog_task is None:
+            self.backlog_task = asyncio.create_task(self._resume_backlogged())
+
+    async def _resume_backlogged(self):
+        """等待下行积压写出（降到低水位），轮流恢复因此暂停读取的通道"""
+        try:
+            await self._send_frame_drain()
         finally:
-            # 清理通道
-            if channel.connected:
-                await self._send_frame(FRAME_CLOSE, channel.channel_id)
-                await self._close_channel(channel)
+            self.backlog_task = None
+            backlogged, self.backlogged = self.backlogged, []
+            if backlogged:
+                # 同时可读的目标按恢复顺序读取: 每轮从不同的通道开始，避免总是同一批通道先占满下行
+                start = self.backlog_rounds % len(backlogged)
+                self.backlog_rounds += 1
+                for protocol in backlogged[start:] + backlogged[:start]:
+                    protocol.unblock(ChannelProtocol.BLOCK_BACKLOG)
+
+    async def _idle_channel_loop(self):
+        """定期关闭长时间没有收到目标数据的通道（暂停读取的通道除外）"""
+        loop = asyncio.get_running_loop()
+        idle_timeout = self.config.performance.channel_idle_timeout
+        while True:
+            await asyncio.sleep(idle_timeout / 10)
+            deadline = loop.time() - idle_timeout
+            for channel in list(self.channels.values()):
+                if channel.last_activity < deadline and not channel.protocol.blocked and not channel.eof_sent:
+                    self._log(logging.DEBUG, f"通道 {channel.channel_id} 空闲超时")
+                    self._write_frame(FRAME_CLOSE, channel.channel_id)
+                    self._close_channel(channel)
+
+    def _write_frame(self, frame_type: int, channel_id: int, payload: bytes = b''):
+        """
+        同步写入一帧，不等待反压（协议回调中使用）
+
+        帧在调用时即进入输出，顺序与调用顺序一致；调用方负责 drain 或暂停读取
+        """
+        if self.writer.is_closing():
+            return
+        # TLS 传输对每段写入单独加密成记录，帧头和负载必须一次写入；帧在池中的缓冲区编码，写入后归还
+        write, transport = self._frame_output()
+        size = self.buffer_pool.write_frame(write, frame_type, channel_id, payload, transport)
+        self.user_metrics.frames_sent.inc()
+        self.user_metrics.bytes_sent.inc(size)
+
+    def _write_buffer(self, buffer: bytearray, end: int):
+        """同步写入已在 buffer[:end] 中编码好的帧（帧缓冲区池中的缓冲区，写入后归还）"""
+        if self.writer.is_closing():
+            self.buffer_pool.release(buffer)
+            return
+        write, transport = self._frame_output()
+        self.buffer_pool.write_buffer(write, buffer, end, transport)
+        self.user_metrics.frames_sent.inc()
+        self.user_metrics.bytes_sent.inc(end)
+
+    def _frame_output(self):
+        """
+        下行帧的写入函数和缓冲区池归还缓冲区所依据的传输层
+
+        BatchSealer、FrameSpool 和 StealthScheduler 在写入时复制数据，传输层为 None
+        """
+        if self.stealth:
+            return self.stealth.send, None
+        if self.frame_writer is self.writer:
+            return self.writer.write, self.writer.transport
+        return self.frame_writer.write, None
+
+    async def _send_frame_drain(self):
+        """等待下行帧写出（二进制模式持有写入锁等待，与 _send_frame 一致）"""
+        try:
+            if self.mail_mode:
+                await self.frame_writer.drain()
+            else:
+                async with self.write_lock:
+                    await (self.sealer or self.writer).drain()
+        except (ConnectionResetError, BrokenPipeError, OSError):
+            pass
 
     async def _send_frame(self, frame_type: int, channel_id: int, payload: bytes = b''):
         """向客户端发送二进制帧"""
@@ -467,40 +1589,51 @@ class TunnelSession:
             return
         try:
             async with self.write_lock:
-                frame = make_frame(frame_type, channel_id, payload)
-                self.writer.write(frame)
-                await self.writer.drain()
+                self._write_frame(frame_type, channel_id, payload)
+                if not self.mail_mode:
+                    await (self.sealer or self.writer).drain()
+            if self.mail_mode:
+                # 不能持有写入锁等待: 事务循环处理帧时也要获取写入锁
+                await self.frame_writer.drain()
         except (ConnectionResetError, BrokenPipeError, OSError):
             pass
 
-    async def _close_channel(self, channel: Channel):
-        """关闭通道"""
+    def _close_channel(self, channel: Channel):
+        """关闭通道（目标连接的写缓冲在后台写完后关闭）"""
         if not channel.connected:
             return
         channel.connected = False
 
-        # 关闭写入器
-        if channel.writer:
-            try:
-                channel.writer.close()
-                await channel.writer.wait_closed()
-            except (ConnectionResetError, BrokenPipeError, OSError):
-                pass  # 连接已断开，忽略错误
-            except Exception as e:
-                logger.debug(f"关闭通道写入器时出错: {e}")
+        compression_stats = format_compression_stats(channel.compressor, channel.decompressor)
+        if compression_stats:
+            self._log(logging.DEBUG, f"通道 {channel.channel_id} 压缩统计: {compression_stats}")
+
+        # 关闭目标连接
+        if channel.transport:
+            channel.transport.close()
 
         # 从通道字典中移除
-        self.channels.pop(channel.channel_id, None)
+        if self.channels.pop(channel.channel_id, None) is channel:
+            channel.read_tuner.close()
+            self.user_metrics.channels_active.dec()
+            if self.admission:
+                self.admission.release_channel()
 
     async def _cleanup(self):
         """清理会话"""
         # 关闭所有通道
+        if self.idle_task:
+            self.idle_task.cancel()
+        for task in list(self.dns_tasks):
+            task.cancel()
         for channel in list(self.channels.values()):
-            await self._close_channel(channel)
+            self._close_channel(channel)
         # 关闭客户端连接
         try:
             self.writer.close()
-            await self.writer.wait_closed()
+            await asyncio.wait_for(self.writer.wait_closed(), timeout=self.config.performance.close_timeout)
+        except asyncio.TimeoutError:
+            self.writer.transport.abort()
         except (ConnectionResetError, BrokenPipeError, OSError):
             pass  # 连接已断开，忽略错误
         except Exception as e:
@@ -519,6 +1652,17 @@ class TunnelServer:
         self.config = config
         self.users = users
         self.ssl_context = self._create_ssl_context()
+        self.metrics = ServerMetrics()
+        self.metrics_server: Optional[asyncio.AbstractServer] = None
+        self.rate_limiters = RateLimiters()  # 每用户令牌桶，跨会话共享
+        self.admission_control = AdmissionControl()  # 每用户会话/通道计数，跨会话共享
+        self.crypto_offload: Optional[CryptoOffload] = None  # 内层加密线程池，跨会话共享
+        if config.crypto_threads > 0:
+            self.crypto_offload = CryptoOffload(config.crypto_threads, config.performance.crypto_offload_threshold)
+        self.buffer_pool = BufferPool()  # 帧缓冲区池，跨会话共享
+        self.metrics.bind_buffer_pool(self.buffer_pool)
+        self.accept_filter = AcceptFilter(config.accept_filter, self.metrics.accept_rejections)
+        self.metrics.bind_accept_filter(self.accept_filter)
 
     def _create_ssl_context(self) -> ssl.SSLContext:
         """创建 SSL 上下文"""
@@ -529,8 +1673,25 @@ class TunnelServer:
 
     async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """处理客户端连接"""
-        session = TunnelSession(reader, writer, self.config, self.ssl_context, self.users)
-        await session.run()
+        # 在问候和 TLS 握手之前检查来源: 被拒绝的连接不发送任何数据，直接关闭
+        accept_filter = self.accept_filter
+        client_ip = None
+        if accept_filter.active:
+            peer = writer.get_extra_info('peername')
+            client_ip = peer[0] if peer else ''
+            reason = accept_filter.admit(client_ip)
+            if reason:
+                logger.debug(f"拒绝来自 {client_ip} 的连接: {reason}")
+                writer.transport.abort()
+                return
+        try:
+            session = TunnelSession(reader, writer, self.config, self.ssl_context, self.users,
+                                    self.metrics, self.rate_limiters, self.admission_control,
+                                    self.crypto_offload, self.buffer_pool)
+            await session.run()
+        finally:
+            if client_ip is not None:
+                accept_filter.release(client_ip)
 
     async def start(self):
         """启动服务端"""
@@ -544,8 +1705,28 @@ class TunnelServer:
         logger.info(f"主机名: {self.config.hostname}")
         logger.info(f"已加载用户数: {len(self.users)}")
 
+        if self.config.metrics_port:
+            self.metrics_server = await start_metrics_server(
+                self.metrics.registry, self.config.metrics_host, self.config.metrics_port
+            )
+            logger.info(f"指标端点: http://{self.config.metrics_host}:{self.config.metrics_port}/metrics")
+
+        if self.accept_filter.active:
+            accept = self.config.accept_filter
+            logger.info(f"来源过滤: 允许 {len(accept.allow)} 条, 拒绝 {len(accept.deny)} 条, "
+                        f"每个 IP 最多 {accept.max_connections_per_ip or '不限'} 个连接, "
+                        f"每秒 {accept.connection_rate_per_ip or '不限'} 个新连接")
+
+        if self.crypto_offload:
+            logger.info(f"内层加密线程池: {self.crypto_offload.threads} 线程, "
+                        f"批次 >= {self.crypto_offload.threshold} 字节时卸载")
+
         async with server:
-            await server.serve_forever()
+            try:
+                await server.serve_forever()
+            finally:
+                if self.crypto_offload:
+                    self.crypto_offload.shutdown()
 
 
 def main():
@@ -568,6 +1749,21 @@ def main():
 
     server_conf = config_data.get('server', {})
 
+    try:
+        performance = parse_performance_config(config_data.get('performance'))
+    except ValueError as e:
+        logger.error(f"performance 配置无效: {e}")
+        return 1
+    moved = [name for name in MOVED_PERFORMANCE_KEYS if name in server_conf]
+    if moved:
+        logger.warning(f"server 段中的 {', '.join(moved)} 已移到 performance 段，此处的设置被忽略")
+
+    try:
+        accept_filter = parse_accept_filter_config(server_conf.get('accept_filter'))
+    except ValueError as e:
+        logger.error(f"accept_filter 配置无效: {e}")
+        return 1
+
     # 创建服务端配置
     config = ServerConfig(
         host=server_conf.get('host', '0.0.0.0'),
@@ -577,11 +1773,33 @@ def main():
         key_file=server_conf.get('key_file', 'server.key'),
         users_file=server_conf.get('users_file', 'users.yaml'),
         log_users=server_conf.get('log_users', True),
+        dns_resolver=server_conf.get('dns_resolver', ''),
+        compression=server_conf.get('compression', True),
+        inner_encryption=server_conf.get('inner_encryption', True),
+        crypto_threads=server_conf.get('crypto_threads', 0),
+        metrics_port=server_conf.get('metrics_port', 0),
+        metrics_host=server_conf.get('metrics_host', '127.0.0.1'),
+        keepalive_interval=server_conf.get('keepalive_interval', 5.0),
+        keepalive_misses=server_conf.get('keepalive_misses', 3),
+        stealth_enabled=(config_data.get('stealth') or {}).get('enabled', False),
+        stealth=parse_stealth_config(config_data.get('stealth')),
+        performance=performance,
+        accept_filter=accept_filter,
     )
 
+    try:
+        get_dns_upstream(config.dns_resolver)
+    except ValueError as e:
+        logger.error(f"dns_resolver 配置无效: {e}")
+        return 1
+
     # 加载用户文件（命令行覆盖或从配置）
     users_file = args.users or config.users_file
-    users = load_users(users_file)
+    try:
+        users = load_users(users_file)
+    except ValueError as e:
+        logger.error(f"用户文件 {users_file} 无效: {e}")
+        return 1
 
     # 检查是否有用户配置
     if not users:
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+测试服务端接受连接时的来源过滤
+
+测试内容:
+1. 允许表和拒绝表（拒绝优先，IPv4 映射地址按 IPv4 匹配）；配置校验；拒绝次数按前缀统计
+2. 每个来源 IP 的并发连接数和新建速率；空闲来源的状态被清理
+3. TunnelServer: 被拒绝的连接收不到 220 问候，连接结束后归还名额
+"""
+
+import asyncio
+import os
+import sys
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import ServerConfig, AcceptFilterConfig, CounterMetric, parse_accept_filter_config
+from server import AcceptFilter, TunnelServer, ACCEPT_SOURCES_SWEEP_MIN, MAX_REJECTION_PREFIXES
+
+
+class PlainServer(TunnelServer):
+    """不加载证书的服务端（测试只到 220 问候为止）"""
+
+    def _create_ssl_context(self):
+        return None
+
+
+def rejections(counter: CounterMetric) -> dict:
+    """计数器中的序列: {(前缀, 原因): 次数}"""
+    return {values: child.value for values, child in counter._children.items()}
+
+
+async def test_allow_deny():
+    """测试允许表和拒绝表"""
+    print("\n=== 测试1: 允许表和拒绝表 ===")
+
+    counter = CounterMetric('accept_rejections_total', '', ('prefix', 'reason'))
+    accept = AcceptFilter(parse_accept_filter_config({
+        'allow': ['10.0.0.0/8', '2001:db8::/32', '192.0.2.7'],
+        'deny': ['10.66.0.0/16'],
+    }), counter)
+    assert accept.active
+    assert accept.admit('10.1.2.3') is None
+    assert accept.admit('192.0.2.7') is None
+    assert accept.admit('2001:db8::1') is None
+    assert accept.admit('::ffff:10.1.2.3') is None, "IPv4 映射地址按 IPv4 匹配"
+    assert accept.admit('10.66.1.1') == AcceptFilter.REASON_DENIED, "拒绝表优先"
+    assert accept.admit('10.66.1.2') == AcceptFilter.REASON_DENIED
+    assert accept.admit('192.0.2.8') == AcceptFilter.REASON_NOT_ALLOWED
+    assert accept.admit('2001:db9::1') == AcceptFilter.REASON_NOT_ALLOWED
+    assert accept.admit('unknown') is None, "无法解析的地址不做检查"
+    assert not accept.sources, "未配置连接数和速率时不跟踪来源"
+    assert rejections(counter) == {
+        ('10.66.1.0/24', 'denied'): 2, ('192.0.2.0/24', 'not_allowed'): 1, ('2001:db9::/64', 'not_allowed'): 1,
+    }, rejections(counter)
+
+    # 前缀数有上限，超出的归入 other
+    accept = AcceptFilter(AcceptFilterConfig(deny=['0.0.0.0/0']), counter)
+    for index in range(MAX_REJECTION_PREFIXES + 10):
+        accept.admit(f"100.{index // 256}.{index % 256}.1")
+    assert len(accept.rejection_prefixes) == MAX_REJECTION_PREFIXES
+    assert rejections(counter)[('other', 'denied')] == 10
+
+    assert not AcceptFilter(AcceptFilterConfig()).active, "默认不检查"
+    for section in ({'deny': ['10.0.0.0/33']}, {'allow': '10.0.0.0/8'}, {'max_connections': 5},
+                    {'max_connections_per_ip': -1}, {'connection_rate_per_ip': 'fast'}):
+        try:
+            parse_accept_filter_config(section)
+        except ValueError as e:
+            print(f"  {section}: {e}")
+        else:
+            assert False, f"应拒绝: {section}"
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_per_ip_limits():
+    """测试每个来源的连接数和速率"""
+    print("\n=== 测试2: 每个来源的限制 ===")
+
+    accept = AcceptFilter(AcceptFilterConfig(max_connections_per_ip=2))
+    assert accept.admit('198.51.100.1') is None
+    assert accept.admit('198.51.100.1') is None
+    assert accept.admit('198.51.100.1') == AcceptFilter.REASON_CONNECTIONS
+    assert accept.admit('198.51.100.2') is None, "其他来源不受影响"
+    accept.release('198.51.100.1')
+    assert accept.admit('198.51.100.1') is None
+    for ip in ('198.51.100.1', '198.51.100.1', '198.51.100.2'):
+        accept.release(ip)
+    assert not accept.sources, "没有连接的来源立即移除"
+
+    accept = AcceptFilter(AcceptFilterConfig(connection_rate_per_ip=1, connection_burst_per_ip=3))
+    results = [accept.admit('198.51.100.1') for _ in range(5)]
+    assert results == [None, None, None, AcceptFilter.REASON_RATE, AcceptFilter.REASON_RATE], results
+    assert accept.sources[accept._address('198.51.100.1')].connections == 3, "被拒绝的连接不占用名额"
+    accept.sources[accept._address('198.51.100.1')].bucket.updated -= 1.0  # 模拟过去一秒
+    assert accept.admit('198.51.100.1') is None
+
+    # 大量来源各连接一次: 状态表增长到阈值时清理令牌桶已补满的来源
+    accept = AcceptFilter(AcceptFilterConfig(connection_rate_per_ip=1))
+    for index in range(ACCEPT_SOURCES_SWEEP_MIN):
+        ip = f"203.{index // 256}.{index % 256}.1"
+        assert accept.admit(ip) is None
+        accept.release(ip)
+    assert len(accept.sources) == ACCEPT_SOURCES_SWEEP_MIN
+    for state in accept.sources.values():
+        state.bucket.updated -= 10.0
+    assert accept.admit('203.255.0.1') is None and accept.admit('203.255.0.2') is None
+    assert len(accept.sources) == 2, len(accept.sources)
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_server_rejects_before_greeting():
+    """测试服务端在问候之前拒绝"""
+    print("\n=== 测试3: 问候之前拒绝 ===")
+
+    config = ServerConfig(accept_filter=parse_accept_filter_config({'max_connections_per_ip': 1}))
+    server = PlainServer(config, {})
+    listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+
+    first_reader, first_writer = await asyncio.open_connection('127.0.0.1', port)
+    greeting = await asyncio.wait_for(first_reader.readline(), timeout=5.0)
+    assert greeting.startswith(b'220 '), greeting
+
+    # 同一来源的第二个连接: 不发送任何数据直接关闭
+    second_reader, second_writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        data = await asyncio.wait_for(second_reader.read(), timeout=5.0)
+    except ConnectionResetError:
+        data = b''
+    assert data == b'', data
+    second_writer.close()
+    assert rejections(server.metrics.accept_rejections) == {('127.0.0.0/24', 'connections'): 1}
+    assert 'smtp_tunnel_accept_filter_sources 1' in server.metrics.registry.render()
+    assert server.metrics.connections.value == 1, "被拒绝的连接不创建会话"
+
+    # 第一个连接结束后归还名额
+    first_writer.close()
+    for _ in range(100):
+        if not server.accept_filter.sources:
+            break
+        await asyncio.sleep(0.02)
+    assert not server.accept_filter.sources
+    third_reader, third_writer = await asyncio.open_connection('127.0.0.1', port)
+    assert (await asyncio.wait_for(third_reader.readline(), timeout=5.0)).startswith(b'220 ')
+    third_writer.close()
+
+    for _ in range(100):
+        if not server.accept_filter.sources:
+            break
+        await asyncio.sleep(0.02)
+    listener.close()
+    await listener.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 来源过滤测试")
+    print("=" * 60)
+
+    tests = [
+        ("允许表和拒绝表", test_allow_deny),
+        ("每个来源的限制", test_per_ip_limits),
+        ("问候之前拒绝", test_server_rejects_before_greeting),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+测试每用户准入控制
+
+测试内容:
+1. 准入限制读写 users.yaml
+2. 同一用户的会话共享会话名额
+3. 通道数和 CONNECT 速率限制
+4. 超限的 CONNECT 在连接目标之前被拒绝
+"""
+
+import asyncio
+import os
+import struct
+import sys
+import tempfile
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import UserConfig, load_users, save_users
+from server import AdmissionControl, UserAdmission, FRAME_CONNECT_FAIL
+from tunnel_testing import RecordingSession
+
+
+class AdmittedSession(RecordingSession):
+    """已通过认证、受准入控制的会话"""
+
+    def __init__(self, user_config: UserConfig, admission_control: AdmissionControl):
+        super().__init__(users={user_config.username: user_config}, admission_control=admission_control)
+        self.user_config = user_config
+        self.admission = admission_control.for_user(user_config)
+
+
+async def test_config_round_trip():
+    """测试准入限制读写"""
+    print("\n=== 测试1: 配置读写 ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'users.yaml')
+        save_users(path, {
+            'alice': UserConfig('alice', 's1', max_sessions=2, max_channels=100, connect_rate=2.5),
+            'bob': UserConfig('bob', 's2'),
+        })
+        users = load_users(path)
+        assert (users['alice'].max_sessions, users['alice'].max_channels) == (2, 100)
+        assert users['alice'].connect_rate == 2.5
+        assert (users['bob'].max_sessions, users['bob'].connect_rate) == (0, 0)
+
+        with open(path, 'w') as f:
+            f.write("users:\n  carol:\n    secret: x\n    max_channels: -1\n")
+        try:
+            load_users(path)
+            assert False, "应拒绝负数限制"
+        except ValueError as e:
+            assert 'carol' in str(e)
+
+    print("✓ 测试通过: 准入限制读写一致")
+    return True
+
+
+async def test_shared_sessions():
+    """测试会话名额共享"""
+    print("\n=== 测试2: 会话名额共享 ===")
+
+    control = AdmissionControl()
+    alice = UserConfig('alice', 's', max_sessions=2)
+    assert control.for_user(UserConfig('bob', 's')) is None, "无限制的用户不应创建计数"
+
+    first = control.for_user(alice)
+    assert first is control.for_user(alice), "同一用户应共享计数"
+    assert first.acquire_session() and first.acquire_session()
+    assert not first.acquire_session(), "第三个会话应被拒绝"
+    first.release_session()
+    assert first.acquire_session(), "释放后应允许新会话"
+
+    print(f"✓ 测试通过: 在线会话={first.sessions}")
+    return True
+
+
+async def test_channel_limits():
+    """测试通道数和 CONNECT 速率限制"""
+    print("\n=== 测试3: 通道数和速率 ===")
+
+    admission = UserAdmission(UserConfig('alice', 's', max_channels=2))
+    assert admission.acquire_channel() is None
+    assert admission.acquire_channel() is None
+    assert admission.acquire_channel() == UserAdmission.REASON_CHANNELS
+    admission.release_channel()
+    assert admission.acquire_channel() is None
+
+    admission = UserAdmission(UserConfig('alice', 's', connect_rate=3))
+    results = [admission.acquire_channel() for _ in range(5)]
+    assert results[:3] == [None, None, None], results
+    assert results[3] == UserAdmission.REASON_CONNECT_RATE
+    assert admission.channels == 3, "被拒绝的请求不应占用名额"
+
+    admission.connect_bucket.updated -= 1.0  # 模拟过去一秒
+    assert admission.acquire_channel() is None
+
+    print("✓ 测试通过: 超出限制时返回拒绝原因")
+    return True
+
+
+async def test_connect_rejected_before_dial():
+    """测试 CONNECT 在连接目标之前被拒绝"""
+    print("\n=== 测试4: 连接前拒绝 ===")
+
+    control = AdmissionControl()
+    user = UserConfig('alice', 's', max_channels=1)
+    session = AdmittedSession(user, control)
+    session.admission.acquire_channel()  # 另一个会话占满名额
+
+    # 目标不可解析: 如果真的尝试连接，会得到解析错误而不是准入原因
+    host = b'unresolvable.invalid'
+    payload = bytes([len(host)]) + host + struct.pack('>H', 443)
+    await session._handle_connect(5, payload)
+
+    assert session.sent == [(FRAME_CONNECT_FAIL, 5, UserAdmission.REASON_CHANNELS)], session.sent
+    assert session.admission.channels == 1
+
+    # 无效载荷在准入之后失败时归还名额
+    session.admission.release_channel()
+    await session._handle_connect(6, b'\x00\x00\x00\x00')
+    assert session.admission.channels == 0, session.admission.channels
+
+    print(f"✓ 测试通过: {session.sent[0][2].decode()}")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道服务端 - 准入控制测试")
+    print("=" * 60)
+
+    tests = [
+        ("配置读写", test_config_round_trip),
+        ("会话名额共享", test_shared_sessions),
+        ("通道数和速率", test_channel_limits),
+        ("连接前拒绝", test_connect_rejected_before_dial),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+测试隧道写缓冲水位的背压
+
+测试内容:
+1. 服务端: 下行超过高水位时暂停全部目标连接，写出后轮流恢复（每轮从不同的通道开始）
+2. 客户端: 上行超过高水位时暂停全部本地连接，降到低水位后恢复；StreamReader 自己暂停的连接不受影响
+3. DATA 传输模式: 帧缓冲超过上限时同样暂停本地连接
+"""
+
+import asyncio
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    ClientConfig, FrameSpool, ReadSizeTuner, CHANNEL_READ_SIZE, READ_SIZE_MIN, READ_SIZE_MAX
+)
+from server import ChannelProtocol, Channel as ServerChannel, FRAME_DATA
+from client import TunnelClient, Channel as ClientChannel
+from tunnel_testing import RecordingSession
+
+
+class FakeTransport:
+    """记录暂停和恢复读取的顺序"""
+
+    def __init__(self, name: str, resumed: list):
+        self.name = name
+        self.resumed = resumed
+        self.reading = True
+
+    def is_reading(self) -> bool:
+        return self.reading
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+        self.resumed.append(self.name)
+
+
+class BackloggedSession(RecordingSession):
+    """写出的数据帧直接丢弃；下行积压和 drain 由测试控制"""
+
+    def __init__(self):
+        super().__init__()
+        self.drained.clear()
+
+    def _write_buffer(self, buffer: bytearray, end: int):
+        self.buffer_pool.release(buffer)
+
+
+class TunnelWriter:
+    """隧道连接的写入器: 写缓冲大小和 drain 由测试控制"""
+
+    def __init__(self):
+        self.transport = self
+        self.buffered = 0
+        self.limits = (16384, 65536)
+        self.drained = asyncio.Event()
+
+    def write(self, data):
+        self.buffered += len(data)
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+    def get_write_buffer_limits(self):
+        return self.limits
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (low, high)
+
+    def is_closing(self) -> bool:
+        return False
+
+    async def drain(self):
+        if self.buffered > self.limits[1]:
+            await self.drained.wait()
+            self.buffered = 0
+
+
+async def test_server_pauses_all_channels():
+    """测试服务端下行背压"""
+    print("\n=== 测试1: 服务端暂停全部目标连接 ===")
+
+    session = BackloggedSession()
+    resumed = []
+    for channel_id in (1, 2, 3):
+        channel = ServerChannel(channel_id, '127.0.0.1', 80, connected=True,
+                                read_tuner=ReadSizeTuner(READ_SIZE_MIN, READ_SIZE_MAX, CHANNEL_READ_SIZE))
+        channel.protocol = ChannelProtocol(session, channel)
+        channel.protocol.connection_made(FakeTransport(channel_id, resumed))
+        channel.protocol.unblock(ChannelProtocol.BLOCK_CONNECTING)
+        session.channels[channel_id] = channel
+
+    for round_number in range(2):
+        resumed.clear()
+        session.backlog = True
+        session.drained.clear()
+        # 只有通道 2 读到数据，其余通道也一起暂停
+        buffer = session.buffer_pool.acquire(100)
+        session._channel_data(session.channels[2], buffer, 100)
+        assert all(channel.protocol.blocked == ChannelProtocol.BLOCK_BACKLOG
+                   for channel in session.channels.values())
+        assert [protocol.channel.channel_id for protocol in session.backlogged] == [1, 2, 3]
+        session._pause_channels()  # 重复调用不重复记录
+        assert len(session.backlogged) == 3
+
+        session.drained.set()
+        await session.backlog_task
+        assert not any(channel.protocol.blocked for channel in session.channels.values())
+        assert resumed == ([1, 2, 3] if round_number == 0 else [2, 3, 1]), resumed
+    assert session.buffer_pool.in_use == 0
+
+    await session._cleanup()
+    print("✓ 测试通过: 两轮恢复顺序 [1, 2, 3] → [2, 3, 1]")
+    return True
+
+
+async def test_client_pauses_all_channels():
+    """测试客户端上行背压"""
+    print("\n=== 测试2: 客户端暂停全部本地连接 ===")
+
+    accepted = asyncio.Queue()
+
+    async def on_local(reader, writer):
+        await accepted.put((reader, writer))
+
+    local = await asyncio.start_server(on_local, '127.0.0.1', 0)
+    apps = [await asyncio.open_connection('127.0.0.1', local.sockets[0].getsockname()[1]) for _ in range(3)]
+
+    client = TunnelClient(ClientConfig())
+    client.connected = True
+    client.writer = TunnelWriter()
+    for channel_id in (1, 2, 3):
+        reader, writer = await accepted.get()
+        client.channels[channel_id] = ClientChannel(channel_id, reader, writer, '127.0.0.1', 80, connected=True)
+    # 通道 3 的 StreamReader 缓冲已满，自己暂停了读取
+    held = client.channels[3].writer.transport
+    held.pause_reading()
+
+    # 写缓冲超过高水位: 发送方在 drain() 中等待，全部本地连接暂停读取
+    client.writer.buffered = 40000
+    send = asyncio.create_task(client.send_frame(FRAME_DATA, 1, b'x' * 40000))
+    await asyncio.sleep(0.05)
+    assert not send.done()
+    assert [channel.channel_id for channel in client.uplink_paused] == [1, 2]
+    assert not any(channel.writer.transport.is_reading() for channel in client.channels.values())
+    assert client.uplink_task is not None and not client.channels[3].uplink_paused
+
+    # 积压期间本地应用继续发送，数据留在内核缓冲区而不是 StreamReader
+    apps[1][1].write(b'pending')
+    await apps[1][1].drain()
+    await asyncio.sleep(0.05)
+    assert len(client.channels[2].reader._buffer) == 0
+
+    client.writer.drained.set()
+    await asyncio.wait_for(send, timeout=5.0)
+    await asyncio.sleep(0.05)
+    assert client.uplink_task is None and not client.uplink_paused
+    assert client.channels[1].writer.transport.is_reading() and client.channels[2].writer.transport.is_reading()
+    assert not client.channels[1].uplink_paused and not client.channels[2].uplink_paused
+    assert not held.is_reading(), "StreamReader 暂停的连接仍由它自己恢复"
+    assert await asyncio.wait_for(client.channels[2].reader.read(100), timeout=5.0) == b'pending'
+
+    for _, writer in apps:
+        writer.close()
+    for channel in client.channels.values():
+        channel.writer.close()
+    local.close()
+    await local.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def test_mail_spool_backlog():
+    """测试 DATA 传输模式的上行背压"""
+    print("\n=== 测试3: DATA 传输模式 ===")
+
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_local(reader, writer):
+        accepted.set_result((reader, writer))
+
+    local = await asyncio.start_server(on_local, '127.0.0.1', 0)
+    _, app_writer = await asyncio.open_connection('127.0.0.1', local.sockets[0].getsockname()[1])
+    reader, writer = await accepted
+
+    client = TunnelClient(ClientConfig(transport='data'))
+    client.connected = True
+    client.writer = TunnelWriter()
+    client.mail_spool = FrameSpool(limit=1000)
+    client.channels[1] = ClientChannel(1, reader, writer, '127.0.0.1', 80, connected=True)
+
+    # 帧缓冲超过上限: 暂停读取，事务循环取走数据后恢复
+    send = asyncio.create_task(client.send_frame(FRAME_DATA, 1, b'x' * 2000))
+    await asyncio.sleep(0.05)
+    assert not send.done() and not writer.transport.is_reading()
+    assert client.uplink_paused == [client.channels[1]]
+    client.mail_spool.take(1 << 20)
+    await asyncio.wait_for(send, timeout=5.0)
+    await asyncio.sleep(0.05)
+    assert writer.transport.is_reading() and client.uplink_task is None
+
+    # 帧缓冲低于上限: 不暂停
+    await client.send_frame(FRAME_DATA, 1, b'y' * 100)
+    assert writer.transport.is_reading() and client.uplink_task is None
+
+    app_writer.close()
+    writer.close()
+    local.close()
+    await local.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 写缓冲水位背压测试")
+    print("=" * 60)
+
+    tests = [
+        ("服务端暂停全部目标连接", test_server_pauses_all_channels),
+        ("客户端暂停全部本地连接", test_client_pauses_all_channels),
+        ("DATA 传输模式", test_mail_spool_backlog),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+测试帧缓冲区池
+
+测试内容:
+1. 大小分级、空闲列表上限、命中率和同时取出数的最大值
+2. 复制数据的写入器写入后归还缓冲区；传输层有积压时交出副本或不归还，已写出的帧不被覆盖
+3. TLS 传输: 写入时已复制到 SSL 对象，缓冲区可以复用，对端收到的帧完整
+"""
+
+import asyncio
+import os
+import ssl
+import sys
+import tempfile
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_certs
+from common import (
+    BufferPool, FrameDecoder, FRAME_HEADER_SIZE, FRAME_DATA, FRAME_CLOSE, BUFFER_POOL_MIN_PAYLOAD
+)
+
+
+class BlockedTransport:
+    """无法写出时保留传入对象而不复制的传输层（与 asyncio 的 TCP 传输一样）"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def get_write_buffer_size(self) -> int:
+        return sum(map(len, self.writes))
+
+
+def decode_all(data: bytes) -> list:
+    decoder = FrameDecoder()
+    decoder.feed(data)
+    return list(decoder)
+
+
+async def test_size_classes():
+    """测试大小分级和统计"""
+    print("\n=== 测试1: 大小分级 ===")
+
+    pool = BufferPool(sizes=(4096, 16384), max_free=2)
+    small = pool.acquire(100)
+    assert len(small) == FRAME_HEADER_SIZE + 4096, "按分级大小分配，另加帧头空间"
+    large = pool.acquire(4097)
+    assert len(large) == FRAME_HEADER_SIZE + 16384
+    assert pool.in_use == 2 and pool.misses == 2 and pool.hits == 0
+
+    pool.release(small)
+    assert pool.acquire(4096) is small, "同一分级的空闲缓冲区被复用"
+    assert pool.hits == 1 and pool.high_water == 2
+
+    # 超过最大分级: 独立分配，不计入 in_use，归还时丢弃
+    oversized = pool.acquire(20000)
+    assert len(oversized) == FRAME_HEADER_SIZE + 20000 and pool.in_use == 2
+    pool.release(oversized)
+    assert not pool.free[16384]
+
+    # 空闲列表有上限
+    extra = [pool.acquire(16384) for _ in range(3)]
+    assert pool.high_water == 5
+    for buffer in extra + [small, large]:
+        pool.release(buffer)
+    assert len(pool.free[4096]) == 1 and len(pool.free[16384]) == 2
+    assert pool.in_use == 0
+    assert abs(pool.hit_rate - pool.hits / (pool.hits + pool.misses)) < 1e-9
+
+    print(f"✓ 测试通过: 命中率 {pool.hit_rate:.0%}")
+    return True
+
+
+async def test_write_frame_recycling():
+    """测试写入后归还"""
+    print("\n=== 测试2: 写入后归还 ===")
+
+    pool = BufferPool()
+    stream = bytearray()
+    payloads = [os.urandom(n) for n in (BUFFER_POOL_MIN_PAYLOAD, 20000, 32768, 65535, 32768)]
+    for payload in payloads:
+        size = pool.write_frame(stream.extend, FRAME_DATA, 7, payload)
+        assert size == FRAME_HEADER_SIZE + len(payload)
+    assert pool.retained == 0 and pool.in_use == 0
+    assert pool.hits == 2, "20000 字节和 32 KiB 负载属于同一分级，后面两次复用同一个缓冲区"
+    assert decode_all(bytes(stream)) == [(FRAME_DATA, 7, payload) for payload in payloads]
+
+    # 小负载不经过池
+    pool.write_frame(stream.extend, FRAME_CLOSE, 7)
+    assert pool.hits + pool.misses == len(payloads)
+
+    # 传输层保留了视图: 缓冲区不再复用；之后已有积压，交出副本并归还缓冲区
+    blocked = BlockedTransport()
+    first, second = os.urandom(32768), os.urandom(32768)
+    pool.write_frame(blocked.write, FRAME_DATA, 1, first, blocked)
+    assert pool.retained == 1 and isinstance(blocked.writes[0], memoryview)
+    pool.write_frame(blocked.write, FRAME_DATA, 2, second, blocked)
+    assert pool.retained == 1 and isinstance(blocked.writes[1], bytes)
+    pool.write_frame(stream.extend, FRAME_DATA, 3, os.urandom(32768))
+    pool.write_frame(stream.extend, FRAME_DATA, 4, os.urandom(32768))
+    assert pool.in_use == 0
+    assert decode_all(b''.join(blocked.writes)) == [(FRAME_DATA, 1, first), (FRAME_DATA, 2, second)], \
+        "缓冲区复用后已写出的帧不被覆盖"
+
+    print(f"✓ 测试通过: 命中 {pool.hits}, 未命中 {pool.misses}, 未归还 {pool.retained}")
+    return True
+
+
+async def test_tls_transport():
+    """测试 TLS 传输"""
+    print("\n=== 测试3: TLS 传输 ===")
+
+    with tempfile.TemporaryDirectory() as cert_dir:
+        key = generate_certs.generate_private_key(2048)
+        ca = generate_certs.generate_ca_certificate(key)
+        server_key = generate_certs.generate_private_key(2048)
+        cert = generate_certs.generate_server_certificate(key, ca, server_key, hostname='localhost')
+        generate_certs.save_private_key(server_key, os.path.join(cert_dir, 'server.key'))
+        generate_certs.save_certificate(cert, os.path.join(cert_dir, 'server.crt'))
+        server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ctx.load_cert_chain(os.path.join(cert_dir, 'server.crt'), os.path.join(cert_dir, 'server.key'))
+
+    received = asyncio.get_running_loop().create_future()
+
+    async def sink(reader, writer):
+        received.set_result(await reader.read())
+        writer.close()
+
+    server = await asyncio.start_server(sink, '127.0.0.1', 0, ssl=server_ctx)
+    client_ctx = ssl.create_default_context()
+    client_ctx.check_hostname = False
+    client_ctx.verify_mode = ssl.CERT_NONE
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1],
+                                                   ssl=client_ctx)
+
+    pool = BufferPool()
+    payloads = [os.urandom(32768) for _ in range(64)]
+    for payload in payloads:
+        pool.write_frame(writer.write, FRAME_DATA, 1, payload, writer.transport)
+        await writer.drain()
+    writer.close()
+    data = await asyncio.wait_for(received, timeout=10)
+    server.close()
+    await server.wait_closed()
+
+    assert decode_all(data) == [(FRAME_DATA, 1, payload) for payload in payloads]
+    assert pool.retained == 0, pool.retained
+    assert pool.misses == 1 and pool.hits == len(payloads) - 1
+    assert pool.high_water == 1
+
+    print(f"✓ 测试通过: 命中率 {pool.hit_rate:.0%}")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 帧缓冲区池测试")
+    print("=" * 60)
+
+    tests = [
+        ("大小分级", test_size_classes),
+        ("写入后归还", test_write_frame_recycling),
+        ("TLS 传输", test_tls_transport),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+测试服务端通道的协议回调转发
+
+测试内容:
+1. 目标先发送数据时 CONNECT_OK 仍在 DATA 之前，通道不各自占用任务
+2. 隧道下行积压时暂停读取目标，写出后由会话级任务统一恢复
+3. 暂停原因叠加: 全部解除后才恢复读取；目标重置时通知客户端 CLOSE
+4. 目标数据直接读入帧缓冲区池的缓冲区，原地填写帧头后整帧写入，缓冲区写入后归还；批量数据加大读取大小
+5. TLS 隧道连接有积压时，缓冲区复用后客户端收到的数据仍然完整
+"""
+
+import asyncio
+import socket
+import ssl
+import struct
+import sys
+import os
+import tempfile
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_certs
+from common import CAP_HALF_CLOSE, FrameDecoder
+from server import ChannelProtocol, CHANNEL_READ_SIZE, FRAME_DATA, FRAME_CONNECT_OK, FRAME_CLOSE
+from tunnel_testing import FakeWriter, RecordingSession, new_session
+
+
+class FakeTransport:
+    """记录暂停和恢复读取"""
+
+    def __init__(self):
+        self.reading = True
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+
+class CopyingWriter(FakeWriter):
+    """在 write() 中复制数据的隧道写入器（与 TLS 传输一样）"""
+
+    def __init__(self):
+        super().__init__()
+        self.stream = bytearray()
+
+    def write(self, data):
+        self.stream += data
+
+
+def connect_payload(port: int, host: bytes = b'127.0.0.1') -> bytes:
+    """CONNECT 帧负载: 主机长度 + 主机 + 端口"""
+    return bytes([len(host)]) + host + struct.pack('>H', port)
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert False, "等待超时"
+
+
+async def test_banner_after_connect_ok():
+    """测试目标先发送数据"""
+    print("\n=== 测试1: 目标先发送数据 ===")
+
+    async def banner(reader, writer):
+        writer.write(b'220 ready\r\n')
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    target = await asyncio.start_server(banner, '127.0.0.1', 0)
+    port = target.sockets[0].getsockname()[1]
+    session = RecordingSession(capabilities=[CAP_HALF_CLOSE])
+
+    tasks = len(asyncio.all_tasks())
+    for channel_id in (1, 2, 3):
+        await session._handle_connect(channel_id, connect_payload(port))
+    await wait_until(lambda: len(session.sent) == 6)
+    for channel_id in (1, 2, 3):
+        frames = [frame for frame in session.sent if frame[1] == channel_id]
+        assert frames == [(FRAME_CONNECT_OK, channel_id, b''), (FRAME_DATA, channel_id, b'220 ready\r\n')], frames
+    # 目标一侧每个连接有一个处理任务；服务端只有一个会话级的空闲检查任务
+    server_tasks = len(asyncio.all_tasks()) - tasks - len(session.channels)
+    assert server_tasks == 1, server_tasks
+
+    await session._cleanup()
+    target.close()
+    await target.wait_closed()
+    print(f"✓ 测试通过: 服务端任务 {server_tasks} 个")
+    return True
+
+
+async def test_backlog_pauses_reading():
+    """测试下行积压"""
+    print("\n=== 测试2: 下行积压暂停读取 ===")
+
+    ready = asyncio.Event()
+
+    async def source(reader, writer):
+        await ready.wait()
+        writer.write(b'first')
+        await writer.drain()
+        await asyncio.sleep(0.1)
+        writer.write(b'second')
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    target = await asyncio.start_server(source, '127.0.0.1', 0)
+    session = RecordingSession(capabilities=[CAP_HALF_CLOSE])
+    await session._handle_connect(1, connect_payload(target.sockets[0].getsockname()[1]))
+    protocol = session.channels[1].protocol
+
+    session.backlog = True
+    session.drained.clear()
+    ready.set()
+    await wait_until(lambda: protocol.blocked)
+    assert protocol.blocked == ChannelProtocol.BLOCK_BACKLOG
+    assert session.backlogged == [protocol] and session.backlog_task is not None
+    await asyncio.sleep(0.3)
+    assert session.sent[1:] == [(FRAME_DATA, 1, b'first')], "积压期间不应继续读取目标"
+
+    session.drained.set()
+    await wait_until(lambda: len(session.sent) == 3)
+    assert session.sent[2] == (FRAME_DATA, 1, b'second')
+    assert not protocol.blocked and not session.backlogged and session.backlog_task is None
+
+    await session._cleanup()
+    target.close()
+    await target.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def test_block_reasons_and_reset():
+    """测试暂停原因叠加和目标重置"""
+    print("\n=== 测试3: 暂停原因和目标重置 ===")
+
+    protocol = ChannelProtocol(None, None)
+    protocol.connection_made(FakeTransport())
+    assert not protocol.transport.reading, "CONNECT_OK 之前不读取"
+    protocol.unblock(ChannelProtocol.BLOCK_CONNECTING)
+    assert protocol.transport.reading
+    protocol.block(ChannelProtocol.BLOCK_THROTTLED)
+    protocol.block(ChannelProtocol.BLOCK_BACKLOG)
+    protocol.unblock(ChannelProtocol.BLOCK_THROTTLED)
+    assert not protocol.transport.reading, "仍有其他暂停原因"
+    protocol.unblock(ChannelProtocol.BLOCK_THROTTLED)
+    protocol.unblock(ChannelProtocol.BLOCK_BACKLOG)
+    assert protocol.transport.reading and not protocol.blocked
+
+    async def reset(reader, writer):
+        # SO_LINGER 0: 关闭时发送 RST 而不是 FIN
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        writer.transport.abort()
+
+    target = await asyncio.start_server(reset, '127.0.0.1', 0)
+    session = RecordingSession(capabilities=[CAP_HALF_CLOSE])
+    await session._handle_connect(1, connect_payload(target.sockets[0].getsockname()[1]))
+    await wait_until(lambda: 1 not in session.channels)
+    assert session.sent == [(FRAME_CONNECT_OK, 1, b''), (FRAME_CLOSE, 1, b'')], session.sent
+
+    # 通道关闭后到达的数据被丢弃
+    await session._handle_data(1, b'late')
+    assert len(session.sent) == 2
+
+    await session._cleanup()
+    target.close()
+    await target.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def test_pooled_read_path():
+    """测试目标数据的零复制路径"""
+    print("\n=== 测试4: 目标数据读入池中的缓冲区 ===")
+
+    data = os.urandom(1024 * 1024)
+
+    async def source(reader, writer):
+        writer.write(data)
+        await writer.drain()
+        writer.close()
+
+    target = await asyncio.start_server(source, '127.0.0.1', 0)
+    writer = CopyingWriter()
+    session = new_session(writer)  # 未协商 HALF_CLOSE: 目标 FIN 后关闭通道
+    await session._handle_connect(1, connect_payload(target.sockets[0].getsockname()[1]))
+    await wait_until(lambda: 1 not in session.channels)
+
+    decoder = FrameDecoder()
+    decoder.feed(writer.stream)
+    frames = list(decoder)
+    assert frames[0] == (FRAME_CONNECT_OK, 1, b'') and frames[-1][0] == FRAME_CLOSE
+    payloads = [payload for frame_type, _, payload in frames if frame_type == FRAME_DATA]
+    assert b''.join(payloads) == data
+    # 批量数据: 读取大小从初始值加大，不超过配置的上限
+    assert max(map(len, payloads)) > CHANNEL_READ_SIZE
+    assert max(map(len, payloads)) <= session.config.performance.read_size_max
+
+    pool = session.buffer_pool
+    assert pool.retained == 0 and pool.in_use == 0, "缓冲区写入后全部归还"
+    # 每次读取取出一个缓冲区（读到 EOF 的那次没有数据，在 connection_lost 中归还），
+    # 读取大小加大后换用更大的分级，每个分级只分配一次
+    assert pool.misses <= len(pool.sizes) and pool.hits >= len(payloads) - len(pool.sizes), (pool.hits, pool.misses)
+
+    await session._cleanup()
+    target.close()
+    await target.wait_closed()
+    print(f"✓ 测试通过: {len(payloads)} 个数据帧, 命中率 {pool.hit_rate:.0%}")
+    return True
+
+
+async def tls_pair():
+    """建立一条本机 TLS 连接，返回 (服务端 reader, writer, 客户端 reader, writer)"""
+    with tempfile.TemporaryDirectory() as cert_dir:
+        key = generate_certs.generate_private_key(2048)
+        ca = generate_certs.generate_ca_certificate(key)
+        server_key = generate_certs.generate_private_key(2048)
+        cert = generate_certs.generate_server_certificate(key, ca, server_key, hostname='localhost')
+        generate_certs.save_private_key(server_key, os.path.join(cert_dir, 'server.key'))
+        generate_certs.save_certificate(cert, os.path.join(cert_dir, 'server.crt'))
+        server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ctx.load_cert_chain(os.path.join(cert_dir, 'server.crt'), os.path.join(cert_dir, 'server.key'))
+
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_tunnel(reader, writer):
+        accepted.set_result((reader, writer))
+
+    listener = await asyncio.start_server(on_tunnel, '127.0.0.1', 0, ssl=server_ctx)
+    client_ctx = ssl.create_default_context()
+    client_ctx.check_hostname = False
+    client_ctx.verify_mode = ssl.CERT_NONE
+    client_reader, client_writer = await asyncio.open_connection(
+        '127.0.0.1', listener.sockets[0].getsockname()[1], ssl=client_ctx)
+    server_reader, server_writer = await asyncio.wait_for(accepted, timeout=5.0)
+    listener.close()
+    await listener.wait_closed()
+    return server_reader, server_writer, client_reader, client_writer
+
+
+async def test_tls_backlog_integrity():
+    """测试 TLS 隧道积压时的数据完整性"""
+    print("\n=== 测试5: TLS 隧道积压时的数据完整性 ===")
+
+    data = os.urandom(8 * 1024 * 1024)
+
+    async def source(reader, writer):
+        writer.write(data)
+        await writer.drain()
+        writer.close()
+
+    target = await asyncio.start_server(source, '127.0.0.1', 0)
+    _, tunnel_writer, client_reader, client_writer = await tls_pair()
+    # 缩小两端的套接字缓冲区，客户端暂不读取时隧道很快积压
+    tunnel_writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    client_writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+
+    # 记录交给 TLS 传输的是视图还是副本
+    writes = {memoryview: 0, bytes: 0}
+    write = tunnel_writer.write
+
+    def recording_write(frame):
+        writes[type(frame)] = writes.get(type(frame), 0) + 1
+        write(frame)
+
+    tunnel_writer.write = recording_write
+    session = new_session(tunnel_writer)
+    await session._handle_connect(1, connect_payload(target.sockets[0].getsockname()[1]))
+    await asyncio.sleep(0.5)
+    assert session._frames_backlogged() or tunnel_writer.transport.get_write_buffer_size() > 0, "隧道应已积压"
+
+    # 客户端开始读取: 缓冲区在积压期间被复用，收到的每个帧仍与目标发送的一致
+    decoder = FrameDecoder()
+    frames = []
+    while not frames or frames[-1][0] != FRAME_CLOSE:
+        chunk = await asyncio.wait_for(client_reader.read(65536), timeout=10.0)
+        assert chunk, "隧道提前关闭"
+        decoder.feed(chunk)
+        frames.extend(decoder)
+    assert frames[0] == (FRAME_CONNECT_OK, 1, b'')
+    assert b''.join(payload for frame_type, _, payload in frames if frame_type == FRAME_DATA) == data
+
+    pool = session.buffer_pool
+    assert writes[bytes] > 0, "积压时应交出副本"
+    assert pool.hits > 0 and pool.in_use == 0, (pool.hits, pool.in_use)
+
+    await session._cleanup()
+    client_writer.close()
+    await client_writer.wait_closed()
+    target.close()
+    await target.wait_closed()
+    print(f"✓ 测试通过: 视图 {writes[memoryview]} 次, 副本 {writes[bytes]} 次, "
+          f"命中率 {pool.hit_rate:.0%}, 未归还 {pool.retained}")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 服务端通道协议测试")
+    print("=" * 60)
+
+    tests = [
+        ("目标先发送数据", test_banner_after_connect_ok),
+        ("下行积压暂停读取", test_backlog_pauses_reading),
+        ("暂停原因和目标重置", test_block_reasons_and_reset),
+        ("目标数据读入池中的缓冲区", test_pooled_read_path),
+        ("TLS 隧道积压时的数据完整性", test_tls_backlog_integrity),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
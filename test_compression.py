@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+测试通道压缩
+
+测试内容:
+1. 可压缩数据往返 (所有可用算法)
+2. 高熵数据自动旁路
+3. 中途变为不可压缩时切换到旁路,对端仍可解压
+4. 解压输出超限被拒绝 (zstd 在解压过程中停止；块被拆到多帧时仍能解压)
+5. 算法协商
+"""
+
+import asyncio
+import os
+import sys
+import zlib
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    ChannelCompressor, ChannelDecompressor, COMPRESSION_ALGORITHMS,
+    choose_compression, shannon_entropy, zstandard,
+)
+
+
+def text_chunks(count: int, size: int = 8192):
+    """生成可压缩的文本块"""
+    line = b'GET /index.html HTTP/1.1\r\nHost: example.com\r\nAccept: text/html\r\n'
+    data = line * (count * size // len(line) + 1)
+    return [data[i * size:(i + 1) * size] for i in range(count)]
+
+
+def relay(compressor: ChannelCompressor, decompressor: ChannelDecompressor, chunks):
+    """模拟通道传输: 返回接收方还原的数据和压缩帧数"""
+    received = []
+    compressed_frames = 0
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out is None:
+            received.append(chunk)
+        else:
+            compressed_frames += 1
+            received.append(decompressor.decompress(out))
+    return b''.join(received), compressed_frames
+
+
+async def test_roundtrip():
+    """测试可压缩数据往返"""
+    print("\n=== 测试1: 可压缩数据往返 ===")
+
+    chunks = text_chunks(16)
+    for algorithm in COMPRESSION_ALGORITHMS:
+        compressor = ChannelCompressor(algorithm)
+        data, frames = relay(compressor, ChannelDecompressor(algorithm), chunks)
+        assert data == b''.join(chunks), algorithm
+        assert frames == len(chunks), frames
+        assert compressor.state == 'compress'
+        assert compressor.ratio < 0.2, compressor.ratio
+        print(f"  {algorithm}: 比率={compressor.ratio:.3f} CPU={compressor.cpu_time * 1000:.2f}ms")
+
+    print("✓ 测试通过: 数据还原一致")
+    return True
+
+
+async def test_high_entropy_bypass():
+    """测试高熵数据旁路"""
+    print("\n=== 测试2: 高熵数据旁路 ===")
+
+    assert shannon_entropy(b'') == 0.0
+    assert shannon_entropy(bytes(range(256)) * 4) == 8.0
+
+    compressor = ChannelCompressor('zlib')
+    chunks = [os.urandom(8192) for _ in range(4)]
+    data, frames = relay(compressor, ChannelDecompressor('zlib'), chunks)
+    assert data == b''.join(chunks)
+    assert frames == 0, "高熵数据不应压缩"
+    assert compressor.state == 'bypass'
+    assert compressor.entropy > ChannelCompressor.ENTROPY_THRESHOLD
+    entropy = compressor.entropy
+
+    # 采样不足时原样发送,继续采样
+    compressor = ChannelCompressor('zlib')
+    assert compressor.compress(b'abc') is None
+    assert compressor.state == 'sampling'
+
+    print(f"✓ 测试通过: 熵={entropy:.2f} 的数据未被压缩")
+    return True
+
+
+async def test_switch_to_bypass():
+    """测试中途切换到旁路"""
+    print("\n=== 测试3: 中途切换到旁路 ===")
+
+    compressor = ChannelCompressor('zlib')
+    decompressor = ChannelDecompressor('zlib')
+    chunks = text_chunks(4) + [os.urandom(8192) for _ in range(12)] + text_chunks(4)
+    data, frames = relay(compressor, decompressor, chunks)
+
+    assert data == b''.join(chunks)
+    assert compressor.state == 'bypass', compressor.state
+    assert frames < len(chunks)
+
+    print(f"✓ 测试通过: {frames}/{len(chunks)} 块压缩后切换到旁路")
+    return True
+
+
+async def test_decompress_limit():
+    """测试解压输出限制"""
+    print("\n=== 测试4: 解压输出限制 ===")
+
+    ctx = zlib.compressobj(9, zlib.DEFLATED, -13)
+    bomb = ctx.compress(b'\x00' * (ChannelDecompressor.MAX_OUTPUT_SIZE + 1)) + ctx.flush(zlib.Z_SYNC_FLUSH)
+    try:
+        ChannelDecompressor('zlib').decompress(bomb)
+        assert False, "应拒绝超限输出"
+    except ValueError:
+        pass
+
+    try:
+        ChannelDecompressor('zlib').decompress(b'\xff\xff\xff\xff')
+        assert False, "应拒绝损坏的数据"
+    except ValueError:
+        pass
+
+    if zstandard:
+        # zstd: 一帧很小的负载解压后远超上限，解压过程中就停止
+        ctx = zstandard.ZstdCompressor(level=3).compressobj()
+        bomb = ctx.compress(b'\x00' * (16 * ChannelDecompressor.MAX_OUTPUT_SIZE))
+        bomb += ctx.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        assert len(bomb) < 65535, len(bomb)
+        try:
+            ChannelDecompressor('zstd').decompress(bomb)
+            assert False, "应拒绝超限输出"
+        except ValueError:
+            pass
+
+        # 恰好等于上限的输出可以解压
+        ctx = zstandard.ZstdCompressor(level=3).compressobj()
+        data = ctx.compress(b'\x00' * ChannelDecompressor.MAX_OUTPUT_SIZE)
+        data += ctx.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        assert len(ChannelDecompressor('zstd').decompress(data)) == ChannelDecompressor.MAX_OUTPUT_SIZE
+
+        # 块被拆到多帧时（帧中只有半个块）后续帧仍能解压
+        compressor = ChannelCompressor('zstd')
+        chunks = text_chunks(6)
+        stream = b''.join(compressor.compress(chunk) for chunk in chunks)
+        decompressor = ChannelDecompressor('zstd')
+        received = [decompressor.decompress(stream[start:start + 5]) for start in range(0, len(stream), 5)]
+        assert b''.join(received) == b''.join(chunks)
+
+        try:
+            ChannelDecompressor('zstd').decompress(b'\xff\xff\xff\xff')
+            assert False, "应拒绝损坏的数据"
+        except ValueError:
+            pass
+
+    print("✓ 测试通过: 超限和损坏的数据被拒绝")
+    return True
+
+
+async def test_choose_compression():
+    """测试算法协商"""
+    print("\n=== 测试5: 算法协商 ===")
+
+    assert choose_compression(['zstd', 'zlib'], ['zlib']) == 'zlib'
+    assert choose_compression(['zlib', 'zstd'], ['zstd', 'zlib']) == 'zlib'
+    assert choose_compression(['lz4'], ['zstd', 'zlib']) is None
+    assert choose_compression([]) is None
+    assert 'zlib' in COMPRESSION_ALGORITHMS
+
+    print(f"✓ 测试通过: 本机可用算法 {COMPRESSION_ALGORITHMS}")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 通道压缩测试")
+    print("=" * 60)
+
+    tests = [
+        ("可压缩数据往返", test_roundtrip),
+        ("高熵数据旁路", test_high_entropy_bypass),
+        ("中途切换到旁路", test_switch_to_bypass),
+        ("解压输出限制", test_decompress_limit),
+        ("算法协商", test_choose_compression),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
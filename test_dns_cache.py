@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+测试客户端 DNS 缓存
+
+测试内容:
+1. 命中时改写查询 ID 并递减 TTL
+2. 过期条目不再命中
+3. 不缓存 SERVFAIL / 截断响应
+4. 热点条目在过期前触发预取
+5. SERVFAIL 响应构造
+6. 服务端: 进行中的查询数有上限，超出时立即返回空响应；会话结束时取消；解析器地址在加载时校验
+7. 客户端: 经隧道进行中的查询数有上限；本地转发器的任务数有上限，超出时立即回复 SERVFAIL
+"""
+
+import asyncio
+import struct
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client import (
+    DNSCache, DNSForwarder, dns_question_key, dns_servfail, MAX_DNS_FORWARDER_TASKS
+)
+from common import ServerConfig, PerformanceConfig, CAP_DNS
+from server import get_dns_upstream, FRAME_DNS_QUERY, FRAME_DNS_RESPONSE
+from tunnel_testing import FakeTunnel, RecordingSession
+
+
+def make_query(qid: int, name: str) -> bytes:
+    """构造 A 记录查询"""
+    qname = b''.join(bytes([len(p)]) + p.encode() for p in name.split('.')) + b'\x00'
+    return struct.pack('>HHHHHH', qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack('>HH', 1, 1)
+
+
+def make_response(query: bytes, ttl: int, flags: int = 0x8180) -> bytes:
+    """构造带一条 A 记录 (压缩指针指向问题) 的响应"""
+    answer = b'\xc0\x0c' + struct.pack('>HHIH', 1, 1, ttl, 4) + bytes([192, 0, 2, 1])
+    return query[:2] + struct.pack('>HHHHH', flags, 1, 1, 0, 0) + query[12:] + answer
+
+
+def answer_ttl(response: bytes) -> int:
+    """读取响应中最后一条记录的 TTL"""
+    return struct.unpack_from('>I', response, len(response) - 10)[0]
+
+
+async def test_hit_rewrites_id_and_ttl():
+    """测试命中时改写 ID 和 TTL"""
+    print("\n=== 测试1: 命中改写 ID 和 TTL ===")
+
+    cache = DNSCache()
+    query = make_query(1, 'Example.COM')
+    key = dns_question_key(query)
+    assert key == dns_question_key(make_query(9, 'example.com')), "缓存键应忽略大小写和 ID"
+
+    assert cache.put(key, make_response(query, 300))
+    cache.entries[key].stored_at -= 100  # 模拟已过去 100 秒
+
+    response, prefetch = cache.get(key, b'\x00\x2a')
+    assert response is not None
+    assert response[:2] == b'\x00\x2a'
+    assert answer_ttl(response) == 200, answer_ttl(response)
+    assert not prefetch
+    assert cache.hits == 1 and cache.misses == 0
+
+    print(f"✓ 测试通过: ID 已改写, TTL={answer_ttl(response)}")
+    return True
+
+
+async def test_expired_entry_misses():
+    """测试过期条目"""
+    print("\n=== 测试2: 过期条目 ===")
+
+    cache = DNSCache()
+    query = make_query(1, 'example.org')
+    key = dns_question_key(query)
+    cache.put(key, make_response(query, 30))
+    cache.entries[key].stored_at -= 31
+
+    response, _ = cache.get(key, b'\x00\x01')
+    assert response is None
+    assert key not in cache.entries
+    assert cache.misses == 1
+
+    print("✓ 测试通过: 过期条目已移除")
+    return True
+
+
+async def test_uncacheable_responses():
+    """测试不可缓存的响应"""
+    print("\n=== 测试3: 不可缓存的响应 ===")
+
+    cache = DNSCache()
+    query = make_query(1, 'example.net')
+    key = dns_question_key(query)
+
+    assert not cache.put(key, make_response(query, 300, flags=0x8182)), "SERVFAIL 不应缓存"
+    assert not cache.put(key, make_response(query, 300, flags=0x8380)), "截断响应不应缓存"
+    assert not cache.put(key, make_response(query, 0)), "TTL 为 0 不应缓存"
+    assert not cache.put(key, b'\x00' * 5), "格式错误的响应不应缓存"
+    assert not cache.entries
+
+    print("✓ 测试通过: 不可缓存的响应被拒绝")
+    return True
+
+
+async def test_prefetch_hot_names():
+    """测试热点条目预取"""
+    print("\n=== 测试4: 热点条目预取 ===")
+
+    cache = DNSCache(prefetch_ratio=0.1, prefetch_min_hits=2)
+    query = make_query(1, 'hot.example.com')
+    key = dns_question_key(query)
+    cache.put(key, make_response(query, 100))
+
+    _, prefetch = cache.get(key, b'\x00\x01')
+    assert not prefetch, "刚存入的条目不应预取"
+
+    cache.entries[key].stored_at -= 95  # 剩余 5 秒 < 10%
+    _, prefetch = cache.get(key, b'\x00\x01')
+    assert prefetch, "热点条目接近过期时应预取"
+    _, prefetch = cache.get(key, b'\x00\x01')
+    assert not prefetch, "预取进行中不应重复触发"
+
+    # 预取完成后新响应保留命中次数
+    cache.put(key, make_response(query, 100))
+    assert cache.entries[key].hits == 3
+    assert cache.prefetches == 1
+    assert abs(cache.hit_rate - 1.0) < 1e-9
+
+    print(f"✓ 测试通过: 预取次数={cache.prefetches}")
+    return True
+
+
+async def test_servfail():
+    """测试 SERVFAIL 构造"""
+    print("\n=== 测试5: SERVFAIL 构造 ===")
+
+    query = make_query(0x1234, 'example.com')
+    response = dns_servfail(query)
+    qid, flags, qd, an, ns, ar = struct.unpack_from('>HHHHHH', response)
+    assert qid == 0x1234
+    assert flags & 0x8000, "应设置 QR"
+    assert flags & 0x0100, "应保留 RD"
+    assert flags & 0x000F == 2, "RCODE 应为 SERVFAIL"
+    assert (qd, an, ns, ar) == (1, 0, 0, 0)
+    assert response[12:] == query[12:]
+    assert dns_servfail(b'\x00' * 4) is None
+
+    print("✓ 测试通过: SERVFAIL 响应正确")
+    return True
+
+
+async def test_server_inflight_limit():
+    """测试服务端进行中的查询数上限"""
+    print("\n=== 测试6: 服务端查询上限 ===")
+
+    # 上游只接收不回复: 查询一直进行到超时
+    loop = asyncio.get_running_loop()
+    upstream, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=('127.0.0.1', 0))
+    port = upstream.get_extra_info('sockname')[1]
+    session = RecordingSession(ServerConfig(dns_resolver=f"127.0.0.1:{port}"), capabilities=[CAP_DNS])
+
+    limit = session.config.performance.max_dns_inflight
+    extra = 5
+    for tag in range(limit + extra):
+        await session._handle_frame(FRAME_DNS_QUERY, tag, make_query(tag, 'example.com'))
+    assert len(session.dns_tasks) == limit
+    tags = list(range(limit, limit + extra))
+    assert session.sent == [(FRAME_DNS_RESPONSE, tag, b'') for tag in tags], "超出的查询立即返回空响应"
+
+    tasks = list(session.dns_tasks)
+    await session._cleanup()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(task.cancelled() for task in tasks) and not session.dns_tasks
+    upstream.close()
+
+    assert get_dns_upstream('192.0.2.53:5353') == ('192.0.2.53', 5353)
+    assert get_dns_upstream('[2001:db8::53]') == ('2001:db8::53', 53)
+    for resolver in ('192.0.2.53:dns', '192.0.2.53:0', ':53', '[2001:db8::53]x', '[2001:db8::53]:70000'):
+        try:
+            get_dns_upstream(resolver)
+        except ValueError:
+            continue
+        assert False, f"应拒绝: {resolver}"
+
+    print(f"✓ 测试通过: {limit} 个进行中, {extra} 个立即返回")
+    return True
+
+
+class RecordingTransport:
+    """记录转发器回复的数据报"""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append(data)
+
+    def is_closing(self):
+        return False
+
+
+async def test_client_inflight_limit():
+    """测试客户端查询上限"""
+    print("\n=== 测试7: 客户端查询上限 ===")
+
+    # 标签全部占用之前就拒绝新查询，不会在分配标签时无限循环（服务器从不回复）
+    tunnel = FakeTunnel(PerformanceConfig(max_dns_inflight=8, dns_timeout=0.2), capabilities=[CAP_DNS])
+    queries = [asyncio.create_task(tunnel.dns_query(make_query(n, 'example.com'))) for n in range(10)]
+    await asyncio.sleep(0.05)
+    assert len(tunnel.dns_waiters) == 8 and len(tunnel.frames) == 8
+    assert sum(task.done() for task in queries) == 2, "超出上限的查询立即返回"
+    assert await asyncio.gather(*queries) == [None] * 10
+    assert not tunnel.dns_waiters
+
+    # 本地转发器: 每个未缓存的查询一个任务，任务数达到上限后直接回复 SERVFAIL
+    tunnel = FakeTunnel(PerformanceConfig(dns_timeout=0.2), capabilities=[CAP_DNS])
+    forwarder = DNSForwarder(tunnel, DNSCache())
+    forwarder.connection_made(RecordingTransport())
+    extra = 3
+    for n in range(MAX_DNS_FORWARDER_TASKS + extra):
+        forwarder.datagram_received(make_query(n, f"host{n}.example.com"), ('127.0.0.1', 5353))
+    assert len(forwarder.tasks) == MAX_DNS_FORWARDER_TASKS
+    assert len(forwarder.transport.sent) == extra
+    assert all(struct.unpack_from('>H', response, 2)[0] & 0x000F == 2 for response in forwarder.transport.sent)
+
+    await asyncio.gather(*forwarder.tasks)
+    assert not forwarder.tasks, "结束的任务从集合中移除"
+    assert len(forwarder.transport.sent) == MAX_DNS_FORWARDER_TASKS + extra, "每个查询都收到回复"
+
+    print(f"✓ 测试通过: 隧道上限 8, 转发器上限 {MAX_DNS_FORWARDER_TASKS}")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道客户端 - DNS 缓存测试")
+    print("=" * 60)
+
+    tests = [
+        ("命中改写 ID 和 TTL", test_hit_rewrites_id_and_ttl),
+        ("过期条目", test_expired_entry_misses),
+        ("不可缓存的响应", test_uncacheable_responses),
+        ("热点条目预取", test_prefetch_hot_names),
+        ("SERVFAIL 构造", test_servfail),
+        ("服务端查询上限", test_server_inflight_limit),
+        ("客户端查询上限", test_client_inflight_limit),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
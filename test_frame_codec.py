@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试隧道帧编解码
+
+测试内容:
+1. 编码结果与线路格式一致
+2. 解码器处理任意切分的数据流
+3. 写入预分配缓冲区与分散/聚集编码
+"""
+
+import asyncio
+import os
+import struct
+import sys
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    FRAME_DATA, FRAME_CLOSE, FRAME_CONNECT_FAIL, FRAME_HEADER_SIZE,
+    FrameDecoder, encode_frame, encode_frame_iov, pack_frame_into
+)
+
+
+async def test_wire_format():
+    """测试线路格式"""
+    print("\n=== 测试1: 线路格式 ===")
+
+    frame = encode_frame(FRAME_DATA, 0x1234, b'hello')
+    assert bytes(frame) == struct.pack('>BHH', FRAME_DATA, 0x1234, 5) + b'hello'
+    assert bytes(encode_frame(FRAME_CLOSE, 7)) == b'\x05\x00\x07\x00\x00'
+    assert FRAME_HEADER_SIZE == 5
+
+    print("✓ 测试通过: 帧头为 类型(1) + 通道(2) + 长度(2)")
+    return True
+
+
+async def test_decoder_split_stream():
+    """测试解码器处理切分的数据流"""
+    print("\n=== 测试2: 切分的数据流 ===")
+
+    frames = [(FRAME_DATA, 1, os.urandom(n)) for n in (0, 1, 1000, 65535)]
+    frames.append((FRAME_CONNECT_FAIL, 2, b'reason'))
+    stream = b''.join(bytes(encode_frame(*f)) for f in frames)
+
+    for step in (1, 7, 4096, len(stream)):
+        decoder = FrameDecoder()
+        decoded = []
+        for i in range(0, len(stream), step):
+            decoder.feed(stream[i:i + step])
+            decoded.extend(decoder)
+        assert decoded == frames, f"步长 {step} 解码不一致"
+        assert decoder.pending == 0
+        assert all(type(payload) is bytes for _, _, payload in decoded)
+
+    decoder = FrameDecoder()
+    decoder.feed(stream[:3])
+    assert list(decoder) == [] and decoder.pending == 3, "不完整的帧头应等待更多数据"
+
+    print(f"✓ 测试通过: {len(frames)} 个帧在各种切分下解码一致")
+    return True
+
+
+async def test_pack_into_and_iov():
+    """测试预分配缓冲区与分散/聚集编码"""
+    print("\n=== 测试3: 预分配缓冲区与分散/聚集 ===")
+
+    buffer = bytearray(64)
+    offset = pack_frame_into(buffer, 0, FRAME_DATA, 1, b'abc')
+    offset = pack_frame_into(buffer, offset, FRAME_CLOSE, 1)
+    assert offset == 2 * FRAME_HEADER_SIZE + 3
+    decoder = FrameDecoder()
+    decoder.feed(buffer[:offset])
+    assert list(decoder) == [(FRAME_DATA, 1, b'abc'), (FRAME_CLOSE, 1, b'')]
+
+    payload = os.urandom(32768)
+    header, view = encode_frame_iov(FRAME_DATA, 9, payload)
+    assert isinstance(view, memoryview) and view.obj is payload, "负载不应被复制"
+    assert header + bytes(view) == bytes(encode_frame(FRAME_DATA, 9, payload))
+
+    print("✓ 测试通过: 编码方式结果一致")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 帧编解码测试")
+    print("=" * 60)
+
+    tests = [
+        ("线路格式", test_wire_format),
+        ("切分的数据流", test_decoder_split_stream),
+        ("预分配缓冲区与分散/聚集", test_pack_into_and_iov),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
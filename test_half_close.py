@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+测试 TCP 半关闭传递
+
+测试内容:
+1. 服务端收到 HALF_CLOSE 后向目标写入 FIN，并继续转发目标的响应
+2. 客户端本地连接半关闭时发送 HALF_CLOSE 并继续等待响应
+3. 半关闭后服务器方向一直不结束: 收到 CLOSE 立即退出，否则按空闲超时退出
+"""
+
+import asyncio
+import struct
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import CAP_HALF_CLOSE, PerformanceConfig
+from server import FRAME_DATA, FRAME_HALF_CLOSE, FRAME_CONNECT_OK, FRAME_CLOSE
+from client import SOCKS5Server, Channel as ClientChannel
+from tunnel_testing import FakeTunnel, RecordingSession
+
+
+def connect_payload(port: int, host: bytes = b'127.0.0.1') -> bytes:
+    """CONNECT 帧负载: 主机长度 + 主机 + 端口"""
+    return bytes([len(host)]) + host + struct.pack('>H', port)
+
+
+async def test_server_half_close():
+    """测试服务端半关闭"""
+    print("\n=== 测试1: 服务端半关闭 ===")
+
+    async def respond_after_eof(reader, writer):
+        request = await reader.read()  # 读到 FIN 才返回
+        writer.write(b'echo:' + request)
+        await writer.drain()
+        writer.close()
+
+    target = await asyncio.start_server(respond_after_eof, '127.0.0.1', 0)
+
+    session = RecordingSession(capabilities=[CAP_HALF_CLOSE])
+    await session._handle_connect(1, connect_payload(target.sockets[0].getsockname()[1]))
+    assert session.sent == [(FRAME_CONNECT_OK, 1, b'')], session.sent
+    channel = session.channels[1]
+
+    await session._handle_data(1, b'request')
+    await session._handle_half_close(1)
+    assert channel.eof_received and channel.connected, "半关闭后通道应保持打开"
+
+    for _ in range(100):
+        if not channel.connected:
+            break
+        await asyncio.sleep(0.05)
+    assert session.sent[1:] == [(FRAME_DATA, 1, b'echo:request'), (FRAME_CLOSE, 1, b'')], session.sent
+    assert not channel.connected and 1 not in session.channels, "两个方向都结束后应关闭通道"
+
+    target.close()
+    await target.wait_closed()
+    print(f"✓ 测试通过: 收到响应 {session.sent[0][2]!r}")
+    return True
+
+
+async def test_client_half_close():
+    """测试客户端半关闭"""
+    print("\n=== 测试2: 客户端半关闭 ===")
+
+    tunnel = FakeTunnel(capabilities=[CAP_HALF_CLOSE])
+    proxy = SOCKS5Server(tunnel)
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_local(reader, writer):
+        accepted.set_result((reader, writer))
+
+    local = await asyncio.start_server(on_local, '127.0.0.1', 0)
+    app_reader, app_writer = await asyncio.open_connection('127.0.0.1', local.sockets[0].getsockname()[1])
+    reader, writer = await accepted
+
+    channel = ClientChannel(4, reader, writer, '127.0.0.1', 80, connected=True)
+    tunnel.channels[4] = channel
+    forward_task = asyncio.create_task(proxy._forward_loop(channel))
+
+    app_writer.write_eof()  # 应用 shutdown(SHUT_WR)
+    for _ in range(50):
+        if channel.eof_sent:
+            break
+        await asyncio.sleep(0.05)
+    assert tunnel.frames == [(FRAME_HALF_CLOSE, 4, b'')], tunnel.frames
+    assert not forward_task.done(), "服务器方向结束前转发循环应继续"
+
+    # 服务器发回响应后半关闭
+    await tunnel._handle_frame(0x01, 4, b'response')
+    await tunnel._handle_frame(FRAME_HALF_CLOSE, 4, b'')
+    await asyncio.wait_for(forward_task, timeout=5.0)
+
+    # 处理器的清理流程: 两个方向都已结束,不再发送 CLOSE
+    await tunnel.close_channel_remote(4)
+    await tunnel._close_channel(channel)
+    assert len(tunnel.frames) == 1, tunnel.frames
+    assert await asyncio.wait_for(app_reader.read(), timeout=5.0) == b'response'
+
+    app_writer.close()
+    local.close()
+    await local.wait_closed()
+    print("✓ 测试通过: 半关闭后仍收到响应")
+    return True
+
+
+async def test_client_half_close_wait():
+    """测试半关闭后的等待"""
+    print("\n=== 测试3: 半关闭后的等待 ===")
+
+    tunnel = FakeTunnel(PerformanceConfig(local_idle_timeout=0.5), capabilities=[CAP_HALF_CLOSE])
+    proxy = SOCKS5Server(tunnel)
+    accepted = asyncio.Queue()
+
+    async def on_local(reader, writer):
+        await accepted.put((reader, writer))
+
+    local = await asyncio.start_server(on_local, '127.0.0.1', 0)
+    port = local.sockets[0].getsockname()[1]
+
+    async def half_closed_channel(channel_id: int):
+        app_reader, app_writer = await asyncio.open_connection('127.0.0.1', port)
+        reader, writer = await accepted.get()
+        channel = ClientChannel(channel_id, reader, writer, '127.0.0.1', 80, connected=True)
+        tunnel.channels[channel_id] = channel
+        forward_task = asyncio.create_task(proxy._forward_loop(channel))
+        app_writer.write_eof()
+        for _ in range(50):
+            if channel.eof_sent:
+                break
+            await asyncio.sleep(0.02)
+        assert channel.eof_sent and not forward_task.done()
+        return channel, forward_task, app_writer
+
+    # 服务器关闭通道: 转发循环立即退出
+    channel, forward_task, app_writer = await half_closed_channel(5)
+    await tunnel._handle_frame(FRAME_CLOSE, 5, b'')
+    await asyncio.wait_for(forward_task, timeout=0.2)
+    app_writer.close()
+
+    # 服务器方向一直不结束: 空闲超时后退出,由处理器关闭通道
+    channel, forward_task, app_writer = await half_closed_channel(6)
+    start = asyncio.get_running_loop().time()
+    await asyncio.wait_for(forward_task, timeout=5.0)
+    elapsed = asyncio.get_running_loop().time() - start
+    assert 0.3 <= elapsed < 2.0, elapsed
+    await tunnel.close_channel_remote(6)
+    await tunnel._close_channel(channel)
+    assert tunnel.frames[-1] == (FRAME_CLOSE, 6, b''), tunnel.frames
+    app_writer.close()
+
+    local.close()
+    await local.wait_closed()
+    print(f"✓ 测试通过: {elapsed:.2f} 秒后超时退出")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 半关闭测试")
+    print("=" * 60)
+
+    tests = [
+        ("服务端半关闭", test_server_half_close),
+        ("客户端半关闭", test_client_half_close),
+        ("半关闭后的等待", test_client_half_close_wait),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
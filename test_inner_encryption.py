@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+测试二进制模式的内层加密
+
+测试内容:
+1. 会话密钥派生: 双方方向对应，不同会话随机数得到不同密钥
+2. 同一轮事件循环中的写入合并为一条记录，超长批次拆分，分块输入可以解密
+3. 重放、乱序、篡改和无效长度的记录被拒绝
+4. 线程池卸载: 先完成的后续批次等待前面的记录，按序号写出和解密
+"""
+
+import asyncio
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    TunnelCrypto, BatchSealer, BatchOpener, CryptoOffload, SEAL_RECORD_HEADER, SEAL_RECORD_MAX, TAG_SIZE
+)
+
+
+class FakeWriter:
+    """记录写入的数据块"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    def is_closing(self):
+        return False
+
+    async def drain(self):
+        pass
+
+
+def make_pair(salt: bytes = b'\x01' * 32, offload: CryptoOffload = None):
+    """客户端发送端和服务端接收端"""
+    client_send, _ = TunnelCrypto('secret', is_server=False).session_ciphers(salt)
+    _, server_recv = TunnelCrypto('secret', is_server=True).session_ciphers(salt)
+    writer = FakeWriter()
+    return writer, BatchSealer(writer, client_send, offload), BatchOpener(server_recv, offload)
+
+
+def expect_rejected(opener: BatchOpener, data: bytes, reason: str):
+    try:
+        opener.feed(data)
+    except ValueError:
+        return
+    assert False, reason
+
+
+async def test_session_keys():
+    """测试会话密钥派生"""
+    print("\n=== 测试1: 会话密钥派生 ===")
+
+    salt = os.urandom(32)
+    client_send, client_recv = TunnelCrypto('secret', is_server=False).session_ciphers(salt)
+    server_send, server_recv = TunnelCrypto('secret', is_server=True).session_ciphers(salt)
+    nonce = b'\x00' * 12
+    assert server_recv.decrypt(nonce, client_send.encrypt(nonce, b'up', None), None) == b'up'
+    assert client_recv.decrypt(nonce, server_send.encrypt(nonce, b'down', None), None) == b'down'
+
+    # 另一个会话的同序号记录无法解密: 计数器 nonce 不会跨会话重复使用同一密钥
+    writer, sealer, _ = make_pair(b'\x01' * 32)
+    _, _, other = make_pair(b'\x02' * 32)
+    sealer.write(b'data')
+    sealer.flush()
+    expect_rejected(other, writer.writes[0], "不同会话的记录应该被拒绝")
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_batching():
+    """测试合并和拆分"""
+    print("\n=== 测试2: 批次合并 ===")
+
+    writer, sealer, opener = make_pair()
+    frames = [os.urandom(n) for n in (10, 1400, 5, 30000)]
+    for frame in frames:
+        sealer.write(frame)
+    assert not writer.writes, "本轮事件循环结束前不写出"
+    await asyncio.sleep(0)
+    assert len(writer.writes) == 1
+    assert sealer.counter == 1, "一轮事件循环的写入只加密一次"
+    record = writer.writes[0]
+    assert len(record) == SEAL_RECORD_HEADER.size + sum(map(len, frames)) + TAG_SIZE
+
+    # 超过记录上限时拆分，仍然一次写出
+    big = os.urandom(SEAL_RECORD_MAX * 2 + 100)
+    sealer.write(big)
+    await asyncio.sleep(0)
+    assert len(writer.writes) == 2
+    assert sealer.counter == 4
+
+    stream = b''.join(writer.writes)
+    plaintext = b''.join(opener.feed(stream[i:i + 1000]) for i in range(0, len(stream), 1000))
+    assert plaintext == b''.join(frames) + big
+    assert opener.pending == 0
+    assert opener.counter == 4
+
+    print(f"✓ 测试通过: {sealer.counter} 条记录")
+    return True
+
+
+async def test_rejects_invalid_records():
+    """测试重放、乱序和篡改"""
+    print("\n=== 测试3: 拒绝无效记录 ===")
+
+    writer, sealer, _ = make_pair()
+    for message in (b'first', b'second'):
+        sealer.write(message)
+        sealer.flush()
+    first, second = writer.writes
+
+    _, _, opener = make_pair()
+    assert opener.feed(first) == b'first'
+    expect_rejected(opener, first, "重放的记录应该被拒绝")
+
+    _, _, opener = make_pair()
+    expect_rejected(opener, second, "乱序的记录应该被拒绝")
+
+    _, _, opener = make_pair()
+    tampered = bytearray(first)
+    tampered[-1] ^= 1
+    expect_rejected(opener, bytes(tampered), "篡改的记录应该被拒绝")
+
+    _, _, opener = make_pair()
+    expect_rejected(opener, SEAL_RECORD_HEADER.pack(SEAL_RECORD_MAX + TAG_SIZE + 1), "超长记录应该被拒绝")
+    _, _, opener = make_pair()
+    expect_rejected(opener, SEAL_RECORD_HEADER.pack(TAG_SIZE), "空记录应该被拒绝")
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_offload_ordering():
+    """测试线程池卸载的顺序"""
+    print("\n=== 测试4: 线程池卸载 ===")
+
+    offload = CryptoOffload(threads=4, threshold=1000)
+    try:
+        writer, sealer, opener = make_pair(offload=offload)
+        batches = [os.urandom(n) for n in (SEAL_RECORD_MAX * 3, 10, 5000, 20, SEAL_RECORD_MAX + 1)]
+        for batch in batches:
+            sealer.write(batch)
+            sealer.flush()  # 每个批次单独一次 flush，模拟多轮事件循环
+        assert sealer.counter == 8
+        assert not writer.writes, "小批次不能越过线程池中的大批次先写出"
+        assert len(sealer.inflight) == 8
+        await sealer.drain()
+        assert len(sealer.inflight) <= 16
+        await sealer.join()
+        assert not sealer.inflight
+        assert offload.offloaded == 6, offload.offloaded
+
+        # 接收端: 大记录并行解密，明文按序号拼接；分块输入可以跨记录边界
+        stream = b''.join(writer.writes)
+        plaintext = b''
+        for offset in range(0, len(stream), 100000):
+            plaintext += await opener.feed_async(stream[offset:offset + 100000])
+        assert plaintext == b''.join(batches)
+        assert opener.counter == 8 and opener.pending == 0
+
+        # 线程池中的认证失败同样抛出 ValueError
+        _, _, other = make_pair(b'\x02' * 32, offload)
+        try:
+            await other.feed_async(stream)
+            assert False, "不同会话的记录应该被拒绝"
+        except ValueError:
+            pass
+    finally:
+        offload.shutdown()
+
+    print(f"✓ 测试通过: {len(writer.writes)} 次写入")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 内层加密测试")
+    print("=" * 60)
+
+    tests = [
+        ("会话密钥派生", test_session_keys),
+        ("批次合并", test_batching),
+        ("拒绝无效记录", test_rejects_invalid_records),
+        ("线程池卸载", test_offload_ordering),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
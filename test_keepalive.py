@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试 PING/PONG 保活
+
+测试内容:
+1. PONG 更新平滑 RTT
+2. 连续无响应的间隔判定对端失效
+3. 收到数据视为存活
+4. 无效的 PONG 载荷被忽略
+"""
+
+import asyncio
+import time
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import KeepaliveMonitor
+
+
+async def test_rtt_smoothing():
+    """测试 RTT 平滑"""
+    print("\n=== 测试1: RTT 平滑 ===")
+
+    monitor = KeepaliveMonitor(interval=1.0, max_missed=3)
+    sent = time.monotonic_ns() - 100_000_000  # 模拟 100ms 前发出
+    rtt = monitor.on_pong(KeepaliveMonitor.PING_PAYLOAD.pack(sent))
+    assert rtt is not None and 0.1 <= rtt < 0.5, rtt
+    assert monitor.srtt == rtt
+    assert abs(monitor.rttvar - rtt / 2) < 1e-9
+
+    sent = time.monotonic_ns() - 300_000_000
+    second = monitor.on_pong(KeepaliveMonitor.PING_PAYLOAD.pack(sent))
+    assert abs(monitor.srtt - (0.875 * rtt + 0.125 * second)) < 1e-9
+    assert not monitor.outstanding
+
+    print(f"✓ 测试通过: SRTT={monitor.srtt * 1000:.1f}ms")
+    return True
+
+
+async def test_missed_intervals():
+    """测试连续无响应判定失效"""
+    print("\n=== 测试2: 连续无响应 ===")
+
+    monitor = KeepaliveMonitor(interval=1.0, max_missed=3)
+    assert not monitor.tick(), "没有未回应的 PING 时不计数"
+
+    monitor.make_ping()
+    assert not monitor.tick()
+    assert not monitor.tick()
+    assert monitor.tick(), "第 3 个无响应间隔应判定失效"
+    assert monitor.dead_after == 4.0
+
+    print(f"✓ 测试通过: missed={monitor.missed}")
+    return True
+
+
+async def test_activity_resets():
+    """测试收到数据视为存活"""
+    print("\n=== 测试3: 数据视为存活 ===")
+
+    monitor = KeepaliveMonitor(interval=1.0, max_missed=2)
+    monitor.make_ping()
+    assert not monitor.tick()
+    monitor.activity = True  # PONG 排在大量数据之后
+    assert not monitor.tick()
+    assert monitor.missed == 0
+    assert not monitor.activity, "tick 之后应清除活动标记"
+
+    print("✓ 测试通过: 数据到达重置计数")
+    return True
+
+
+async def test_invalid_pong():
+    """测试无效的 PONG 载荷"""
+    print("\n=== 测试4: 无效 PONG ===")
+
+    monitor = KeepaliveMonitor()
+    monitor.make_ping()
+    assert monitor.on_pong(b'short') is None
+    future = time.monotonic_ns() + 10_000_000_000
+    assert monitor.on_pong(KeepaliveMonitor.PING_PAYLOAD.pack(future)) is None
+    assert monitor.outstanding and monitor.srtt is None
+
+    print("✓ 测试通过: 无效载荷被忽略")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 保活测试")
+    print("=" * 60)
+
+    tests = [
+        ("RTT 平滑", test_rtt_smoothing),
+        ("连续无响应", test_missed_intervals),
+        ("数据视为存活", test_activity_resets),
+        ("无效 PONG", test_invalid_pong),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+测试 DATA / BDAT 传输模式的流式编解码
+
+测试内容:
+1. base64 行编码/解码往返，输入任意分块，带 "250-" 行前缀
+2. MIMEStreamDecoder 逐块解析 SMTPMessageGenerator 生成的邮件
+3. FrameSpool 的取走与 drain() 反压
+4. BDAT 模式: binary 附件解析、按帧边界取走和 PADDING 补齐
+"""
+
+import asyncio
+import email
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    Base64LineEncoder, Base64LineDecoder, MIMEStreamDecoder, SMTPMessageGenerator, FrameSpool,
+    MAIL_CAPABILITIES_HEADER, FrameDecoder, encode_frame, padded_size, pad_frames,
+    FRAME_DATA, FRAME_PADDING
+)
+
+
+def feed_in_chunks(feed, data: bytes, size: int) -> bytes:
+    """按 size 字节分块喂给 feed，拼接输出"""
+    return b''.join(feed(data[offset:offset + size]) for offset in range(0, len(data), size))
+
+
+async def test_base64_lines():
+    """测试 base64 行编解码"""
+    print("\n=== 测试1: base64 行编解码 ===")
+
+    for size in (0, 1, 56, 57, 58, 1000, 65536):
+        data = os.urandom(size)
+        for prefix in (b'', b'250-'):
+            encoder = Base64LineEncoder(prefix)
+            encoded = feed_in_chunks(encoder.encode, data, 13) + encoder.flush()
+            lines = encoded.split(b'\r\n')
+            assert lines[-1] == b'', "每行都应以 CRLF 结束"
+            assert all(line.startswith(prefix) and len(line) <= len(prefix) + 76 for line in lines[:-1])
+
+            for chunk in (7, 4096):
+                decoder = Base64LineDecoder(prefix)
+                decoded = feed_in_chunks(decoder.decode, encoded, chunk) + decoder.finish()
+                assert decoded == data, (size, prefix, chunk)
+
+    # 截断的 base64 必须报错而不是静默丢数据
+    decoder = Base64LineDecoder()
+    decoder.decode(b'QUJD\r\nRE')
+    try:
+        decoder.finish()
+        assert False, "不完整的 base64 应该报错"
+    except ValueError:
+        pass
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_mime_stream_decoder():
+    """测试邮件流式解析"""
+    print("\n=== 测试2: 邮件流式解析 ===")
+
+    generator = SMTPMessageGenerator()
+    data = os.urandom(100000)
+    _, _, subject, head, tail = generator.begin_message(extra_headers={MAIL_CAPABILITIES_HEADER: 'PING'})
+    encoder = Base64LineEncoder()
+    message = head + encoder.encode(data) + encoder.flush() + tail
+
+    # 与标准库解析结果一致
+    parsed = email.message_from_bytes(message)
+    assert parsed[MAIL_CAPABILITIES_HEADER] == 'PING'
+    assert [part.get_payload(decode=True) for part in parsed.walk()][-1] == data
+
+    for chunk in (1, 7, 65536):
+        decoder = MIMEStreamDecoder()
+        body = feed_in_chunks(decoder.feed, message, chunk) + decoder.finish()
+        assert body == data, chunk
+        assert decoder.headers[MAIL_CAPABILITIES_HEADER.lower()] == 'PING'
+        assert decoder.headers['subject'] == subject
+
+    # 缺少结束边界的邮件不完整
+    decoder = MIMEStreamDecoder()
+    decoder.feed(message[:-20])
+    try:
+        decoder.finish()
+        assert False, "不完整的邮件应该报错"
+    except ValueError:
+        pass
+
+    # 兼容接口仍然可用
+    assert generator.extract_tunnel_data(generator.wrap_tunnel_data(data)[3]) == data
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_frame_spool():
+    """测试帧缓冲的反压"""
+    print("\n=== 测试3: 帧缓冲反压 ===")
+
+    spool = FrameSpool(limit=1000)
+    spool.write(b'a' * 600)
+    await asyncio.wait_for(spool.drain(), 1)  # 未超过上限时不等待
+
+    spool.write(b'b' * 600)
+    writer = asyncio.ensure_future(spool.drain())
+    await asyncio.sleep(0.01)
+    assert not writer.done(), "超过上限时 drain() 应等待"
+
+    assert spool.take(100) == b'a' * 100
+    await asyncio.sleep(0.01)
+    assert not writer.done(), "仍然超过上限"
+    assert spool.take(1000) == b'a' * 500 + b'b' * 500
+    await asyncio.wait_for(writer, 1)
+
+    # 事务循环自己发送帧时不等待
+    async def flusher():
+        spool.write(b'c' * 5000)
+        await spool.drain()
+    spool.flusher = asyncio.ensure_future(flusher())
+    await asyncio.wait_for(spool.flusher, 1)
+
+    # 关闭后等待方收到连接错误
+    writer = asyncio.ensure_future(spool.drain())
+    await asyncio.sleep(0.01)
+    spool.close()
+    try:
+        await asyncio.wait_for(writer, 1)
+        assert False, "关闭后 drain() 应该报错"
+    except ConnectionResetError:
+        pass
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_bdat_framing():
+    """测试 BDAT 模式的附件和分块"""
+    print("\n=== 测试4: BDAT 附件和填充 ===")
+
+    generator = SMTPMessageGenerator()
+    for size in (0, 1, 100000):
+        data = os.urandom(size)
+        _, _, _, head, tail = generator.begin_message(transfer_encoding='binary')
+        message = head + data + tail
+        parsed = email.message_from_bytes(message)
+        assert [part.get_payload(decode=True) for part in parsed.walk()][-1] == data
+        for chunk in (1, 7, 65536):
+            decoder = MIMEStreamDecoder()
+            assert feed_in_chunks(decoder.feed, message, chunk) + decoder.finish() == data, (size, chunk)
+
+    # 按帧边界取走，之后补齐的 PADDING 帧可以被完整解码
+    spool = FrameSpool()
+    frames = [encode_frame(FRAME_DATA, 1, os.urandom(n)) for n in (3000, 5000, 100, 9000)]
+    for frame in frames:
+        spool.write(frame)
+    taken = spool.take(9000, whole_frames=True)
+    assert bytes(taken) == b''.join(frames[:3]), len(taken)
+    assert spool.take(10, whole_frames=True) == frames[3], "至少取走一个帧"
+
+    padded = pad_frames(taken, padded_size(len(taken), [4096, 16384]))
+    assert len(padded) == 16384
+    decoder = FrameDecoder()
+    decoder.feed(padded)
+    decoded = list(decoder)
+    assert decoder.pending == 0
+    assert [f for f in decoded if f[0] == FRAME_DATA] == [(FRAME_DATA, 1, frame[5:]) for frame in frames[:3]]
+    assert all(f[0] == FRAME_PADDING for f in decoded[3:])
+
+    print("✓ 测试通过")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 邮件传输模式编解码测试")
+    print("=" * 60)
+
+    tests = [
+        ("base64 行编解码", test_base64_lines),
+        ("邮件流式解析", test_mime_stream_decoder),
+        ("帧缓冲反压", test_frame_spool),
+        ("BDAT 附件和填充", test_bdat_framing),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+测试运行指标
+
+测试内容:
+1. 计数器、仪表和直方图的文本格式输出
+2. 标签序列缓存与转义
+3. 指标 HTTP 端点
+4. 采集时取值的指标与 Unix 套接字端点
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import MetricsRegistry, start_metrics_server
+
+
+def sample_lines(text: str):
+    """返回去掉注释后的样本行"""
+    return [line for line in text.splitlines() if line and not line.startswith('#')]
+
+
+async def test_render():
+    """测试文本格式输出"""
+    print("\n=== 测试1: 文本格式输出 ===")
+
+    registry = MetricsRegistry('test_')
+    frames = registry.counter('frames_total', '帧数')
+    active = registry.gauge('active', '活跃数')
+    latency = registry.histogram('latency_seconds', '延迟', buckets=(0.1, 1.0))
+
+    frames.inc()
+    frames.inc(4)
+    active.inc(3)
+    active.dec()
+    for value in (0.05, 0.1, 0.5, 7.0):
+        latency.observe(value)
+
+    text = registry.render()
+    assert '# TYPE test_frames_total counter' in text
+    assert '# TYPE test_latency_seconds histogram' in text
+    lines = sample_lines(text)
+    assert 'test_frames_total 5' in lines, lines
+    assert 'test_active 2' in lines, lines
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in lines, "le 桶应包含等于上界的观测值"
+    assert 'test_latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_count 4' in lines
+    assert 'test_latency_seconds_sum 7.65' in lines
+
+    print("✓ 测试通过: 输出符合 Prometheus 文本格式")
+    return True
+
+
+async def test_labels():
+    """测试标签序列"""
+    print("\n=== 测试2: 标签序列 ===")
+
+    registry = MetricsRegistry()
+    sent = registry.counter('bytes_sent_total', '发送字节数', ('user',))
+
+    alice = sent.labels('alice')
+    assert sent.labels('alice') is alice, "同一标签值应返回同一序列"
+    alice.inc(100)
+    sent.labels('a"b\\c').inc()
+
+    lines = sample_lines(registry.render())
+    assert 'bytes_sent_total{user="alice"} 100' in lines, lines
+    assert 'bytes_sent_total{user="a\\"b\\\\c"} 1' in lines, lines
+
+    try:
+        sent.labels()
+        assert False, "缺少标签值应报错"
+    except ValueError:
+        pass
+
+    try:
+        registry.counter('bytes_sent_total', '重复')
+        assert False, "重复注册应报错"
+    except ValueError:
+        pass
+
+    print("✓ 测试通过: 标签序列缓存与转义正确")
+    return True
+
+
+async def _http_get(port: int, request: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), timeout=5.0)
+    writer.close()
+    return response
+
+
+async def test_http_endpoint():
+    """测试指标 HTTP 端点"""
+    print("\n=== 测试3: 指标 HTTP 端点 ===")
+
+    registry = MetricsRegistry()
+    registry.counter('requests_total', '请求数').inc(7)
+    server = await start_metrics_server(registry, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    try:
+        response = await _http_get(port, b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 200 OK'), response[:40]
+        assert b'text/plain; version=0.0.4' in response
+        assert response.endswith(b'requests_total 7\n'), response[-40:]
+
+        response = await _http_get(port, b'GET / HTTP/1.1\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 404'), response[:40]
+
+        response = await _http_get(port, b'POST /metrics HTTP/1.1\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 405'), response[:40]
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    print("✓ 测试通过: /metrics 返回指标,其他请求被拒绝")
+    return True
+
+
+async def test_function_metrics_unix_socket():
+    """测试采集时取值与 Unix 套接字端点"""
+    print("\n=== 测试4: 采集时取值与 Unix 套接字 ===")
+
+    state = {'channels': {1: None, 2: None}}
+    registry = MetricsRegistry('client_')
+    registry.gauge('channels_active', '活跃通道').set_function(lambda: len(state['channels']))
+    registry.gauge('broken', '取值失败').set_function(lambda: 1 / 0)
+
+    try:
+        registry.counter('by_user', '带标签', ('user',)).set_function(lambda: 1)
+        assert False, "带标签的指标不应支持函数取值"
+    except ValueError:
+        pass
+
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.sock')
+    server = await start_metrics_server(registry, path=path)
+    try:
+        state['channels'][3] = None
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'GET /metrics HTTP/1.1\r\n\r\n')
+        await writer.drain()
+        response = (await asyncio.wait_for(reader.read(), timeout=5.0)).decode()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    lines = sample_lines(response.split('\r\n\r\n', 1)[1])
+    assert 'client_channels_active 3' in lines, lines
+    assert not any(line.startswith('client_broken') for line in lines), "取值失败的样本应省略"
+
+    # 重新启动时清理遗留的套接字文件
+    server = await start_metrics_server(registry, path=path)
+    server.close()
+    await server.wait_closed()
+
+    print("✓ 测试通过: 采集时读取当前状态")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 运行指标测试")
+    print("=" * 60)
+
+    tests = [
+        ("文本格式输出", test_render),
+        ("标签序列", test_labels),
+        ("指标 HTTP 端点", test_http_endpoint),
+        ("采集时取值与 Unix 套接字", test_function_metrics_unix_socket),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+测试 performance 配置段
+
+测试内容:
+1. 默认值与原来的固定值一致；config.yaml 中的 performance 段可以解析
+2. 未知配置项、类型错误和超出范围的取值被拒绝
+3. 服务端和客户端按配置的上限工作
+"""
+
+import asyncio
+import os
+import struct
+import sys
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    ClientConfig, ServerConfig, PerformanceConfig, parse_performance_config, load_config,
+    READ_SIZE_MIN, READ_SIZE_MAX, TUNNEL_READ_SIZE_MAX
+)
+from client import TunnelClient, SOCKS5Server
+from server import FRAME_CONNECT_FAIL
+from tunnel_testing import RecordingSession
+
+
+async def test_defaults():
+    """测试默认值和 config.yaml"""
+    print("\n=== 测试1: 默认值 ===")
+
+    defaults = parse_performance_config(None)
+    assert defaults == PerformanceConfig() == ServerConfig().performance == ClientConfig().performance
+    assert defaults.max_channels_per_session == 1000 and defaults.max_local_connections == 100
+    assert defaults.max_receive_buffer == 10 * 1024 * 1024
+    assert (defaults.read_size_min, defaults.read_size_max) == (READ_SIZE_MIN, READ_SIZE_MAX)
+    assert defaults.tunnel_read_size_max == TUNNEL_READ_SIZE_MAX
+    assert (defaults.connect_timeout, defaults.channel_open_timeout, defaults.tunnel_read_timeout,
+            defaults.channel_idle_timeout) == (30.0, 10.0, 60.0, 300.0)
+    assert (defaults.close_timeout, defaults.stats_interval, defaults.stale_check_interval,
+            defaults.zombie_check_interval) == (5.0, 60.0, 60.0, 120.0)
+    assert (defaults.write_buffer_high, defaults.write_buffer_low, defaults.crypto_offload_threshold) == \
+        (65536, 16384, 16384)
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml')
+    assert parse_performance_config(load_config(path).get('performance')) == defaults, \
+        "config.yaml 中的取值应与默认值一致"
+
+    # 整数写法的超时转换为浮点数
+    performance = parse_performance_config({'dns_timeout': 2, 'max_channels_per_session': 200})
+    assert performance.dns_timeout == 2.0 and isinstance(performance.dns_timeout, float)
+    assert performance.max_channels_per_session == 200 and performance.connect_timeout == 30.0
+
+    # 低水位可以为 0: 写缓冲完全清空后才恢复读取
+    performance = parse_performance_config({'write_buffer_low': 0})
+    assert performance.write_buffer_low == 0 and performance.write_buffer_high == 65536
+
+    print("✓ 测试通过")
+    return True
+
+
+async def test_validation():
+    """测试无效配置"""
+    print("\n=== 测试2: 无效配置 ===")
+
+    invalid = [
+        {'max_channel': 10},                                  # 拼写错误
+        {'connect_timeout': 'fast'},                          # 非数值
+        {'max_local_connections': True},                      # 布尔值
+        {'max_channels_per_session': 10.5},                   # 非整数
+        {'tunnel_read_timeout': 0},                           # 非正数
+        {'channel_idle_timeout': -1},
+        {'close_timeout': 0},
+        {'stats_interval': 'hourly'},
+        {'max_channels_per_session': 70000},                  # 超过通道 ID 范围
+        {'max_dns_inflight': 65536},                          # 超过查询标签范围
+        {'read_size_min': 32768, 'read_size_max': 16384},     # 下限大于上限
+        {'read_size_max': READ_SIZE_MAX + 1},                 # DATA 帧放不下
+        {'tunnel_read_size_max': 4096},                       # 低于隧道读取的初始值
+        {'write_buffer_low': -1},
+        {'write_buffer_high': 0},
+        {'write_buffer_high': 8192, 'write_buffer_low': 16384},  # 低水位高于高水位
+        {'crypto_offload_threshold': 0},
+    ]
+    for section in invalid:
+        try:
+            parse_performance_config(section)
+        except ValueError as e:
+            print(f"  {section}: {e}")
+        else:
+            assert False, f"应拒绝: {section}"
+
+    print(f"✓ 测试通过: 拒绝 {len(invalid)} 种无效配置")
+    return True
+
+
+async def test_limits_applied():
+    """测试配置的上限生效"""
+    print("\n=== 测试3: 上限生效 ===")
+
+    performance = parse_performance_config({
+        'max_channels_per_session': 2, 'max_local_connections': 3, 'max_receive_buffer': 65536,
+    })
+
+    client = TunnelClient(ClientConfig(performance=performance))
+    assert client.max_channels == client.max_channel_id == 2
+    assert client.max_buffer_size == 65536
+    proxy = SOCKS5Server(client)
+    assert proxy.max_connections == 3 and proxy.connection_semaphore._value == 3
+
+    # 服务端: 第三个 CONNECT 在连接目标之前被拒绝
+    async def accept(reader, writer):
+        await reader.read()
+        writer.close()
+
+    target = await asyncio.start_server(accept, '127.0.0.1', 0)
+    host = b'127.0.0.1'
+    payload = bytes([len(host)]) + host + struct.pack('>H', target.sockets[0].getsockname()[1])
+    session = RecordingSession(ServerConfig(performance=performance))
+    for channel_id in (1, 2, 3):
+        await session._handle_connect(channel_id, payload)
+    assert sorted(session.channels) == [1, 2]
+    assert (FRAME_CONNECT_FAIL, 3, b'Too many channels') in session.sent, session.sent
+
+    await session._cleanup()
+    await asyncio.sleep(0.05)  # 目标一侧读到 EOF 后关闭
+    target.close()
+    await target.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - performance 配置测试")
+    print("=" * 60)
+
+    tests = [
+        ("默认值", test_defaults),
+        ("无效配置", test_validation),
+        ("上限生效", test_limits_applied),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
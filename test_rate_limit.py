@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+测试每用户限速
+
+测试内容:
+1. 速率解析与格式化
+2. 令牌桶透支与补充
+3. 限速配置读写 users.yaml
+4. 同一用户的会话共享令牌桶
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import TokenBucket, UserConfig, parse_rate, format_rate, load_users, save_users
+from server import RateLimiters
+
+
+async def test_parse_rate():
+    """测试速率解析"""
+    print("\n=== 测试1: 速率解析 ===")
+
+    assert parse_rate(None) == 0
+    assert parse_rate(4096) == 4096
+    assert parse_rate('512K') == 512 * 1024
+    assert parse_rate('10M') == 10 * 1024 * 1024
+    assert parse_rate('1.5MB/s') == 1536 * 1024
+    assert parse_rate('2g') == 2 * 1024 ** 3
+    for bad in ('fast', '-1', -5, True):
+        try:
+            parse_rate(bad)
+            assert False, f"应拒绝 {bad!r}"
+        except ValueError:
+            pass
+
+    for rate in (0, 100, 512 * 1024, 10 * 1024 * 1024, 1536 * 1024):
+        assert parse_rate(format_rate(rate)) == rate, rate
+
+    print("✓ 测试通过: 速率解析与格式化可往返")
+    return True
+
+
+async def test_token_bucket():
+    """测试令牌桶"""
+    print("\n=== 测试2: 令牌桶 ===")
+
+    bucket = TokenBucket(100000)
+    assert bucket.capacity == 100000, "默认容量为一秒的流量"
+    assert TokenBucket(1000).capacity == TokenBucket.MIN_BURST, "容量不小于一次完整读取"
+
+    assert bucket.consume(100000) == 0.0, "满桶时不应暂停"
+    delay = bucket.consume(50000)
+    assert 0.45 < delay <= 0.5, f"透支 50000 字节应暂停约 0.5 秒, 实际 {delay}"
+
+    # 模拟经过 1 秒: 补充令牌但不超过容量
+    bucket.updated -= 1.0
+    assert bucket.consume(0) == 0.0
+    assert bucket.tokens <= bucket.capacity
+
+    print(f"✓ 测试通过: 透支暂停 {delay:.3f} 秒")
+    return True
+
+
+async def test_users_file_roundtrip():
+    """测试限速配置读写"""
+    print("\n=== 测试3: users.yaml 读写 ===")
+
+    path = os.path.join(tempfile.mkdtemp(), 'users.yaml')
+    save_users(path, {
+        'alice': UserConfig('alice', 'secret-a', upload_rate=parse_rate('2M'),
+                            download_rate=parse_rate('10M'), channel_download_rate=parse_rate('1M')),
+        'bob': UserConfig('bob', 'secret-b'),
+    })
+    with open(path) as f:
+        text = f.read()
+    assert 'upload_rate: 2M' in text, text
+    assert 'bob:' in text and text.count('upload_rate') == 1, "未限速的用户不写入限速项"
+
+    users = load_users(path)
+    alice = users['alice']
+    assert (alice.upload_rate, alice.download_rate, alice.channel_download_rate) == (
+        2 * 1024 * 1024, 10 * 1024 * 1024, 1024 * 1024)
+    assert users['bob'].upload_rate == 0
+
+    with open(path, 'w') as f:
+        f.write("users:\n  carol:\n    secret: s\n    upload_rate: fast\n")
+    try:
+        load_users(path)
+        assert False, "无效的速率应报错"
+    except ValueError as e:
+        assert 'carol' in str(e)
+
+    print("✓ 测试通过: 限速配置可往返")
+    return True
+
+
+async def test_shared_buckets():
+    """测试会话共享令牌桶"""
+    print("\n=== 测试4: 会话共享令牌桶 ===")
+
+    limiters = RateLimiters()
+    alice = UserConfig('alice', 's', upload_rate=100000, channel_download_rate=50000)
+
+    first = limiters.for_user(alice)
+    second = limiters.for_user(alice)
+    assert first is second, "同一用户的会话应共享限速器"
+    assert first.download is None
+    assert limiters.for_user(UserConfig('bob', 's')) is None, "未限速的用户不创建限速器"
+    assert limiters.for_user(None) is None
+
+    # 两个会话各自消费,总量受同一个桶限制
+    assert first.upload.consume(60000) == 0.0
+    assert second.upload.consume(60000) > 0.0
+
+    # 单通道令牌桶每个通道独立
+    assert first.channel_bucket() is not first.channel_bucket()
+
+    print("✓ 测试通过: 用户级令牌桶跨会话共享")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道服务端 - 限速测试")
+    print("=" * 60)
+
+    tests = [
+        ("速率解析", test_parse_rate),
+        ("令牌桶", test_token_bucket),
+        ("users.yaml 读写", test_users_file_roundtrip),
+        ("会话共享令牌桶", test_shared_buckets),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
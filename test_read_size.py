@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+测试读取大小自动调整
+
+测试内容:
+1. 连续读满时加倍、连续小读取时减半，始终在上下限之间；隧道积压时不加倍；按读取大小统计的仪表
+2. 客户端转发循环: 批量上传加大读取大小，交互式流量减小，通道结束后从仪表中移除
+3. 服务端: 交互式目标减小读取大小，读取使用池中更小的分级
+"""
+
+import asyncio
+import os
+import struct
+import sys
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    GaugeMetric, ReadSizeTuner, CHANNEL_READ_SIZE, READ_SIZE_MIN, READ_SIZE_MAX,
+    READ_SIZE_GROW_AFTER, READ_SIZE_SHRINK_AFTER
+)
+from client import SOCKS5Server, Channel as ClientChannel
+from tunnel_testing import FakeTunnel, new_session
+
+
+def sent_sizes(tunnel: FakeTunnel) -> list:
+    """客户端每次发送的通道数据大小"""
+    return [len(data) for _, data in tunnel.data]
+
+
+def gauge_values(gauge: GaugeMetric) -> dict:
+    """仪表中非零的序列: {读取大小: 通道数}"""
+    return {int(values[0]): child.value for values, child in gauge._children.items() if child.value}
+
+
+async def test_tuner():
+    """测试调整规则"""
+    print("\n=== 测试1: 调整规则 ===")
+
+    gauge = GaugeMetric('channels_by_read_size', '', ('read_size',))
+    tuner = ReadSizeTuner(16384, 61440, 32768, gauge)
+    assert tuner.size == 32768 and gauge_values(gauge) == {32768: 1}
+
+    # 连续读满才加倍，中间一次普通读取重新计数
+    for _ in range(READ_SIZE_GROW_AFTER - 1):
+        assert not tuner.record(32768)
+    tuner.record(20000)
+    for _ in range(READ_SIZE_GROW_AFTER - 1):
+        assert not tuner.record(32768)
+    assert tuner.record(32768) and tuner.size == 61440, "加倍后不超过上限"
+    for _ in range(READ_SIZE_GROW_AFTER * 2):
+        assert not tuner.record(61440)
+    assert gauge_values(gauge) == {61440: 1}
+
+    # 隧道积压时读满也不加倍
+    small = ReadSizeTuner(16384, 61440, 16384)
+    for _ in range(READ_SIZE_GROW_AFTER * 2):
+        assert not small.record(16384, congested=True)
+    assert small.size == 16384
+
+    # 连续小读取减半，不低于下限
+    changes = sum(tuner.record(100) for _ in range(READ_SIZE_SHRINK_AFTER * 4))
+    assert changes == 2 and tuner.size == 16384, (changes, tuner.size)
+    assert gauge_values(gauge) == {16384: 1}
+
+    tuner.close()
+    tuner.close()  # 重复调用不重复减少
+    assert gauge_values(gauge) == {}
+    assert ReadSizeTuner(16384, 20000, 65536).size == 20000, "初始大小限制在上下限之间"
+
+    print("✓ 测试通过: 32768 → 61440 → 16384")
+    return True
+
+
+async def test_client_forward_loop():
+    """测试客户端转发循环"""
+    print("\n=== 测试2: 客户端转发循环 ===")
+
+    tunnel = FakeTunnel()
+    proxy = SOCKS5Server(tunnel)
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_local(reader, writer):
+        accepted.set_result((reader, writer))
+
+    local = await asyncio.start_server(on_local, '127.0.0.1', 0)
+    app_reader, app_writer = await asyncio.open_connection('127.0.0.1', local.sockets[0].getsockname()[1])
+    reader, writer = await accepted
+
+    channel = ClientChannel(5, reader, writer, '127.0.0.1', 80, connected=True)
+    tunnel.channels[5] = channel
+    forward_task = asyncio.create_task(proxy._forward_loop(channel))
+    await asyncio.sleep(0.05)
+    assert channel.read_tuner.size == CHANNEL_READ_SIZE
+    assert gauge_values(tunnel.metrics.channel_read_size) == {CHANNEL_READ_SIZE: 1}
+
+    # 批量上传: 本地应用一次写入远多于读取大小的数据
+    app_writer.write(os.urandom(4 * 1024 * 1024))
+    await app_writer.drain()
+    for _ in range(100):
+        if sum(sent_sizes(tunnel)) == 4 * 1024 * 1024:
+            break
+        await asyncio.sleep(0.05)
+    assert sum(sent_sizes(tunnel)) == 4 * 1024 * 1024
+    assert channel.read_tuner.size == READ_SIZE_MAX and max(sent_sizes(tunnel)) == READ_SIZE_MAX, max(sent_sizes(tunnel))
+
+    # 交互式流量: 每次只有几十字节
+    for _ in range(READ_SIZE_SHRINK_AFTER * 2):
+        app_writer.write(b'x' * 50)
+        await app_writer.drain()
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.05)
+    assert channel.read_tuner.size == READ_SIZE_MIN, channel.read_tuner.size
+
+    app_writer.close()
+    await asyncio.wait_for(forward_task, timeout=5.0)
+    assert gauge_values(tunnel.metrics.channel_read_size) == {}, "转发循环结束后从仪表中移除"
+
+    writer.close()
+    await writer.wait_closed()
+    local.close()
+    await local.wait_closed()
+    print(f"✓ 测试通过: {len(tunnel.data)} 次发送, 最大 {max(sent_sizes(tunnel))} 字节")
+    return True
+
+
+async def test_server_interactive_target():
+    """测试服务端交互式目标"""
+    print("\n=== 测试3: 服务端交互式目标 ===")
+
+    sent = asyncio.Event()
+    finished = asyncio.Event()
+
+    async def chatty(reader, writer):
+        for _ in range(READ_SIZE_SHRINK_AFTER * 2):
+            writer.write(b'y' * 50)
+            await writer.drain()
+            await asyncio.sleep(0.005)
+        sent.set()
+        await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        finished.set()
+
+    target = await asyncio.start_server(chatty, '127.0.0.1', 0)
+    session = new_session()
+    host = b'127.0.0.1'
+    payload = bytes([len(host)]) + host + struct.pack('>H', target.sockets[0].getsockname()[1])
+    await session._handle_connect(1, payload)
+    channel = session.channels[1]
+
+    for _ in range(100):
+        if channel.read_tuner.size == READ_SIZE_MIN:
+            break
+        await asyncio.sleep(0.02)
+    assert channel.read_tuner.size == READ_SIZE_MIN, channel.read_tuner.size
+    assert gauge_values(session.metrics.channel_read_size) == {READ_SIZE_MIN: 1}
+    # 之后的读取使用最小分级的缓冲区
+    frames = session.user_metrics.frames_sent.value
+    for _ in range(100):
+        if session.user_metrics.frames_sent.value > frames + 1:
+            break
+        await asyncio.sleep(0.02)
+    assert session.buffer_pool.free[READ_SIZE_MIN], "读取大小减小后使用 16 KiB 分级"
+
+    # 目标发送完后再关闭通道，目标读到 EOF 后自行关闭
+    await asyncio.wait_for(sent.wait(), timeout=5.0)
+    await session._cleanup()
+    assert gauge_values(session.metrics.channel_read_size) == {}
+    await asyncio.wait_for(finished.wait(), timeout=5.0)
+    target.close()
+    await target.wait_closed()
+    print("✓ 测试通过")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 读取大小自动调整测试")
+    print("=" * 60)
+
+    tests = [
+        ("调整规则", test_tuner),
+        ("客户端转发循环", test_client_forward_loop),
+        ("服务端交互式目标", test_server_interactive_target),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+测试隐蔽模式输出级
+
+测试内容:
+1. 时隙到达时合并发送并用 PADDING 帧补齐到填充大小
+2. 满最大填充大小的整块立即发送，只有尾部等待时隙
+3. 超过最大填充大小时补齐到整数倍，长填充拆成多个帧
+4. 虚假消息按预算在空闲时隙发送
+"""
+
+import asyncio
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (
+    StealthConfig, StealthScheduler, FrameDecoder, encode_frame,
+    FRAME_DATA, FRAME_PADDING, MAX_FRAME_PAYLOAD
+)
+
+
+class FakeWriter:
+    """记录写入的数据块"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    def is_closing(self):
+        return False
+
+
+def decode(data: bytes) -> list:
+    """把写入的字节流解码为帧列表"""
+    decoder = FrameDecoder()
+    decoder.feed(data)
+    frames = list(decoder)
+    assert decoder.pending == 0, "写入的数据应由完整的帧组成"
+    return frames
+
+
+async def test_batch_padding():
+    """测试合并发送和填充"""
+    print("\n=== 测试1: 合并发送和填充 ===")
+
+    writer = FakeWriter()
+    scheduler = StealthScheduler(writer, StealthConfig(pad_to_sizes=[4096, 8192, 16384]))
+    scheduler.send(encode_frame(FRAME_DATA, 1, b'a' * 100))
+    scheduler.send(encode_frame(FRAME_DATA, 2, b'b' * 200))
+    assert not writer.writes, "时隙之前不应写出"
+
+    scheduler._tick()
+    assert len(writer.writes) == 1
+    assert len(writer.writes[0]) == 4096, len(writer.writes[0])
+    frames = decode(writer.writes[0])
+    assert frames[0] == (FRAME_DATA, 1, b'a' * 100)
+    assert frames[1] == (FRAME_DATA, 2, b'b' * 200)
+    assert all(frame_type == FRAME_PADDING for frame_type, _, _ in frames[2:])
+    assert scheduler.payload_bytes == 310
+    assert scheduler.padding_bytes == 4096 - 310
+
+    # 恰好占满一个填充大小时不追加填充（4091 + 帧头 = 4096）
+    scheduler.send(encode_frame(FRAME_DATA, 1, b'c' * 4091))
+    scheduler.flush()
+    assert len(writer.writes[1]) == 4096
+    assert len(decode(writer.writes[1])) == 1
+
+    print(f"✓ 测试通过: {scheduler.stats()}")
+    return True
+
+
+async def test_full_blocks_bypass_slot():
+    """测试整块立即发送"""
+    print("\n=== 测试2: 整块立即发送 ===")
+
+    writer = FakeWriter()
+    scheduler = StealthScheduler(writer, StealthConfig(pad_to_sizes=[4096, 16384]))
+    stream = b''
+    for _ in range(3):
+        frame = bytes(encode_frame(FRAME_DATA, 1, os.urandom(13000)))
+        stream += frame
+        scheduler.send(frame)
+
+    written = sum(len(chunk) for chunk in writer.writes)
+    assert written == 32768, written
+    assert len(scheduler.pending) == len(stream) - 32768
+    assert scheduler.padding_bytes == 0
+
+    scheduler.stop()
+    data = b''.join(writer.writes)
+    assert len(data) % 4096 == 0
+    assert data[:len(stream)] == stream, "帧顺序和内容应保持不变"
+    frames = decode(data)
+    assert [f for f in frames if f[0] == FRAME_DATA] == decode(stream)
+
+    print(f"✓ 测试通过: {scheduler.stats()}")
+    return True
+
+
+async def test_large_batch_padding():
+    """测试超大批次的填充"""
+    print("\n=== 测试3: 超大批次填充 ===")
+
+    writer = FakeWriter()
+    scheduler = StealthScheduler(writer, StealthConfig(pad_to_sizes=[200000]))
+    # 剩余 65542 字节: 单个最大 PADDING 帧之后只剩 2 字节，必须拆分得当
+    payload = b'x' * (200000 - 65542 - 3 * 5)
+    for offset in range(0, len(payload), MAX_FRAME_PAYLOAD):
+        scheduler.send(encode_frame(FRAME_DATA, 1, payload[offset:offset + MAX_FRAME_PAYLOAD]))
+    scheduler.flush()
+
+    data = writer.writes[0]
+    assert len(data) == 200000, len(data)
+    frames = decode(data)
+    padding = [f for f in frames if f[0] == FRAME_PADDING]
+    assert len(padding) == 2
+    assert b''.join(f[2] for f in frames if f[0] == FRAME_DATA) == payload
+
+    print(f"✓ 测试通过: {len(padding)} 个填充帧")
+    return True
+
+
+async def test_dummy_budget():
+    """测试虚假消息预算"""
+    print("\n=== 测试4: 虚假消息预算 ===")
+
+    writer = FakeWriter()
+    config = StealthConfig(pad_to_sizes=[4096, 8192], dummy_message_probability=0.5)
+    scheduler = StealthScheduler(writer, config)
+
+    # 繁忙时隙只积累额度，上限为 1
+    for _ in range(10):
+        scheduler.send(encode_frame(FRAME_DATA, 1, b'data'))
+        scheduler._tick()
+    assert scheduler.dummy_messages == 0
+    assert scheduler.dummy_budget == 1.0
+
+    # 空闲时隙: 第一个花掉积累的额度，之后每两个时隙一条
+    writes = len(writer.writes)
+    for _ in range(5):
+        scheduler._tick()
+    assert scheduler.dummy_messages == 3, scheduler.dummy_messages
+    for chunk in writer.writes[writes:]:
+        assert len(chunk) in (4096, 8192)
+        assert all(frame_type == FRAME_PADDING for frame_type, _, _ in decode(chunk))
+
+    print(f"✓ 测试通过: 虚假消息 {scheduler.dummy_messages} 条")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道 - 隐蔽模式输出级测试")
+    print("=" * 60)
+
+    tests = [
+        ("合并发送和填充", test_batch_padding),
+        ("整块立即发送", test_full_blocks_bypass_slot),
+        ("超大批次填充", test_large_batch_padding),
+        ("虚假消息预算", test_dummy_budget),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+测试透明代理模式
+
+测试内容:
+1. 从 SO_ORIGINAL_DST 解析 IPv4 原始目标地址
+2. 从 IP6T_SO_ORIGINAL_DST 解析 IPv6 原始目标地址
+3. 重定向连接直接打开隧道通道 (使用合成的原始目标地址)
+4. 拒绝指向透明代理自身的连接
+
+真实环境可在网络命名空间中验证:
+    ip netns add tp && ip netns exec tp sh -c '
+        ip link set lo up
+        iptables -t nat -A OUTPUT -p tcp -d 198.51.100.1 -j REDIRECT --to-ports 12345
+        python client.py --transparent-port 12345 & curl http://198.51.100.1/'
+"""
+
+import asyncio
+import socket
+import struct
+import sys
+import os
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client import (
+    TransparentProxyServer, get_original_dst,
+    SO_ORIGINAL_DST, IP6T_SO_ORIGINAL_DST, SOL_IP, SOL_IPV6,
+)
+from tunnel_testing import FakeTunnel
+
+
+class FakeSocket:
+    """返回合成 sockaddr 的套接字,模拟 netfilter 的 getsockopt 结果"""
+
+    def __init__(self, family, peer, original):
+        self.family = family
+        self.peer = peer
+        self.original = original
+
+    def getpeername(self):
+        return self.peer
+
+    def getsockopt(self, level, option, buflen):
+        if self.family == socket.AF_INET6 and not self.peer[0].startswith('::ffff:'):
+            assert (level, option) == (SOL_IPV6, IP6T_SO_ORIGINAL_DST)
+            host, port = self.original
+            return (struct.pack('=H', socket.AF_INET6) + struct.pack('>HI', port, 0)
+                    + socket.inet_pton(socket.AF_INET6, host) + struct.pack('=I', 0))
+        assert (level, option) == (SOL_IP, SO_ORIGINAL_DST)
+        host, port = self.original
+        return (struct.pack('=H', socket.AF_INET) + struct.pack('>H', port)
+                + socket.inet_aton(host) + b'\x00' * 8)
+
+
+async def test_ipv4_original_dst():
+    """测试 IPv4 原始目标地址解析"""
+    print("\n=== 测试1: IPv4 原始目标地址 ===")
+
+    sock = FakeSocket(socket.AF_INET, ('127.0.0.1', 40000), ('93.184.216.34', 443))
+    assert get_original_dst(sock) == ('93.184.216.34', 443)
+
+    # 双栈监听器上的 IPv4 映射地址走 IPv4 选项
+    sock = FakeSocket(socket.AF_INET6, ('::ffff:127.0.0.1', 40000, 0, 0), ('10.1.2.3', 80))
+    assert get_original_dst(sock) == ('10.1.2.3', 80)
+
+    print("✓ 测试通过: IPv4 原始目标地址解析正确")
+    return True
+
+
+async def test_ipv6_original_dst():
+    """测试 IPv6 原始目标地址解析"""
+    print("\n=== 测试2: IPv6 原始目标地址 ===")
+
+    sock = FakeSocket(socket.AF_INET6, ('::1', 40000, 0, 0), ('2001:db8::10', 8443))
+    assert get_original_dst(sock) == ('2001:db8::10', 8443)
+
+    print("✓ 测试通过: IPv6 原始目标地址解析正确")
+    return True
+
+
+async def _run_proxy(resolver, payload: bytes):
+    """启动透明代理,发送一次数据并等待处理器结束"""
+    tunnel = FakeTunnel(channel_id=3)
+    proxy = TransparentProxyServer(tunnel, '127.0.0.1', 0, original_dst_resolver=resolver)
+    server = await asyncio.start_server(proxy.handle_client, proxy.host, proxy.port)
+    port = server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(payload)
+    await writer.drain()
+
+    for _ in range(50):
+        if tunnel.data:
+            break
+        await asyncio.sleep(0.05)
+
+    writer.close()
+    for _ in range(50):
+        if proxy.current_connections == 0:
+            break
+        await asyncio.sleep(0.05)
+    server.close()
+    await server.wait_closed()
+    return tunnel, port
+
+
+async def test_redirected_connection():
+    """测试重定向连接直接打开通道"""
+    print("\n=== 测试3: 重定向连接打开通道 ===")
+
+    tunnel, _ = await _run_proxy(lambda sock: ('198.51.100.7', 8080), b'GET / HTTP/1.0\r\n\r\n')
+
+    assert tunnel.opened == [('198.51.100.7', 8080)], tunnel.opened
+    assert tunnel.data == [(3, b'GET / HTTP/1.0\r\n\r\n')], tunnel.data
+    print(f"✓ 测试通过: 通道已打开 {tunnel.opened[0]}")
+    return True
+
+
+async def test_reject_self_loop():
+    """测试拒绝指向自身的连接"""
+    print("\n=== 测试4: 拒绝回环连接 ===")
+
+    tunnel, _ = await _run_proxy(lambda sock: sock.getsockname()[:2], b'loop')
+
+    assert tunnel.opened == [], tunnel.opened
+    print("✓ 测试通过: 未经重定向的连接被拒绝")
+    return True
+
+
+async def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("SMTP隧道客户端 - 透明代理测试")
+    print("=" * 60)
+
+    tests = [
+        ("IPv4 原始目标地址", test_ipv4_original_dst),
+        ("IPv6 原始目标地址", test_ipv6_original_dst),
+        ("重定向连接打开通道", test_redirected_connection),
+        ("拒绝回环连接", test_reject_self_loop),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            result = await test_func()
+            if result:
+                passed += 1
+        except AssertionError as e:
+            print(f"✗ 测试失败: {name} - {e}")
+            failed += 1
+        except Exception as e:
+            print(f"✗ 测试异常: {name} - {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"测试结果: 通过={passed}, 失败={failed}")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = asyncio.run(main())
+    exit(0 if success else 1)
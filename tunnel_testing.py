@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+测试共用的假对象
+
+FakeWriter: 代替隧道连接的写入器，写入的数据直接丢弃
+new_session(): 创建没有读取器和 TLS 上下文的服务端会话
+RecordingSession: 不写入网络、记录发送的帧的服务端会话
+FakeTunnel: 不连接服务器、记录通道数据和帧的客户端隧道
+"""
+
+import asyncio
+from typing import Iterable, Optional
+
+from common import ClientConfig, ServerConfig, PerformanceConfig, FRAME_HEADER, FRAME_HEADER_SIZE
+from server import TunnelSession
+from client import TunnelClient
+
+
+class FakeWriter:
+    """只提供对端地址、写入即丢弃的写入器（同时充当自己的传输层，写缓冲始终为空）"""
+
+    def __init__(self):
+        self.transport = self
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', 40000) if name == 'peername' else None
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        pass
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_write_buffer_limits(self):
+        return 0, 65536
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def new_session(writer=None, config: Optional[ServerConfig] = None, users: Optional[dict] = None,
+                **kwargs) -> TunnelSession:
+    """
+    创建没有读取器和 TLS 上下文的服务端会话
+
+    参数:
+        writer: 隧道连接的写入器（默认 FakeWriter()）
+        config: 服务端配置（默认 ServerConfig()）
+        users: 用户表（默认为空）
+        kwargs: 传给 TunnelSession 的其他参数（admission_control、buffer_pool 等）
+    """
+    return TunnelSession(None, writer or FakeWriter(), config or ServerConfig(), None, users or {}, **kwargs)
+
+
+class RecordingSession(TunnelSession):
+    """
+    记录发送的帧，不写入网络
+
+    sent 中为 (帧类型, 通道ID, 负载)；下行积压由 backlog 控制，
+    drained 清除后 _send_frame_drain() 一直等待到测试设置它
+    """
+
+    def __init__(self, config: Optional[ServerConfig] = None, capabilities: Iterable[str] = (),
+                 users: Optional[dict] = None, **kwargs):
+        """
+        参数:
+            config: 服务端配置（默认 ServerConfig()）
+            capabilities: 已协商的扩展能力
+            users: 用户表（默认为空）
+            kwargs: 传给 TunnelSession 的其他参数（admission_control 等）
+        """
+        super().__init__(None, FakeWriter(), config or ServerConfig(), None, users or {}, **kwargs)
+        self.capabilities = {name: [] for name in capabilities}
+        self.sent = []
+        self.backlog = False
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    def _write_frame(self, frame_type: int, channel_id: int, payload: bytes = b''):
+        self.sent.append((frame_type, channel_id, bytes(payload)))
+
+    async def _send_frame(self, frame_type: int, channel_id: int, payload: bytes = b''):
+        self._write_frame(frame_type, channel_id, payload)
+
+    def _write_buffer(self, buffer: bytearray, end: int):
+        # 目标数据的零复制路径: 帧头已原地写在缓冲区开头
+        frame_type, channel_id, length = FRAME_HEADER.unpack_from(buffer)
+        assert length == end - FRAME_HEADER_SIZE
+        self._write_frame(frame_type, channel_id, buffer[FRAME_HEADER_SIZE:end])
+        self.buffer_pool.release(buffer)
+
+    async def _send_frame_drain(self):
+        await self.drained.wait()
+        self.backlog = False
+
+    def _frames_backlogged(self) -> bool:
+        return self.backlog
+
+
+
+class FakeTunnel(TunnelClient):
+    """
+    不连接服务器的隧道客户端,记录通道数据和帧
+
+    opened 中为 open_channel() 的 (主机, 端口)，每次都成功并返回 channel_id；
+    data 中为 send_data() 的 (通道ID, 数据)；frames 中为 send_frame() 的 (帧类型, 通道ID, 负载)
+    """
+
+    def __init__(self, performance: Optional[PerformanceConfig] = None, capabilities: Iterable[str] = (),
+                 channel_id: int = 7):
+        """
+        参数:
+            performance: 性能参数（默认 PerformanceConfig()）
+            capabilities: 已协商的扩展能力
+            channel_id: open_channel() 返回的通道ID
+        """
+        super().__init__(ClientConfig(username='test_user', secret='test_secret',
+                                      performance=performance or PerformanceConfig()))
+        self.connected = True
+        self.capabilities = {name: [] for name in capabilities}
+        self.channel_id = channel_id
+        self.opened = []
+        self.data = []
+        self.frames = []
+
+    async def open_channel(self, host: str, port: int):
+        self.opened.append((host, port))
+        return self.channel_id, True
+
+    async def send_data(self, channel_id: int, data: bytes):
+        self.data.append((channel_id, data))
+
+    async def send_frame(self, frame_type: int, channel_id: int, payload: bytes = b''):
+        self.frames.append((frame_type, channel_id, payload))